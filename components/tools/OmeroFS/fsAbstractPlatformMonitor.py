@@ -16,9 +16,12 @@ class AbstractPlatformMonitor(threading.Thread):
 
     """
 
-    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy):
+    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile=None):
         """
             Set-up Monitor thread.
+
+            indexFile is the file in which monitors keeping a snapshot
+            of the tree save it between runs, None not to save it.
         """
         threading.Thread.__init__(self)
         
@@ -33,6 +36,7 @@ class AbstractPlatformMonitor(threading.Thread):
         self.ignoreSysFiles = ignoreSysFiles
         self.ignoreDirEvents = ignoreDirEvents
         self.proxy = proxy
+        self.indexFile = indexFile
                 
     def run(self):
         """
@@ -10,8 +10,25 @@
 """
 
 import logging
+import os
+import time
 from time import localtime, strftime
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# os.scandir, or the scandir package it came from, gives the type of
+# each entry with the listing so directories need not be stat'ed twice.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 # Third party path package. It provides much of the 
 # functionality of os.path but without the complexity.
 # Imported as pathModule to avoid potential clashes.
@@ -793,3 +810,326 @@ class DirStub(Node):
 
     def isFile(self):
         return False
+
+
+class SnapshotIndex(object):
+    """
+        A snapshot of a directory tree held as a flat index.
+
+        The index maps the path of each directory to its mtime and to the
+        size, mtime, inode and type of each of its entries. Changes under a
+        path are found in a single walk which compares the live file system
+        against the index and updates it as it goes. Below the path of
+        interest, a directory whose mtime is unchanged since it was listed
+        has not gained or lost entries and is not listed again, only its
+        subdirectories are visited. Its files are not stat'ed either, a
+        change to them is expected to be reported against the directory
+        itself, as FSEvents does.
+
+        SnapshotIndex can be used in place of Directory by the monitors.
+
+        :group Constructor: __init__
+        :group Accessors: getPath, getWhitelist, getEntry
+        :group Persistence: load, save
+        :group Other Methods: getChangedFiles, pruneZeroFiles, pruneDirectories
+
+    """
+
+    #: Version of the saved index, bumped whenever its layout changes.
+    VERSION = 1
+
+    #: Directories modified less than this many seconds before they were
+    #: listed are always listed again, since a later change in the same
+    #: tick of the file system clock would not change their mtime.
+    RACY = 1.0
+
+    def __init__(self, pathString, whitelist=None, pathMode='Flat', indexFile=None):
+        """
+            Load the index of the directory from indexFile or, if there is
+            no usable saved index, build it from the file system.
+
+            A loaded index is left as it was saved so that a call to
+            getChangedFiles on the path returns the changes made since.
+
+            :Parameters:
+                pathString : string
+                    A full path to the directory of interest.
+                whitelist : list<string>
+                    A list of extensions of interest.
+                pathMode : string
+                    'Flat' to index the top directory only or 'Follow'
+                    to index the whole tree.
+                indexFile : string
+                    A full path to the file the index is saved in, if any.
+
+        """
+        self.log = logging.getLogger("fsserver."+__name__)
+
+        #: path as a string
+        self.pathString = str(pathModule.path(pathString).abspath())
+
+        #: path as a pathModule path type
+        self.path = pathModule.path(self.pathString)
+
+        # Use an empty whitelist if necessary.
+        if whitelist == None:
+            whitelist = []
+        #: whitelist of extensions
+        self.whitelist = fsLists.Whitelist(whitelist)
+
+        self.pathMode = pathMode
+        self.indexFile = indexFile
+
+        #: dirs is a dictionary of [mtime, listed, entries] keyed by path,
+        #: entries a dictionary of (size, mtime, inode, isDir) keyed by name.
+        self.dirs = {}
+
+        #: whether the index was loaded from indexFile rather than built
+        self.loaded = self.load()
+        if not self.loaded:
+            self._scan(self.pathString, [], [], [], True, ())
+
+    def getPath(self):
+        """
+            Return the path, ie the root
+
+            :return: Path of interest.
+            :rtype: pathModule.path
+
+        """
+        return self.path
+
+    def getWhitelist(self):
+        """
+            Getter for the whitelist.
+
+            :return: String representation whitelist.
+            :rtype: list<string>
+
+        """
+        return self.whitelist.asList()
+
+    def getEntry(self, pathString):
+        """
+            Return the indexed stats of a file or directory.
+
+            :Parameters:
+                pathString : string
+                    A full path to the file of interest.
+
+            :return: size, mtime, inode and whether it is a directory or None.
+            :rtype: tuple
+
+        """
+        dirs = self.dirs.get(os.path.dirname(pathString))
+        if dirs is None:
+            return None
+        return dirs[2].get(os.path.basename(pathString))
+
+    def load(self):
+        """
+            Replace the index with the one saved in indexFile.
+
+            A saved index of another path, mode or whitelist is ignored.
+
+            :return: Whether an index was loaded.
+            :rtype: boolean
+
+        """
+        if self.indexFile is None or not os.path.exists(self.indexFile):
+            return False
+        try:
+            f = open(self.indexFile, 'rb')
+            try:
+                saved = pickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            self.log.warn('Failed to load index ' + self.indexFile + ' : ' + str(e))
+            return False
+        if saved.get('key') != self._key():
+            self.log.info('Ignoring index ' + self.indexFile + ' of another directory')
+            return False
+        self.dirs = saved['dirs']
+        self.log.info('Loaded index of %d directories from %s', len(self.dirs), self.indexFile)
+        return True
+
+    def save(self):
+        """
+            Write the index to indexFile, if there is one.
+
+            The index is written to a temporary file which then replaces
+            indexFile so that a failed save leaves the last index intact.
+
+            :return: No explicit return value.
+
+        """
+        if self.indexFile is None:
+            return
+        tmp = self.indexFile + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            pickle.dump({'key': self._key(), 'dirs': self.dirs}, f, 2)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(self.indexFile):
+            os.remove(self.indexFile)
+        os.rename(tmp, self.indexFile)
+
+    def getChangedFiles(self, pathString, compare=('SIZE'), full=False):
+        """
+            Return lists of new, deleted and changed files in a subtree.
+
+            As Directory.getChangedFiles but found in one pass over the
+            file system and the index, which is updated to match.
+
+            :Parameters:
+                pathString : string
+                    A full path to the subdirectory of interest.
+                compare : list<string>
+                    A list of what file attribute should be compared,
+                    'SIZE' and/or 'MTIME'.
+                full : boolean
+                    List and stat every directory, not only those whose
+                    mtime has changed.
+
+            :return: A tuple containing lists containing files as full path strings.
+            :rtype: tuple<list<string>>
+
+        """
+        newFileList = []
+        delFileList = []
+        chgFileList = []
+        self._scan(str(pathModule.path(pathString).abspath()),
+                   newFileList, delFileList, chgFileList, True, compare, full)
+        return newFileList, delFileList, chgFileList
+
+    def pruneZeroFiles(self, fileList):
+        """
+            Prune out zero-sized files.
+
+            :Parameters:
+                fileList : list<string>
+                    A list containing files as full path strings.
+
+            :return: A list containing files as full path strings.
+            :rtype: list<string>
+
+        """
+        return [f for f in fileList if (self.getEntry(f) or (0,))[0] > 0]
+
+    def pruneDirectories(self, fileList):
+        """
+            Prune out directories.
+
+            :Parameters:
+                fileList : list<string>
+                    A list containing files as full path strings.
+
+            :return: A list containing files as full path strings.
+            :rtype: list<string>
+
+        """
+        return [f for f in fileList if self.getEntry(f) and not self.getEntry(f)[3]]
+
+    def _key(self):
+        return (self.VERSION, self.pathString, self.pathMode, sorted(self.whitelist.asList()))
+
+    def _list(self, pathString):
+        """
+            Return the whitelisted files and the directories in a directory
+            as a dictionary of (size, mtime, inode, isDir) keyed by name.
+
+        """
+        entries = {}
+        if scandir is not None:
+            listing = [(e.name, e.is_dir(), e.is_file(), e) for e in scandir(pathString)]
+        else:
+            listing = []
+            for name in os.listdir(pathString):
+                p = os.path.join(pathString, name)
+                listing.append((name, os.path.isdir(p), os.path.isfile(p), p))
+        for name, isDir, isFile, e in listing:
+            if isFile and not self.whitelist.onList(os.path.splitext(name)[1]):
+                continue
+            if not (isFile or isDir):
+                self.log.info('Not a file or directory. Ignoring ' + os.path.join(pathString, name))
+                continue
+            try:
+                st = isinstance(e, basestring) and os.stat(e) or e.stat()
+            except OSError:
+                continue
+            entries[name] = (st.st_size, st.st_mtime, st.st_ino, isDir)
+        return entries
+
+    def _scan(self, pathString, new, old, chg, force, compare, full=False):
+        """
+            Compare a directory against its index, recursively if following,
+            adding the changes to new, old and chg and updating the index.
+
+        """
+        try:
+            mtime = os.stat(pathString).st_mtime
+        except OSError:
+            self._forget(pathString, old)
+            return
+
+        indexed = self.dirs.get(pathString)
+        if indexed is not None and not (force or full) and indexed[0] == mtime \
+                and indexed[1] - mtime > self.RACY:
+            if self.pathMode == 'Follow':
+                for name, entry in indexed[2].items():
+                    if entry[3]:
+                        self._scan(os.path.join(pathString, name), new, old, chg, False, compare, full)
+            return
+
+        now = time.time()
+        try:
+            entries = self._list(pathString)
+        except OSError:
+            self._forget(pathString, old)
+            return
+        indexedEntries = indexed and indexed[2] or {}
+        self.dirs[pathString] = [mtime, now, entries]
+
+        for name, entry in entries.items():
+            p = os.path.join(pathString, name)
+            was = indexedEntries.get(name)
+            if was is not None and was[3] != entry[3]:
+                old.append(p)
+                self._forget(p, old)
+                was = None
+            if was is None:
+                new.append(p)
+                if entry[3] and self.pathMode == 'Follow':
+                    # Anything indexed under a path that was not listed is stale.
+                    self._forget(p, [])
+                    self._scan(p, new, old, chg, False, compare, full)
+            elif not entry[3]:
+                if ('SIZE' in compare and was[0] != entry[0]) or \
+                        ('MTIME' in compare and was[1] != entry[1]):
+                    chg.append(p)
+            elif self.pathMode == 'Follow':
+                self._scan(p, new, old, chg, False, compare, full)
+
+        for name, was in indexedEntries.items():
+            if name not in entries:
+                p = os.path.join(pathString, name)
+                old.append(p)
+                if was[3]:
+                    self._forget(p, old)
+
+    def _forget(self, pathString, old):
+        """
+            Remove a directory and everything under it from the index,
+            adding its contents to old.
+
+        """
+        indexed = self.dirs.pop(pathString, None)
+        if indexed is None:
+            return
+        for name, entry in indexed[2].items():
+            p = os.path.join(pathString, name)
+            old.append(p)
+            if entry[3]:
+                self._forget(p, old)
@@ -6,7 +6,8 @@
 
 """
 import logging
-import sys, traceback
+import os, stat, sys, time, traceback
+import threading
 
 try:
     from hashlib import sha1 as sha
@@ -21,22 +22,101 @@ import path as pathModule
 import omero.all
 import omero.grid.monitors as monitors
 
+try:
+    import pwd
+except ImportError:
+    pwd = None
+
+
+class OpenFile(object):
+    """
+        A read-only descriptor held open by FileServerI between reads.
+
+        Reads take an offset, as pread does, so that the descriptor can be
+        shared. Where os.pread is not available the seek and read are done
+        under a lock.
+
+    """
+    def __init__(self, pathString):
+        self.pathString = pathString
+        self.fd = os.open(pathString, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        st = os.fstat(self.fd)
+        self.ident = (st.st_dev, st.st_ino)
+        self.lock = threading.Lock()
+        self.users = 0
+        self.used = 0
+        self.evicted = False
+
+    def pread(self, offset, size):
+        """
+            Return at most size bytes from offset, fewer only at the end of the file.
+
+        """
+        if hasattr(os, 'pread'):
+            read = lambda n, pos: os.pread(self.fd, n, pos)
+        else:
+            def read(n, pos):
+                self.lock.acquire()
+                try:
+                    os.lseek(self.fd, pos, 0)
+                    return os.read(self.fd, n)
+                finally:
+                    self.lock.release()
+        blocks = []
+        while size > 0:
+            block = read(size, offset)
+            if not block:
+                break
+            blocks.append(block)
+            offset += len(block)
+            size -= len(block)
+        return "".join(blocks)
+
+    def close(self):
+        os.close(self.fd)
+
+
 class FileServerI(monitors.FileServer):
     """
         Provides access to the local file system
         
         :group Constructor: __init__
         :group Methods exposed in Slice: getDirectory, getBaseName, getStats, getSize,
-            getOwner, getCTime, getATime, getMTime, isDir, isFile, getSHA1, readBlock
+            getOwner, getCTime, getATime, getMTime, isDir, isFile, getSHA1, readBlock,
+            readBlocks
         :group Other methods: _getPathString
         
     """
-    def __init__(self):
+    def __init__(self, maxOpen=64, statsTimeout=1.0, shaBlockSize=1024*1024, maxCached=10000):
         """
             Intialise the instance variables and logging.
+
+            :Parameters:
+                maxOpen : int
+                    Number of files kept open between reads.
+
+                statsTimeout : float
+                    Seconds for which the stats of a file are reused by getStats
+                    and the single stat getters.
+
+                shaBlockSize : int
+                    Bytes read at a time when calculating a SHA1.
+
+                maxCached : int
+                    Number of files whose stats and SHA1 are kept.
         
         """
         self.log = logging.getLogger("fsserver."+__name__)                            
+        self.maxOpen = maxOpen
+        self.statsTimeout = statsTimeout
+        self.shaBlockSize = shaBlockSize
+        self.maxCached = maxCached
+        self.lock = threading.Lock()
+        self.openFiles = {}
+        self.stats = {}
+        self.sha1s = {}
+        self.owners = {}
+        self.tick = 0
 
     """
         Methods published in the slice interface omerofs.ice
@@ -206,7 +286,7 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
 
         try:
-            return self._getFileStats(pathString)
+            return self._getStats(pathString)
         except Exception, e:
             self.log.error('Failed to get  ' + str(fileId) + ' stats : ' + str(e))
             raise omero.OmeroFSError(reason='Failed to get  ' + str(fileId) + ' stats : '  + str(e))       
@@ -235,7 +315,7 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
 
         try:
-            size = pathModule.path(pathString).size
+            size = self._getStats(pathString).size
         except Exception, e:
             self.log.error('Failed to get  ' + str(fileId) + ' size : ' +  str(e))
             raise omero.OmeroFSError(reason='Failed to get  ' + str(fileId) + ' size : '  + str(e))       
@@ -266,7 +346,7 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
 
         try:
-            owner = pathModule.path(pathString).owner
+            owner = self._getStats(pathString).owner
         except Exception, e:
             self.log.error('Failed to get  ' + str(fileId) + ' owner : '  + str(e))
             raise omero.OmeroFSError(reason='Failed to get  ' + str(fileId) + ' owner : ' +  str(e))       
@@ -297,7 +377,7 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
 
         try:
-            ctime = pathModule.path(pathString).ctime
+            ctime = self._getStats(pathString).cTime
         except Exception, e:
             self.log.error('Failed to get  ' + str(fileId) + ' ctime : ' + str(e))
             raise omero.OmeroFSError(reason='Failed to get  ' + str(fileId) + ' ctime : ' + str(e))       
@@ -328,7 +408,7 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
 
         try:
-            mtime = pathModule.path(pathString).mtime
+            mtime = self._getStats(pathString).mTime
         except Exception, e:
             self.log.error('Failed to get  ' + str(fileId) + ' mtime : ' + str(e))
             raise omero.OmeroFSError(reason='Failed to get  ' + str(fileId) + ' mtime : ' + str(e))       
@@ -359,7 +439,7 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
    
         try:
-            atime = pathModule.path(pathString).atime
+            atime = self._getStats(pathString).aTime
         except Exception, e:
             self.log.error('Failed to get  ' + str(fileId) + ' atime : ' + str(e))
             raise omero.OmeroFSError(reason='Failed to get  ' + str(fileId) + ' atime : ' + str(e))       
@@ -488,39 +568,198 @@ class FileServerI(monitors.FileServer):
             raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
 
         try:
-            file = open(pathString, 'rb')
-            file.seek(offset)
-            bytes = file.read(size)
-            file.close()
+            bytes = self._readBlocks(pathString, [(offset, size)])[0]
         except Exception, e:
             self.log.error('Failed to read data from  ' + str(fileId) + ' : ' + str(e))
             raise omero.OmeroFSError(reason='Failed to read data from  ' + str(fileId) + ' : ' + str(e))       
     
         return bytes      
+
+    def readBlocks(self, fileId, ranges, current=None):
+        """
+            Return an at most size block of bytes from offset for each range.
+        
+            :Parameters:
+                fileId : string
+                    A string uniquely identifying a file on this Monitor.
+              
+                ranges : list<monitors.BlockRange>
+                    The offset and size of each block to read.
+                
+                current 
+                    An ICE context, this parameter is required to be present
+                    in an ICE interface method.
+                       
+            :return: Data, one block per range.
+            :rtype: list<list<byte>>
+     
+        """
+        try:
+            pathString = self._getPathString(fileId)
+        except Exception, e:
+            self.log.error('File ID  ' + str(fileId) + ' not on this FSServer')
+            raise omero.OmeroFSError(reason='File ID  ' + str(fileId) + ' not on this FSServer')       
+
+        try:
+            blocks = self._readBlocks(pathString, [(r.offset, r.size) for r in ranges])
+        except Exception, e:
+            self.log.error('Failed to read data from  ' + str(fileId) + ' : ' + str(e))
+            raise omero.OmeroFSError(reason='Failed to read data from  ' + str(fileId) + ' : ' + str(e))       
+    
+        return blocks
+
+    def _readBlocks(self, pathString, ranges):
+        """
+            Private method to read (offset, size) ranges through an open file.
+
+            The file is checked once per call so that a file which has been
+            replaced since it was opened is reopened rather than read stale.
+            Reads go outside the server lock so that several threads can
+            read the same file, or different files, at once.
+
+        """
+        file = self._acquire(pathString)
+        try:
+            return [file.pread(offset, size) for offset, size in ranges]
+        finally:
+            self._release(file)
+
+    def _acquire(self, pathString):
+        """
+            Private method returning an OpenFile for pathString, opening it if
+            it is not already open or if the path now names a different file.
+
+        """
+        st = os.stat(pathString)
+        self.lock.acquire()
+        try:
+            file = self.openFiles.get(pathString)
+            if file is not None and file.ident != (st.st_dev, st.st_ino):
+                self._evict(pathString)
+                file = None
+            if file is None:
+                file = OpenFile(pathString)
+                self.openFiles[pathString] = file
+            self.tick += 1
+            file.used = self.tick
+            file.users += 1
+            while len(self.openFiles) > self.maxOpen:
+                lru = min(self.openFiles.values(), key=lambda f: f.used)
+                self._evict(lru.pathString)
+            return file
+        finally:
+            self.lock.release()
+
+    def _release(self, file):
+        """
+            Private method ending a read started with _acquire.
+
+        """
+        self.lock.acquire()
+        try:
+            file.users -= 1
+            if file.evicted and not file.users:
+                file.close()
+        finally:
+            self.lock.release()
+
+    def _evict(self, pathString):
+        """
+            Private method dropping an open file, closing it once no read is
+            using it. Must be called holding self.lock.
+
+        """
+        file = self.openFiles.pop(pathString)
+        file.evicted = True
+        if not file.users:
+            file.close()
+
+    def close(self):
+        """
+            Close all open files.
+
+        """
+        self.lock.acquire()
+        try:
+            for pathString in self.openFiles.keys():
+                self._evict(pathString)
+        finally:
+            self.lock.release()
+
+    def _getStats(self, pathString):
+        """
+            Private method returning the stats of a file, reusing those
+            collected in the last statsTimeout seconds.
+
+            :Parameters:
+                pathString : string
+                    The path of the file.
+
+            :return: stats
+            :rtype: monitors.FileStats
+
+        """
+        now = time.time()
+        cached = self.stats.get(pathString)
+        if cached is not None and now - cached[0] < self.statsTimeout:
+            return cached[1]
+        stats = self._getFileStats(pathString)
+        self._cache(self.stats, pathString, (now, stats))
+        return stats
+
+    def _cache(self, cache, key, value):
+        """
+            Private method adding to a stats or SHA1 cache, emptying it when
+            it has grown past maxCached entries.
+
+        """
+        self.lock.acquire()
+        try:
+            if len(cache) >= self.maxCached:
+                cache.clear()
+            cache[key] = value
+        finally:
+            self.lock.release()
+
+    def _getOwner(self, uid):
+        """
+            Private method returning the user name for a uid, as path.owner.
+
+        """
+        owner = self.owners.get(uid)
+        if owner is None:
+            if pwd is None:
+                raise NotImplementedError("File.owner is not implemented on this platform.")
+            owner = self.owners[uid] = pwd.getpwuid(uid).pw_name
+        return owner
        
     def _getFileStats(self, pathString):
         """
             Private method to get stats for a file
             
             :Parameters:
-                fileId : string
-                    A string uniquely identifying a file on this Monitor.
+                pathString : string
+                    The path of the file.
                   
             :return: stats
             :rtype: monitors.FileStats
      
         """
+        st = os.stat(pathString)
         stats = monitors.FileStats()
         
         stats.baseName = pathModule.path(pathString).name
-        stats.owner = pathModule.path(pathString).owner
-        stats.size = pathModule.path(pathString).size
-        stats.mTime = pathModule.path(pathString).mtime
-        stats.cTime = pathModule.path(pathString).ctime
-        stats.aTime = pathModule.path(pathString).atime
-        if pathModule.path(pathString).isfile():
+        if pwd is None:
+            stats.owner = pathModule.path(pathString).owner
+        else:
+            stats.owner = self._getOwner(st.st_uid)
+        stats.size = st.st_size
+        stats.mTime = st.st_mtime
+        stats.cTime = st.st_ctime
+        stats.aTime = st.st_atime
+        if stat.S_ISREG(st.st_mode):
             stats.type = monitors.FileType.File
-        elif pathModule.path(pathString).isdir():
+        elif stat.S_ISDIR(st.st_mode):
             stats.type = monitors.FileType.Dir
         elif pathModule.path(pathString).islink():
             stats.type = monitors.FileType.Link
@@ -533,7 +772,22 @@ class FileServerI(monitors.FileServer):
         
 
     def _getSHA1(self, pathString):
-        """docstring for _getSHA1"""
+        """
+            Private method to SHA1 digest a file, reusing the digest of an
+            earlier call unless the file's size or times have changed since.
+
+        """
+        try:
+            st = os.stat(pathString)
+        except Exception, e:
+            self.log.error('Failed to open file ' + pathString + ' : ' + str(e))
+            raise Exception('Failed to open file ' + pathString + ' : ' + str(e))       
+
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+        cached = self.sha1s.get(pathString)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
         try:
             file = open(pathString, 'rb')
         except Exception, e:
@@ -543,17 +797,19 @@ class FileServerI(monitors.FileServer):
         digest = sha()
         try:
             try:
-                block = file.read(1024)
+                block = file.read(self.shaBlockSize)
                 while block:
                     digest.update(block)
-                    block = file.read(1024)
+                    block = file.read(self.shaBlockSize)
             except Exception, e:
                 self.log.error('Failed to SHA1 digest file ' + pathString + ' : ' + str(e))
                 raise Exception('Failed to SHA1 digest file ' + pathString + ' : ' + str(e))       
         finally:
             file.close()
 
-        return digest.hexdigest()
+        sha1 = digest.hexdigest()
+        self._cache(self.sha1s, pathString, (key, sha1))
+        return sha1
    
     def _getPathString(self, fileId):
         """
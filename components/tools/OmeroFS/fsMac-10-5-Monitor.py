@@ -10,6 +10,7 @@ from Foundation import NSAutoreleasePool, NSMutableArray, NSString
 import FSEvents
 
 import threading
+import time
 import sys, traceback
 import socket
 
@@ -36,10 +37,14 @@ class PlatformMonitor(AbstractPlatformMonitor):
         A Thread to monitor a path.
         
         :group Constructor: __init__
-        :group Other methods: run, stop
+        :group Other methods: run, stop, saveIndex
 
     """
-    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy):
+
+    #: Minimum number of seconds between saves of the index after events.
+    SAVE_INTERVAL = 60
+
+    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile=None):
         """
             Set-up Monitor thread.
             
@@ -70,9 +75,13 @@ class PlatformMonitor(AbstractPlatformMonitor):
                     
                 proxy :
                     A proxy to be informed of events
+
+                indexFile : string
+                    A file in which the snapshot of the tree is saved
+                    between runs, or None.
                     
         """
-        AbstractPlatformMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy)
+        AbstractPlatformMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile)
         self.log = logging.getLogger("fsserver."+__name__)
         
         #: an FSEvents.FSEventStream StreamRef object reference.
@@ -96,9 +105,13 @@ class PlatformMonitor(AbstractPlatformMonitor):
         ms = NSString.stringWithString_(self.pathsToMonitor)
         pathsToMonitor.insertObject_atIndex_(ms, 0)
 
-        self.directory = fsDirectory.Directory(pathString=self.pathsToMonitor, 
-                                            whitelist=self.whitelist,
-                                            pathMode=self.pathMode)
+        self.directory = fsDirectory.SnapshotIndex(pathString=self.pathsToMonitor, 
+                                                whitelist=self.whitelist,
+                                                pathMode=self.pathMode,
+                                                indexFile=self.indexFile)
+        #: Guards the index against a save while events are processed.
+        self.indexLock = threading.Lock()
+        self.lastSave = time.time()
 
         self.streamRef = FSEvents.FSEventStreamCreate(FSEvents.kCFAllocatorDefault,
                                 self.callback,
@@ -140,6 +153,12 @@ class PlatformMonitor(AbstractPlatformMonitor):
         if not FSEvents.FSEventStreamStart(self.streamRef):
             raise Exception('Failed to start the FSEventStream')
 
+        # Report the changes made since a loaded index was saved. The
+        # whole tree is scanned, as files may have been modified in
+        # directories whose mtime did not change.
+        if self.directory.loaded:
+            self.callback(self.streamRef, self.clientInfo, 1, [self.pathsToMonitor], [0], [0], full=True)
+
         # Blocks
         FSEvents.CFRunLoopRun()
 
@@ -160,9 +179,40 @@ class PlatformMonitor(AbstractPlatformMonitor):
         FSEvents.FSEventStreamStop(self.streamRef)
         FSEvents.FSEventStreamInvalidate(self.streamRef)
         FSEvents.FSEventStreamRelease(self.streamRef)
+        self.saveIndex(True)
+
+    def saveIndex(self, force=False):
+        """
+            Save the index to indexFile, if any.
+
+            After events the index is saved at most every SAVE_INTERVAL
+            seconds. Changes made since the last save are reported again
+            when the monitor is restarted, none are lost.
+
+            :Parameters:
+                force : boolean
+                    Save even if the index was saved recently.
+
+            :return: No explicit return value.
+
+        """
+        if self.indexFile is None:
+            return
+        self.indexLock.acquire()
+        try:
+            now = time.time()
+            if not force and now - self.lastSave < self.SAVE_INTERVAL:
+                return
+            self.lastSave = now
+            try:
+                self.directory.save()
+            except:
+                self.log.exception('Failed to save index %s : ', self.indexFile)
+        finally:
+            self.indexLock.release()
 
     def callback(self, streamRef, clientInfo, numEvents, 
-                    eventPaths, eventMasks, eventIDs):
+                    eventPaths, eventMasks, eventIDs, full=False):
         """
             Callback required by FSEvents.FSEventStream.
 
@@ -186,6 +236,10 @@ class PlatformMonitor(AbstractPlatformMonitor):
                 eventIDs : list<long>
                     Sequential IDs of the events.
 
+                full : boolean
+                    Compare every directory below the event paths, not only
+                    those whose mtime changed. Used for the startup scan.
+
             :return: No explicit return value.
 
         """
@@ -201,7 +255,11 @@ class PlatformMonitor(AbstractPlatformMonitor):
             # to be forwarded to the client (proxy).
             for i in range(0, numEvents):
             
-                new, old, chg = dir.getChangedFiles(eventPaths[i])
+                self.indexLock.acquire()
+                try:
+                    new, old, chg = dir.getChangedFiles(eventPaths[i], full=full)
+                finally:
+                    self.indexLock.release()
 
                 self.log.info("Full event set : %s", str(eventPaths))
                 self.log.info("New files      : %s", str(new))
@@ -281,6 +339,8 @@ class PlatformMonitor(AbstractPlatformMonitor):
                 
                 self.propagateEvents(eventList)
 
+            self.saveIndex()
+
         else:
             self.log.info("Notification not for this monitor : %s != %s", self.clientInfo, clientInfo)
 
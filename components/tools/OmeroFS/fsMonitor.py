@@ -29,19 +29,19 @@ class MonitorFactory(object):
     @staticmethod
     def createMonitor(mType, eTypes, pMode, pathString, 
                         whitelist, blacklist, timeout, blockSize,
-                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId):
+                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile=None):
 
         if str(mType) == 'Persistent':
             return PersistentMonitor(eTypes, pMode, pathString, whitelist, blacklist, timeout, blockSize, 
-                                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId)
+                                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile)
                                         
         elif str(mType) == 'OneShot':
             return OneShotMonitor(eTypes, pMode, pathString, whitelist, blacklist, timeout, 
-                                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId)
+                                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile)
                                         
         elif str(mType) == 'Inactivity':
             return InactivityMonitor(eTypes, pMode, pathString, whitelist, blacklist, timeout, 
-                                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId)
+                                        ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile)
                                         
         else:
             raise Exception("Unknown monitor type: %s", str(mType))
@@ -56,16 +56,19 @@ class AbstractMonitor(object):
 
     """
     def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist,
-                    ignoreSysFiles, ignoreDirEvents, proxy, monitorId):
+                    ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile=None):
         """
             Initialise Monitor.
 
+            indexFile is passed to the platform monitor, see
+            AbstractPlatformMonitor.
+
         """
         self.log = logging.getLogger("fsclient."+__name__)
         self.proxy = proxy
         self.monitorId = monitorId
         self.pMonitor = PlatformMonitor.PlatformMonitor(eventTypes, pathMode, pathString, whitelist, blacklist, 
-                            ignoreSysFiles, ignoreDirEvents, self)
+                            ignoreSysFiles, ignoreDirEvents, self, indexFile)
 
     def start(self):
         """
@@ -103,7 +106,7 @@ class AbstractMonitor(object):
         raise Exception('Abstract Method: must be implemented by the subclass.')
 
 
-from fsNotificationScheduler import NotificationScheduler
+from fsNotificationScheduler import NotificationScheduler, mergeEvents
 
 class PersistentMonitor(AbstractMonitor):
     """
@@ -114,14 +117,14 @@ class PersistentMonitor(AbstractMonitor):
 
     """
     def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, timeout, blockSize,
-                    ignoreSysFiles, ignoreDirEvents, proxy, monitorId):
+                    ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile=None):
  
         """
             Initialise Monitor.
                                  
         """
         AbstractMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, 
-                            ignoreSysFiles, ignoreDirEvents, proxy, monitorId)
+                            ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile)
         
         self.notifier = NotificationScheduler(self.proxy, self.monitorId, timeout, blockSize)
         self.notifier.start()
@@ -166,13 +169,13 @@ class InactivityMonitor(AbstractMonitor):
         :group Other methods: run, stop
 
     """
-    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, timeout, ignoreSysFiles, ignoreDirEvents, proxy, monitorId):
+    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, timeout, ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile=None):
         """
             Initialise Monitor.
                                  
         """
         AbstractMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, 
-                            ignoreSysFiles, ignoreDirEvents, proxy, monitorId)
+                            ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile)
         self.timer = threading.Timer(timeout, self.inactive)
         self.log.info('Inactivity monitor created. Timer: %s', str(self.timer))
 
@@ -207,15 +210,12 @@ class InactivityMonitor(AbstractMonitor):
 
         self.pMonitor.stop()
 
-    def callback(self, monitorId, eventList):
+    def callback(self, eventList):
         """
             Callback used by ProcessEvent methods
 
             :Parameters:
 
-                id : string
-                watch id.
-
                 eventList : string
                 File paths of the event.
 
@@ -223,7 +223,7 @@ class InactivityMonitor(AbstractMonitor):
 
         """
         self.stop()
-        self.proxy.callback(self.monitorId, eventList)
+        self.proxy.callback(self.monitorId, mergeEvents(eventList))
 
 
 class OneShotMonitor(AbstractMonitor):
@@ -234,13 +234,13 @@ class OneShotMonitor(AbstractMonitor):
         :group Other methods: run, stop
 
     """
-    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, timeout, ignoreSysFiles, ignoreDirEvents, proxy, monitorId):
+    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, timeout, ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile=None):
         """
             Initialise Monitor.
                                  
         """
         AbstractMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, 
-                            ignoreSysFiles, ignoreDirEvents, proxy, monitorId)
+                            ignoreSysFiles, ignoreDirEvents, proxy, monitorId, indexFile)
         self.timer = threading.Timer(timeout, self.inactive)
         self.log.info('OneShot monitor created. Timer: %s', str(self.timer))
 
@@ -294,6 +294,6 @@ class OneShotMonitor(AbstractMonitor):
         """
         self.log.info('File arrived. Timer: %s', str(self.timer))
         self.stop()
-        self.proxy.callback(self.monitorId, eventList)
+        self.proxy.callback(self.monitorId, mergeEvents(eventList))
         self.log.info('Stopped! Timer: %s', str(self.timer))
 
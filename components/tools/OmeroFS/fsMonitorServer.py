@@ -37,9 +37,13 @@ class MonitorServerI(monitors.MonitorServer):
         :group Other methods: _getNextMonitorId, callback
         
     """
-    def __init__(self):
+    def __init__(self, indexDir=""):
         """
             Intialise the instance variables.
+
+            indexDir is the directory in which monitors save the index of
+            the tree they watch, so that changes made while the server is
+            down are reported on restart. Indexes are not saved if empty.
         
         """
         self.log = logging.getLogger("fsserver."+__name__)
@@ -51,6 +55,8 @@ class MonitorServerI(monitors.MonitorServer):
         self.monitors = {}
         #: Dictionary of MonitorClientI proxies by Id
         self.proxies = {}
+        #: Directory of the saved indexes of the monitored trees
+        self.indexDir = indexDir
 
 
     """
@@ -110,7 +116,8 @@ class MonitorServerI(monitors.MonitorServer):
             # blockSize (0) and ignoreDirEvents (True) hardwired until slice is changed.
             self.monitors[monitorId] = MonitorFactory.createMonitor(mType, eTypes, pMode, pathString, 
                                             whitelist, blacklist, timeout, blockSize, 
-                                            ignoreSysFiles, ignoreDirEvents, self, monitorId)
+                                            ignoreSysFiles, ignoreDirEvents, self, monitorId,
+                                            self._getIndexFile(pathString))
 
         except Exception, e:
             self.log.exception('Failed to create monitor: ')
@@ -213,6 +220,21 @@ class MonitorServerI(monitors.MonitorServer):
         
         
    
+    def _getIndexFile(self, pathString):
+        """
+            Return the file in which the index of a path is saved.
+
+            The file is named after the path rather than the monitor Id
+            so that the index is found again by a restarted server.
+
+            :return: Full path of the index file or None if not saved.
+            :rtype: string
+
+        """
+        if not self.indexDir:
+            return None
+        return str(pathModule.path(self.indexDir) / (sha(str(pathString)).hexdigest() + '.index'))
+
     def _getNextMonitorId(self):
         """
             Return next monitor ID and increment.
@@ -6,41 +6,122 @@
 
 """
 import logging
-import threading, Queue
+import threading
 import time
 
+import omero.all
+import omero.grid.monitors as monitors
+
+
+def mergeEvents(eventList, pending=None, types=None):
+    """
+        Merge a list of (path, event type) tuples per path.
+
+        The last event type for a path is kept except that a Modify after
+        a Create leaves the Create, so that a file being written is only
+        reported as created. Paths keep the order of their first event.
+
+        :Parameters:
+            eventList : list<tuple>
+                The events to merge.
+            pending : list<string>
+                Paths already merged, in order, to merge into.
+            types : dict<string, EventType>
+                The event type of each path in pending.
+
+        :return: The merged events, or None if merged into pending.
+        :rtype: list<tuple>
+
+    """
+    if pending is None:
+        pending = []
+        types = {}
+        mergeEvents(eventList, pending, types)
+        return [(name, types[name]) for name in pending]
+    for name, eventType in eventList:
+        was = types.get(name)
+        if was is None:
+            pending.append(name)
+        elif was == monitors.EventType.Create and eventType == monitors.EventType.Modify:
+            continue
+        types[name] = eventType
+
+
 class NotificationScheduler(threading.Thread):
-    def __init__(self, proxy, monitorId, timeout=0.0, blockSize=0):
+    """
+        Forwards the events of a monitor to its client in batches.
+
+        Events are merged per path as they are scheduled, and at most one
+        batch of at most blockSize events is sent per timeout seconds. A
+        client that takes longer than that to accept a batch sets the pace
+        instead, and once maxPending paths are waiting schedule blocks
+        until the client has caught up.
+
+    """
+
+    #: Seconds between batches when no timeout is given.
+    INTERVAL = 0.1
+
+    def __init__(self, proxy, monitorId, timeout=0.0, blockSize=0, maxPending=10000):
         threading.Thread.__init__(self)
         self.log = logging.getLogger("fsclient."+__name__)
-        # infinite queue for first test
-        self.queue = Queue.Queue(0)
         self.event = threading.Event()
         self.proxy = proxy
         self.monitorId = monitorId
         self.timeout = timeout
         self.blockSize = blockSize
+        self.maxPending = maxPending
+        #: Paths waiting to be sent, in order, and their event types.
+        self.pending = []
+        self.types = {}
+        self.cond = threading.Condition()
 
     def schedule(self, eventList):
-        self.queue.put_nowait(eventList)
-        
+        self.cond.acquire()
+        try:
+            while len(self.pending) >= self.maxPending and not self.event.isSet():
+                self.log.info('Notification queue full, waiting on monitor id= %s', self.monitorId)
+                self.cond.wait(1.0)
+            mergeEvents(eventList, self.pending, self.types)
+        finally:
+            self.cond.release()
+
+    def next(self):
+        """
+            Remove and return the next batch of waiting events.
+
+        """
+        self.cond.acquire()
+        try:
+            names = self.pending[:self.blockSize or len(self.pending)]
+            notice = [(name, self.types.pop(name)) for name in names]
+            del self.pending[:len(names)]
+            self.cond.notifyAll()
+            return notice
+        finally:
+            self.cond.release()
+
     def run(self):
         self.log.info('Notification Scheduler running')
+        interval = self.timeout > 0 and self.timeout or self.INTERVAL
+        wait = interval
         while not self.event.isSet():
-            qnow = self.queue.qsize()
-            if qnow > 0:
-                self.log.info('Notification queue size = %s', qnow)
-                if self.blockSize != 0 and qnow >= self.blockSize:
-                    qnow = self.blockSize
-                notice = []
-                for i in range(qnow):
-                    notice += self.queue.get_nowait()
-                self.log.info('Notification queue %s items removed.', qnow)
-                self.log.info('Notification queue size = %s', self.queue.qsize())
+            self.event.wait(wait)
+            wait = interval
+            notice = self.next()
+            if notice:
+                self.log.info('Notification of %s events, %s waiting', len(notice), len(self.pending))
+                started = time.time()
                 self.proxy.callback(self.monitorId, notice)
-            time.sleep(0.1)
+                # A slow client sets the pace.
+                elapsed = time.time() - started
+                wait = max(interval - elapsed, elapsed)
         self.log.info('Notification Scheduler stopped')
-           
+
     def stop(self):
         self.event.set()
-        
+        self.cond.acquire()
+        try:
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
@@ -7,7 +7,9 @@
 """
 import logging
 import copy
+import os
 import threading
+import Queue
 import sys, traceback
 import socket
 import time
@@ -19,7 +21,9 @@ import path as pathModule
 
 import omero.all
 import omero.grid.monitors as monitors
+from omero.util.decorators import locked
 from fsAbstractPlatformMonitor import AbstractPlatformMonitor
+from fsNotificationScheduler import mergeEvents
 
 importlog = logging.getLogger("fsserver."+__name__)     
 from omero_ext import pyinotify
@@ -34,7 +38,7 @@ class PlatformMonitor(AbstractPlatformMonitor):
 
     """
 
-    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy):
+    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile=None):
         """
             Set-up Monitor thread.
             
@@ -65,9 +69,12 @@ class PlatformMonitor(AbstractPlatformMonitor):
                     
                 proxy :
                     A proxy to be informed of events
+
+                indexFile : string
+                    Not used, this monitor keeps no snapshot of the tree.
                     
         """
-        AbstractPlatformMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy)
+        AbstractPlatformMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile)
         self.log = logging.getLogger("fsserver."+__name__)
 
         recurse = False
@@ -79,7 +86,8 @@ class PlatformMonitor(AbstractPlatformMonitor):
             recurse = True
         
         self.wm = MyWatchManager()
-        self.notifier = pyinotify.ThreadedNotifier(self.wm, ProcessEvent(wm=self.wm, cb=self.propagateEvents, et=self.eTypes,  ignoreDirEvents=self.ignoreDirEvents))      
+        self.processEvent = ProcessEvent(wm=self.wm, cb=self.propagateEvents, et=self.eTypes,  ignoreDirEvents=self.ignoreDirEvents)
+        self.notifier = pyinotify.ThreadedNotifier(self.wm, self.processEvent)
         self.wm.addBaseWatch(self.pathsToMonitor, (pyinotify.ALL_EVENTS), rec=recurse, auto_add=follow)
         self.log.info('Monitor set-up on %s', str(self.pathsToMonitor))
         self.log.info('Monitoring %s events', str(self.eTypes))
@@ -99,6 +107,7 @@ class PlatformMonitor(AbstractPlatformMonitor):
         """
 
         # Blocks
+        self.processEvent.start()
         self.notifier.start()
         
     def stop(self):        
@@ -115,6 +124,7 @@ class PlatformMonitor(AbstractPlatformMonitor):
             
         """
         self.notifier.stop()
+        self.processEvent.stop()
                 
 class MyWatchManager(pyinotify.WatchManager):
     """
@@ -122,15 +132,25 @@ class MyWatchManager(pyinotify.WatchManager):
        
        At present only one watch is allowed on each path. This 
        may need to be fixed for applications outside of DropBox.
+
+       Watches are added by both the notifier thread and the Crawler,
+       so the watch dictionaries are only used while holding _lock.
        
     """
     watchPaths = {}
     watchParams = {}
+    _lock = threading.RLock()
     log = logging.getLogger("fsserver."+__name__)
     
+    @locked
     def isPathWatched(self, pathString):
         return pathString in self.watchPaths.keys()
 
+    @locked
+    def getWatchParams(self, pathString):
+        return self.watchParams[pathString]
+
+    @locked
     def addBaseWatch(self, path, mask, rec=False, auto_add=False):
         res = pyinotify.WatchManager.add_watch(self, path, mask, rec=False, auto_add=False)
         self.watchPaths.update(res)
@@ -140,16 +160,18 @@ class MyWatchManager(pyinotify.WatchManager):
                 self.addWatch(str(d), mask)
         self.log.info('Base watch created on: %s', path)
 
-    def addWatch(self, path, mask):
+    @locked
+    def addWatch(self, path, mask, recurse=True):
         if not self.isPathWatched(path):
             res = pyinotify.WatchManager.add_watch(self, path, mask, rec=False, auto_add=False)
             self.watchPaths.update(res)
             self.watchParams[path] = copy.copy(self.watchParams[pathModule.path(path).parent])
-            if self.watchParams[path].getRec():
+            if recurse and self.watchParams[path].getRec():
                 for d in pathModule.path(path).dirs():
                     self.addWatch(str(d), mask)
             self.log.info('Watch added on: %s', path)
 
+    @locked
     def removeWatch(self, path):
         if self.isPathWatched(path):
             removeDict = {}
@@ -168,9 +190,9 @@ class MyWatchManager(pyinotify.WatchManager):
                 else:
                     self.log.info('Watch remove failed, wd=%s, on: %s', wd, removeDict[wd]) 
 
+    @locked
     def getWatchPaths(self):
-        for (path,wd) in self.watchPaths.items():
-            yield (path, wd)
+        return self.watchPaths.items()
   
 class WatchParameters(object):
     def __init__(self, mask, rec=False, auto_add=False):
@@ -187,7 +209,100 @@ class WatchParameters(object):
     def getAutoAdd(self):
         return self.auto_add
 
+class Crawler(threading.Thread):
+    """
+        Adds watches to new subtrees and reports what is already in them.
+
+        A directory moved into the watch area can hold a whole acquisition,
+        so rather than walking it on the event thread each new directory is
+        queued here. The crawler adds watches to its subdirectories before
+        listing them, so that whatever is created later is seen by inotify,
+        and hands Create events for what it finds to the ProcessEvent a
+        batch of directories at a time.
+
+    """
+
+    def __init__(self, proc, batch=100):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.log = logging.getLogger("fsserver."+__name__)
+        self.proc = proc
+        self.batch = batch
+        self.queue = Queue.Queue()
+
+    def add(self, pathString, mask, rec):
+        """
+            Queue a new directory whose contents have not been reported.
+
+        """
+        self.queue.put((pathString, mask, rec))
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.crawl(*item)
+            except:
+                self.log.exception("Failed to crawl %s : ", item[0])
+
+    def crawl(self, pathString, mask, rec):
+        """
+            Report the contents of a new directory, and if recursing add
+            watches to and report the contents of each of its subdirectories.
+
+        """
+        el = []
+        todo = [pathString]
+        done = 0
+        while todo:
+            dirString = todo.pop()
+            try:
+                names = os.listdir(dirString)
+            except OSError, e:
+                self.log.info('Failed to list %s : %s', dirString, e)
+                continue
+            for name in names:
+                p = os.path.join(dirString, name)
+                if os.path.isdir(p):
+                    self.log.info('NON-INOTIFY event: New directory at: %s', p)
+                    if not self.proc.ignoreDirEvents:
+                        el.append((p, monitors.EventType.Create))
+                    else:
+                        self.log.info('Not propagated.')
+                    if rec:
+                        try:
+                            self.proc.wm.addWatch(p, mask, recurse=False)
+                        except Exception, e:
+                            self.log.info('Failed to add watch on %s : %s', p, e)
+                            continue
+                        todo.append(p)
+                elif os.path.isfile(p):
+                    self.log.info('NON-INOTIFY event: New file at: %s', p)
+                    el.append((p, monitors.EventType.Create))
+            done += 1
+            if done % self.batch == 0:
+                self.proc.addEvents(el)
+                el = []
+        self.proc.addEvents(el)
+
+
 class ProcessEvent(pyinotify.ProcessEvent):
+    """
+        Turns inotify events into monitor events.
+
+        Each event mask is looked up in a table of handlers. The events a
+        handler produces for a path are held for coalesce seconds and merged
+        with any later events for the same path before being passed to the
+        callback in one list, off the notifier thread. New directories are
+        watched at once and their contents crawled in the background.
+
+    """
+
     def __init__(self, **kwargs):
         pyinotify.ProcessEvent.__init__(self)
         self.log = logging.getLogger("fsserver."+__name__)
@@ -195,8 +310,57 @@ class ProcessEvent(pyinotify.ProcessEvent):
         self.cb = kwargs['cb']
         self.et = kwargs['et']
         self.ignoreDirEvents = kwargs['ignoreDirEvents'] 
+        self.coalesce = kwargs.get('coalesce', 0.1)
         self.waitingCreates = set([])
-        
+
+        #: events waiting to be passed on, as a list of paths in order
+        #: of their first event and a dictionary of event type by path.
+        self.pending = []
+        self.pendingTypes = {}
+        self.lock = threading.Lock()
+        self.timer = None
+        self.crawler = Crawler(self, kwargs.get('crawlBatch', 100))
+
+        dirCreated = self.dirCreated
+        dirDeleted = self.dirDeleted
+        fileDeleted = self.fileDeleted
+        self.handlers = {
+            pyinotify.IN_CREATE | pyinotify.IN_ISDIR: dirCreated,
+            pyinotify.IN_MOVED_TO | pyinotify.IN_ISDIR: dirCreated,
+            pyinotify.IN_MOVED_FROM | pyinotify.IN_ISDIR: dirDeleted,
+            pyinotify.IN_DELETE | pyinotify.IN_ISDIR: dirDeleted,
+            pyinotify.IN_CREATE: self.fileCreated,
+            pyinotify.IN_MOVED_TO: self.fileMovedTo,
+            pyinotify.IN_CLOSE_WRITE: self.fileClosed,
+            pyinotify.IN_MODIFY: self.fileModified,
+            pyinotify.IN_MOVED_FROM: fileDeleted,
+            pyinotify.IN_DELETE: fileDeleted,
+        }
+        # These are all the currently ignored events.
+        #   IN_ATTRIB: attributes have changed? Useful?
+        #   IN_DELETE_SELF, IN_IGNORED: a directory being watched is removed, handled above.
+        #   IN_MOVE_SELF: a directory being watched is moved out of the watch area (itself!), handled above.
+        #   The rest, dir and file open, close and access, are ignored to reduce the log volume at any rate.
+        for mask in (pyinotify.IN_ATTRIB, pyinotify.IN_DELETE_SELF, pyinotify.IN_IGNORED,
+                     pyinotify.IN_MOVE_SELF,
+                     pyinotify.IN_OPEN | pyinotify.IN_ISDIR, pyinotify.IN_CLOSE_NOWRITE | pyinotify.IN_ISDIR,
+                     pyinotify.IN_ACCESS | pyinotify.IN_ISDIR, pyinotify.IN_OPEN,
+                     pyinotify.IN_CLOSE_NOWRITE, pyinotify.IN_ACCESS):
+            self.handlers[mask] = self.ignored
+
+    def start(self):
+        self.crawler.start()
+
+    def stop(self):
+        """
+            Stop the crawler and pass on any events still waiting.
+
+        """
+        self.crawler.stop()
+        if self.crawler.isAlive():
+            self.crawler.join()
+        self.flush()
+
     def process_default(self, event):
         
         try:
@@ -208,8 +372,6 @@ class ProcessEvent(pyinotify.ProcessEvent):
             name = pathModule.path(event.path) / pathModule.path(event.name)
             maskname = event.event_name
             
-        el = []
-        
         # This is a tricky one. I'm not sure why these events arise exactly.
         # It seems to happen when inotify isn't sure of the path. Yet all the
         # events seem to have otherwise good paths. So, remove the suffix and 
@@ -217,150 +379,149 @@ class ProcessEvent(pyinotify.ProcessEvent):
         if name.find('-unknown-path') > 0:
             self.log.debug('Event with "-unknown-path" of type %s : %s', maskname, name)
             name = name.replace('-unknown-path','')
-            
-        # New directory within watch area, either created or moved into.
-        if event.mask == (pyinotify.IN_CREATE | pyinotify.IN_ISDIR) \
-                or event.mask ==  (pyinotify.IN_MOVED_TO | pyinotify.IN_ISDIR):
-            self.log.info('New directory event of type %s at: %s', maskname, name)
-            if "Creation" in self.et:
-                if name.find('untitled folder') == -1:
-                    if not self.ignoreDirEvents:
-                        el.append((name, monitors.EventType.Create))
-                    else:
-                        self.log.info('Not propagated.')
-                    # Handle the recursion plus create any potentially missed Create events
-                    if self.wm.watchParams[pathModule.path(name).parent].getAutoAdd():
-                        self.wm.addWatch(name, self.wm.watchParams[pathModule.path(name).parent].getMask())
-                        if self.wm.watchParams[pathModule.path(name).parent].getRec():
-                            for d in pathModule.path(name).walkdirs():
-                                self.log.info('NON-INOTIFY event: New directory at: %s', str(d))
-                                if not self.ignoreDirEvents:
-                                    el.append((str(d), monitors.EventType.Create))
-                                else:
-                                    self.log.info('Not propagated.')
-                                self.wm.addWatch(str(d), self.wm.watchParams[pathModule.path(name).parent].getMask())
-                            for f in pathModule.path(name).walkfiles():
-                                self.log.info('NON-INOTIFY event: New file at: %s', str(f))
-                                el.append((str(f), monitors.EventType.Create))
-                        else:
-                            for d in pathModule.path(name).dirs():
-                                self.log.info('NON-INOTIFY event: New directory at: %s', str(d))
-                                if not self.ignoreDirEvents:
-                                    el.append((str(d), monitors.EventType.Create))
-                                else:
-                                    self.log.info('Not propagated.')
-                            for f in pathModule.path(name).files():
-                                self.log.info('NON-INOTIFY event: New file at: %s', str(f))
-                                el.append((str(f), monitors.EventType.Create))
+
+        self.handlers.get(event.mask, self.uncaught)(name, maskname)
+
+    def addEvents(self, el):
+        """
+            Queue events to be passed on, merging them with any already
+            waiting for the same path.
+
+            The latest event type for a path is kept, except that a
+            Modify does not replace a Create.
+
+            :Parameters:
+                el : list<tuple>
+                    A list of (path, event type) tuples.
+
+            :return: No explicit return value.
+
+        """
+        if not el:
+            return
+        self.lock.acquire()
+        try:
+            mergeEvents(el, self.pending, self.pendingTypes)
+            if self.timer is None and self.coalesce > 0:
+                self.timer = threading.Timer(self.coalesce, self.flush)
+                self.timer.setDaemon(True)
+                self.timer.start()
+        finally:
+            self.lock.release()
+        if self.coalesce <= 0:
+            self.flush()
+
+    def flush(self):
+        """
+            Pass all waiting events to the callback.
+
+        """
+        self.lock.acquire()
+        try:
+            el = [(name, self.pendingTypes[name]) for name in self.pending]
+            self.pending = []
+            self.pendingTypes = {}
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = None
+        finally:
+            self.lock.release()
+        if len(el) > 0:
+            self.cb(el)
+
+    # New directory within watch area, either created or moved into.
+    def dirCreated(self, name, maskname):
+        self.log.info('New directory event of type %s at: %s', maskname, name)
+        if "Creation" in self.et:
+            if name.find('untitled folder') == -1:
+                if not self.ignoreDirEvents:
+                    self.addEvents([(name, monitors.EventType.Create)])
                 else:
-                    self.log.info('Created "untitled folder" ignored.')
+                    self.log.info('Not propagated.')
+                # Watch the directory now and leave the recursion plus
+                # any potentially missed Create events to the crawler.
+                params = self.wm.getWatchParams(pathModule.path(name).parent)
+                if params.getAutoAdd():
+                    self.wm.addWatch(name, params.getMask(), recurse=False)
+                    self.crawler.add(name, params.getMask(), params.getRec())
             else:
-                self.log.info('Not propagated.')
-                
-        # Deleted directory or one moved out of the watch area.
-        elif event.mask ==  (pyinotify.IN_MOVED_FROM | pyinotify.IN_ISDIR) \
-                or event.mask ==  (pyinotify.IN_DELETE | pyinotify.IN_ISDIR):
-            self.log.info('Deleted directory event of type %s at: %s', maskname, name)
-            if "Deletion" in self.et:
-                if name.find('untitled folder') == -1:
-                    if not self.ignoreDirEvents:
-                        el.append((name, monitors.EventType.Delete))
-                    else:
-                        self.log.info('Not propagated.')
-                    self.log.info('Files and subfolders within %s may have been deleted without notice', name)
-                    self.wm.removeWatch(name)
+                self.log.info('Created "untitled folder" ignored.')
+        else:
+            self.log.info('Not propagated.')
+
+    # Deleted directory or one moved out of the watch area.
+    def dirDeleted(self, name, maskname):
+        self.log.info('Deleted directory event of type %s at: %s', maskname, name)
+        if "Deletion" in self.et:
+            if name.find('untitled folder') == -1:
+                if not self.ignoreDirEvents:
+                    self.addEvents([(name, monitors.EventType.Delete)])
                 else:
-                    self.log.info('Deleted "untitled folder" ignored.')
-            else:
-                self.log.info('Not propagated.')
-        
-        # New file within watch area, either created or moved into.
-        # The file may have been created but it may not be complete and closed.
-        # Modifications should be watched
-        elif event.mask == pyinotify.IN_CREATE:
-            self.log.info('New file event of type %s at: %s', maskname, name)
-            if "Creation" in self.et:
-                self.waitingCreates.add(name)
+                    self.log.info('Not propagated.')
+                self.log.info('Files and subfolders within %s may have been deleted without notice', name)
+                self.wm.removeWatch(name)
             else:
-                self.log.info('Not propagated.')
+                self.log.info('Deleted "untitled folder" ignored.')
+        else:
+            self.log.info('Not propagated.')
 
-        # New file within watch area.
-        elif event.mask == pyinotify.IN_MOVED_TO:
-            self.log.info('New file event of type %s at: %s', maskname, name)
+    # New file within watch area, either created or moved into.
+    # The file may have been created but it may not be complete and closed.
+    # Modifications should be watched
+    def fileCreated(self, name, maskname):
+        self.log.info('New file event of type %s at: %s', maskname, name)
+        if "Creation" in self.et:
+            self.waitingCreates.add(name)
+        else:
+            self.log.info('Not propagated.')
+
+    # New file within watch area.
+    def fileMovedTo(self, name, maskname):
+        self.log.info('New file event of type %s at: %s', maskname, name)
+        if "Creation" in self.et:
+            self.addEvents([(name, monitors.EventType.Create)])
+        else:
+            self.log.info('Not propagated.')
+
+    # Modified file within watch area.
+    def fileClosed(self, name, maskname):
+        self.log.info('Modified file event of type %s at: %s', maskname, name)
+        if name in self.waitingCreates:
             if "Creation" in self.et:
-                el.append((name, monitors.EventType.Create))
+                self.addEvents([(name, monitors.EventType.Create)])
+                self.waitingCreates.remove(name)
             else:
                 self.log.info('Not propagated.')
-
-        # Modified file within watch area.
-        elif event.mask == pyinotify.IN_CLOSE_WRITE:
-            self.log.info('Modified file event of type %s at: %s', maskname, name)
-            if name in self.waitingCreates:
-                if "Creation" in self.et:
-                    el.append((name, monitors.EventType.Create))
-                    self.waitingCreates.remove(name)
-                else:
-                    self.log.info('Not propagated.')
+        else:
+            if "Modification" in self.et:
+                self.addEvents([(name, monitors.EventType.Modify)])
             else:
-                if "Modification" in self.et:
-                    el.append((name, monitors.EventType.Modify))
-                else:
-                    self.log.info('Not propagated.')
-
-        # Modified file within watch area, only notify if file is not waitingCreate.
-        elif event.mask == pyinotify.IN_MODIFY:
-            self.log.info('Modified file event of type %s at: %s', maskname, name)
-            if name not in self.waitingCreates:
-                if "Modification" in self.et:
-                    el.append((name, monitors.EventType.Modify))
-                else:
-                    self.log.info('Not propagated.')
-                    
+                self.log.info('Not propagated.')
 
-        # Deleted file  or one moved out of the watch area.
-        elif event.mask == pyinotify.IN_MOVED_FROM or event.mask == pyinotify.IN_DELETE:
-            self.log.info('Deleted file event of type %s at: %s', maskname, name)
-            if "Deletion" in self.et:
-                el.append((name, monitors.EventType.Delete))
+    # Modified file within watch area, only notify if file is not waitingCreate.
+    def fileModified(self, name, maskname):
+        self.log.info('Modified file event of type %s at: %s', maskname, name)
+        if name not in self.waitingCreates:
+            if "Modification" in self.et:
+                self.addEvents([(name, monitors.EventType.Modify)])
             else:
                 self.log.info('Not propagated.')
 
-        # These are all the currently ignored events.
-        elif event.mask == pyinotify.IN_ATTRIB:
-            # Attributes have changed? Useful?
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_DELETE_SELF or event.mask == pyinotify.IN_IGNORED:
-            # This is when a directory being watched is removed, handled above.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_MOVE_SELF:
-            # This is when a directory being watched is moved out of the watch area (itself!), handled above.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_OPEN | pyinotify.IN_ISDIR :
-            # Event, dir open, we can ignore for now to reduce the log volume at any rate.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_CLOSE_NOWRITE | pyinotify.IN_ISDIR :
-            # Event, dir close, we can ignore for now to reduce the log volume at any rate.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_ACCESS | pyinotify.IN_ISDIR :
-            # Event, dir access, we can ignore for now to reduce the log volume at any rate.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_OPEN :
-            # Event, file open, we can ignore for now to reduce the log volume at any rate.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_CLOSE_NOWRITE :
-            # Event, file close, we can ignore for now to reduce the log volume at any rate.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        elif event.mask == pyinotify.IN_ACCESS :
-            # Event, file access, we can ignore for now to reduce the log volume at any rate.
-            self.log.debug('Ignored event of type %s at: %s', maskname, name)
-        
-        # Other events, log them since they really should be caught above    
+    # Deleted file  or one moved out of the watch area.
+    def fileDeleted(self, name, maskname):
+        self.log.info('Deleted file event of type %s at: %s', maskname, name)
+        if "Deletion" in self.et:
+            self.addEvents([(name, monitors.EventType.Delete)])
         else:
-            self.log.info('Uncaught event of type %s at: %s', maskname, name)
             self.log.info('Not propagated.')
-        
-        if len(el) > 0:
-            self.cb(el)
+
+    def ignored(self, name, maskname):
+        self.log.debug('Ignored event of type %s at: %s', maskname, name)
+
+    # Other events, log them since they really should be caught above    
+    def uncaught(self, name, maskname):
+        self.log.info('Uncaught event of type %s at: %s', maskname, name)
+        self.log.info('Not propagated.')
 
 
 if __name__ == "__main__":
@@ -49,7 +49,7 @@ class Server(Ice.Application):
         try:
             serverIdString = self.getServerIdString(props)
             serverAdapterName = self.getServerAdapterName(props)
-            mServer = fsMonitorServer.MonitorServerI()
+            mServer = fsMonitorServer.MonitorServerI(self.getIndexDir(props))
             adapter = self.communicator().createObjectAdapter(serverAdapterName)
             mServerPrx = adapter.add(mServer, self.communicator().stringToIdentity(serverIdString))
             adapter.activate() 
@@ -79,6 +79,14 @@ class Server(Ice.Application):
         """
         return props.getPropertyWithDefault("omero.fs.monitorServerAdapterName","")
 
+    def getIndexDir(self, props):
+        """
+            Get indexDir, where monitors save the index of their tree,
+            from the communicator properties.
+            
+        """
+        return props.getPropertyWithDefault("omero.fs.indexDir","")
+
 
 if __name__ == '__main__':
     try:
@@ -30,7 +30,7 @@ class PlatformMonitor(AbstractPlatformMonitor):
         :group Other methods: run, stop
 
     """
-    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy):
+    def __init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile=None):
         """
             Set-up Monitor thread.
             
@@ -61,8 +61,11 @@ class PlatformMonitor(AbstractPlatformMonitor):
                     
                 proxy :
                     A proxy to be informed of events         
+
+                indexFile : string
+                    Not used, this monitor keeps no snapshot of the tree.
         """
-        AbstractPlatformMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy)
+        AbstractPlatformMonitor.__init__(self, eventTypes, pathMode, pathString, whitelist, blacklist, ignoreSysFiles, ignoreDirEvents, proxy, indexFile)
         self.log = logging.getLogger("fsserver."+__name__)
 
         self.actions = {
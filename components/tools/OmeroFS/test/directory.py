@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+    Tests the change detection of fsDirectory.SnapshotIndex against
+    that of the fsDirectory.Directory tree.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+from omero.util.temp_files import create_path
+
+import fsDirectory
+
+
+def changes(rv):
+    return tuple([sorted(l) for l in rv])
+
+
+class TestSnapshotIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path(folder=True)
+        for d in ("a", "a/b", "a/b/c", "d"):
+            (self.dir / d).makedirs()
+        for f in ("x.txt", "a/y.txt", "a/z.dv", "a/b/c/w.txt", "d/v.txt"):
+            self.write(f, "data")
+        # Age the tree so that unchanged directories are not racy
+        for p in [self.dir] + list(self.dir.walk()):
+            os.utime(p, (time.time() - 60, time.time() - 60))
+
+    def write(self, name, data):
+        (self.dir / name).write_bytes(data)
+
+    def p(self, name=None):
+        if name is None:
+            return str(self.dir)
+        return str(self.dir / name)
+
+    def both(self, pathMode, whitelist=None):
+        return (fsDirectory.Directory(self.p(), whitelist, pathMode),
+                fsDirectory.SnapshotIndex(self.p(), whitelist, pathMode))
+
+    def assertSameChanges(self, trees, pathString):
+        expected = changes(trees[0].getChangedFiles(pathString))
+        self.assertEquals(expected, changes(trees[1].getChangedFiles(pathString)))
+        return expected
+
+    def testFollow(self):
+        trees = self.both("Follow")
+        self.write("a/new.txt", "new")
+        self.write("a/y.txt", "longer")
+        os.remove(self.p("a/z.dv"))
+        (self.dir / "a/e").makedirs()
+        self.write("a/e/u.txt", "data")
+        rv = self.assertSameChanges(trees, self.p("a"))
+        self.assertEquals(([self.p("a/e"), self.p("a/e/u.txt"), self.p("a/new.txt")],
+                           [self.p("a/z.dv")], [self.p("a/y.txt")]), rv)
+        self.assertSameChanges(trees, self.p("a"))
+
+    def testDeletedTree(self):
+        trees = self.both("Follow")
+        (self.dir / "a/b").rmtree()
+        rv = self.assertSameChanges(trees, self.p("a"))
+        self.assertEquals([self.p("a/b"), self.p("a/b/c"), self.p("a/b/c/w.txt")], rv[1])
+        self.assertEquals(None, trees[1].getEntry(self.p("a/b/c/w.txt")))
+
+    def testFlat(self):
+        trees = self.both("Flat")
+        self.write("new.txt", "new")
+        self.write("x.txt", "longer")
+        (self.dir / "d").rmtree()
+        self.write("a/ignored.txt", "new")
+        rv = self.assertSameChanges(trees, self.p())
+        self.assertEquals(([self.p("new.txt")], [self.p("d")], [self.p("x.txt")]), rv)
+
+    def testWhitelist(self):
+        trees = self.both("Follow", [".dv"])
+        self.write("a/new.txt", "new")
+        self.write("a/new.dv", "new")
+        self.assertEquals(([self.p("a/new.dv")], [], []), self.assertSameChanges(trees, self.p("a")))
+
+    def testPrune(self):
+        index = fsDirectory.SnapshotIndex(self.p(), None, "Follow")
+        self.write("a/empty.txt", "")
+        new = index.getChangedFiles(self.p("a"))[0]
+        self.assertEquals([self.p("a/empty.txt")], index.pruneDirectories(new))
+        self.assertEquals([], index.pruneZeroFiles(new))
+        self.assertEquals([self.p("a/y.txt")], index.pruneDirectories([self.p("a"), self.p("a/y.txt")]))
+
+    def testUnchangedDirectoriesSkipped(self):
+        index = fsDirectory.SnapshotIndex(self.p(), None, "Follow")
+        listed = []
+        _list = index._list
+        index._list = lambda p: listed.append(p) or _list(p)
+        self.write("a/b/c/new.txt", "new")
+        # The event path is always listed, c has a new mtime
+        self.assertEquals(([self.p("a/b/c/new.txt")], [], []), index.getChangedFiles(self.p()))
+        self.assertEquals([self.p(), self.p("a/b/c")], listed)
+        listed[:] = []
+        index.getChangedFiles(self.p(), full=True)
+        self.assertEquals(5, len(listed))
+
+    def testRacyDirectoryListed(self):
+        index = fsDirectory.SnapshotIndex(self.p(), None, "Follow")
+        self.write("a/b/new.txt", "new")
+        index.getChangedFiles(self.p("a/b"))
+        # Added within the same second as b was listed, b's mtime may not change
+        self.write("a/b/new2.txt", "new")
+        os.utime(self.p("a/b"), (time.time(), index.dirs[self.p("a/b")][0]))
+        self.assertEquals([self.p("a/b/new2.txt")], index.getChangedFiles(self.p())[0])
+
+    def testSaveAndLoad(self):
+        indexFile = str(self.dir / "index")
+        index = fsDirectory.SnapshotIndex(self.p("a"), None, "Follow", indexFile)
+        index.save()
+        self.write("a/new.txt", "new")
+        self.assertFalse(index.loaded)
+        loaded = fsDirectory.SnapshotIndex(self.p("a"), None, "Follow", indexFile)
+        self.assertTrue(loaded.loaded)
+        self.assertEquals(index.dirs, loaded.dirs)
+        self.assertEquals(([self.p("a/new.txt")], [], []), loaded.getChangedFiles(self.p("a")))
+        # An index of another path is ignored
+        other = fsDirectory.SnapshotIndex(self.p("d"), None, "Follow", indexFile)
+        self.assertFalse(other.loaded)
+        self.assertEquals([self.p("d")], other.dirs.keys())
+
+    def testFullScanAfterLoad(self):
+        indexFile = str(create_path(folder=True) / "index")
+        fsDirectory.SnapshotIndex(self.p(), None, "Follow", indexFile).save()
+        # Modified while no monitor ran, c's mtime does not change
+        self.write("a/b/c/w.txt", "longer")
+        loaded = fsDirectory.SnapshotIndex(self.p(), None, "Follow", indexFile)
+        self.assertEquals(([], [], []), loaded.getChangedFiles(self.p()))
+        loaded = fsDirectory.SnapshotIndex(self.p(), None, "Follow", indexFile)
+        self.assertEquals(([], [], [self.p("a/b/c/w.txt")]), loaded.getChangedFiles(self.p(), full=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+   Times change detection over a synthetic tree, with the Directory tree
+   and with SnapshotIndex: building the snapshot, finding a few changes
+   from the top of the tree, and for SnapshotIndex a full rescan and a
+   warm restart from its saved index.
+
+   The number of files and of files per directory can be set via the
+   BENCHMARK_FILES (default 100000) and BENCHMARK_PER_DIR (default 100)
+   environment variables. Directories are nested BENCHMARK_PER_DIR to a
+   level. Set BENCHMARK_TREE=0 to skip the Directory tree, which is slow
+   for a million files.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+from omero.util.temp_files import create_path
+
+import fsDirectory
+
+FILES = int(os.environ.get("BENCHMARK_FILES", 100000))
+PER_DIR = int(os.environ.get("BENCHMARK_PER_DIR", 100))
+TREE = int(os.environ.get("BENCHMARK_TREE", 1))
+CHANGES = 10
+
+
+class TestDirectoryBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path(folder=True)
+        self.root = str(self.dir / "root")
+        self.dirs = []
+        for n in range(0, FILES, PER_DIR):
+            d = n / PER_DIR
+            p = os.path.join(self.root, "%s" % (d / PER_DIR), "%s" % (d % PER_DIR))
+            os.makedirs(p)
+            self.dirs.append(p)
+            for f in range(min(PER_DIR, FILES - n)):
+                open(os.path.join(p, "%s.txt" % f), "w").close()
+        old = time.time() - 60
+        for p in self.dirs + [os.path.dirname(p) for p in self.dirs] + [self.root]:
+            os.utime(p, (old, old))
+
+    def change(self):
+        for p in self.dirs[::max(1, len(self.dirs) / CHANGES)][:CHANGES]:
+            open(os.path.join(p, "new%s.txt" % time.time()), "w").close()
+
+    def timed(self, label, func):
+        t0 = time.time()
+        rv = func()
+        print "%-24s %8.3fs" % (label, time.time() - t0)
+        return rv
+
+    def testTree(self):
+        print "\n%s files, %s per directory" % (FILES, PER_DIR)
+        if TREE:
+            tree = self.timed("Directory", lambda: fsDirectory.Directory(self.root, None, "Follow"))
+            self.change()
+            new = self.timed("Directory changes", lambda: tree.getChangedFiles(self.root))[0]
+            self.assertEquals(CHANGES, len(new))
+
+        indexFile = str(self.dir / "index")
+        index = self.timed("SnapshotIndex", lambda: fsDirectory.SnapshotIndex(self.root, None, "Follow", indexFile))
+        self.change()
+        new = self.timed("SnapshotIndex changes", lambda: index.getChangedFiles(self.root))[0]
+        self.assertEquals(CHANGES, len(new))
+        self.timed("SnapshotIndex full", lambda: index.getChangedFiles(self.root, full=True))
+        self.timed("SnapshotIndex save", index.save)
+        index = self.timed("SnapshotIndex load", lambda: fsDirectory.SnapshotIndex(self.root, None, "Follow", indexFile))
+        self.change()
+        new = self.timed("SnapshotIndex restart", lambda: index.getChangedFiles(self.root))[0]
+        self.assertEquals(CHANGES, len(new))
+
+if __name__ == '__main__':
+    unittest.main()
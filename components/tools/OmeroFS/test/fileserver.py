@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+    Tests the reads, SHA1 digests and stats of the FileServerI servant
+    against local temporary files.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import threading
+import unittest
+
+import omero
+import omero.all
+import omero.grid.monitors as monitors
+
+from omero.util.temp_files import create_path
+
+try:
+    from hashlib import sha1 as sha
+except:
+    from sha import sha
+
+import fsFileServer
+
+
+def block(offset, size):
+    r = monitors.BlockRange()
+    r.offset = offset
+    r.size = size
+    return r
+
+
+class TestFileServer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path(folder=True)
+        self.server = fsFileServer.FileServerI(maxOpen=2, shaBlockSize=1000)
+        self.data = "".join([chr(i % 251) for i in range(10000)])
+        self.file = self.write("data", self.data)
+
+    def tearDown(self):
+        self.server.close()
+
+    def write(self, name, data):
+        f = self.dir / name
+        f.write_bytes(data)
+        return str(f)
+
+    def testReadBlock(self):
+        self.assertEquals(self.data[100:200], self.server.readBlock(self.file, 100, 100))
+        self.assertEquals(self.data[9990:], self.server.readBlock(self.file, 9990, 100))
+        self.assertEquals("", self.server.readBlock(self.file, 20000, 100))
+        self.assertEquals(1, len(self.server.openFiles))
+
+    def testReadBlocks(self):
+        ranges = [block(0, 10), block(5000, 3000), block(9999, 10), block(0, 0)]
+        self.assertEquals([self.data[0:10], self.data[5000:8000], self.data[9999:], ""],
+                          self.server.readBlocks(self.file, ranges))
+
+    def testOpenFilesBounded(self):
+        files = [self.write("f%s" % i, str(i) * 10) for i in range(5)]
+        for f in files + files:
+            self.assertEquals(f[-1] * 10, self.server.readBlock(f, 0, 10))
+            self.assertTrue(len(self.server.openFiles) <= 2)
+
+    def testReplacedFileReopened(self):
+        self.server.readBlock(self.file, 0, 10)
+        os.remove(self.file)
+        self.write("data", "replaced")
+        self.assertEquals("replaced", self.server.readBlock(self.file, 0, 10))
+
+    def testMissingFile(self):
+        self.assertRaises(omero.OmeroFSError, self.server.readBlock, str(self.dir / "missing"), 0, 10)
+        self.assertRaises(omero.OmeroFSError, self.server.getSHA1, str(self.dir / "missing"))
+
+    def testParallelReads(self):
+        errors = []
+        def read(offset):
+            for i in range(50):
+                if self.data[offset:offset + 500] != self.server.readBlock(self.file, offset, 500):
+                    errors.append(offset)
+        threads = [threading.Thread(target=read, args=(i * 1000,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals([], errors)
+
+    def testSHA1(self):
+        self.assertEquals(sha(self.data).hexdigest(), self.server.getSHA1(self.file))
+        self.assertEquals(1, len(self.server.sha1s))
+        self.assertEquals(sha(self.data).hexdigest(), self.server.getSHA1(self.file))
+
+    def testSHA1Invalidated(self):
+        self.server.getSHA1(self.file)
+        self.write("data", self.data + "more")
+        self.assertEquals(sha(self.data + "more").hexdigest(), self.server.getSHA1(self.file))
+        # Same size, new mtime
+        self.write("data", "x" + self.data[1:] + "more")
+        st = os.stat(self.file)
+        os.utime(self.file, (st.st_atime, st.st_mtime + 10))
+        self.assertEquals(sha("x" + self.data[1:] + "more").hexdigest(), self.server.getSHA1(self.file))
+
+    def testStats(self):
+        stats = self.server.getStats(self.file)
+        self.assertEquals("data", stats.baseName)
+        self.assertEquals(10000, stats.size)
+        self.assertEquals(monitors.FileType.File, stats.type)
+        self.assertEquals(10000, self.server.getSize(self.file))
+        self.assertEquals(stats.mTime, self.server.getMTime(self.file))
+        self.assertEquals(stats.owner, self.server.getOwner(self.file))
+        self.assertEquals(monitors.FileType.Dir, self.server.getStats(str(self.dir)).type)
+
+    def testStatsTimeout(self):
+        self.server.statsTimeout = 0.2
+        self.assertEquals(10000, self.server.getSize(self.file))
+        self.write("data", "short")
+        self.assertEquals(10000, self.server.getSize(self.file))
+        time.sleep(0.3)
+        self.assertEquals(5, self.server.getSize(self.file))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+   Times reading large local files through the FileServerI servant
+   in-process, in blocks with readBlock and readBlocks, and digesting
+   them with getSHA1 twice, the second time from the digest cache.
+
+   The number of files, their size in megabytes and the block size in
+   kilobytes can be set via the BENCHMARK_FILES (default 4), BENCHMARK_SIZE
+   (default 64) and BENCHMARK_BLOCK (default 64) environment variables
+   and the number of blocks per readBlocks call via BENCHMARK_RANGES
+   (default 16).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+import omero.all
+import omero.grid.monitors as monitors
+
+from omero.util.temp_files import create_path
+
+import fsFileServer
+
+FILES = int(os.environ.get("BENCHMARK_FILES", 4))
+SIZE = int(os.environ.get("BENCHMARK_SIZE", 64)) * 1024 * 1024
+BLOCK = int(os.environ.get("BENCHMARK_BLOCK", 64)) * 1024
+RANGES = int(os.environ.get("BENCHMARK_RANGES", 16))
+
+
+class TestFileServerBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path(folder=True)
+        self.files = []
+        chunk = os.urandom(1024 * 1024)
+        for i in range(FILES):
+            f = self.dir / ("f%s" % i)
+            out = open(f, "wb")
+            try:
+                for j in range(SIZE / len(chunk)):
+                    out.write(chunk)
+            finally:
+                out.close()
+            self.files.append(str(f))
+        self.server = fsFileServer.FileServerI()
+
+    def tearDown(self):
+        self.server.close()
+
+    def timed(self, label, func):
+        t0 = time.time()
+        count = func()
+        elapsed = time.time() - t0
+        print "%-12s %8.3fs %8.1f MB/s" % (label, elapsed, count / elapsed / 1024 / 1024)
+        return count
+
+    def readBlock(self):
+        count = 0
+        for f in self.files:
+            for offset in range(0, SIZE, BLOCK):
+                count += len(self.server.readBlock(f, offset, BLOCK))
+        return count
+
+    def readBlocks(self):
+        count = 0
+        for f in self.files:
+            for start in range(0, SIZE, BLOCK * RANGES):
+                ranges = []
+                for offset in range(start, min(start + BLOCK * RANGES, SIZE), BLOCK):
+                    r = monitors.BlockRange()
+                    r.offset = offset
+                    r.size = BLOCK
+                    ranges.append(r)
+                count += sum([len(b) for b in self.server.readBlocks(f, ranges)])
+        return count
+
+    def getSHA1(self):
+        for f in self.files:
+            self.server.getSHA1(f)
+        return FILES * SIZE
+
+    def testRead(self):
+        print "\n%s files of %s MB, %s KB blocks" % (FILES, SIZE / 1024 / 1024, BLOCK / 1024)
+        self.assertEquals(FILES * SIZE, self.timed("readBlock", self.readBlock))
+        self.assertEquals(FILES * SIZE, self.timed("readBlocks", self.readBlocks))
+        self.timed("getSHA1", self.getSHA1)
+        self.timed("getSHA1 (2)", self.getSHA1)
+
+if __name__ == '__main__':
+    unittest.main()
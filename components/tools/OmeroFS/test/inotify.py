@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+    Tests the event handling of fsPyinotifyMonitor.ProcessEvent with
+    synthetic inotify events, and the crawling of new directories.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+import omero.all
+import omero.grid.monitors as monitors
+
+from omero.util.temp_files import create_path
+
+if sys.platform.startswith("linux"):
+    import fsPyinotifyMonitor
+    from fsPyinotifyMonitor import pyinotify
+
+Create = monitors.EventType.Create
+Modify = monitors.EventType.Modify
+Delete = monitors.EventType.Delete
+
+
+class FakeEvent(object):
+
+    def __init__(self, pathname, mask):
+        self.pathname = str(pathname)
+        self.mask = mask
+        self.maskname = str(mask)
+
+
+class FakeWatchManager(object):
+    """ Records the watches added and removed """
+
+    def __init__(self, root, rec):
+        self.watchParams = {str(root): fsPyinotifyMonitor.WatchParameters(0, rec=rec, auto_add=True)}
+        self.watches = []
+
+    def getWatchParams(self, path):
+        return self.watchParams[str(path)]
+
+    def addWatch(self, path, mask, recurse=True):
+        self.watches.append(str(path))
+        self.watchParams[str(path)] = self.watchParams[str(os.path.dirname(path))]
+
+    def removeWatch(self, path):
+        self.watches.remove(str(path))
+
+
+class TestProcessEvent(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path(folder=True)
+        self.events = []
+        self.proc = self.process()
+
+    def tearDown(self):
+        self.proc.stop()
+
+    def process(self, coalesce=0, rec=True, ignoreDirEvents=False, **kwargs):
+        self.wm = FakeWatchManager(self.dir, rec)
+        proc = fsPyinotifyMonitor.ProcessEvent(wm=self.wm, cb=self.events.append,
+                et=["Creation", "Modification", "Deletion"], ignoreDirEvents=ignoreDirEvents,
+                coalesce=coalesce, **kwargs)
+        proc.start()
+        return proc
+
+    def send(self, name, mask):
+        self.proc.process_default(FakeEvent(self.dir / name, mask))
+
+    def flat(self):
+        return [e for el in self.events for e in el]
+
+    def testFileEvents(self):
+        self.send("a", pyinotify.IN_CREATE)
+        self.send("a", pyinotify.IN_MODIFY)
+        self.send("a", pyinotify.IN_CLOSE_WRITE)
+        self.send("a", pyinotify.IN_MODIFY)
+        self.send("b", pyinotify.IN_MOVED_TO)
+        self.send("b", pyinotify.IN_ACCESS)
+        self.send("b", pyinotify.IN_DELETE)
+        self.assertEquals([[(self.dir / "a", Create)], [(self.dir / "a", Modify)],
+                           [(self.dir / "b", Create)], [(self.dir / "b", Delete)]], self.events)
+
+    def testCoalesced(self):
+        self.proc.stop()
+        self.proc = self.process(coalesce=0.2)
+        self.send("a", pyinotify.IN_MOVED_TO)
+        for i in range(100):
+            self.send("a", pyinotify.IN_MODIFY)
+            self.send("b", pyinotify.IN_MODIFY)
+        self.send("c", pyinotify.IN_MOVED_TO)
+        self.send("c", pyinotify.IN_DELETE)
+        self.assertEquals([], self.events)
+        time.sleep(0.5)
+        self.assertEquals([[(self.dir / "a", Create), (self.dir / "b", Modify),
+                            (self.dir / "c", Delete)]], self.events)
+
+    def testNewTreeCrawled(self):
+        self.proc.stop()
+        self.proc = self.process(crawlBatch=2)
+        for d in ("new/a/b", "new/c"):
+            (self.dir / d).makedirs()
+        for f in ("new/x", "new/a/y", "new/a/b/z", "new/c/w"):
+            (self.dir / f).write_bytes("data")
+        self.send("new", pyinotify.IN_MOVED_TO | pyinotify.IN_ISDIR)
+        self.proc.stop()
+        expected = ["new", "new/a", "new/a/b", "new/c", "new/x", "new/a/y", "new/a/b/z", "new/c/w"]
+        self.assertEquals(sorted([(self.dir / p, Create) for p in expected]), sorted(self.flat()))
+        self.assertEquals(sorted([self.dir / p for p in ("new", "new/a", "new/a/b", "new/c")]),
+                          sorted(self.wm.watches))
+        # Several directories were reported per batch
+        self.assertTrue(len(self.events) > 2)
+
+    def testNewDirectoryNotRecursed(self):
+        self.proc.stop()
+        self.proc = self.process(rec=False, ignoreDirEvents=True)
+        (self.dir / "new/a").makedirs()
+        (self.dir / "new/x").write_bytes("data")
+        (self.dir / "new/a/y").write_bytes("data")
+        self.send("new", pyinotify.IN_CREATE | pyinotify.IN_ISDIR)
+        self.proc.stop()
+        self.assertEquals([(self.dir / "new/x", Create)], self.flat())
+        self.assertEquals([self.dir / "new"], self.wm.watches)
+
+    def testDeletedDirectory(self):
+        self.wm.watches.append(str(self.dir / "old"))
+        self.send("old", pyinotify.IN_DELETE | pyinotify.IN_ISDIR)
+        self.assertEquals([[(self.dir / "old", Delete)]], self.events)
+        self.assertEquals([], self.wm.watches)
+
+
+class TestWatchManager(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path(folder=True)
+        (self.dir / "a").makedirs()
+        self.wm = fsPyinotifyMonitor.MyWatchManager()
+        self.wm.addBaseWatch(str(self.dir), pyinotify.ALL_EVENTS, rec=False, auto_add=True)
+
+    def tearDown(self):
+        self.wm.removeWatch(str(self.dir))
+        self.wm.close()
+
+    def testAddWaitsForLock(self):
+        a = str(self.dir / "a")
+        t = threading.Thread(target=self.wm.addWatch, args=(a, pyinotify.ALL_EVENTS, False))
+        self.wm._lock.acquire()
+        try:
+            t.start()
+            t.join(0.2)
+            self.assertTrue(t.isAlive())
+            self.assertFalse(a in self.wm.watchPaths)
+        finally:
+            self.wm._lock.release()
+        t.join()
+        self.assertTrue(self.wm.isPathWatched(a))
+        self.wm.removeWatch(a)
+        self.assertFalse(self.wm.isPathWatched(a))
+
+if not sys.platform.startswith("linux"):
+    del TestProcessEvent
+    del TestWatchManager
+
+if __name__ == '__main__':
+    unittest.main()
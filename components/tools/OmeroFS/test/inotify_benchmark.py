@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""
+   Drives the Linux monitor with files created at a high rate, and with
+   a whole tree moved into the watched directory, and reports how long
+   each Create event lagged the creation of its file and how many files
+   were never reported.
+
+   The number of files and the number of directories they are spread
+   over can be set via the BENCHMARK_FILES (default 5000) and
+   BENCHMARK_DIRS (default 10) environment variables and the seconds to
+   wait for the last event via BENCHMARK_WAIT (default 30).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+import omero.all
+import omero.grid.monitors as monitors
+
+from omero.util.temp_files import create_path
+
+FILES = int(os.environ.get("BENCHMARK_FILES", 5000))
+DIRS = int(os.environ.get("BENCHMARK_DIRS", 10))
+WAIT = float(os.environ.get("BENCHMARK_WAIT", 30))
+
+
+class Proxy(object):
+    """ Records the time each path was first reported as created """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.callbacks = 0
+
+    def callback(self, eventList):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self.callbacks += 1
+            for name, eventType in eventList:
+                if eventType == monitors.EventType.Create:
+                    self.seen.setdefault(str(name), now)
+        finally:
+            self.lock.release()
+
+
+class TestInotifyBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        import fsPyinotifyMonitor
+        self.dir = create_path(folder=True)
+        self.watched = self.dir / "watched"
+        self.watched.makedirs()
+        self.proxy = Proxy()
+        self.monitor = fsPyinotifyMonitor.PlatformMonitor(
+            ["Creation", "Modification"], "Follow", str(self.watched), [], [], True, True, self.proxy)
+        self.monitor.start()
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def wait(self, created):
+        end = time.time() + WAIT
+        while time.time() < end and len([p for p in created if p in self.proxy.seen]) < len(created):
+            time.sleep(0.05)
+
+    def report(self, label, created):
+        lags = [self.proxy.seen[p] - t for p, t in created.items() if p in self.proxy.seen]
+        lost = len(created) - len(lags)
+        if lags:
+            print "%-8s %8d files %8d lost %8d callbacks %8.3fs mean lag %8.3fs max lag" % (
+                label, len(created), lost, self.proxy.callbacks, sum(lags) / len(lags), max(lags))
+        else:
+            print "%-8s %8d files %8d lost" % (label, len(created), lost)
+        return lost
+
+    def write(self, dirs, created=None):
+        for i in range(FILES):
+            p = os.path.join(dirs[i % len(dirs)], "f%s" % i)
+            open(p, "w").write("data")
+            if created is not None:
+                created[p] = time.time()
+
+    def testCreate(self):
+        dirs = [str(self.watched / ("d%s" % i)) for i in range(DIRS)]
+        for d in dirs:
+            os.mkdir(d)
+        time.sleep(0.5)
+        created = {}
+        self.write(dirs, created)
+        self.wait(created)
+        self.report("create", created)
+
+    def testMoveIn(self):
+        tree = self.dir / "tree"
+        dirs = [str(tree / ("d%s" % i) / "sub") for i in range(DIRS)]
+        for d in dirs:
+            os.makedirs(d)
+        self.write(dirs)
+        moved = [os.path.join(d, f).replace(str(tree), str(self.watched / "tree"))
+                 for d in dirs for f in os.listdir(d)]
+        t0 = time.time()
+        os.rename(tree, self.watched / "tree")
+        created = dict([(p, t0) for p in moved])
+        self.wait(created)
+        self.report("move in", created)
+
+if not sys.platform.startswith("linux"):
+    del TestInotifyBenchmark
+
+if __name__ == '__main__':
+    unittest.main()
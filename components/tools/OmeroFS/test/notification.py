@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+    Tests the merging, batching and pacing of monitor events by the
+    NotificationScheduler, driving thousands of synthetic writes through
+    it to a stub client proxy.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import threading
+import time
+import unittest
+
+import omero.all
+import omero.grid.monitors as monitors
+
+from fsNotificationScheduler import NotificationScheduler, mergeEvents
+
+Create = monitors.EventType.Create
+Modify = monitors.EventType.Modify
+Delete = monitors.EventType.Delete
+
+
+class StubProxy(object):
+    """ Counts callbacks and the events delivered in them """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.callbacks = []
+        self.times = []
+
+    def callback(self, monitorId, eventList):
+        self.times.append(time.time())
+        self.callbacks.append(eventList)
+        time.sleep(self.delay)
+
+    def delivered(self):
+        return [e for el in self.callbacks for e in el]
+
+
+class TestNotificationScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.schedulers = []
+
+    def tearDown(self):
+        for s in self.schedulers:
+            s.stop()
+            s.join()
+
+    def scheduler(self, proxy, timeout=0.0, blockSize=0, maxPending=10000):
+        s = NotificationScheduler(proxy, "id", timeout, blockSize, maxPending)
+        s.start()
+        self.schedulers.append(s)
+        return s
+
+    def writes(self, files, modifies):
+        """ The events of writing files, each created then modified repeatedly """
+        for i in range(files):
+            yield [("f%s" % i, Create)]
+        for m in range(modifies):
+            for i in range(files):
+                yield [("f%s" % i, Modify)]
+
+    def drain(self, scheduler, proxy, count):
+        end = time.time() + 10
+        while len(proxy.delivered()) < count and time.time() < end:
+            time.sleep(0.05)
+
+    def testMerge(self):
+        self.assertEquals([("a", Create), ("b", Delete), ("c", Modify)],
+                          mergeEvents([("a", Create), ("b", Create), ("a", Modify),
+                                       ("c", Modify), ("b", Delete), ("c", Modify)]))
+
+    def testWrites(self):
+        proxy = StubProxy()
+        s = self.scheduler(proxy, timeout=0.2)
+        for el in self.writes(100, 50):
+            s.schedule(el)
+        self.drain(s, proxy, 100)
+        time.sleep(0.3)
+        # 5100 events, each path delivered once as created
+        self.assertEquals(sorted([("f%s" % i, Create) for i in range(100)]), sorted(proxy.delivered()))
+        self.assertTrue(len(proxy.callbacks) <= 2, len(proxy.callbacks))
+
+    def testBlockSize(self):
+        proxy = StubProxy()
+        s = self.scheduler(proxy, timeout=0.05, blockSize=30)
+        for el in self.writes(100, 10):
+            s.schedule(el)
+        self.drain(s, proxy, 100)
+        self.assertEquals([30, 30, 30, 10], [len(el) for el in proxy.callbacks])
+        self.assertEquals(["f%s" % i for i in range(100)], [e[0] for e in proxy.delivered()])
+
+    def testOneBatchPerInterval(self):
+        proxy = StubProxy()
+        s = self.scheduler(proxy, timeout=0.1)
+        end = time.time() + 0.55
+        i = 0
+        while time.time() < end:
+            s.schedule([("f%s" % i, Create)])
+            i += 1
+            time.sleep(0.001)
+        self.drain(s, proxy, i)
+        self.assertEquals(i, len(proxy.delivered()))
+        gaps = [b - a for a, b in zip(proxy.times, proxy.times[1:])]
+        self.assertTrue(min(gaps) > 0.08, gaps)
+
+    def testSlowClient(self):
+        proxy = StubProxy(delay=0.2)
+        s = self.scheduler(proxy, timeout=0.05, blockSize=10, maxPending=20)
+        started = time.time()
+        for i in range(60):
+            s.schedule([("f%s" % i, Create)])
+            self.assertTrue(len(s.pending) <= 20)
+        # The writer was held back until the client had taken all but 20
+        self.assertTrue(time.time() - started > 0.5)
+        self.drain(s, proxy, 60)
+        self.assertEquals(60, len(proxy.delivered()))
+        # The client was given as long between batches as it took
+        gaps = [b - a for a, b in zip(proxy.times, proxy.times[1:])]
+        self.assertTrue(min(gaps) >= 0.35, gaps)
+
+    def testWritesFromThreads(self):
+        proxy = StubProxy(delay=0.01)
+        s = self.scheduler(proxy, blockSize=500, maxPending=1000)
+        def write(n):
+            for el in self.writes(200, 20):
+                s.schedule([("t%s/%s" % (n, el[0][0]), el[0][1])])
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.drain(s, proxy, 1000)
+        time.sleep(0.3)
+        delivered = proxy.delivered()
+        self.assertEquals(1000, len(set([e[0] for e in delivered])))
+        self.assertTrue(len(delivered) < 21000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,10 @@ def additional_tests():
     suite.addTest(load("drivers"))
     suite.addTest(load("replay"))
     suite.addTest(load("state"))
+    suite.addTest(load("fileserver"))
+    suite.addTest(load("directory"))
+    suite.addTest(load("inotify"))
+    suite.addTest(load("notification"))
     return suite
 
 if __name__ == "__main__":
@@ -35,7 +35,12 @@ between control and experimental datasets.
  
 """ 
 
-from mpi4py import MPI as mpi
+try:
+    from mpi4py import MPI as mpi
+except ImportError:
+    # Without MPI a single process fits all pixels, optionally spreading
+    # them over a multiprocessing pool (see -w)
+    mpi = None
 import warnings as wrn
 
 import matplotlib as mpl
@@ -57,6 +62,8 @@ from scipy import ndimage as ndi
 from scipy import cluster as clt
 
 import mpfit as mpf
+import omero.util.flim_fit as flf
+from omero.util.flim_fit import cexp_1, err_1, cexp_2, err_2
 
 # OMERO Imports 
 import omero.clients
@@ -77,9 +84,6 @@ try:
 except ImportError:
     import Image, ImageDraw # see ticket:2597
 
-# eps (epsilon) is a magic small number to avoid getting division by zero warnings from the mpfit calls
-eps=0.000000001
-
 # mycmdata1 and cycm1 are custom colormaps for generating plots in matplotlib of the numpy arrays
 # of the spatial parameter distributions (the colours are chosen to make nice inverted images for presentations
 # rather than nice look nice in their uninverted form.
@@ -94,34 +98,8 @@ paranames=['$\\alpha_{1}$','$\\tau_{1}$','$b$','$\\alpha_{2}$','$\\tau_{2}$']
 # A functions to locate the index of the maximum value in an array 
 argmax = lambda a: max(itr.izip(a, xrange(len(a))))[1]
 
-# The following functions are the single exponential and the double exponential functions
-# and the wrapper functions for the mpfit program.
-
-# Single exponential decay function convolved with irf
-cexp_1= lambda p,x, i: npy.convolve(p[0]*npy.e**(-x/(p[1]+eps))+p[2],i[::-1],mode=2)
-    
-# Single exponential decay function wrapped for calling by mpfit
-def err_1(p,fjac=None,x=None,y=None,err=None,i=None,sh=None,sm=None,lf=None):
-    err=None
-    model = cexp_1(p,x,i)
-    status = 0
-    if err==None:
-        return [status, (y[sm:lf]-model[sm+sh:sh+lf])]
-    else:
-        return [status, (y[sm:lf]-model[sm+sh:sh+lf])/err[sm:lf]]
-
-# Double exponential decay function convolved with irf
-cexp_2 = lambda p,x,i: npy.convolve(p[0]*npy.e**(-x/(p[1]+eps))+p[3]*npy.e**(-x/(p[4]+eps))+p[2],i[::-1],mode=2)
-
-# Double exponential decay function wrapped for calling by mpfit
-def err_2(p,fjac=None,x=None,y=None,err=None,i=None,sh=None,sm=None,lf=None):
-    err=None
-    model = cexp_2(p,x,i)
-    status = 0
-    if err==None:
-        return [status, (y[sm:lf]-model[sm+sh:sh+lf])]
-    else:
-        return [status, (y[sm:lf]-model[sm+sh:sh+lf])/err[sm:lf]]
+# The single exponential and the double exponential functions and the
+# wrapper functions for the mpfit program are in omero.util.flim_fit
 
 # This function fits a numpy array s representing the signal and e respresenting the variance against a model
 # given by mode over time points given by a_tp. It returns a large number of values so that the global average
@@ -133,19 +111,10 @@ def procFitIt(s,e,a_tp,mode,d_args,par=None):
     sig=npy.zeros(i_slice*2)
     err=npy.ones(i_slice*2)
     se=npy.zeros(i_slice*2)
-    tp=npy.zeros(i_slice*2)
-    irf=npy.zeros(i_slice*2)
     # fill in the values from the signal and time points from irf
     sig[0:i_slice]=s[0:i_slice]
-    tp[0:i_slice]=a_tp[0:i_slice,0]
     err[0:i_slice]=e[0:i_slice]
-    irf[int(i_slice*0.5):int(i_slice*1.5)] = a_tp[0:i_slice,1]
-    # Fill up time points missing time points
-    textra=npy.array(range(i_slice),npy.float)
-    textra+=1.0
-    textra*=float(tp[2]-tp[1])
-    textra+=tp[i_slice-1]
-    tp[i_slice:]=textra
+    tp,irf=flf.padded_axes(a_tp)
     # Select which model to fit
     if mode>1:
         # fit double exponential (FRET condition fit) if there are no initial parameters generate them 
@@ -313,23 +282,45 @@ def attachFileToImage(gateway, queryService, updateService, rawFileStore, imageI
 def getImageIdFromPixels(gateway, pixelId):
     return gateway.getPixels(pixelsId).getImage().getId().getValue();
 
+# Stands in for the MPI world communicator when mpi4py is not installed:
+# a single process of rank 0 which does all the work
+class SerialComm(object):
+    def Get_size(self):
+        return 1
+    def Get_rank(self):
+        return 0
+    def scatter(self, data, root=0):
+        return data[0]
+    def bcast(self, data, root=0):
+        return data
+    def gather(self, data, root=0):
+        return [data]
+    def allreduce(self, data):
+        return data
+
 def mpi_run(argv):
     texfilename = 'test_n.tex';
     # set up mpi world recover number of nodes and rank of each process
     # Process of rank=0 acts as co-ordinating process and does the latex generation
-    comm = mpi.COMM_WORLD
+    if mpi is not None:
+        comm = mpi.COMM_WORLD
+        wtime = mpi.Wtime
+    else:
+        comm = SerialComm()
+        wtime = tim.time
     size = comm.Get_size()
     rank = comm.Get_rank()
-    name= mpi.Get_processor_name()
     # get the command line arguments 
     try:
-        opts, args = gop.getopt(argv, "h:u:p:c:e:r:o", ["host","user","password","control","experiment", "rfid", "outputfilename"])
+        opts, args = gop.getopt(argv, "h:u:p:c:e:r:ow:", ["host","user","password","control","experiment", "rfid", "outputfilename", "workers"])
     except gop.error, msg:
         print >>sys.stderr, msg
         return 2
     s_dir = str(uuid.uuid1())+'/';
     d_args={}
     d_args['d'] = s_dir;
+    # number of processes each node uses to fit its pixels
+    d_args['w'] = 1
     for opt, arg in opts:
         if opt in ("-h", "--host"):
             host=arg.strip()
@@ -349,6 +340,8 @@ def mpi_run(argv):
         if opt in ("-r","--rfid"):
             rfid=arg.strip()
             d_args['rfid']=rfid
+        if opt in ("-w","--workers"):
+            d_args['w']=int(arg.strip())
 
             #a_tp=procTP(arg.strip())
             #i_slice=len(a_tp)
@@ -431,7 +424,7 @@ def mpi_run(argv):
         # the processed so each process knows which pixels it is working on
         if rank==0:
             tex.write("\\verb=%s= \\\\ \n"%d_args['i'])
-            start=mpi.Wtime()
+            start=wtime()
             celpix, initfit,tp,cf1,sig,se,ipar=procSEG(localraw,a_tp,d_args)
             tex.write("Status: %d Chisq: %10.5f \\\\ \n"%(initfit.status,initfit.fnorm))
             for i in range(len(ipar)-2):
@@ -464,28 +457,27 @@ def mpi_run(argv):
         if i_mode>1:
             a2=npy.zeros((i_sres,i_sres),npy.float)
             k2=npy.zeros((i_sres,i_sres),npy.float)
-        # for each pixel process has been assigne fo the fit
-        for idx in localpixels:
-            # PUT FITTING CALL HERE  only fit none edge pixels
-            if idx[0]>0 and idx[0]<i_sres and idx[1]>0 and idx[1]<i_sres:
-                s=localraw.reshape((i_slice,i_sres,i_sres))[:,idx[0]-1:idx[0]+1,idx[1]-1:idx[1]+1].mean(axis=1).mean(axis=1)
-                e=localraw.reshape((i_slice,i_sres,i_sres))[:,idx[0]-1:idx[0]+1,idx[1]-1:idx[1]+1].std(axis=1).std(axis=1)
-                e=npy.zeros(len(s))+1
-                fit,tp,cf1,sig,se,fpar=procFitIt(s,e,a_tp,i_mode,d_args,localparams)
-                totalfitcalls+=1
-                c[idx[0],idx[1]]=fit.fnorm
-                g[idx[0],idx[1]]=fit.status
-                if i_mode >1:
-                    a1[idx[0],idx[1]]=fit.params[0]/(fit.params[0]+fit.params[3])
-                    k1[idx[0],idx[1]]=fit.params[1]
-                    b[idx[0],idx[1]]=fit.params[2]
-                    a2[idx[0],idx[1]]=fit.params[3]/(fit.params[0]+fit.params[3])
-                    k2[idx[0],idx[1]]=fit.params[4]
-                    f[idx[0],idx[1]]=(1.0-k1[idx[0],idx[1]]/k2[idx[0],idx[1]])
-                else:
-                    a1[idx[0],idx[1]]=fit.params[0]
-                    k1[idx[0],idx[1]]=fit.params[1]
-                    b[idx[0],idx[1]]=fit.params[2]
+        # fit the pixels this process has been assigned in blocks, only
+        # fitting none edge pixels, seeded from the segmentation mean fit
+        localpixels=npy.array(localpixels,npy.int).reshape((-1,2))
+        localpixels=localpixels[(localpixels[:,0]>0)&(localpixels[:,1]>0)]
+        model=flf.DecayModel(a_tp,i_mode,localparams)
+        fp,fnorm,status=flf.fit_pixels(localraw,localpixels,model,i_sres,processes=d_args['w'])
+        totalfitcalls+=len(localpixels)
+        r,q=localpixels[:,0],localpixels[:,1]
+        c[r,q]=fnorm
+        g[r,q]=status
+        if i_mode >1:
+            a1[r,q]=fp[:,0]/(fp[:,0]+fp[:,3])
+            k1[r,q]=fp[:,1]
+            b[r,q]=fp[:,2]
+            a2[r,q]=fp[:,3]/(fp[:,0]+fp[:,3])
+            k2[r,q]=fp[:,4]
+            f[r,q]=(1.0-k1[r,q]/k2[r,q])
+        else:
+            a1[r,q]=fp[:,0]
+            k1[r,q]=fp[:,1]
+            b[r,q]=fp[:,2]
         # Gather the results from all nodes
         rg=comm.gather(g,root=0)
         ra1=comm.gather(a1,root=0)
@@ -537,7 +529,7 @@ def mpi_run(argv):
             # calculate the mean of this new range
             nmean=(k1h[0][csmin:csmax+md]*mp[csmin:csmax+md]).sum()/k1h[0][csmin:csmax+md].sum()
             tex.write('Mean %10.5f\\\\ \n'%nmean)
-            end=mpi.Wtime()
+            end=wtime()
             tex.write('Time %9.5f\\\\ \n'%((end-start)))
             cummean+=nmean
             # THIS BIT IS WHERE PROCESS RANK=0 generates output for use in the tex document
@@ -630,9 +622,8 @@ def mpi_run(argv):
             tex.write("\\end{tabular} \n")
             tex.write("\\end{figure} \n")
         
-        ncalls=npy.asarray(0,'i')
         # This line syncs the processes so they wait for process rank=0 to do its collating and output before getting next file
-        comm.Allreduce([npy.asarray(totalfitcalls,'i'),mpi.INT], [ncalls,mpi.INT],op=mpi.SUM)
+        ncalls=comm.allreduce(totalfitcalls)
         if rank==0:
             tex.write('Total pixels fitted=%d\\\\ \n'%(ncalls))
             tex.flush()
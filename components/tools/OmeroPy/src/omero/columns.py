@@ -82,6 +82,13 @@ class AbstractColumn(object):
         rows = tbl.read(start, stop)
         self.fromrows(rows)
 
+    def marshal(self):
+        """
+        Called by tables.py before the column is returned to
+        the client. By default, does nothing.
+        """
+        pass
+
     def getsize(self):
         """
         Any method which does not use the "values" field
@@ -308,22 +315,55 @@ class MaskColumnI(AbstractColumn, omero.grid.MaskColumn):
     def readCoordinates(self, tbl, rowNumbers):
         self.__sanitycheck()
         AbstractColumn.readCoordinates(self, tbl, rowNumbers) # calls fromrows
-        masks = self._getmasks(tbl)
         if rowNumbers is None or len(rowNumbers) == 0:
-            rowNumbers = range(masks.nrows)
-        self.getbytes(masks, rowNumbers)
+            rowNumbers = range(tbl.nrows)
+        self.bytes = self.slices(tbl, rowNumbers)
 
     def read(self, tbl, start, stop):
         self.__sanitycheck()
         AbstractColumn.read(self, tbl, start, stop) # calls fromrows
-        masks = self._getmasks(tbl)
         rowNumbers = range(start, stop)
-        self.getbytes(masks, rowNumbers)
+        self.bytes = self.slices(tbl, rowNumbers)
 
-    def getbytes(self, masks, rowNumbers):
-        self.bytes = []
-        for idx in rowNumbers:
-            self.bytes.append(masks[idx].tolist())
+    def marshal(self):
+        """
+        Reads leave the masks as numpy slices, which are only turned
+        into byte strings here for Ice.
+        """
+        if self.bytes is not None:
+            for i, x in enumerate(self.bytes):
+                if isinstance(x, numpy.ndarray):
+                    self.bytes[i] = x.tostring()
+
+    def slices(self, tbl, rowNumbers):
+        """
+        Returns the bytes of the masks in rowNumbers as numpy uint8
+        arrays. With the packed layout, the heap is read once for the
+        span of the rows and the arrays are views of that read, unless
+        the rows are too sparse for the span to be worth reading.
+        """
+        store = self._getstore(tbl, False)
+        if store is None:
+            return [numpy.zeros(0, dtype=numpy.uint8) for idx in rowNumbers]
+        if isinstance(store, tables.VLArray):
+            return [store[idx] for idx in rowNumbers]
+        if len(rowNumbers) == 0:
+            return []
+
+        heap, ends = store
+        rows = numpy.asarray(rowNumbers, dtype=numpy.int64)
+        first = int(rows.min())
+        last = int(rows.max())
+        stops = ends.read(first, last + 1)
+        starts = numpy.empty_like(stops)
+        starts[1:] = stops[:-1]
+        starts[0] = first and ends[first - 1] or 0
+        idx = rows - first
+        if last - first + 1 > 4 * len(rows) + 1024:
+            return [heap.read(int(starts[i]), int(stops[i])) for i in idx]
+        lo = starts[0]
+        block = heap.read(int(lo), int(stops[-1]))
+        return [block[x:y] for x, y in zip(starts[idx] - lo, stops[idx] - lo)]
 
     def fromrows(self, all_rows):
         rows = all_rows[self.name]
@@ -337,26 +377,59 @@ class MaskColumnI(AbstractColumn, omero.grid.MaskColumn):
         self.h = rows["h"]
 
     def append(self, tbl):
+        """
+        Appends all the masks in one write to the heap and one to the
+        ends array, or one by one to the VLArray of older tables.
+        """
         self.__sanitycheck()
-        masks = self._getmasks(tbl)
-        for x in self.bytes:
-            if isinstance(x, list):
-                # This occurs primarily in testing.
-                masks.append(numpy.array(x, dtype=tables.UInt8Atom()))
-            else:
-                masks.append(numpy.fromstring(x, count=len(x), dtype=tables.UInt8Atom()))
-
-    def _getmasks(self, tbl):
+        store = self._getstore(tbl, True)
+        arrays = [self._asarray(x) for x in self.bytes]
+        if isinstance(store, tables.VLArray):
+            for x in arrays:
+                store.append(x)
+            return
+        if not arrays:
+            return
+
+        heap, ends = store
+        offset = ends.nrows and ends[-1] or 0
+        lengths = numpy.array([len(x) for x in arrays], dtype=numpy.int64)
+        stops = offset + numpy.cumsum(lengths)
+        if stops[-1] > offset:
+            heap.append(numpy.concatenate(arrays))
+        ends.append(stops)
+
+    def _asarray(self, x):
+        if isinstance(x, list):
+            # This occurs primarily in testing.
+            return numpy.array(x, dtype=numpy.uint8)
+        else:
+            return numpy.fromstring(x, count=len(x), dtype=numpy.uint8)
+
+    def _getstore(self, tbl, create):
+        """
+        Returns the VLArray holding one row per mask of tables written
+        before the packed layout, or the (heap, ends) arrays of the packed
+        layout: the bytes of all masks one after the other, and the offset
+        of the end of each mask in the heap. If neither exists, the packed
+        arrays are created when create is True, otherwise None is returned.
+        """
         n = tbl._v_name
         f = tbl._v_file
         p = tbl._v_parent
-        # http://www.zeroc.com/doc/Ice-3.3.1/manual/Slice.5.8.html#200
-        # Ice::Byte can be -128 to 127 OR 0 to 255, but using UInt8 for the moment
         try:
-            masks = getattr(p, "%s_masks" % n)
+            return getattr(p, "%s_masks" % n)
+        except tables.NoSuchNodeError:
+            pass
+        names = ("%s_%s_heap" % (n, self.name), "%s_%s_ends" % (n, self.name))
+        try:
+            return getattr(p, names[0]), getattr(p, names[1])
         except tables.NoSuchNodeError:
-            masks = f.createVLArray(p, "%s_masks" % n, tables.UInt8Atom())
-        return masks
+            if not create:
+                return None
+        heap = f.createEArray(p, names[0], tables.UInt8Atom(), (0,))
+        ends = f.createEArray(p, names[1], tables.Int64Atom(), (0,))
+        return heap, ends
 
 # Helpers
 # ========================================================================
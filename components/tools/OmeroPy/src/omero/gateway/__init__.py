@@ -25,6 +25,7 @@ import ConfigParser
 import omero
 import omero.clients
 from omero.util.decorators import timeit, TimeIt, setsessiongroup
+from omero.util.pipelined_read import PipelinedReader, DEFAULT_DEPTH
 from omero.cmd import Chgrp, DoAll
 from omero.api import Save
 from omero.callbacks import CmdCallbackI
@@ -39,6 +40,11 @@ import time
 import array
 import math
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -124,6 +130,29 @@ def fileread_gen (fin, fsize, bufsize):
         p += s
     fin.close()
 
+def fileread_pipelined (fin, fsize, bufsize, depth=DEFAULT_DEPTH):
+    """
+    Generator helper function that yields chunks of the file of size fsize,
+    keeping up to depth reads outstanding while the previous chunk is
+    being consumed.
+
+    @type fin: file
+    @param fin: filelike readable object
+    @type fsize: int
+    @param fsize: total number of bytes to read
+    @type bufsize: int
+    @param bufsize: size of each chunk of data read from fin that gets yielded
+    @type depth: int
+    @param depth: number of reads kept outstanding
+    @rtype: generator
+    @return: generator of string buffers of size up to bufsize read from fin
+    """
+    try:
+        for chunk in PipelinedReader(fin.read, fsize, bufsize, depth):
+            yield chunk
+    finally:
+        fin.close()
+
 class BlitzObjectWrapper (object):
     """
     Object wrapper class which provides various methods for hierarchy traversing, 
@@ -161,6 +190,8 @@ class BlitzObjectWrapper (object):
             self._cache = {}
         self._conn = conn
         self._creationDate = None
+        self._parents = None
+        self._siblings = None
         if conn is None:
             return
         if hasattr(obj, 'id') and obj.id is not None:
@@ -523,6 +554,9 @@ class BlitzObjectWrapper (object):
         @rtype:     Long
         """
         
+        if self._siblings is not None:
+            self._cached_countChildren = self._siblings.countChildren(self)
+            return self._cached_countChildren
         childw = self._getChildWrapper()
         klass = "%sLinks" % childw().OMERO_CLASS.lower()
         #self._cached_countChildren = len(self._conn.getQueryService().findAllByQuery("from %s as c where c.parent.id=%i" % (self.LINK_CLASS, self._oid), None))
@@ -550,6 +584,10 @@ class BlitzObjectWrapper (object):
         @rtype: generator of Ice client proxy objects for the child nodes
         @return: child objects.
         """
+        if self._siblings is not None and ns is None and val is None and params is None:
+            for child in self._siblings.listChildren(self):
+                yield child
+            return
         if not params:
             params = omero.sys.Parameters()
         if not params.map:
@@ -580,8 +618,9 @@ class BlitzObjectWrapper (object):
         @return: child objects.
         """
         childw = self._getChildWrapper()
-        for child in self._listChildren(ns=ns, val=val, params=params):
-            yield childw(self._conn, child, self._cache)
+        children = self._listChildren(ns=ns, val=val, params=params)
+        for child in self._conn._wrapSiblings(childw, children, self._cache):
+            yield child
 
     def getParent (self, withlinks=False):
         """
@@ -597,9 +636,25 @@ class BlitzObjectWrapper (object):
         @return: the parent object with or without the link depending on args
         """
 
-        rv = self.listParents(withlinks=withlinks)
+        if withlinks:
+            rv = self.listParents(withlinks=withlinks)
+        else:
+            rv = self._getParents()
         return len(rv) and rv[0] or None
 
+    def _getParents (self):
+        """
+        Returns the parents of this object as L{listParents} does, remembering them
+        so that getParent(), getAncestry() etc. only query the server once.
+        L{BlitzGateway.getAncestries} fills this in for many objects at once.
+
+        @rtype: list of L{BlitzObjectWrapper}
+        @return: the parent objects
+        """
+        if self._parents is None:
+            self._parents = list(self.listParents())
+        return self._parents
+
     def listParents (self, withlinks=False):
         """
         Lists available parent objects.
@@ -1212,6 +1267,53 @@ class BlitzObjectWrapper (object):
         """
         self._obj.setDescription(omero_type(value))
 
+class _SiblingWrappers (object):
+    """
+    Wrappers created together, E.g. by one getObjects() call, while batching is
+    enabled on the connection (see L{BlitzGateway.setBatching}). The first
+    countChildren() or listChildren() on any of them loads the counts or the
+    children of all of them, with one getCollectionCount() or one query.
+    Only the ids of the wrappers are kept: the wrappers refer to this object,
+    and a reference back would make cycles which Python cannot collect when
+    a wrapper defines __del__, as L{_ImageWrapper} does.
+    """
+
+    def __init__ (self, conn, wrappers):
+        self._conn = conn
+        self._ids = [w._oid for w in wrappers]
+        self._counts = None
+        self._children = None
+
+    def countChildren (self, wrapper):
+        """
+        Returns the number of children of wrapper, counting the children of all
+        the siblings on first use.
+        """
+        if self._counts is None:
+            klass = "%sLinks" % wrapper._getChildWrapper()().OMERO_CLASS.lower()
+            self._counts = self._conn.getContainerService().getCollectionCount(wrapper.OMERO_CLASS, klass, self._ids, None, self._conn.SERVICE_OPTS)
+        return self._counts.get(wrapper._oid, 0)
+
+    def listChildren (self, wrapper):
+        """
+        Returns the child objects of wrapper, ordered by name as
+        L{BlitzObjectWrapper._listChildren} returns them, loading the children of all
+        the siblings on first use.
+        """
+        if self._children is None:
+            params = omero.sys.Parameters()
+            params.map = {"ids": rlist([rlong(i) for i in self._ids])}
+            query = "select c from %s as c" \
+                    " join fetch c.child as ch" \
+                    " left outer join fetch ch.annotationLinks as ial" \
+                    " left outer join fetch ial.child as a" \
+                    " where c.parent.id in (:ids) order by c.child.name" % wrapper.LINK_CLASS
+            children = dict([(i, []) for i in self._ids])
+            for link in self._conn.getQueryService().findAllByQuery(query, params, self._conn.SERVICE_OPTS):
+                children[link.parent.id.val].append(link.child)
+            self._children = children
+        return self._children.get(wrapper._oid, [])
+
 ## BASIC ##
 
 class NoProxies (object):
@@ -1232,6 +1334,7 @@ class _BlitzGateway (object):
     """
     ICE_CONFIG - Defines the path to the Ice configuration
     """
+    _batching = False
 #    def __init__ (self, username, passwd, server, port, client_obj=None, group=None, clone=False):
     
     def __init__ (self, username=None, passwd=None, client_obj=None, group=None, clone=False, try_super=False, host=None, port=None, extra_config=None, secure=False, anonymous=True, useragent=None):
@@ -2509,8 +2612,124 @@ class _BlitzGateway (object):
         """
         query, params, wrapper = self.buildQuery(obj_type, ids, params, attributes)
         result = self.getQueryService().findAllByQuery(query, params, self.SERVICE_OPTS)
-        for r in result:
-            yield wrapper(self, r)
+        for r in self._wrapSiblings(wrapper, result):
+            yield r
+
+    def setBatching (self, batching=True):
+        """
+        Turns batching of sibling queries on or off. While it is on, the wrappers
+        created by one getObjects() or listChildren() call load their countChildren()
+        and listChildren() results together: the first call on any of them queries
+        for all of them. Counts and children so loaded are kept by the wrappers.
+
+        @param batching:    True to batch queries
+        @type batching:     Boolean
+        """
+        self._batching = batching
+
+    def isBatching (self):
+        """
+        Returns True if sibling queries are batched, see L{setBatching}
+
+        @rtype:     Boolean
+        """
+        return self._batching
+
+    def _wrapSiblings (self, wrapper, objs, cache=None):
+        """
+        Generator of wrappers for objs. While batching, they are created all at
+        once and share a L{_SiblingWrappers}.
+        """
+        if not self._batching:
+            for obj in objs:
+                yield wrapper(self, obj, cache)
+            return
+        wrappers = [wrapper(self, obj, cache) for obj in objs]
+        siblings = _SiblingWrappers(self, wrappers)
+        for w in wrappers:
+            w._siblings = siblings
+            yield w
+
+    def getAncestries (self, obj_type, ids):
+        """
+        Resolves the ancestry of many objects at once, with one query per hierarchy
+        instead of the queries per object, level and parent type that
+        L{BlitzObjectWrapper.getAncestry} makes. Images are resolved through both
+        Dataset/Project and WellSample/Well/Plate/Screen.
+        Every wrapper returned, and every wrapper passed in ids, remembers its parents
+        so that getParent(), getAncestry(), getDataset() and getProject() on it need no
+        further queries.
+
+        @param obj_type:    Object type: "Image", "Dataset", "WellSample", "Well" or "Plate"
+        @type obj_type:     String
+        @param ids:         object IDs or L{BlitzObjectWrapper}s of obj_type
+        @type ids:          List
+        @return:            Map of object ID to its ancestors, parent first, as getAncestry()
+        @rtype:             Dict
+        """
+        if type(obj_type) is not type('') or obj_type.lower() not in self._ANCESTRY_QUERIES:
+            raise AttributeError("getAncestries supports obj_type of %s" % ", ".join(sorted(self._ANCESTRY_QUERIES.keys())))
+        wrappers = [x for x in ids if isinstance(x, BlitzObjectWrapper)]
+        ids = [isinstance(x, BlitzObjectWrapper) and x.getId() or x for x in ids]
+        parents = dict([(oid, []) for oid in ids])
+        if not parents:
+            return {}
+
+        cache = {}
+        def wrap (wrapper, obj, listParents):
+            """ One wrapper per object, remembering its parents """
+            key = (wrapper, obj.id.val)
+            if key not in cache:
+                cache[key] = wrapper(self, obj)
+                cache[key]._parents = listParents(obj)
+            return cache[key]
+        project = lambda x: wrap(ProjectWrapper, x, lambda o: [])
+        dataset = lambda x: wrap(DatasetWrapper, x, lambda o: [project(l.parent) for l in o.copyProjectLinks()])
+        screen = lambda x: wrap(ScreenWrapper, x, lambda o: [])
+        plate = lambda x: wrap(PlateWrapper, x, lambda o: [screen(l.parent) for l in o.copyScreenLinks()])
+        well = lambda x: wrap(WellWrapper, x, lambda o: [plate(o.plate)])
+        wellsample = lambda x: wrap(WellSampleWrapper, x, lambda o: [well(o.well)])
+        resolve = {
+            'image': (lambda l: (l.child.id.val, dataset(l.parent)), lambda ws: (ws.image.id.val, wellsample(ws))),
+            'dataset': (lambda l: (l.child.id.val, project(l.parent)),),
+            'wellsample': (lambda ws: (ws.id.val, well(ws.well)),),
+            'well': (lambda w: (w.id.val, plate(w.plate)),),
+            'plate': (lambda l: (l.child.id.val, screen(l.parent)),),
+            }[obj_type.lower()]
+
+        params = omero.sys.Parameters()
+        params.map = {"ids": rlist([rlong(a) for a in parents.keys()])}
+        q = self.getQueryService()
+        for query, fn in zip(self._ANCESTRY_QUERIES[obj_type.lower()], resolve):
+            for obj in q.findAllByQuery(query, params, self.SERVICE_OPTS):
+                oid, parent = fn(obj)
+                parents[oid].append(parent)
+
+        for w in wrappers:
+            w._parents = parents[w.getId()]
+        rv = {}
+        for oid, p in parents.items():
+            rv[oid] = len(p) and [p[0]] + p[0].getAncestry() or []
+        return rv
+
+    _ANCESTRY_QUERIES = {
+        'image': ("select distinct l from DatasetImageLink as l join fetch l.parent as ds "
+                  "left outer join fetch ds.projectLinks as pl left outer join fetch pl.parent "
+                  "where l.child.id in (:ids)",
+                  "select distinct ws from WellSample as ws join fetch ws.well as w "
+                  "join fetch w.plate as pt left outer join fetch pt.screenLinks as sl "
+                  "left outer join fetch sl.parent where ws.image.id in (:ids)"),
+        'dataset': ("select l from ProjectDatasetLink as l join fetch l.parent "
+                    "where l.child.id in (:ids)",),
+        'wellsample': ("select distinct ws from WellSample as ws join fetch ws.well as w "
+                       "join fetch w.plate as pt left outer join fetch pt.screenLinks as sl "
+                       "left outer join fetch sl.parent where ws.id in (:ids)",),
+        'well': ("select distinct w from Well as w join fetch w.plate as pt "
+                 "left outer join fetch pt.screenLinks as sl left outer join fetch sl.parent "
+                 "where w.id in (:ids)",),
+        'plate': ("select l from ScreenPlateLink as l join fetch l.parent "
+                  "where l.child.id in (:ids)",),
+        }
 
     def buildQuery (self, obj_type, ids=None, params=None, attributes=None):
         """
@@ -4451,6 +4670,161 @@ def _letterGridLabel (i):
         i = i/26
     return r
 
+class PlateGrid (object):
+    """
+    The wells of a plate with the image of one field each, as loaded by
+    L{_PlateWrapper.getWellGridData}. Cells are kept in flat arrays indexed by
+    row * columns + column rather than as wrappers, so that large plates are cheap
+    to hold and can be written out as json one cell at a time.
+    """
+
+    def __init__ (self, rows, columns, field=0):
+        """
+        Creates an empty grid
+
+        @param rows:        Number of rows
+        @type rows:         Int
+        @param columns:     Number of columns
+        @type columns:      Int
+        @param field:       The well sample index the images are of
+        @type field:        Int
+        """
+        self.rows = rows
+        self.columns = columns
+        self.field = field
+        self.authors = []
+        self._authorIndex = {}
+        self._clear()
+
+    def _clear (self):
+        n = self.rows * self.columns
+        self.wellIds = array.array('l', [0]) * n
+        self.imageIds = array.array('l', [0]) * n
+        self.dates = array.array('d', [0]) * n
+        self.authorIds = array.array('l', [-1]) * n
+        self.sizes = array.array('l', [0]) * (5 * n)
+        self.names = [None] * n
+        self.descriptions = [None] * n
+
+    def _get (self, i):
+        return (self.wellIds[i], self.imageIds[i], self.names[i], self.descriptions[i],
+                self.dates[i], self.authorIds[i], self.sizes[5*i:5*i+5])
+
+    def _put (self, i, cell):
+        self.wellIds[i], self.imageIds[i], self.names[i], self.descriptions[i], \
+            self.dates[i], self.authorIds[i], self.sizes[5*i:5*i+5] = cell
+
+    def set (self, row, column, wellId, imageId, name, description, date, author, sizes):
+        """
+        Sets a cell of the grid
+
+        @param date:        Acquisition or creation date, in seconds as simpleMarshal() has it
+        @type date:         Float
+        @param author:      'Firstname Lastname' of the image owner
+        @type author:       String
+        @param sizes:       sizeX, sizeY, sizeZ, sizeC and sizeT of the primary pixels
+        @type sizes:        Sequence of Int
+        """
+        if author not in self._authorIndex:
+            self._authorIndex[author] = len(self.authors)
+            self.authors.append(author)
+        self._put(row * self.columns + column, (wellId, imageId, name, description, date,
+                  self._authorIndex[author], array.array('l', sizes)))
+
+    def resize (self, rows, columns):
+        """
+        Changes the size of the grid, keeping the cells which still fit. E.g. after
+        L{_PlateWrapper.setGridSizeConstraints}
+        """
+        cells = [(r, c, self._get(r * self.columns + c))
+                 for r in range(min(rows, self.rows)) for c in range(min(columns, self.columns))
+                 if self.wellIds[r * self.columns + c]]
+        self.rows, self.columns = rows, columns
+        self._clear()
+        for r, c, cell in cells:
+            self._put(r * columns + c, cell)
+
+    def getWellId (self, row, column):
+        """ Returns the ID of the well at row, column or None """
+        return self.wellIds[row * self.columns + column] or None
+
+    def getPixelsSize (self, row, column):
+        """
+        Returns (sizeX, sizeY, sizeZ, sizeC, sizeT) of the image at row, column or None
+        """
+        i = row * self.columns + column
+        if not self.imageIds[i]:
+            return None
+        return tuple(self.sizes[5*i:5*i+5])
+
+    def marshal (self, row, column, xtra=None):
+        """
+        Returns the image at row, column as L{ImageWrapper.simpleMarshal} does, with
+        the 'wellId' and 'field' the webgateway plate grid adds, or None if there is none.
+
+        @param xtra:        A dict of extra keys. E.g. 'thumbUrlPrefix'
+        @type xtra:         Dict
+        @rtype:             Dict
+        """
+        i = row * self.columns + column
+        iid = self.imageIds[i]
+        if not iid:
+            return None
+        rv = {'type': 'Image',
+              'id': iid,
+              'name': self.names[i],
+              'description': self.descriptions[i],
+              'author': self.authors[self.authorIds[i]],
+              'date': self.dates[i],
+              'wellId': self.wellIds[i],
+              'field': self.field,
+              }
+        if xtra and xtra.has_key('thumbUrlPrefix'):
+            if callable(xtra['thumbUrlPrefix']):
+                rv['thumb_url'] = xtra['thumbUrlPrefix'](str(iid))
+            else:
+                rv['thumb_url'] = xtra['thumbUrlPrefix'] + str(iid) + '/'
+        return rv
+
+    def toList (self, xtra=None):
+        """
+        Returns the grid as a list of rows of L{marshal}ed cells
+
+        @rtype:             List of Lists
+        """
+        return [[self.marshal(r, c, xtra) for c in range(self.columns)] for r in range(self.rows)]
+
+    def writeJson (self, out, xtra=None, **kwargs):
+        """
+        Writes the grid to out as a json object {'grid': L{toList}}, one cell at a time,
+        without building the list first. Further keyword arguments are written as
+        further keys of the object. E.g. collabels=plate.getColumnLabels()
+
+        @param out:         File like object to write to
+        """
+        out.write('{"grid": [')
+        for r in range(self.rows):
+            out.write(r and ', [' or '[')
+            for c in range(self.columns):
+                if c:
+                    out.write(', ')
+                out.write(json.dumps(self.marshal(r, c, xtra)))
+            out.write(']')
+        out.write(']')
+        for k, v in kwargs.items():
+            out.write(', %s: %s' % (json.dumps(k), json.dumps(v)))
+        out.write('}')
+
+    def toJson (self, xtra=None, **kwargs):
+        """
+        Returns the grid as a json string, see L{writeJson}
+
+        @rtype:             String
+        """
+        out = StringIO()
+        self.writeJson(out, xtra, **kwargs)
+        return out.getvalue()
+
 class _PlateWrapper (BlitzObjectWrapper):
     """
     omero_model_PlateI class wrapper extends BlitzObjectWrapper.
@@ -4587,6 +4961,45 @@ _
             rv[child.row.val][child.column.val] = childw(self._conn, child, index=index)
         return rv
 
+    def getWellGridData (self, index=0):
+        """
+        Returns the wells of this plate with the image at well sample index, as a
+        L{PlateGrid}. Wells, images, owners and pixels sizes are all loaded with a
+        single projection, so unlike L{getWellGrid} there are no queries per well.
+        Wells without a well sample at index are left empty. If the grid size is not
+        known yet it is taken from the last row and column of all wells of the plate.
+
+        @param index:       The well sample index (field)
+        @type index:        Int
+        @rtype:             L{PlateGrid}
+        """
+        params = omero.sys.Parameters()
+        params.map = {"pid": rlong(self.getId()), "index": rint(index)}
+        query = "select well.id, well.row, well.column, img.id, img.name, img.description, " \
+                "img.acquisitionDate, ev.time, owner.firstName, owner.lastName, " \
+                "pix.sizeX, pix.sizeY, pix.sizeZ, pix.sizeC, pix.sizeT " \
+                "from Well as well join well.wellSamples as ws join ws.image as img " \
+                "join img.details.owner as owner join img.details.creationEvent as ev " \
+                "join img.pixels as pix " \
+                "where well.plate.id = :pid and index(ws) = :index and index(pix) = 0"
+        q = self._conn.getQueryService()
+        rows = unwrap(q.projection(query, params, self._conn.SERVICE_OPTS))
+        if self._gridSize is None:
+            params = omero.sys.Parameters()
+            params.map = {"pid": rlong(self.getId())}
+            last = unwrap(q.projection("select max(well.row), max(well.column) from Well as well "
+                                       "where well.plate.id = :pid", params, self._conn.SERVICE_OPTS))
+            r, c = last and last[0] or (None, None)
+            self._gridSize = {'rows': r is not None and r + 1 or 0,
+                              'columns': c is not None and c + 1 or 0}
+        size = self.getGridSize()
+        grid = PlateGrid(size['rows'], size['columns'], index)
+        for x in rows:
+            t = x[6] is not None and x[6] > 0 and x[6] or x[7]
+            date = time.mktime(datetime.fromtimestamp(t/1000).timetuple())
+            grid.set(x[1], x[2], x[0], x[3], x[4], x[5] or '', date, "%s %s" % (x[8], x[9]), x[10:15])
+        return grid
+
     def getColumnLabels (self):
         """
         Returns a list of labels for the columns on this plate. E.g. [1, 2, 3...] or ['A', 'B', 'C'...] etc
@@ -5535,6 +5948,7 @@ class _ImageWrapper (BlitzObjectWrapper):
         self.CHILD_WRAPPER_CLASS = None
         self.PARENT_WRAPPER_CLASS = ['DatasetWrapper', 'WellSampleWrapper']
         self._thumbInProgress = False
+        self._author = None
         
     def __del__ (self):
         self._re and self._re.untaint()
@@ -5740,11 +6154,25 @@ class _ImageWrapper (BlitzObjectWrapper):
         @rtype:     String
         """
         
-        q = self._conn.getQueryService()
-        e = q.findByQuery("select e from Experimenter e where e.id = %i" % self._obj.details.owner.id.val,None, self._conn.SERVICE_OPTS)
-        self._author = e.firstName.val + " " + e.lastName.val
+        if self._author is None:
+            q = self._conn.getQueryService()
+            e = q.findByQuery("select e from Experimenter e where e.id = %i" % self._obj.details.owner.id.val,None, self._conn.SERVICE_OPTS)
+            self._author = e.firstName.val + " " + e.lastName.val
         return self._author
 
+    def _getResolvedDatasets (self):
+        """
+        Returns the Datasets among the remembered parents of this image, with their
+        own parents remembered too (see L{BlitzGateway.getAncestries}), or None
+        if they are not known yet.
+        """
+        if self._parents is None:
+            return None
+        datasets = [p for p in self._parents if p is not None and p.OMERO_CLASS == 'Dataset']
+        if len([d for d in datasets if d._parents is None]):
+            return None
+        return datasets
+
     def getDataset(self):
         """
         XXX: Deprecated since 4.3.2, use listParents(). (See #6660)
@@ -5755,6 +6183,9 @@ class _ImageWrapper (BlitzObjectWrapper):
         @rtype:     L{DatasetWrapper}
         """
         
+        datasets = self._getResolvedDatasets()
+        if datasets is not None:
+            return len(datasets) == 1 and datasets[0] or None
         try:
             q = """
             select ds from Image i join i.datasetLinks dl join dl.parent ds
@@ -5777,6 +6208,10 @@ class _ImageWrapper (BlitzObjectWrapper):
         @rtype:     L{ProjectWrapper}
         """
         
+        datasets = self._getResolvedDatasets()
+        if datasets is not None:
+            projects = [p for d in datasets for p in d._parents]
+            return len(projects) == 1 and projects[0] or None
         try:
             q = """
             select p from Image i join i.datasetLinks dl join dl.parent ds join ds.projectLinks pl join pl.parent p
@@ -6419,8 +6854,12 @@ class _ImageWrapper (BlitzObjectWrapper):
         @type compression:      Float
         """
         
-        self._pd.z = z is not None and long(z) or self._re.getDefaultZ()
-        self._pd.t = t is not None and long(t) or self._re.getDefaultT()
+        if z is None:
+            z = self._re.getDefaultZ()
+        if t is None:
+            t = self._re.getDefaultT()
+        self._pd.z = long(z)
+        self._pd.t = long(t)
         try:
             if compression is not None:
                 try:
@@ -6447,7 +6886,7 @@ class _ImageWrapper (BlitzObjectWrapper):
             self._re = None
             raise
 
-    def exportOmeTiff (self, bufsize=0):
+    def exportOmeTiff (self, bufsize=0, depth=DEFAULT_DEPTH):
         """
         Exports the OME-TIFF representation of this image.
 
@@ -6455,6 +6894,9 @@ class _ImageWrapper (BlitzObjectWrapper):
         @param bufsize: if 0 return a single string buffer with the whole OME-TIFF
                         if >0 return a tuple holding total size and generator of chunks
                         (string buffers) of bufsize bytes each
+        @type depth:    int
+        @param depth:   number of reads kept outstanding while a chunk is consumed
+                        (bufsize > 0 only). 1 reads sequentially.
         @return:        OME-TIFF file data
         @rtype:         String or (size, data generator)
         """
@@ -6466,8 +6908,8 @@ class _ImageWrapper (BlitzObjectWrapper):
             # Read it all in one go
             return fileread(e, size, 65536)
         else:
-            # generator using bufsize
-            return (size, fileread_gen(e, size, bufsize))
+            # generator using bufsize, reading ahead
+            return (size, fileread_pipelined(e, size, bufsize, depth))
 
     def _wordwrap (self, width, text, font):
         """
@@ -6641,6 +7083,39 @@ class _ImageWrapper (BlitzObjectWrapper):
 
         return os.path.splitext(f.name.val)[-1], f.mimetype.val
         
+    @assert_re()
+    def renderPackedInt (self, z=None, t=None):
+        """
+        Return the rendered (and projected) plane as it comes from the rendering engine,
+        uncompressed, as a numpy array of shape (sizeY, sizeX, 3) of red, green and blue.
+        Projection (or not) is specified by calling L{setProjection} before renderPackedInt.
+
+        @param z:               The Z index. Ignored if projecting image. If None, use defaultZ
+        @param t:               The T index. If None, use defaultT
+        @return:                numpy array of uint8
+        """
+
+        import numpy
+        if z is None:
+            z = self._re.getDefaultZ()
+        if t is None:
+            t = self._re.getDefaultT()
+        self._pd.z = long(z)
+        self._pd.t = long(t)
+        projection = self.PROJECTIONS.get(self._pr, -1)
+        if not isinstance(projection, omero.constants.projection.ProjectionType):
+            packed = self._re.renderAsPackedInt(self._pd, self._conn.SERVICE_OPTS)
+        else:
+            packed = self._re.renderProjectedAsPackedInt(projection, self._pd.t, 1, 0, self.getSizeZ()-1, self._conn.SERVICE_OPTS)
+        # Packed as 0xAARRGGBB
+        packed = numpy.asarray(packed, dtype=numpy.int32).view(numpy.uint32)
+        packed = packed.reshape(self.getSizeY(), self.getSizeX())
+        rv = numpy.empty(packed.shape + (3,), dtype=numpy.uint8)
+        rv[..., 0] = (packed >> 16) & 0xff
+        rv[..., 1] = (packed >> 8) & 0xff
+        rv[..., 2] = packed & 0xff
+        return rv
+
     def renderImage (self, z, t, compression=0.9):
         """
         Render the Image, (projected) and compressed. 
@@ -6659,7 +7134,7 @@ class _ImageWrapper (BlitzObjectWrapper):
             rv = Image.open(i)
         return rv
 
-    def renderSplitChannel (self, z, t, compression=0.9, border=2):
+    def renderSplitChannel (self, z, t, compression=0.9, border=2, packed=False):
         """
         Prepares a jpeg representation of a 2d grid holding a render of each channel, 
         along with one for all channels at the set Z and T points.
@@ -6668,10 +7143,11 @@ class _ImageWrapper (BlitzObjectWrapper):
         @param t:       T index
         @param compression: Image compression level 
         @param border:
+        @param packed:  See L{renderSplitChannelImage}
         @return: value
         """
         
-        img = self.renderSplitChannelImage(z,t,compression, border)
+        img = self.renderSplitChannelImage(z,t,compression, border, packed)
         rv = StringIO()
         img.save(rv, 'jpeg', quality=int(compression*100))
         return rv.getvalue()
@@ -6719,20 +7195,29 @@ class _ImageWrapper (BlitzObjectWrapper):
     def _renderSplit_channelLabel (self, channel):
         return str(channel.getEmissionWave())
 
-    def renderSplitChannelImage (self, z, t, compression=0.9, border=2):
+    def renderSplitChannelImage (self, z, t, compression=0.9, border=2, packed=False):
         """
         Prepares a PIL Image with a 2d grid holding a render of each channel, 
         along with one for all channels at the set Z and T points.
+        If packed is True, each active channel is rendered once with L{renderPackedInt}
+        instead of as a jpeg, and the merged panel is added up from the channel panels
+        rather than rendered again. The panels are the same as the server renders them,
+        without the jpeg compression of each one.
         
         @param z:   Z index
         @param t:   T index
         @param compression: Compression level
         @param border:  space around each panel (int)
+        @param packed:  Render uncompressed, with one call per active channel
+        @type packed:   Boolean
         @return:        canvas
         @rtype:         PIL Image
         """
                 
-        dims = self.splitChannelDims(border=border)[self.isGreyscaleRenderingModel() and 'g' or 'c']
+        if packed:
+            import numpy
+        greyscale = self.isGreyscaleRenderingModel()
+        dims = self.splitChannelDims(border=border)[greyscale and 'g' or 'c']
         canvas = Image.new('RGBA', (dims['width'], dims['height']), '#fff')
         cmap = [ch.isActive() and i+1 or 0 for i,ch in enumerate(self.getChannels())]
         c = self.getSizeC()
@@ -6764,10 +7249,21 @@ class _ImageWrapper (BlitzObjectWrapper):
             font = ImageFont.load('%s/pilfonts/B%0.2d.pil' % (THISPATH, fsize) )
 
 
+        merged = None
         for i in range(c):
             if cmap[i]:
                 self.setActiveChannels((i+1,))
-                img = self.renderImage(z,t, compression)
+                if packed:
+                    rgb = self.renderPackedInt(z,t)
+                    if not greyscale:
+                        # Channels add up in the merged render, saturating at 255
+                        if merged is None:
+                            merged = rgb.astype(numpy.uint16)
+                        else:
+                            merged = numpy.minimum(merged + rgb, 255)
+                    img = Image.fromarray(rgb, 'RGB')
+                else:
+                    img = self.renderImage(z,t, compression)
                 if fsize > 0:
                     draw = ImageDraw.ImageDraw(img)
                     draw.text((2,2), "%s" % (self._renderSplit_channelLabel(self.getChannels()[i])), font=font, fill="#fff")
@@ -6779,9 +7275,14 @@ class _ImageWrapper (BlitzObjectWrapper):
                 pxc = 0
                 px = border
                 py += self.getSizeY() + border
-        if not self.isGreyscaleRenderingModel():
+        if not greyscale:
             self.setActiveChannels(cmap)
-            img = self.renderImage(z,t, compression)
+            if packed:
+                if merged is None:
+                    merged = numpy.zeros((self.getSizeY(), self.getSizeX(), 3))
+                img = Image.fromarray(merged.astype(numpy.uint8), 'RGB')
+            else:
+                img = self.renderImage(z,t, compression)
             if fsize > 0:
                 draw = ImageDraw.ImageDraw(img)
                 draw.text((2,2), "merged", font=font, fill="#fff")
@@ -9,8 +9,11 @@
 
 import os
 import sys
+import threading
 
+from Queue import Queue, Empty
 from omero.cli import BaseControl, CLI, NewFileType
+from omero.util.pipelined_read import PipelinedReader, DEFAULT_DEPTH, DEFAULT_READ_LENGTH
 
 HELP="""Support for exporting data in XML and TIFF formats
 
@@ -18,15 +21,12 @@ Example Usage:
   omero export --file new.ome.tif            Image:1
   omero export --file new.ome.xml --type XML Image:1
   omero export --file output-dir  --iterate  Dataset:2
+  omero export --file output-dir  --iterate  --parallel=4 Dataset:2
 
 If --iterate is used used, the only supported obj is Dataset:<id>
 """
 
 
-# Default block read size when downloading exported data
-DEFAULT_READ_LENGTH = 1000*1000
-
-
 class ExportControl(BaseControl):
 
     def _configure(self, parser):
@@ -35,6 +35,12 @@ class ExportControl(BaseControl):
         parser.add_argument("obj", help="Format: Image:<id>")
         parser.add_argument("--iterate", action="store_true", default=False,
             help="Iterate over an object and write individual objects to the directory named by --file (EXPERIMENTAL)")
+        parser.add_argument("--parallel", type=int, default=1,
+            help="Number of images exported concurrently with --iterate, each with its own exporter. Default: %(default)s")
+        parser.add_argument("--read-ahead", type=int, default=DEFAULT_DEPTH,
+            help="Number of read calls kept outstanding per exporter. 1 reads sequentially. Default: %(default)s")
+        parser.add_argument("--progress", action="store_true", default=False,
+            help="Print progress and throughput to stderr")
 
         parser.set_defaults(func=self.export)
 
@@ -85,19 +91,57 @@ class ExportControl(BaseControl):
         if not ds:
             self.ctx.die(7, "No datasets found: %s", ", ".join([str(x) for x in datasets]))
 
+        ids = []
         for d in ds:
             for i in d.linkedImageList():
                 if i:
-                    i = i.id.val
-                    args.file = open(os.path.join(dir, "%s.ome.%s" % (i,args.type.lower())), "wb")
-                    self.handleImages(args, [i])
+                    ids.append(i.id.val)
+
+        def export(i):
+            handle = open(os.path.join(dir, "%s.ome.%s" % (i,args.type.lower())), "wb")
+            self.exportImages(c, args, [i], handle)
+
+        if args.parallel < 2:
+            for i in ids:
+                export(i)
+            return
+
+        # Bounded pool of workers, each creating its own exporter per image
+        queue = Queue()
+        for i in ids:
+            queue.put(i)
+        failed = []
+        def work():
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    export(i)
+                except Exception, ex:
+                    self.ctx.err("Failed to export Image:%s: %s" % (i, ex))
+                    failed.append(i)
+        workers = []
+        for x in range(min(args.parallel, len(ids))):
+            t = threading.Thread(target=work)
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+        if failed:
+            self.ctx.die(8, "Failed to export %s of %s images: %s" % \
+                (len(failed), len(ids), ", ".join(["Image:%s" % x for x in sorted(failed)])))
 
     def handleImages(self, args, images):
+        c = self.ctx.conn(args)
+        self.exportImages(c, args, images, args.file)
+
+    def exportImages(self, c, args, images, handle):
         e = None
-        handle = args.file
         issysout = (handle == sys.stdout)
 
-        c = self.ctx.conn(args)
         e = c.getSession().createExporter()
 
         remove = True
@@ -116,14 +160,18 @@ class ExportControl(BaseControl):
                 return
 
             remove = False
-            offset = 0
-            while True:
-                rv = e.read(offset, DEFAULT_READ_LENGTH)
-                if not rv:
-                    break
-                rv = rv[:min(DEFAULT_READ_LENGTH, l - offset)]
-                offset += len(rv)
+            progress = None
+            if args.progress:
+                progress = self.progress
+            reader = PipelinedReader(e.read, l, DEFAULT_READ_LENGTH,
+                depth=max(1, args.read_ahead), progress=progress)
+            for rv in reader:
                 handle.write(rv)
+            if args.progress:
+                self.ctx.err("Exported %s: %s bytes in %.2fs (%.2f MB/s)" % \
+                    (", ".join(["Image:%s" % x for x in images]),
+                     reader.bytes_read, reader.elapsed(),
+                     reader.throughput() / 1000000))
 
         finally:
             try:
@@ -131,11 +179,22 @@ class ExportControl(BaseControl):
                     handle.close()
                     if remove:
                         os.remove(handle.name)
-            except Exception, e:
-                self.ctx.err("Failed to close handle: %s" % e)
+            except Exception, ex:
+                self.ctx.err("Failed to close handle: %s" % ex)
 
             e.close()
 
+    def progress(self, done, total, elapsed):
+        if elapsed > 0:
+            rate = done / elapsed / 1000000
+        else:
+            rate = 0.0
+        percent = 100.0
+        if total:
+            percent = 100.0 * done / total
+        self.ctx.err("%5.1f%% %s/%s bytes (%.2f MB/s)" % \
+            (percent, done, total, rate))
+
 try:
     register("export", ExportControl, HELP)
 except NameError:
@@ -12,14 +12,63 @@
 
 from omero.cli import BaseControl, CLI
 import exceptions
+import threading
 import cmd
+import csv
 import time
 import cmd
 import sys
 
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 HELP = """Executes an HQL statement with the given parameters.
 If no query is given, then a shell is opened which
-will run any entered query with the current parameters."""
+will run any entered query with the current parameters.
+
+With --all, every result is written without user input,
+one page at a time, so that large results can be exported:
+
+  omero hql --all --format=csv "select i.id, i.name from Image i" > images.csv
+"""
+
+FORMATS = ("table", "csv", "tsv", "jsonl")
+
+# Default number of rows fetched per query with --all
+DEFAULT_PAGE_SIZE = 1000
+
+
+class Prefetch(object):
+    """
+    Calls a function on a background thread so that its result is
+    available by the time get() is called. Any exception raised by the
+    function is re-raised by get().
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self.rv = None
+        self.exc_info = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.rv = self.func(*self.args)
+        except:
+            self.exc_info = sys.exc_info()
+
+    def get(self):
+        self.thread.join()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.rv
 
 class HqlControl(BaseControl):
 
@@ -30,9 +79,22 @@ class HqlControl(BaseControl):
         parser.add_argument("--limit", help="Maximum number of return values", type=int, default=25)
         parser.add_argument("--offset", help="Number of entries to skip", type=int, default=0)
         parser.add_argument("--admin", help="Run an admin query", default=False, action="store_true")
+        self._configure_output(parser)
+        parser.add_argument("--all", action="store_true", default=False,
+            help="Write all results starting at --offset, without user input")
+        parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+            help="Number of results fetched per query with --all. Default: %(default)s")
+
+    def _configure_output(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="table",
+            help="Output format. 'table' is only available without --all. Default: %(default)s")
 
     def __call__(self, args):
-        if args.query:
+        if args.all:
+            if not args.query:
+                self.ctx.die(68, "A query is required with --all")
+            self.stream(args)
+        elif args.query:
             self.hql(args)
         else:
             if args.quiet:
@@ -56,6 +118,9 @@ class HqlControl(BaseControl):
         p = ParametersI()
         p.page(args.offset, args.limit)
         rv = self.project(q, args.query, p, ice_map)
+        if args.format != "table":
+            self.write(rv, args.format)
+            return
         has_details = self.display(rv)
         if args.quiet:
             return
@@ -150,11 +215,96 @@ To quit, enter 'q' or just enter.
         self.ctx.out(str(tb.build()))
         return has_details
 
+    def stream(self, args):
+        """
+        Writes every result of the query in the requested format, one page
+        at a time. The next page is fetched while the current one is being
+        written and no page is kept once written.
+        """
+        from omero_sys_ParametersI import ParametersI
+
+        if args.format == "table":
+            self.ctx.die(69, "Use --format=csv, tsv or jsonl with --all")
+        if args.page_size < 1:
+            self.ctx.die(70, "Page size must be positive: %s" % args.page_size)
+
+        ice_map = dict()
+        if args.admin:
+            ice_map["omero.group"]="-1"
+
+        c = self.ctx.conn(args)
+        q = c.sf.getQueryService()
+
+        def fetch(offset):
+            p = ParametersI()
+            p.page(offset, args.page_size)
+            return q.projection(args.query, p, ice_map)
+
+        offset = args.offset
+        header = True
+        next = Prefetch(fetch, offset)
+        while next is not None:
+            try:
+                rv = next.get()
+            except exceptions.Exception, e:
+                self.handle_error(e, ice_map)
+            if len(rv) < args.page_size:
+                next = None
+            else:
+                next = Prefetch(fetch, offset + len(rv))
+            self.write(rv, args.format, header)
+            offset += len(rv)
+            header = False
+        self.ctx.dbg("Wrote %s rows" % (offset - args.offset))
+
+    def write(self, rv, format, header = True):
+        """
+        Writes one page of results as csv, tsv or JSON lines. Single
+        objects are written as "Class:id" in the delimited formats and as
+        their fields in jsonl.
+        """
+        import omero.rtypes
+
+        if not rv:
+            return
+        buf = StringIO()
+        if format == "jsonl":
+            for object_list in rv:
+                if len(object_list) == 1 and isinstance(object_list[0], omero.rtypes.RObjectI):
+                    o = object_list[0].val
+                    values = {}
+                    if o:
+                        for k, v in o.__dict__.items():
+                            values[k] = self.unwrap(v)
+                        values = self.filter(values)
+                        values["Class"] = o.__class__.__name__
+                        values["Id"] = o.id.val
+                    row = values
+                else:
+                    row = [self.unwrap(x) for x in object_list]
+                buf.write(json.dumps(row, default=str))
+                buf.write("\n")
+        else:
+            delimiter = (format == "tsv") and "\t" or ","
+            writer = csv.writer(buf, delimiter=delimiter, lineterminator="\n")
+            if header:
+                width = max([len(x) for x in rv])
+                writer.writerow(["Col%s" % x for x in range(1, width + 1)])
+            for object_list in rv:
+                row = []
+                for x in object_list:
+                    x = self.unwrap(x)
+                    if isinstance(x, unicode):
+                        x = x.encode("utf-8")
+                    row.append(x)
+                writer.writerow(row)
+        self.ctx.out(buf.getvalue(), newline = False)
+
     def unwrap(self, object, cache = None):
 
         if cache == None:
             cache = {}
-        elif object in cache:
+        elif id(object) in cache:
             return cache[id(object)]
 
         from omero.rtypes import unwrap
@@ -207,19 +357,28 @@ To quit, enter 'q' or just enter.
         return rv
 
     def project(self, querySvc, queryStr, params, ice_map):
-        import omero
         try:
             rv = querySvc.projection(queryStr, params, ice_map)
             self.ctx.set("last.hql.rv", rv)
             return rv
-        except omero.SecurityViolation, sv:
+        except exceptions.Exception, e:
+            self.handle_error(e, ice_map)
+
+    def handle_error(self, e, ice_map):
+        """
+        Converts query errors into an exit with the appropriate code,
+        re-raising anything else.
+        """
+        import omero
+        if isinstance(e, omero.SecurityViolation):
             if "omero.group" in ice_map:
                 self.ctx.die(53, "SecurityViolation: Current user is not an admin and cannot use '--admin'")
             else:
-                self.ctx.die(54, "SecurityViolation: %s" % sv)
-        except omero.QueryException, qe:
+                self.ctx.die(54, "SecurityViolation: %s" % e)
+        elif isinstance(e, omero.QueryException):
             self.ctx.set("last.hql.rv", [])
-            self.ctx.die(52, "Bad query: %s" % qe.message)
+            self.ctx.die(52, "Bad query: %s" % e.message)
+        raise
 
 try:
     register("hql", HqlControl, HELP)
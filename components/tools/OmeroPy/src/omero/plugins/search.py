@@ -14,7 +14,7 @@ Simple command-line searching. Similar to the hql plugin.
 import sys
 
 from omero.cli import CLI
-from omero.plugins.hql import HqlControl
+from omero.plugins.hql import HqlControl, Prefetch
 
 
 HELP = """Search for object ids by string.
@@ -24,6 +24,7 @@ Examples:
   bin/omero search Image "my-text"
   bin/omero search Image "with wildcard*"
   bin/omero search Project "with wildcard*"
+  bin/omero search --format=csv Image "my-text" > ids.csv
 
 Examples (admin-only):
 
@@ -46,6 +47,7 @@ class SearchControl(HqlControl):
                 help="Object type to search for, e.g. 'Image' or 'Well'")
         parser.add_argument("search_string", nargs="?",
                 help="Lucene search string")
+        self._configure_output(parser)
         parser.set_defaults(func=self.search)
 
     def search(self, args):
@@ -78,10 +80,24 @@ class SearchControl(HqlControl):
                     search.byFullText(args.search_string)
                     if not search.hasNext():
                         self.ctx.die(433, "No results found.")
-                    while search.hasNext():
-                        results = search.results()
+                    # Fetch the next batch while the current one is written
+                    def fetch():
+                        if search.hasNext():
+                            return search.results()
+                        return []
+                    header = True
+                    next = Prefetch(fetch)
+                    while next is not None:
+                        results = next.get()
+                        if not results:
+                            break
+                        next = Prefetch(fetch)
                         results = [[x] for x in results]
-                        self.display(results)
+                        if args.format == "table":
+                            self.display(results)
+                        else:
+                            self.write(results, args.format, header)
+                            header = False
                 except omero.ApiUsageException, aue:
                     self.ctx.die(434, aue.message)
 
@@ -18,6 +18,8 @@ import omero
 import omero.rtypes
 import omero.util.originalfileutils
 
+from omero.util.batch_upload import BatchUploader, DEFAULT_THREADS
+
 from omero.rtypes import rlong
 from omero.rtypes import rint
 from omero.rtypes import rstring
@@ -32,7 +34,15 @@ except:
     import sha
     hash_sha1 = sha.new
 
-HELP = """Upload local files to the OMERO server"""
+HELP = """Upload local files to the OMERO server
+
+Example Usage:
+  omero upload results.csv
+  omero upload --batch --threads=8 results/*.csv
+
+With --batch, all OriginalFile objects are created at once and the files
+are transferred concurrently, each being hashed while it is sent.
+"""
 RE = re.compile("\s*upload\s*")
 
 class UploadControl(BaseControl):
@@ -49,11 +59,15 @@ class UploadControl(BaseControl):
 
     def _configure(self, parser):
         parser.add_argument("--pytable", action="store_true", help="If set, the following files are interpreted as pytable files" )
+        parser.add_argument("--batch", action="store_true", help="Upload all files together, concurrently")
+        parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="Number of concurrent transfers with --batch. Default: %(default)s")
         parser.add_argument("file", nargs="+")
         parser.set_defaults(func=self.upload)
 
     def upload(self, args):
         client = self.ctx.conn(args)
+        if args.batch:
+            return self.batch_upload(client, args)
         for file in args.file:
             is_importer, omero_format = omero.util.originalfileutils.getFormat(file)
             if (is_importer == omero.util.originalfileutils.IMPORTER):
@@ -63,6 +77,32 @@ class UploadControl(BaseControl):
                 self.ctx.out("Uploaded %s as " % file + str(obj.id.val))
                 self.ctx.set("last.upload.id", obj.id.val)
 
+    def batch_upload(self, client, args):
+        files = []
+        for file in args.file:
+            is_importer, omero_format = omero.util.originalfileutils.getFormat(file)
+            if (is_importer == omero.util.originalfileutils.IMPORTER):
+                self.ctx.die(493, "%s should be imported using omero import" % file)
+            files.append((file, omero_format))
+
+        uploader = BatchUploader(client.getSession(), threads = args.threads)
+        results = uploader.upload(files)
+        failed = 0
+        for result in results:
+            if result.error is not None:
+                failed += 1
+                self.ctx.err("Failed to upload %s as %s: %s" % \
+                    (result.filename, result.ofile.id.val, result.error))
+            else:
+                self.ctx.out("Uploaded %s as %s" % \
+                    (result.filename, result.ofile.id.val))
+                self.ctx.set("last.upload.id", result.ofile.id.val)
+        self.ctx.out("Uploaded %s files (%s bytes) in %.2fs (%.2f MB/s)" % \
+            (len(results) - failed, uploader.bytes, uploader.elapsed,
+             uploader.throughput() / 1000000))
+        if failed:
+            self.ctx.die(494, "%s of %s uploads failed" % (failed, len(results)))
+
 try:
     register("upload", UploadControl, HELP)
 except NameError:
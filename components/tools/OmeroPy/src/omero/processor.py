@@ -9,6 +9,7 @@ import os
 import time
 import signal
 import logging
+import threading
 import traceback
 import exceptions
 import killableprocess as subprocess
@@ -21,6 +22,8 @@ import omero.clients
 import omero.scripts
 import omero.util
 import omero.util.concurrency
+import omero.util.temp_files
+import omero.util.warm_pool
 
 import omero_ext.uuid as uuid # see ticket:3774
 
@@ -31,6 +34,11 @@ from omero.util.decorators import remoted, perf, wraps
 
 sys = __import__("sys")
 
+try:
+    from hashlib import sha1 as sha_new
+except ImportError:
+    from sha import new as sha_new
+
 
 def with_context(func, context):
     """ Decorator for invoking Ice methods with a context """
@@ -70,6 +78,24 @@ class WithGroup(object):
             return with_context(method, ctx)
         raise AttributeError("'%s' object has no attribute '%s'" % (self.service, name))
 
+def script_env(omero_home):
+    """
+    Returns the omero.util.Environment shared by all scripts, i.e.
+    everything but the ICE_CONFIG of a single ProcessI.
+    """
+    env = omero.util.Environment("PATH", "PYTHONPATH",\
+        "DYLD_LIBRARY_PATH", "LD_LIBRARY_PATH", "MLABRAW_CMD_STR", "HOME",\
+        "DISPLAY")
+    # WORKAROUND
+    # Currently duplicating the logic here as in the PYTHONPATH
+    # setting of the grid application descriptor (see etc/grid/*.xml)
+    # This should actually be taken care of in the descriptor itself
+    # by having setting PYTHONPATH to an absolute value. This is
+    # not currently possible with IceGrid (without using icepatch --
+    # see 39.17.2 "node.datadir).
+    env.append("PYTHONPATH", str(path(omero_home) / "lib" / "python"))
+    return env
+
 class ProcessI(omero.grid.Process, omero.util.SimpleServant):
     """
     Wrapper around a subprocess.Popen instance. Returned by ProcessorI
@@ -128,17 +154,7 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
     #
 
     def make_env(self):
-        self.env = omero.util.Environment("PATH", "PYTHONPATH",\
-            "DYLD_LIBRARY_PATH", "LD_LIBRARY_PATH", "MLABRAW_CMD_STR", "HOME",\
-            "DISPLAY")
-        # WORKAROUND
-        # Currently duplicating the logic here as in the PYTHONPATH
-        # setting of the grid application descriptor (see etc/grid/*.xml)
-        # This should actually be taken care of in the descriptor itself
-        # by having setting PYTHONPATH to an absolute value. This is
-        # not currently possible with IceGrid (without using icepatch --
-        # see 39.17.2 "node.datadir).
-        self.env.append("PYTHONPATH", str(self.omero_home / "lib" / "python"))
+        self.env = script_env(self.omero_home)
         self.env.set("ICE_CONFIG", str(self.config_path))
 
     def make_files(self):
@@ -631,6 +647,209 @@ class UseSessionHolder(object):
     def cleanup(self):
         pass
 
+class ParamsCache(object):
+    """
+    Bounded map from a script file to the JobParams which parsing it
+    produced, so that parseJob does not need to start a process for a
+    script which has not changed. Entries are keyed by the interpreter
+    which parsed the script together with the file's id and sha1, so the
+    same text in another file or under another interpreter is parsed
+    again. The least recently used entry is dropped once more than size
+    scripts are held. A size of 0 disables caching.
+    """
+
+    def __init__(self, size = 100, interpreter = sys.executable):
+        self._lock = threading.RLock()
+        self.size = size
+        self.interpreter = interpreter
+        self.params = {}
+        self.order = []
+
+    def key(self, file):
+        if file is None or file.id is None or file.sha1 is None:
+            return None
+        return (self.interpreter, file.id.val, file.sha1.val)
+
+    @locked
+    def get(self, file):
+        key = self.key(file)
+        if key not in self.params:
+            return None
+        self.order.remove(key)
+        self.order.append(key)
+        return self.params[key]
+
+    @locked
+    def put(self, file, params):
+        key = self.key(file)
+        if key is None or self.size <= 0:
+            return
+        if key in self.params:
+            self.order.remove(key)
+        self.params[key] = params
+        self.order.append(key)
+        while len(self.order) > self.size:
+            del self.params[self.order.pop(0)]
+
+class ScriptCache(object):
+    """
+    Size-bounded copies of script texts on disk, stored as dir/ID/SHA1 for
+    an OriginalFile ID with the given SHA1, so that launching a script
+    which has not changed does not need to fetch its text again.
+
+    write() verifies the sha1 of a cached text before using it, so a
+    damaged entry is simply fetched again, and storing a new sha1 for a
+    file removes the entries of its older versions. Texts are written to
+    a hidden temporary file and renamed into place, so several processors
+    may share dir. Once more than max_bytes are held, the least recently
+    used entries of this instance are removed. A max_bytes of 0 disables
+    caching.
+    """
+
+    def __init__(self, dir, max_bytes = 64 * 1024 * 1024):
+        self._lock = threading.RLock()
+        self.logger = logging.getLogger("omero.processor.ScriptCache")
+        self.dir = path(dir)
+        self.max_bytes = max_bytes
+        self.entries = {}  #: (id, sha1) to [size, last use]
+        self.total = 0     #: sum of the sizes of all entries
+        self.fetches = {}  #: id to the lock held while fetching it
+        self.hits = 0
+        self.misses = 0
+        if self.max_bytes > 0:
+            self.load()
+
+    def load(self):
+        """
+        Indexes the entries already in dir, e.g. from a previous run.
+        """
+        if not self.dir.exists():
+            self.dir.makedirs(0700)
+        for d in self.dir.dirs():
+            for f in d.files():
+                if f.name.startswith("."):
+                    self._remove_file(f) # Left over by a failed write
+                else:
+                    self._index((d.name, f.name), f.size, f.mtime)
+        self.evict()
+
+    def key(self, file):
+        return (str(file.id.val), file.sha1.val)
+
+    def write(self, file, target, fetch):
+        """
+        Writes the text of the script file to target, from the cache if
+        possible and otherwise from fetch(), which is only called once
+        at a time per file. Returns the sha1 of the text written, which
+        the caller must compare to file.sha1.
+        """
+        if self.max_bytes <= 0 or file.sha1 is None:
+            text = fetch()
+            path(target).write_bytes(text)
+            return sha_new(text).hexdigest()
+
+        key = self.key(file)
+        lock = self._fetch_lock(key[0])
+        lock.acquire()
+        try:
+            if self.copy(key, target):
+                return key[1]
+            self.misses += 1
+            text = fetch()
+            path(target).write_bytes(text)
+            digest = sha_new(text).hexdigest()
+            if digest == key[1]:
+                self.add(key, text)
+            return digest
+        finally:
+            lock.release()
+
+    @locked
+    def _fetch_lock(self, id):
+        return self.fetches.setdefault(id, threading.Lock())
+
+    def copy(self, key, target):
+        """
+        Copies the text cached for key to target. Returns False if there
+        is no (valid) entry.
+        """
+        source = self.dir / key[0] / key[1]
+        try:
+            text = source.bytes()
+        except (IOError, OSError):
+            self._drop(key)
+            return False
+        if sha_new(text).hexdigest() != key[1]:
+            self.logger.warn("Removing damaged entry: %s", source)
+            self._drop(key)
+            self._remove_file(source)
+            return False
+        path(target).write_bytes(text)
+        self._index(key, len(text), time.time())
+        self.hits += 1
+        return True
+
+    def add(self, key, text):
+        """
+        Stores text for key, replacing the older versions of the file.
+        """
+        if len(text) > self.max_bytes:
+            return
+        self.invalidate(key[0], keep = key[1])
+        d = self.dir / key[0]
+        try:
+            if not d.exists():
+                d.makedirs(0700)
+            tmp = d / (".%s.%s.%s" % (key[1], os.getpid(), uuid.uuid4()))
+            tmp.write_bytes(text)
+            target = d / key[1]
+            if target.exists():
+                target.remove() # rename does not replace on Windows
+            tmp.rename(target)
+        except (IOError, OSError):
+            self.logger.warn("Failed to cache %s", key, exc_info = True)
+            return
+        self._index(key, len(text), time.time())
+        self.evict()
+
+    def invalidate(self, id, keep = None):
+        """
+        Removes all entries for the file id other than the sha1 keep.
+        """
+        d = self.dir / str(id)
+        if not d.exists():
+            return
+        for f in d.files():
+            if f.name != keep and not f.name.startswith("."):
+                self._drop((str(id), f.name))
+                self._remove_file(f)
+
+    @locked
+    def evict(self):
+        while self.total > self.max_bytes and self.entries:
+            items = [(v[1], k) for k, v in self.entries.items()]
+            key = min(items)[1]
+            self._drop(key)
+            self._remove_file(self.dir / key[0] / key[1])
+
+    @locked
+    def _index(self, key, size, used):
+        self._drop(key)
+        self.entries[key] = [size, used]
+        self.total += size
+
+    @locked
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total -= entry[0]
+
+    def _remove_file(self, f):
+        try:
+            f.remove()
+        except (IOError, OSError):
+            pass # Already removed by another thread or processor
+
 class ProcessorI(omero.grid.Processor, omero.util.Servant):
 
     def __init__(self, ctx, needs_session = True,
@@ -669,6 +888,32 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         # Keep this session alive until the processor is finished
         self.resources.add( UseSessionHolder(use_session) )
 
+        self.params_cache = ParamsCache(
+            int(self.get_property("omero.processor.params_cache", "100")),
+            interpreter = sys.executable)
+
+        manager = omero.util.temp_files.manager
+        default_dir = manager.userdir.parent / ("%s_%s_scripts" % (manager.prefix, manager.username()))
+        self.script_cache = ScriptCache(
+            self.get_property("omero.processor.script_cache_dir", str(default_dir)),
+            int(self.get_property("omero.processor.script_cache_size", str(64 * 1024 * 1024))))
+
+        # Interpreters with omero already imported, used to start scripts.
+        # Off unless omero.processor.warm_workers is set.
+        self.warm_pool = omero.util.warm_pool.WarmPool(
+            size = int(self.get_property("omero.processor.warm_workers", "0")),
+            max_jobs = int(self.get_property("omero.processor.warm_jobs", "50")),
+            env = script_env(self.omero_home)(), fallback = subprocess.Popen)
+        self.resources.add(self.warm_pool)
+
+    def get_property(self, key, default):
+        """
+        Returns the value of key from the communicator's properties.
+        """
+        if self.communicator is None:
+            return default
+        return self.communicator.getProperties().getPropertyWithDefault(key, default)
+
     def setProxy(self, prx):
         """
         Overrides the default action in order to register this proxy
@@ -802,12 +1047,22 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         try:
             iskill = False
             client.joinSession(session).detachOnDestroy()
-            properties = {}
-            properties["omero.scripts.parse"] = "true"
-            prx, process = self.process(client, session, job, current, None, properties, iskill)
+            file, handle = self.lookup(job)
+            try:
+                rv = self.params_cache.get(file)
+                if rv is not None:
+                    self.logger.info("Using cached params for file %s (sha1=%s)", file.id.val, file.sha1.val)
+                    handle.setStatus("Finished")
+                    return rv
+                properties = {}
+                properties["omero.scripts.parse"] = "true"
+                prx, process = self.launch(client, session, job, file, handle, current, None, properties, iskill)
+            finally:
+                handle.close()
             process.wait()
             rv = client.getOutput("omero.scripts.parse")
             if rv != None:
+                self.params_cache.put(file, rv.val)
                 return rv.val
             else:
                 self.logger.warning("No output found for omero.scripts.parse. Keys: %s" % client.getOutputKeys())
@@ -838,62 +1093,70 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         client: an omero.client object which should be attached to a session
         """
 
-        if properties is None: properties = {}
-
         if not session or not job or not job.id:
             raise omero.ApiUsageException("No null arguments")
 
         file, handle = self.lookup(job)
 
         try:
-            if not file:
-                raise omero.ApiUsageException(\
-                    None, None, "Job should have one executable file attached.")
-
-            sf = self.internal_session()
-            if params:
-                self.logger.debug("Checking params for job %s" % job.id.val)
-                svc = sf.getSessionService()
-                inputs = svc.getInputs(session)
-                errors = omero.scripts.validate_inputs(params, inputs, svc, session)
-                if errors:
-                    errors = "Invalid parameters:\n%s" % errors
-                    raise omero.ValidationException(None, None, errors)
-
-            properties["omero.job"] = str(job.id.val)
-            properties["omero.user"] = session
-            properties["omero.pass"] = session
-            properties["Ice.Default.Router"] = client.getProperty("Ice.Default.Router")
-
-            process = ProcessI(self.ctx, sys.executable, properties, params, iskill, omero_home = self.omero_home)
-            self.resources.add(process)
-
-            # client.download(file, str(process.script_path))
-            scriptText = sf.getScriptService().getScriptText(file.id.val)
-            process.script_path.write_bytes(scriptText)
-
-            self.logger.info("Downloaded file: %s" % file.id.val)
-            s = client.sha1(str(process.script_path))
-            if not s == file.sha1.val:
-                msg = "Sha1s don't match! expected %s, found %s" % (file.sha1.val, s)
-                self.logger.error(msg)
-                process.cleanup()
-                raise omero.InternalException(None, None, msg)
-            else:
-                process.activate()
-                handle.setStatus("Running")
-
-            id = None
-            if self.category:
-                id = Ice.Identity()
-                id.name = "Process-%s" % uuid.uuid4()
-                id.category = self.category
-            prx = self.ctx.add_servant(current, process, ice_identity=id)
-            return omero.grid.ProcessPrx.uncheckedCast(prx), process
-
+            return self.launch(client, session, job, file, handle, current, params, properties, iskill)
         finally:
             handle.close()
 
+    def launch(self, client, session, job, file, handle, current, params, properties = None, iskill = True):
+        """
+        Starts a ProcessI for the script file of a job which has already
+        been looked up. The caller is responsible for closing handle.
+        """
+
+        if properties is None: properties = {}
+
+        if not file:
+            raise omero.ApiUsageException(\
+                None, None, "Job should have one executable file attached.")
+
+        sf = self.internal_session()
+        if params:
+            self.logger.debug("Checking params for job %s" % job.id.val)
+            svc = sf.getSessionService()
+            inputs = svc.getInputs(session)
+            errors = omero.scripts.validate_inputs(params, inputs, svc, session)
+            if errors:
+                errors = "Invalid parameters:\n%s" % errors
+                raise omero.ValidationException(None, None, errors)
+
+        properties["omero.job"] = str(job.id.val)
+        properties["omero.user"] = session
+        properties["omero.pass"] = session
+        properties["Ice.Default.Router"] = client.getProperty("Ice.Default.Router")
+
+        process = ProcessI(self.ctx, sys.executable, properties, params, iskill,
+                           Popen = self.warm_pool.Popen, omero_home = self.omero_home)
+        self.resources.add(process)
+
+        # client.download(file, str(process.script_path))
+        scripts = sf.getScriptService()
+        s = self.script_cache.write(file, process.script_path,
+                                    lambda: scripts.getScriptText(file.id.val))
+
+        self.logger.info("Wrote file: %s" % file.id.val)
+        if not s == file.sha1.val:
+            msg = "Sha1s don't match! expected %s, found %s" % (file.sha1.val, s)
+            self.logger.error(msg)
+            process.cleanup()
+            raise omero.InternalException(None, None, msg)
+        else:
+            process.activate()
+            handle.setStatus("Running")
+
+        id = None
+        if self.category:
+            id = Ice.Identity()
+            id.name = "Process-%s" % uuid.uuid4()
+            id.category = self.category
+        prx = self.ctx.add_servant(current, process, ice_identity=id)
+        return omero.grid.ProcessPrx.uncheckedCast(prx), process
+
 def usermode_processor(client, serverid = "UsermodeProcessor",\
                        cfg = None, accepts_list = None, stop_event = None,\
                        omero_home = path.getcwd()):
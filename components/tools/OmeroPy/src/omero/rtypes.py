@@ -24,6 +24,12 @@ import IceImport
 IceImport.load("omero_RTypes_ice")
 IceImport.load("omero_Scripts_ice")
 
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
 def rtype(val):
     """
     If None or an RType, return the argument itself. Otherwise,
@@ -66,32 +72,51 @@ def rtype(val):
 
 def wrap(val, cache=None):
     """
+    Recursively converts val into RTypes: lists and tuples into RLists,
+    sets into RSets, dicts into RMaps and numpy arrays into RArrays.
+    Lists of items which are all of the same primitive type are converted
+    in one pass without recursing. cache maps the id of each collection
+    already converted to its RType, so that shared and recursive
+    substructures are converted only once.
     """
     if cache is None:
         cache = {}
-    elif id(val) in cache:
+    return _wrap(val, cache, [])
+
+def _wrap(val, cache, keep):
+    if id(val) in cache:
         return cache[id(val)]
 
     if val is None:
         return None
     elif isinstance(val, (list, tuple)):
         rv = rlist()
-        cache[id(val)] = rv
-        for x in val:
-            rv.val.append(wrap(x, cache))
+        _memo(cache, keep, val, rv)
+        rv.val.extend(_wrap_all(val, cache, keep))
     elif isinstance(val, set):
         rv = rset()
-        cache[id(val)] = rv
-        for x in val:
-            rv.val.add(wrap(x, cache))
+        _memo(cache, keep, val, rv)
+        rv.val.extend(_wrap_all(list(val), cache, keep))
     elif isinstance(val, dict):
         rv = rmap()
-        cache[id(val)] = rv
-        for k, v in val.items():
-            rv.val[k] = wrap(v, cache)
+        _memo(cache, keep, val, rv)
+        keys = val.keys()
+        rv.val.update(zip(keys, _wrap_all([val[k] for k in keys], cache, keep)))
         rv._validate()
     elif isinstance(val, omero.RType):
         rv = val
+    elif has_numpy and isinstance(val, numpy.ndarray):
+        if val.ndim == 0:
+            return _wrap(val.item(), cache, keep)
+        rv = rarray()
+        _memo(cache, keep, val, rv)
+        factory = val.ndim == 1 and _numpy_factory(val.dtype)
+        if factory:
+            rv.val.extend(map(factory, val.tolist()))
+        else:
+            rv.val.extend([_wrap(x, cache, keep) for x in val])
+    elif has_numpy and isinstance(val, numpy.generic):
+        rv = rtype(val.item())
     else:
         rv = rtype(val)
 
@@ -99,55 +124,137 @@ def wrap(val, cache=None):
 
 def unwrap(val, cache=None):
     """
+    Recursively converts RTypes back into their values, and the items
+    of plain collections likewise. RCollections of items which are all
+    non-collection RTypes are converted in one pass without recursing.
+    cache works as for wrap(). See unwrap_view() for a lazy alternative
+    for large collections.
     """
     if cache is None:
         cache = {}
-    elif id(val) in cache:
+    return _unwrap(val, cache, [])
+
+def _unwrap(val, cache, keep):
+    if id(val) in cache:
         return cache[id(val)]
 
     if val is None:
         return None
     elif isinstance(val, (list, tuple)):
         rv = []
-        cache[id(val)] = rv
+        _memo(cache, keep, val, rv)
         for x in val:
-            rv.append(unwrap(x, cache))
+            rv.append(_unwrap(x, cache, keep))
     elif isinstance(val, set):
         rv = set()
-        cache[id(val)] = rv
+        _memo(cache, keep, val, rv)
         for x in val:
-            rv.add(unwrap(x, cache))
+            rv.add(_unwrap(x, cache, keep))
     elif isinstance(val, dict):
         rv = {}
-        cache[id(val)] = rv
+        _memo(cache, keep, val, rv)
         for k, v in val.items():
-            rv[unwrap(k, cache)] = unwrap(v, cache)
+            rv[_unwrap(k, cache, keep)] = _unwrap(v, cache, keep)
     elif isinstance(val, omero.RCollection):
         if val.val is None:
             rv = None
-            cache[id(val)] = None
+            _memo(cache, keep, val, None)
         else:
             rv = []
-            cache[id(val)] = rv
-            for x in val.val:
-                rv.append(unwrap(x, cache))
+            _memo(cache, keep, val, rv)
+            if _all_values(val.val):
+                rv.extend([x._val for x in val.val])
+            else:
+                for x in val.val:
+                    rv.append(_unwrap(x, cache, keep))
     elif isinstance(val, omero.RMap):
         if val.val is None:
             rv = None
-            cache[id(val)] = None
+            _memo(cache, keep, val, None)
         else:
             rv = {}
-            cache[id(val)] = rv
-            for k, v in val.val.items():
-                rv[unwrap(k, cache)] = unwrap(v, cache)
+            _memo(cache, keep, val, rv)
+            values = val.val.values()
+            if _all_values(values):
+                rv.update(zip(val.val.keys(), [x._val for x in values]))
+            else:
+                for k, v in val.val.items():
+                    rv[_unwrap(k, cache, keep)] = _unwrap(v, cache, keep)
     elif isinstance(val, omero.RType): # Non-recursive
         rv = val.val
-        cache[id(val)] = rv
     else:
         rv = val
 
     return rv
 
+def unwrap_view(val):
+    """
+    Like unwrap() but returns a read-only view of RCollections and RMaps
+    which unwraps each item only when it is accessed, rather than
+    converting the whole collection up front. Nested collections are in
+    turn returned as views. Any other argument is passed to unwrap().
+    """
+    if isinstance(val, omero.RCollection) and val.val is not None:
+        return UnwrappedList(val)
+    elif isinstance(val, omero.RMap) and val.val is not None:
+        return UnwrappedMap(val)
+    else:
+        return unwrap(val)
+
+def _memo(cache, keep, val, rv):
+    """
+    Records in cache that val was converted into rv. val is also
+    appended to keep, a list which lasts as long as the outer wrap() or
+    unwrap() call, so that it cannot be freed and its id reused by
+    another object before then. Transient objects, such as the rows of
+    a numpy array, would otherwise match the entry of an earlier one.
+    """
+    cache[id(val)] = rv
+    keep.append(val)
+
+def _wrap_all(values, cache, keep):
+    """
+    Wraps each of values, in one pass if all have the same primitive type.
+    """
+    kinds = set(map(type, values))
+    if len(kinds) == 1:
+        factory = _factories.get(kinds.pop())
+        if factory is not None:
+            return map(factory, values)
+    return [_wrap(x, cache, keep) for x in values]
+
+def _all_values(items):
+    """
+    Returns True if all items are RTypes which are not collections and
+    so can be unwrapped by taking their value.
+    """
+    for kind in set(map(type, items)):
+        if kind not in _values:
+            if not issubclass(kind, omero.RType) or \
+                    issubclass(kind, (omero.RCollection, omero.RMap)):
+                return False
+            _values[kind] = True
+    return True
+
+def _numpy_factory(dtype):
+    """
+    Returns the static factory method for the items of a numpy array of
+    the given dtype, or None if the items must be wrapped one by one.
+    64-bit and unsigned 32-bit integers become RLongs, float64 RDoubles.
+    """
+    kind = dtype.kind
+    size = dtype.itemsize
+    if kind == "b":
+        return rbool
+    elif kind == "i":
+        return _factories[size < 8 and int or long]
+    elif kind == "u":
+        return _factories[size < 4 and int or long]
+    elif kind == "f":
+        return size < 8 and _factories[float] or _rdouble
+    elif kind == "S":
+        return _factories[str]
+    return None
 
 # Static factory methods (primitives)
 # =========================================================================
@@ -1188,6 +1295,97 @@ class RMapI(omero.RMap):
         """
         pass # Currently unused
 
+# Lazy views (see unwrap_view)
+# =========================================================================
+
+class UnwrappedList(object):
+    """
+    Read-only list view of an RCollection, see unwrap_view()
+    """
+
+    def __init__(self, rcollection):
+        self._items = rcollection.val
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [unwrap_view(x) for x in self._items[index]]
+        return unwrap_view(self._items[index])
+
+    def __iter__(self):
+        for x in self._items:
+            yield unwrap_view(x)
+
+    def __contains__(self, value):
+        for x in self:
+            if x == value:
+                return True
+        return False
+
+    def __eq__(self, obj):
+        if isinstance(obj, UnwrappedList):
+            obj = list(obj)
+        return isinstance(obj, list) and list(self) == obj
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __repr__(self):
+        return "UnwrappedList(%s items)" % len(self._items)
+
+class UnwrappedMap(object):
+    """
+    Read-only dict view of an RMap, see unwrap_view()
+    """
+
+    def __init__(self, rmap):
+        self._items = rmap.val
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, key):
+        return unwrap_view(self._items[key])
+
+    def get(self, key, default = None):
+        if key in self._items:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self._items
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def keys(self):
+        return self._items.keys()
+
+    def values(self):
+        return [unwrap_view(x) for x in self._items.values()]
+
+    def items(self):
+        return [(k, unwrap_view(v)) for k, v in self._items.items()]
+
+    def iteritems(self):
+        for k, v in self._items.iteritems():
+            yield k, unwrap_view(v)
+
+    def __eq__(self, obj):
+        if isinstance(obj, UnwrappedMap):
+            obj = dict(obj.items())
+        return isinstance(obj, dict) and dict(self.items()) == obj
+
+    def __ne__(self, obj):
+        return not self.__eq__(obj)
+
+    def __repr__(self):
+        return "UnwrappedMap(%s items)" % len(self._items)
+
 # Helpers
 # ========================================================================
 
@@ -1228,6 +1426,34 @@ rnullinternal = RInternalI(None)
 
 rnullobject = RObjectI(None)
 
+# Conversion tables for wrap and unwrap
+# =========================================================================
+
+def _fast_factory(cls):
+    """
+    Returns a function which creates an instance of cls holding its
+    argument without the overhead of __init__ and __setattr__, for
+    converting many values in one pass.
+    """
+    new = cls.__new__
+    def create(val):
+        rv = new(cls)
+        rv.__dict__["_val"] = val
+        return rv
+    return create
+
+_factories = {
+    bool: rbool,
+    int: _fast_factory(RIntI),
+    long: _fast_factory(RLongI),
+    float: _fast_factory(RFloatI),
+    str: _fast_factory(RStringI),
+    }
+
+_rdouble = _fast_factory(RDoubleI)
+
+_values = {} # Non-collection RType classes, filled by _all_values
+
 # Object factories
 # =========================================================================
 
@@ -69,6 +69,44 @@ def stamped(func, update = False):
     checked_and_update_stamp = wraps(func)(check_and_update_stamp)
     return locked(check_and_update_stamp)
 
+# Storage profiles which can be passed to HdfStorage.initialize, either
+# directly or via the "omero.tables.profile" call context or property.
+# "expectedrows" and "chunkshape" are passed to createTable, the others
+# are used to create the tables.Filters for the OME group and all of its
+# nodes. A complib which PyTables was built without falls back to zlib.
+PROFILES = {
+    "default": {},
+    "append-heavy": {"expectedrows": 1000000, "complib": "blosc",
+                     "complevel": 1, "shuffle": True},
+    "scan-heavy": {"expectedrows": 10000000, "complib": "zlib",
+                   "complevel": 6, "shuffle": True},
+    "random-read": {"expectedrows": 100000, "chunkshape": (256,),
+                    "complevel": 0},
+    }
+
+def storage_profile(name):
+    """
+    Returns the keyword arguments for createTable for the named
+    profile in PROFILES, including "filters" if it sets compression.
+    """
+    try:
+        profile = PROFILES[name]
+    except KeyError:
+        known = ", ".join(sorted(PROFILES.keys()))
+        raise omero.ApiUsageException(None, None, "Unknown storage profile: %s (known: %s)" % (name, known))
+
+    kwargs = {}
+    for key in ("expectedrows", "chunkshape"):
+        if key in profile:
+            kwargs[key] = profile[key]
+    if "complib" in profile or "complevel" in profile:
+        complib = profile.get("complib", "zlib")
+        if tables.whichLibVersion(complib) is None:
+            complib = "zlib"
+        kwargs["filters"] = tables.Filters(complevel = profile.get("complevel", 0),\
+            complib = complib, shuffle = profile.get("shuffle", False))
+    return kwargs
+
 
 class HdfList(object):
     """
@@ -76,49 +114,32 @@ class HdfList(object):
     with equal fileno's, portalocker cannot be used to prevent
     the creation of two HdfStorage instances from the same
     Python process.
+
+    HdfList also bounds the number of HDF5 files held open: once more
+    than max_open storages have an open file, the least recently used
+    ones are closed. HdfStorage reopens its file on the next use.
+    Storages which were written keep their exclusive lock meanwhile.
     """
 
-    def __init__(self):
+    def __init__(self, max_open = 256):
         self.logger = logging.getLogger("omero.tables.HdfList")
         self._lock = threading.RLock()
+        self.max_open = max_open
         self.__filenos = {}
         self.__paths = {}
-        self.__locks = {}
+        self.__open = [] # Storages with an open file, least recent first
 
     @locked
     def addOrThrow(self, hdfpath, hdfstorage):
 
-        if hdfpath in self.__locks:
+        if hdfpath in self.__paths:
             raise omero.LockTimeout(None, None, "Path already in HdfList: %s" % hdfpath)
 
         parent = path(hdfpath).parent
         if not parent.exists():
             raise omero.ApiUsageException(None, None, "Parent directory does not exist: %s" % parent)
 
-        lock = None
-        try:
-            lock = open(hdfpath, "a+")
-            portalocker.lock(lock, portalocker.LOCK_NB|portalocker.LOCK_EX)
-            self.__locks[hdfpath] = lock
-        except portalocker.LockException, le:
-            if lock:
-                lock.close()
-            raise omero.LockTimeout(None, None, "Cannot acquire exclusive lock on: %s" % hdfpath, 0)
-        except:
-            if lock:
-                lock.close()
-            raise
-
-        hdffile = hdfstorage.openfile("a")
-        fileno = hdffile.fileno()
-        if fileno in self.__filenos.keys():
-            hdffile.close()
-            raise omero.LockTimeout(None, None, "File already opened by process: %s" % hdfpath, 0)
-        else:
-            self.__filenos[fileno] = hdfstorage
-            self.__paths[hdfpath] = hdfstorage
-
-        return hdffile
+        self.__paths[hdfpath] = hdfstorage
 
     @locked
     def getOrCreate(self, hdfpath):
@@ -128,18 +149,57 @@ class HdfList(object):
             return HdfStorage(hdfpath) # Adds itself.
 
     @locked
-    def remove(self, hdfpath, hdffile):
-        del self.__filenos[hdffile.fileno()]
-        del self.__paths[hdfpath]
+    def remove(self, hdfpath):
         try:
-            if hdfpath in self.__locks:
-                try:
-                    lock = self.__locks[hdfpath]
-                    lock.close()
-                finally:
-                    del self.__locks[hdfpath]
-        except exceptions.Exception, e:
-            self.logger.warn("Exception on remove(%s)" % hdfpath, exc_info=True)
+            del self.__paths[hdfpath]
+        except KeyError:
+            self.logger.warn("Unknown path on remove(%s)" % hdfpath)
+
+    def opened(self, hdfstorage, hdffile):
+        """
+        Registers the newly opened file of hdfstorage, and then closes the
+        files of the least recently used storages beyond max_open. Those
+        in use by another thread are skipped and tried again next time.
+        """
+        for victim in self.__register(hdfstorage, hdffile):
+            if victim.evict():
+                self.logger.debug("Closed %s to free a handle", victim)
+
+    @locked
+    def __register(self, hdfstorage, hdffile):
+        fileno = hdffile.fileno()
+        if fileno in self.__filenos:
+            raise omero.LockTimeout(None, None, "File already opened by process: %s" % hdffile.filename, 0)
+        self.__filenos[fileno] = hdfstorage
+        self.__open.append(hdfstorage)
+        return self.__open[:-max(1, self.max_open)]
+
+    @locked
+    def used(self, hdfstorage):
+        """
+        Marks hdfstorage as the most recently used.
+        """
+        if self.__open[-1] is not hdfstorage:
+            self.__open.remove(hdfstorage)
+            self.__open.append(hdfstorage)
+
+    @locked
+    def closed(self, hdfstorage, hdffile):
+        """
+        Unregisters the file of hdfstorage before it is closed.
+        """
+        try:
+            del self.__filenos[hdffile.fileno()]
+            self.__open.remove(hdfstorage)
+        except (KeyError, ValueError):
+            self.logger.warn("Unknown file on closed(%s)" % hdfstorage, exc_info=True)
+
+    @locked
+    def size(self):
+        """
+        Returns the number of open HDF5 files.
+        """
+        return len(self.__open)
 
 # Global object for maintaining files
 HDFLIST = HdfList()
@@ -148,6 +208,13 @@ class HdfStorage(object):
     """
     Provides HDF-storage for measurement results. At most a single
     instance will be available for any given physical HDF5 file.
+
+    Existing files are opened read-only under a shared lock, so that they
+    can also be read by other processes, and reopened for writing under
+    an exclusive lock on the first write. The file may be closed by
+    HDFLIST when too many are open, and is reopened on the next call.
+    An exclusive lock is held until cleanup() regardless, so that no
+    other process can take the file while it is being written.
     """
 
 
@@ -156,7 +223,7 @@ class HdfStorage(object):
         """
         file_path should be the path to a file in a valid directory where
         this HDF instance can be stored (Not None or Empty). Once this
-        method is finished, self.__hdf_file is guaranteed to be a PyTables HDF
+        method is finished, the file is guaranteed to be a PyTables HDF
         file, but not necessarily initialized.
         """
 
@@ -166,9 +233,9 @@ class HdfStorage(object):
         self.logger = logging.getLogger("omero.tables.HdfStorage")
 
         self.__hdf_path = path(file_path)
-        # Locking first as described at:
-        # http://www.pytables.org/trac/ticket/185
-        self.__hdf_file = HDFLIST.addOrThrow(file_path, self)
+        self.__hdf_file = None
+        self.__lock_file = None
+        self.__mode = None
         self.__tables = []
 
         self._lock = threading.RLock()
@@ -177,15 +244,20 @@ class HdfStorage(object):
         # These are what we'd like to have
         self.__mea = None
         self.__ome = None
+        self.__initialized = False
 
+        HDFLIST.addOrThrow(file_path, self)
         try:
-            self.__ome = self.__hdf_file.root.OME
-            self.__mea = self.__ome.Measurements
-            self.__types = self.__ome.ColumnTypes[:]
-            self.__descriptions = self.__ome.ColumnDescriptions[:]
-            self.__initialized = True
-        except tables.NoSuchNodeError:
-            self.__initialized = False
+            if self.__hdf_path.exists() and self.__hdf_path.size > 0:
+                self.__open("r")
+            else:
+                self.__open("a")
+        except:
+            HDFLIST.remove(file_path)
+            raise
+
+    def __str__(self):
+        return "HdfStorage(%s)" % self.__hdf_path
 
     #
     # Non-locked methods
@@ -205,6 +277,126 @@ class HdfStorage(object):
             self.logger.error(msg)
             raise omero.ValidationException(None, None, msg)
 
+    def __open(self, mode):
+        """
+        Locks and opens the file in the given mode ("r" or "a") and loads
+        the nodes used by the other methods. Read-only files are locked
+        shared, others exclusively. A lock which is still held is
+        converted in place rather than released and taken again.
+        """
+        # Locking first as described at:
+        # http://www.pytables.org/trac/ticket/185
+        lock = self.__lock_file
+        hdffile = None
+        try:
+            if lock is None:
+                lock = open(self.__hdf_path, "a+")
+            if mode == "r":
+                portalocker.lock(lock, portalocker.LOCK_NB|portalocker.LOCK_SH)
+            else:
+                portalocker.lock(lock, portalocker.LOCK_NB|portalocker.LOCK_EX)
+            hdffile = self.openfile(mode)
+            HDFLIST.opened(self, hdffile)
+        except:
+            exc_info = sys.exc_info()
+            if hdffile:
+                hdffile.close()
+            if lock is not self.__lock_file:
+                lock.close()
+            elif lock is not None and self.__mode == "r":
+                self.__downgrade()
+            if isinstance(exc_info[1], portalocker.LockException):
+                raise omero.LockTimeout(None, None, "Cannot acquire %s lock on: %s" % \
+                    (mode == "r" and "shared" or "exclusive", self.__hdf_path), 0)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        self.__hdf_file = hdffile
+        self.__lock_file = lock
+        self.__mode = mode
+        try:
+            self.__ome = hdffile.root.OME
+            self.__mea = self.__ome.Measurements
+            self.__types = self.__ome.ColumnTypes[:]
+            self.__descriptions = self.__ome.ColumnDescriptions[:]
+            self.__initialized = True
+        except tables.NoSuchNodeError:
+            self.__initialized = False
+
+    def __downgrade(self):
+        """
+        Converts the lock back to a shared one after a failed upgrade,
+        which may have released it. If another process has since taken
+        the file, the lock file is closed and the next call reopens it.
+        """
+        try:
+            portalocker.lock(self.__lock_file, portalocker.LOCK_NB|portalocker.LOCK_SH)
+        except portalocker.LockException:
+            self.logger.warn("Lost shared lock on %s", self.__hdf_path)
+            self.__lock_file.close()
+            self.__lock_file = None
+
+    def __close(self, unlock):
+        """
+        Closes the file if it is open, and releases its lock if unlock
+        is True. Called with self._lock held.
+        """
+        hdffile = self.__hdf_file
+        lock = self.__lock_file
+        self.__hdf_file = None
+        self.__mea = None
+        self.__ome = None
+        if unlock:
+            self.__lock_file = None
+        try:
+            if hdffile is not None:
+                HDFLIST.closed(self, hdffile)
+                hdffile.close() # Resources freed
+        finally:
+            if unlock and lock is not None:
+                lock.close()
+
+    def __file(self, write = False):
+        """
+        Returns the open file, reopening it if HDFLIST closed it, or
+        reopening it for writing if write is True and it was opened
+        read-only. Called with self._lock held.
+        """
+        if self.__mode is None:
+            raise omero.ApiUsageException(None, None, "Storage closed: %s" % self.__hdf_path)
+        if write and self.__mode == "r":
+            if self.__hdf_file is not None:
+                self.__close(False)
+            self.__open("a")
+        elif self.__hdf_file is None:
+            self.__open(self.__mode)
+        else:
+            HDFLIST.used(self)
+        return self.__hdf_file
+
+    def __table(self, write = False):
+        """
+        Returns the Measurements table, reopening the file if necessary.
+        """
+        self.__file(write)
+        return self.__mea
+
+    def evict(self):
+        """
+        Called by HDFLIST to close the file unless the storage is
+        being used by another thread. Returns True if it was closed.
+        Only a shared lock is released; an exclusive one is kept so
+        that the writes of the storage cannot fail once it reopens.
+        """
+        if not self._lock.acquire(False):
+            return False
+        try:
+            if self.__hdf_file is None:
+                return False
+            self.__close(self.__mode == "r")
+            return True
+        finally:
+            self._lock.release()
+
     def __initcheck(self):
         if not self.__initialized:
             raise omero.ApiUsageException(None, None, "Not yet initialized")
@@ -213,7 +405,7 @@ class HdfStorage(object):
         return len(self.__types)
 
     def __length(self):
-        return self.__mea.nrows
+        return self.__table().nrows
 
     def __sizecheck(self, colNumbers, rowNumbers):
         if colNumbers is not None:
@@ -240,9 +432,10 @@ class HdfStorage(object):
     #
 
     @locked
-    def initialize(self, cols, metadata = None):
+    def initialize(self, cols, metadata = None, profile = "default"):
         """
-
+        Creates the table for the given columns with the chunking and
+        compression of the named storage profile (see PROFILES).
         """
         if metadata is None: metadata = {}
 
@@ -256,14 +449,16 @@ class HdfStorage(object):
             if not c.name:
                 raise omero.ApiUsageException(None, None, "Column unnamed: %s" % c)
 
+        kwargs = storage_profile(profile)
+        hdffile = self.__file(write = True)
         self.__definition = columns2definition(cols)
-        self.__ome = self.__hdf_file.createGroup("/", "OME")
-        self.__mea = self.__hdf_file.createTable(self.__ome, "Measurements", self.__definition)
+        self.__ome = hdffile.createGroup("/", "OME", filters = kwargs.get("filters"))
+        self.__mea = hdffile.createTable(self.__ome, "Measurements", self.__definition, **kwargs)
 
         self.__types = [ x.ice_staticId() for x in cols ]
         self.__descriptions = [ (x.description != None) and x.description or "" for x in cols ]
-        self.__hdf_file.createArray(self.__ome, "ColumnTypes", self.__types)
-        self.__hdf_file.createArray(self.__ome, "ColumnDescriptions", self.__descriptions)
+        hdffile.createArray(self.__ome, "ColumnTypes", self.__types)
+        hdffile.createArray(self.__ome, "ColumnDescriptions", self.__descriptions)
 
         self.__mea.attrs.version = "v1"
         self.__mea.attrs.initialized = time.time()
@@ -273,7 +468,7 @@ class HdfStorage(object):
                 # See attrs._f_list("user") to retrieve these.
 
         self.__mea.flush()
-        self.__hdf_file.flush()
+        hdffile.flush()
         self.__initialized = True
 
     @locked
@@ -305,14 +500,15 @@ class HdfStorage(object):
     @locked
     def rows(self):
         self.__initcheck()
-        return self.__mea.nrows
+        return self.__table().nrows
 
     @locked
     def cols(self, size, current):
         self.__initcheck()
         ic = current.adapter.getCommunicator()
+        mea = self.__table()
         types = self.__types
-        names = self.__mea.colnames
+        names = mea.colnames
         cols = []
         for i in range(len(types)):
             t = types[i]
@@ -321,7 +517,7 @@ class HdfStorage(object):
                 col = ic.findObjectFactory(t).create(t)
                 col.name = n
                 col.setsize(size)
-                col.settable(self.__mea)
+                col.settable(mea)
                 cols.append(col)
             except:
                 msg = traceback.format_exc()
@@ -332,8 +528,8 @@ class HdfStorage(object):
     def get_meta_map(self):
         self.__initcheck()
         metadata = {}
-        attr = self.__mea.attrs
-        keys = list(self.__mea.attrs._v_attrnamesuser)
+        attr = self.__table().attrs
+        keys = list(attr._v_attrnamesuser)
         for key in keys:
             val = attr[key]
             if type(val) == numpy.float64:
@@ -354,14 +550,16 @@ class HdfStorage(object):
         if not m:
             return
         self.__initcheck()
-        attr = self.__mea.attrs
+        mea = self.__table(write = True)
+        attr = mea.attrs
         for k, v in m.items():
             attr[k] = unwrap(v)
-        self.__mea.flush()
+        mea.flush()
 
     @locked
     def append(self, cols):
         # Optimize!
+        mea = self.__table(write = True)
         arrays = []
         names = []
         sz = None
@@ -373,10 +571,10 @@ class HdfStorage(object):
                     raise omero.ValidationException("Columns are of differing length")
             names.extend(col.names())
             arrays.extend(col.arrays())
-            col.append(self.__mea) # Potential corruption !!!
+            col.append(mea) # Potential corruption !!!
         records = numpy.rec.fromarrays(arrays, names=names)
-        self.__mea.append(records)
-        self.__mea.flush()
+        mea.append(records)
+        mea.flush()
 
     #
     # Stamped methods
@@ -384,17 +582,18 @@ class HdfStorage(object):
 
     @stamped
     def update(self, stamp, data):
+        mea = self.__table(write = True)
         if data:
             for i, rn in enumerate(data.rowNumbers):
                 for col in data.columns:
-                    getattr(self.__mea.cols, col.name)[rn] = col.values[i]
-        self.__mea.flush()
+                    getattr(mea.cols, col.name)[rn] = col.values[i]
+        mea.flush()
 
     @stamped
     def getWhereList(self, stamp, condition, variables, unused, start, stop, step):
         self.__initcheck()
         try:
-            return self.__mea.getWhereList(condition, variables, None, start, stop, step).tolist()
+            return self.__table().getWhereList(condition, variables, None, start, stop, step).tolist()
         except (exceptions.NameError, exceptions.SyntaxError, exceptions.TypeError, exceptions.ValueError), err:
             aue = omero.ApiUsageException()
             aue.message = "Bad condition: %s, %s" % (condition, variables)
@@ -417,22 +616,29 @@ class HdfStorage(object):
         self.__initcheck()
         self.__sizecheck(None, rowNumbers)
         cols = self.cols(None, current)
+        mea = self.__table()
         for col in cols:
-            col.readCoordinates(self.__mea, rowNumbers)
+            col.readCoordinates(mea, rowNumbers)
         return self._as_data(cols, rowNumbers)
 
-    @stamped
     def read(self, stamp, colNumbers, start, stop, current):
+        """
+        Only the read of the rows holds the lock. Readers of the same
+        file then overlap while converting the rows to columns.
+        """
+        cols, rows = self._read(stamp, colNumbers, start, stop, current)
+        rv, l = self._rowstocols(rows, colNumbers, cols)
+        return self._as_data(rv, range(start, start+l))
+
+    @stamped
+    def _read(self, stamp, colNumbers, start, stop, current):
         self.__initcheck()
         self.__sizecheck(colNumbers, None)
         cols = self.cols(None, current)
-
-        rows = self._getrows(start, stop)
-        rv, l = self._rowstocols(rows, colNumbers, cols)
-        return self._as_data(rv, range(start, start+l))
+        return cols, self._getrows(start, stop)
 
     def _getrows(self, start, stop):
-        return self.__mea.read(start, stop)
+        return self.__table().read(start, stop)
 
     def _rowstocols(self, rows, colNumbers, cols):
         l = 0
@@ -456,10 +662,11 @@ class HdfStorage(object):
 
         self.__sizecheck(colNumbers, rowNumbers)
         cols = self.cols(None, current)
+        mea = self.__table()
         rv   = []
         for i in colNumbers:
             col = cols[i]
-            col.readCoordinates(self.__mea, rowNumbers)
+            col.readCoordinates(mea, rowNumbers)
             rv.append(col)
         return self._as_data(rv, rowNumbers)
 
@@ -473,16 +680,15 @@ class HdfStorage(object):
     @locked
     def cleanup(self):
         self.logger.info("Cleaning storage: %s", self.__hdf_path)
-        if self.__mea:
-            self.__mea.flush()
-            self.__mea = None
-        if self.__ome:
-            self.__ome = None
-        if self.__hdf_file:
-            HDFLIST.remove(self.__hdf_path, self.__hdf_file)
-        hdffile = self.__hdf_file
-        self.__hdf_file = None
-        hdffile.close() # Resources freed
+        if self.__mode is None:
+            return
+        self.__mode = None
+        try:
+            if self.__hdf_file and self.__mea:
+                self.__mea.flush()
+            self.__close(True)
+        finally:
+            HDFLIST.remove(self.__hdf_path)
 
 # End class HdfStorage
 
@@ -493,8 +699,9 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
     """
 
     def __init__(self, ctx, file_obj, factory, storage, uuid = "unknown", \
-            call_context = None):
+            call_context = None, profile = "default"):
         self.uuid = uuid
+        self.profile = profile
         self.file_obj = file_obj
         self.factory = factory
         self.storage = storage
@@ -622,7 +829,7 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
     def readCoordinates(self, rowNumbers, current = None):
         self.logger.info("%s.readCoordinates(size=%s)", self, slen(rowNumbers))
         try:
-            return self.storage.readCoordinates(self.stamp, rowNumbers, current)
+            return self._marshal(self.storage.readCoordinates(self.stamp, rowNumbers, current))
         except tables.HDF5ExtError, err:
             aue = omero.ApiUsageException()
             aue.message = "Error reading coordinates. Most likely out of range"
@@ -637,7 +844,7 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
         if start == 0L and stop == 0L:
             stop = None
         try:
-            return self.storage.read(self.stamp, colNumbers, start, stop, current)
+            return self._marshal(self.storage.read(self.stamp, colNumbers, start, stop, current))
         except tables.HDF5ExtError, err:
             aue = omero.ApiUsageException()
             aue.message = "Error reading coordinates. Most likely out of range"
@@ -649,7 +856,12 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
     @perf
     def slice(self, colNumbers, rowNumbers, current = None):
         self.logger.info("%s.slice(size=%s, size=%s)", self, slen(colNumbers), slen(rowNumbers))
-        return self.storage.slice(self.stamp, colNumbers, rowNumbers, current)
+        return self._marshal(self.storage.slice(self.stamp, colNumbers, rowNumbers, current))
+
+    def _marshal(self, data):
+        for col in data.columns:
+            col.marshal()
+        return data
 
     # TABLES WRITE API ===========================
 
@@ -657,9 +869,12 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
     @perf
     def initialize(self, cols, current = None):
         self.assert_write()
-        self.storage.initialize(cols)
+        profile = self.profile
+        if current is not None and current.ctx:
+            profile = current.ctx.get("omero.tables.profile", profile)
+        self.storage.initialize(cols, profile = profile)
         if cols:
-            self.logger.info("Initialized %s with %s col(s)", self, slen(cols))
+            self.logger.info("Initialized %s with %s col(s) (profile=%s)", self, slen(cols), profile)
 
     @remoted
     @perf
@@ -766,10 +981,31 @@ class TablesI(omero.grid.Tables, omero.util.Servant):
         self._internal_repo_cast = internal_repo_cast
 
         self.__stores = []
+        self._get_limits()
+        self._get_profile()
         self._get_dir()
         self._get_uuid()
         self._get_repo()
 
+    def _get_limits(self):
+        """
+        Before the repository is looked up, the maximum number of
+        HDF5 files which will be held open at once is set. Tables beyond that
+        reopen their file when they are next used.
+        """
+        props = self.communicator.getProperties()
+        HDFLIST.max_open = int(props.getPropertyWithDefault("omero.tables.max_open_files", "256"))
+        self.logger.info("Holding at most %s HDF5 files open", HDFLIST.max_open)
+
+    def _get_profile(self):
+        """
+        Looks up the storage profile of new tables, which can also be
+        chosen per table via the "omero.tables.profile" call context.
+        """
+        props = self.communicator.getProperties()
+        self.profile = props.getPropertyWithDefault("omero.tables.profile", "default")
+        storage_profile(self.profile) # Fail on unknown profiles
+
     def _get_dir(self):
         """
         Second step in initialization is to find the .omero/repository
@@ -852,7 +1088,7 @@ class TablesI(omero.grid.Tables, omero.util.Servant):
         id = Ice.Identity()
         id.name = Ice.generateUUID()
         table = TableI(self.ctx, file_obj, factory, storage, uuid = id.name, \
-                call_context=current.ctx)
+                call_context=current.ctx, profile=self.profile)
         self.resources.add(table)
 
         prx = current.adapter.add(table, id)
@@ -13,6 +13,7 @@ import path
 import time
 import omero
 import IcePy
+import Queue
 import IceGrid
 import logging
 import platform
@@ -536,14 +537,51 @@ class Servant(SimpleServant):
         self.cleanup()
 
 
+class ResourceEntry(object):
+    """
+    An object registered with Resources, along with the state used to
+    schedule its checks. Indexing gives (object, cleanupMethod,
+    checkMethod) as for the tuples previously stored by Resources.
+    """
+
+    def __init__(self, object, cleanupMethod, checkMethod, interval, max_interval):
+        self.object = object
+        self.cleanupMethod = cleanupMethod
+        self.checkMethod = checkMethod
+        self.base = interval           #: Interval after adding or a failure
+        self.interval = interval       #: Current interval, up to max_interval
+        self.max_interval = max(interval, max_interval or interval)
+        self.due = time.time() + interval
+        self.queued = False            #: Whether a check is queued or running
+        self.started = None            #: Start of the running check, if any
+        self.timed_out = False         #: Whether the running check timed out
+        self.removed = False
+
+    def __getitem__(self, i):
+        return (self.object, self.cleanupMethod, self.checkMethod)[i]
+
+    def __str__(self):
+        return str(self.object)
+
 class Resources:
     """
     Container class for storing resources which should be
     cleaned up on close and periodically checked. Use
-    stop_event.set() to stop the internal thread.
+    stop_event.set() to stop the internal threads.
+
+    Checks are run by up to "threads" worker threads, so that one
+    slow check does not hold up the others. Each object is checked
+    every "interval" seconds (sleeptime by default). If max_interval
+    is larger, the interval doubles after every successful check up to
+    that value. A failed check is immediately retried "retries" times
+    before the object is cleaned up and removed. A check still running
+    after "timeout" seconds is logged and another worker takes the place
+    of the one running it; the object is next checked once that call
+    returns. Counts and timings are available from stats().
     """
 
-    def __init__(self, sleeptime = 60, stop_event = None):
+    def __init__(self, sleeptime = 60, stop_event = None, threads = 4,\
+        timeout = None, max_interval = None, retries = 1):
         """
         Add resources via add(object). They should have a no-arg cleanup()
         and a check() method.
@@ -556,6 +594,7 @@ class Resources:
         self.stuff = []
         self._lock = threading.RLock()
         self.logger = logging.getLogger("omero.util.Resources")
+        self.wakeup = threading.Event() #: Set when a check is due earlier
         self.stop_event = stop_event
         if not self.stop_event:
             self.stop_event = omero.util.concurrency.get_event(name="Resources")
@@ -564,30 +603,43 @@ class Resources:
             raise exceptions.Exception("Sleep time should be greater than 5: %s" % sleeptime)
 
         self.sleeptime = sleeptime
+        self.threads = max(1, threads)
+        self.timeout = timeout is None and sleeptime or timeout
+        self.max_interval = max_interval #: None disables the backoff
+        self.retries = retries
+        self.poll = min(1.0, sleeptime) #: Longest wait of the scheduler
+        self.next_run = 0               #: When the scheduler next wakes up
+
+        self.queue = Queue.Queue()
+        self.workers = 0          #: Live worker threads
+        self.idle = 0             #: Workers waiting on the queue
+        self.abandoned = 0        #: Workers whose running check timed out
+        self.metrics = {"checks": 0, "failures": 0, "retries": 0,\
+            "timeouts": 0, "removed": 0, "time": 0.0, "max_time": 0.0}
 
         class Task(threading.Thread):
             """
-            Internal thread used for checking "stuff"
+            Internal thread used for scheduling checks of "stuff"
             """
             def run(self):
                 ctx = self.ctx # Outer class
                 ctx.logger.info("Starting")
                 while not ctx.stop_event.isSet():
+                    wait = ctx.poll
                     try:
-                        ctx.logger.debug("Executing")
                         copy = ctx.copyStuff()
-                        remove = ctx.checkAll(copy)
-                        ctx.removeAll(remove)
+                        wait = ctx.schedule(copy)
                     except:
                         ctx.logger.error("Exception during execution", exc_info = True)
 
-                    ctx.logger.debug("Sleeping %s" % ctx.sleeptime)
                     # ticket:1531 - Attempting to catch threading issues
                     try:
-                        ctx.stop_event.wait(ctx.sleeptime)
+                        ctx.wakeup.wait(wait)
+                        ctx.wakeup.clear()
                     except ValueError:
                         pass
 
+                ctx.stopWorkers()
                 if isinstance(ctx.stop_event, omero.util.concurrency.AtExitEvent):
                     if ctx.stop_event.atexit:
                         return # Skipping log. See #3260
@@ -606,10 +658,164 @@ class Resources:
         later, which may depend on earlier added entries
         get a chance to be cleaned up first.
         """
+        if self.stuff is None:
+            return []
         copy = list(self.stuff)
         copy.reverse()
         return copy
 
+    @locked
+    def schedule(self, copy):
+        """
+        Queues the checks which are due and notes those which have timed
+        out. Returns the number of seconds until the next check or timeout,
+        at most self.poll so that a set stop_event is noticed.
+        """
+        now = time.time()
+        wait = self.poll
+        for m in copy:
+            if not m.queued:
+                if m.due <= now:
+                    m.queued = True
+                    self.queue.put(m)
+                else:
+                    wait = min(wait, m.due - now)
+            elif m.started is not None and not m.timed_out:
+                if now - m.started > self.timeout:
+                    m.timed_out = True
+                    self.abandoned += 1
+                    self.metrics["timeouts"] += 1
+                    self.logger.warn("Check of %s running for %.1fs", m, now - m.started)
+                else:
+                    wait = min(wait, m.started + self.timeout - now)
+        self.spawn()
+        wait = max(wait, 0.01)
+        self.next_run = now + wait
+        return wait
+
+    @locked
+    def spawn(self):
+        """
+        Starts workers while checks are waiting for one, keeping at most
+        self.threads workers whose check has not timed out.
+        """
+        while self.queue.qsize() > self.idle and \
+                self.workers - self.abandoned < self.threads:
+            self.workers += 1
+            self.idle += 1
+            worker = threading.Thread(target = self.work, name = "Resources-%s" % self.workers)
+            worker.setDaemon(True)
+            worker.start()
+
+    def work(self):
+        """
+        Body of the worker threads: runs checks from the queue until
+        stopWorkers() is called, or exits after a check which timed out
+        since another worker has taken its place.
+        """
+        while True:
+            m = self.queue.get()
+            self._lock.acquire()
+            try:
+                self.idle -= 1
+                if m is None:
+                    self.workers -= 1
+                    return
+            finally:
+                self._lock.release()
+            timed_out = self.checkOne(m)
+            self._lock.acquire()
+            try:
+                if timed_out:
+                    self.workers -= 1
+                    return
+                self.idle += 1
+            finally:
+                self._lock.release()
+
+    @locked
+    def stopWorkers(self):
+        for i in range(self.workers):
+            self.queue.put(None)
+
+    def checkOne(self, m):
+        """
+        Calls the check method of the entry, retrying a failed check up
+        to self.retries times, and then reschedules or removes it.
+        Returns True if the check timed out.
+        """
+        self._lock.acquire()
+        m.started = time.time()
+        self._lock.release()
+
+        rv = None
+        attempt = 0
+        while attempt <= self.retries:
+            if self.stop_event.isSet() or m.removed:
+                break # Let cleanup handle this
+            if attempt:
+                self.logger.debug("Re-checking %s" % m)
+            else:
+                self.logger.debug("Checking %s" % m)
+            method = getattr(m[0],m[2])
+            start = time.time()
+            try:
+                rv = method()
+            except:
+                self.logger.warn("Error from %s" % method, exc_info = True)
+            self.measure(time.time() - start, rv, attempt)
+            if rv:
+                break
+            attempt += 1
+
+        self._lock.acquire()
+        try:
+            timed_out = m.timed_out
+            if timed_out:
+                self.abandoned -= 1
+            m.queued = False
+            m.started = None
+            m.timed_out = False
+            if rv:
+                if attempt:
+                    m.interval = m.base
+                else:
+                    m.interval = min(m.interval * 2, m.max_interval)
+                m.due = time.time() + m.interval
+                if m.due < self.next_run:
+                    self.wakeup.set()
+            elif not (self.stop_event.isSet() or m.removed):
+                self.removeAll([m])
+        finally:
+            self._lock.release()
+        return timed_out
+
+    @locked
+    def measure(self, elapsed, rv, attempt = 0):
+        metrics = self.metrics
+        metrics["checks"] += 1
+        metrics["time"] += elapsed
+        metrics["max_time"] = max(metrics["max_time"], elapsed)
+        if attempt:
+            metrics["retries"] += 1
+        if not rv:
+            metrics["failures"] += 1
+
+    @locked
+    def stats(self):
+        """
+        Returns a dictionary of counts and timings of all checks so far:
+        checks, failures, retries, timeouts, removed, time (total
+        seconds), max_time and mean_time, as well as the number of
+        entries, running checks and worker threads.
+        """
+        rv = dict(self.metrics)
+        rv["mean_time"] = rv["checks"] and rv["time"] / rv["checks"] or 0.0
+        rv["entries"] = len(self.stuff or [])
+        rv["running"] = len([m for m in self.stuff or [] if m.started is not None])
+        rv["workers"] = self.workers
+        return rv
+
     # Not locked
     def checkAll(self, copy):
         """
@@ -645,20 +851,51 @@ class Resources:
         for r in remove:
             if self.stop_event.isSet():
                 return # Let cleanup handle this
+            if r.removed:
+                continue
             self.logger.debug("Removing %s" % r[0])
             self.safeClean(r)
+            r.removed = True
             self.stuff.remove(r)
+            self.metrics["removed"] += 1
 
     @locked
-    def add(self, object, cleanupMethod = "cleanup", checkMethod = "check"):
-        entry = (object,cleanupMethod,checkMethod)
+    def add(self, object, cleanupMethod = "cleanup", checkMethod = "check",\
+        interval = None, max_interval = None):
+        """
+        Registers object, to be checked every interval seconds, backing
+        off to max_interval. Both default to the values of this instance.
+        """
+        if interval is None:
+            interval = self.sleeptime
+        if max_interval is None:
+            max_interval = self.max_interval
+        entry = ResourceEntry(object, cleanupMethod, checkMethod, interval, max_interval)
         self.logger.debug("Adding object %s" % object)
         self.stuff.append(entry)
+        if entry.due < self.next_run:
+            self.wakeup.set()
+
+    @locked
+    def remove(self, object):
+        """
+        Unregisters object without calling its cleanup method. Returns
+        True if it was found.
+        """
+        found = False
+        for m in list(self.stuff or []):
+            if m.object is object:
+                m.removed = True
+                self.stuff.remove(m)
+                found = True
+        return found
 
     @locked
     def cleanup(self):
         self.stop_event.set()
-        for m in self.stuff:
+        self.wakeup.set()
+        for m in self.stuff or []:
+            m.removed = True
             self.safeClean(m)
         self.stuff = None
         self.logger.debug("Cleanup done")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Glencoe Software, Inc.  All Rights Reserved.
+# Use is subject to license terms supplied in LICENSE.txt
+#
+"""
+Uploads many local files to the server at once.
+
+Where omero.clients.BaseClient.upload() reads every file twice (once to
+calculate its sha1 and once to transfer it), creates a RawFileStore per
+file and saves each OriginalFile separately, BatchUploader:
+
+ * creates all OriginalFile rows with a single saveAndReturnArray() call,
+ * transfers the files concurrently over a small pool of RawFileStore
+   proxies, each of which is reused for several files, and
+ * calculates the sha1 of each file while it is being sent, checking it
+   against the sha1 calculated by the server when the file is saved.
+"""
+
+import os
+import time
+import logging
+import threading
+
+import omero
+import omero.rtypes
+
+from Queue import Queue, Empty
+from path import path
+
+try:
+    from hashlib import sha1 as sha_new
+except ImportError:
+    from sha import new as sha_new
+
+# Number of RawFileStore proxies used concurrently
+DEFAULT_THREADS = 4
+
+# Size of each write() to the server
+DEFAULT_BLOCK_SIZE = 1024*1024
+
+
+class UploadResult(object):
+    """
+    Outcome of uploading a single file: the saved OriginalFile and, if the
+    transfer failed, the exception raised.
+    """
+
+    def __init__(self, filename, ofile):
+        self.filename = filename
+        self.ofile = ofile
+        self.size = ofile.size.val
+        self.sha1 = None
+        self.error = None
+
+
+class BatchUploader(object):
+    """
+    Uploads a list of files using the given service factory. After
+    upload() has returned, bytes and elapsed hold the totals of the run.
+    """
+
+    def __init__(self, sf, threads = DEFAULT_THREADS,
+                 block_size = DEFAULT_BLOCK_SIZE):
+        if threads < 1:
+            raise ValueError("threads must be positive: %s" % threads)
+        self.logger = logging.getLogger("omero.util.BatchUploader")
+        self.sf = sf
+        self.threads = threads
+        self.block_size = block_size
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def prepare(self, filename, type = None):
+        """
+        Returns an unsaved OriginalFile for the given local file,
+        filled in the same way as BaseClient.upload(). The sha1 is only
+        known once the file has been transferred; until then the sha1 of
+        the empty string is used, which is correct for empty files.
+        """
+        if not os.path.exists(filename):
+            raise omero.ClientError("File does not exist: " + filename)
+        abspath = path(filename).normpath().abspath()
+        ofile = omero.model.OriginalFileI()
+        ofile.size = omero.rtypes.rlong(os.path.getsize(filename))
+        ofile.sha1 = omero.rtypes.rstring(sha_new().hexdigest())
+        ofile.name = omero.rtypes.rstring(str(abspath.basename()))
+        ofile.path = omero.rtypes.rstring(str(abspath.dirname())+os.path.sep)
+        if type:
+            ofile.mimetype = omero.rtypes.rstring(type)
+        return ofile
+
+    def upload(self, files):
+        """
+        Uploads files, a list of (filename, mimetype) pairs where mimetype
+        may be None, returning an UploadResult per file in the same order.
+        Failed transfers are reported via UploadResult.error rather than
+        raised so that one bad file does not abort the whole batch.
+        """
+        start = time.time()
+        self.bytes = 0
+        ofiles = [self.prepare(filename, type) for filename, type in files]
+        if not ofiles:
+            return []
+        ofiles = self.sf.getUpdateService().saveAndReturnArray(ofiles)
+        results = [UploadResult(f[0], o) for f, o in zip(files, ofiles)]
+
+        queue = Queue()
+        for result in results:
+            queue.put(result)
+        workers = []
+        for i in range(min(self.threads, len(results))):
+            t = threading.Thread(target=self._work, args=(queue,),
+                                 name="BatchUploader-%s" % i)
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+
+        self.elapsed = time.time() - start
+        return results
+
+    def throughput(self):
+        """
+        Bytes per second transferred in the last run.
+        """
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes / self.elapsed
+
+    def _work(self, queue):
+        prx = None
+        try:
+            while True:
+                try:
+                    result = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    if prx is None:
+                        prx = self.sf.createRawFileStore()
+                    self._transfer(prx, result)
+                except Exception, e:
+                    self.logger.error("Failed to upload %s",
+                                      result.filename, exc_info=True)
+                    result.error = e
+                    # The proxy may be unusable; start again with a new one.
+                    self._close(prx)
+                    prx = None
+        finally:
+            self._close(prx)
+
+    def _transfer(self, prx, result):
+        """
+        Sends a single file, hashing each block as it is written.
+        """
+        digest = sha_new()
+        file = open(result.filename, 'rb')
+        try:
+            prx.setFileId(result.ofile.id.val)
+            prx.truncate(result.size) # ticket:2337
+            offset = 0
+            while True:
+                block = file.read(self.block_size)
+                if not block:
+                    break
+                digest.update(block)
+                prx.write(block, offset, len(block))
+                offset += len(block)
+                self.lock.acquire()
+                try:
+                    self.bytes += len(block)
+                finally:
+                    self.lock.release()
+        finally:
+            file.close()
+        result.sha1 = digest.hexdigest()
+        saved = prx.save()
+        if saved is not None:
+            result.ofile = saved
+            if saved.sha1.val != result.sha1:
+                raise omero.ClientError("sha1 mismatch for %s: %s != %s" % \
+                    (result.filename, result.sha1, saved.sha1.val))
+
+    def _close(self, prx):
+        if prx is not None:
+            try:
+                prx.close()
+            except Exception, e:
+                self.logger.warn("Failed to close RawFileStore: %s", e)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Columnar accumulation of OMERO.tables data and incremental table writes.
+"""
+
+#
+#  Copyright (C) 2011 University of Dundee. All rights reserved.
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import copy
+import time
+import array
+import logging
+
+from omero.grid import BoolColumn, DoubleColumn, FileColumn, ImageColumn, \
+                       LongColumn, PlateColumn, RoiColumn, WellColumn
+
+log = logging.getLogger("omero.util.columnar")
+
+# Number of rows sent to the table per addData() call
+DEFAULT_BATCH_SIZE = 10000
+
+def _long_typecode():
+    """
+    Returns the array typecode for a 64-bit signed integer or None if the
+    platform's array module has none (e.g. 'l' is 32-bit on Windows).
+    """
+    for typecode in ('l', 'q'):
+        try:
+            if array.array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+LONG_TYPECODE = _long_typecode()
+
+# Ordered so that subclasses are matched before their parents
+TYPECODES = (
+    (DoubleColumn, 'd'),
+    (BoolColumn, 'b'),
+    (FileColumn, LONG_TYPECODE),
+    (ImageColumn, LONG_TYPECODE),
+    (LongColumn, LONG_TYPECODE),
+    (PlateColumn, LONG_TYPECODE),
+    (RoiColumn, LONG_TYPECODE),
+    (WellColumn, LONG_TYPECODE),
+)
+
+def typecode_for(column):
+    """
+    Returns the array typecode used to buffer the values of a column or None
+    if the column's values have to be kept in a Python list.
+    """
+    for klass, typecode in TYPECODES:
+        if isinstance(column, klass):
+            return typecode
+    return None
+
+def buffered(column):
+    """
+    Replaces the values of an omero.grid column with a typed buffer of the
+    same content and returns the column. Numeric columns are backed by an
+    array.array which holds 8 bytes per value rather than a full Python
+    object; all other columns keep a list. The buffer supports the list
+    operations used by the populate scripts (append, extend, len() and
+    indexing).
+    """
+    typecode = typecode_for(column)
+    values = column.values
+    if values is None:
+        values = list()
+    if typecode is None:
+        column.values = list(values)
+    else:
+        column.values = array.array(typecode, values)
+    return column
+
+def values_slice(column, start, stop):
+    """
+    Returns the values of a column between start and stop as a list, which
+    is what the Ice mapping of omero.grid columns expects.
+    """
+    values = column.values[start:stop]
+    if isinstance(values, array.array):
+        return values.tolist()
+    return list(values)
+
+def empty_copy(column):
+    """
+    Returns a shallow copy of a column without values, suitable for
+    Table.initialize() which only requires the column definitions.
+    """
+    definition = copy.copy(column)
+    definition.values = list()
+    return definition
+
+class TableCheckpoint(object):
+    """
+    Records the OriginalFile id of a table being written and the number of
+    rows which have been committed to it in a small local file, so that an
+    interrupted population can be resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        Returns a tuple of (table OriginalFile id, committed rows) or None
+        if there is no checkpoint.
+        """
+        if not os.path.exists(self.path):
+            return None
+        f = open(self.path, 'r')
+        try:
+            file_id, committed = f.read().split()
+        finally:
+            f.close()
+        return long(file_id), long(committed)
+
+    def save(self, file_id, committed):
+        """Atomically replaces the checkpoint."""
+        tmp = '%s.tmp' % self.path
+        f = open(tmp, 'w')
+        try:
+            f.write('%d %d\n' % (file_id, committed))
+        finally:
+            f.close()
+        if os.path.exists(self.path):
+            # os.rename() does not overwrite on Windows
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class TableWriter(object):
+    """
+    Writes a set of buffered columns to an OMERO.tables instance in fixed
+    size row batches via addData(), keeping track of the last committed row.
+    If a batch fails, write() may be called again (in this process or, with a
+    TableCheckpoint, in a new one after resume()) and continues from the last
+    committed row rather than from the start.
+
+    Rows may also be written while they are still being appended to the
+    columns: flush() writes each full batch of rows and discard() then drops
+    the committed rows from the buffers. Row numbers count discarded rows.
+    """
+
+    def __init__(self, table, columns, batch_size=DEFAULT_BATCH_SIZE,
+                 checkpoint=None):
+        if batch_size < 1:
+            raise ValueError('Batch size must be positive: %s' % batch_size)
+        self.table = table
+        self.columns = columns
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.committed = 0
+        self.file_id = None
+        # Number of rows dropped from the front of the buffers by discard()
+        self.offset = 0
+
+    def get_row_count(self):
+        """Returns the number of rows appended, including discarded ones."""
+        if not self.columns:
+            return 0
+        return self.offset + len(self.columns[0].values)
+
+    def get_complete_row_count(self):
+        """
+        Returns the number of rows appended to every column, including
+        discarded ones.
+        """
+        if not self.columns:
+            return 0
+        return self.offset + min([len(c.values) for c in self.columns])
+
+    def initialize(self):
+        """Initializes the table with the column definitions only."""
+        self.table.initialize([empty_copy(c) for c in self.columns])
+        self.file_id = self.table.getOriginalFile().id.val
+        self.committed = 0
+        self._checkpoint()
+
+    def resume(self):
+        """
+        Resumes writing to an already initialized table. The table itself
+        is the authority on how many rows have been committed since a
+        checkpoint may lag behind the last successful addData().
+        """
+        self.file_id = self.table.getOriginalFile().id.val
+        self.committed = self.table.getNumberOfRows()
+        log.info('Resuming OriginalFile:%d at row %d' % \
+                (self.file_id, self.committed))
+        self._checkpoint()
+
+    def write(self):
+        """
+        Writes all buffered rows which have not yet been committed. Returns
+        the number of rows written.
+        """
+        total = self.get_row_count()
+        if self.committed > total:
+            raise ValueError('Table has %d rows, only %d buffered!' % \
+                    (self.committed, total))
+        return self._write(total)
+
+    def flush(self):
+        """
+        Writes the full batches of the rows appended to every column which
+        have not yet been committed, leaving any remainder for a later
+        flush() or write(). Rows which were committed before a resume() are
+        skipped. Returns the number of rows written.
+        """
+        total = self.get_complete_row_count()
+        if self.committed >= total:
+            return 0
+        return self._write(total - (total - self.committed) % self.batch_size)
+
+    def discard(self):
+        """
+        Drops the committed rows from the front of the buffers, bounding
+        the memory held while rows are appended and flushed.
+        """
+        n = min(self.committed, self.get_complete_row_count()) - self.offset
+        if n > 0:
+            for column in self.columns:
+                del column.values[:n]
+            self.offset += n
+
+    def _write(self, total):
+        start = self.committed
+        while self.committed < total:
+            stop = min(self.committed + self.batch_size, total)
+            t0 = int(time.time() * 1000)
+            self.table.addData([self.slice(c, self.committed - self.offset,
+                                           stop - self.offset)
+                                for c in self.columns])
+            log.debug('Rows %d-%d added in %sms' % \
+                    (self.committed, stop, int(time.time() * 1000) - t0))
+            self.committed = stop
+            self._checkpoint()
+        return self.committed - start
+
+    def slice(self, column, start, stop):
+        """Returns a copy of a column holding only the rows in range."""
+        batch = copy.copy(column)
+        batch.values = values_slice(column, start, stop)
+        return batch
+
+    def finish(self):
+        """Removes the checkpoint once the table is complete."""
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+
+    def _checkpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.file_id, self.committed)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Glencoe Software, Inc.  All Rights Reserved.
+# Use is subject to license terms supplied in LICENSE.txt
+#
+"""
+Decay models and a block fitting engine for FLIM data.
+
+cexp_1/cexp_2 and err_1/err_2 are the single and double exponential
+models (convolved with the instrument response function) and their mpfit
+wrappers, as used by flim-omero.py to fit one pixel at a time.
+
+DecayModel fits the same models to a block of pixels at once: since the
+models are linear in their amplitudes, the convolution with the IRF is a
+fixed matrix which is built once per model and applied to every pixel in
+a single dot(), and the Levenberg-Marquardt steps of all the pixels in a
+block are taken together using the analytic Jacobian. fit_pixels() splits
+an image into such blocks and spreads them over a multiprocessing pool.
+
+    model = DecayModel(a_tp, mode, seed)
+    params, fnorm, status = fit_pixels(rawdata, pixels, model, processes=4)
+"""
+
+import logging
+import multiprocessing
+
+import numpy as npy
+
+# eps (epsilon) is a magic small number to avoid getting division by zero
+# warnings from the mpfit calls
+eps = 0.000000001
+
+# Number of pixels fitted together
+DEFAULT_BLOCK_SIZE = 512
+
+# Status codes, as returned by mpfit
+STATUS_FTOL = 1
+STATUS_XTOL = 2
+STATUS_MAXITER = 5
+
+# Single exponential decay function convolved with irf
+cexp_1 = lambda p,x,i: npy.convolve(p[0]*npy.e**(-x/(p[1]+eps))+p[2],i[::-1],mode=2)
+
+# Single exponential decay function wrapped for calling by mpfit
+def err_1(p,fjac=None,x=None,y=None,err=None,i=None,sh=None,sm=None,lf=None):
+    err=None
+    model = cexp_1(p,x,i)
+    status = 0
+    if err==None:
+        return [status, (y[sm:lf]-model[sm+sh:sh+lf])]
+    else:
+        return [status, (y[sm:lf]-model[sm+sh:sh+lf])/err[sm:lf]]
+
+# Double exponential decay function convolved with irf
+cexp_2 = lambda p,x,i: npy.convolve(p[0]*npy.e**(-x/(p[1]+eps))+p[3]*npy.e**(-x/(p[4]+eps))+p[2],i[::-1],mode=2)
+
+# Double exponential decay function wrapped for calling by mpfit
+def err_2(p,fjac=None,x=None,y=None,err=None,i=None,sh=None,sm=None,lf=None):
+    err=None
+    model = cexp_2(p,x,i)
+    status = 0
+    if err==None:
+        return [status, (y[sm:lf]-model[sm+sh:sh+lf])]
+    else:
+        return [status, (y[sm:lf]-model[sm+sh:sh+lf])/err[sm:lf]]
+
+
+def padded_axes(a_tp):
+    """
+    Returns the 2n long time points and instrument response function used
+    for the convolution of the models, from the n x 2 array a_tp of time
+    points and IRF values.
+    """
+    i_slice = len(a_tp)
+    tp = npy.zeros(i_slice*2)
+    irf = npy.zeros(i_slice*2)
+    tp[0:i_slice] = a_tp[0:i_slice,0]
+    irf[int(i_slice*0.5):int(i_slice*1.5)] = a_tp[0:i_slice,1]
+    # Fill up time points missing time points
+    textra = npy.array(range(i_slice),npy.float)
+    textra += 1.0
+    textra *= float(tp[2]-tp[1])
+    textra += tp[i_slice-1]
+    tp[i_slice:] = textra
+    return tp, irf
+
+
+def neighbourhood_signals(rawdata, i_res, pixels):
+    """
+    Returns the m x t decay curves for the m (row, column) pixels, each
+    averaged over the 2x2 neighbourhood ending at the pixel as in the
+    per-pixel fit of flim-omero.py. rawdata is t x (i_res*i_res).
+    """
+    data = npy.asarray(rawdata, npy.float).reshape((-1, i_res, i_res))
+    pixels = npy.asarray(pixels).reshape((-1, 2))
+    r = pixels[:,0]
+    c = pixels[:,1]
+    s = data[:,r-1,c-1] + data[:,r-1,c] + data[:,r,c-1] + data[:,r,c]
+    return (s / 4.0).T
+
+
+def _solve(a, b):
+    """
+    Solves the m small symmetric positive definite systems a[k] x = b[k]
+    by Gaussian elimination vectorized over k.
+    """
+    a = a.copy()
+    b = b.copy()
+    n = a.shape[1]
+    for i in range(n):
+        pivot = a[:,i,i]
+        pivot = npy.where(npy.abs(pivot) < 1e-300, 1e-300, pivot)
+        for j in range(i+1, n):
+            f = a[:,j,i] / pivot
+            a[:,j,i:] -= f[:,npy.newaxis] * a[:,i,i:]
+            b[:,j] -= f * b[:,i]
+    x = npy.zeros(b.shape)
+    for i in range(n-1, -1, -1):
+        pivot = a[:,i,i]
+        pivot = npy.where(npy.abs(pivot) < 1e-300, 1e-300, pivot)
+        x[:,i] = (b[:,i] - (a[:,i,i+1:] * x[:,i+1:]).sum(axis=1)) / pivot
+    return x
+
+
+class DecayModel(object):
+    """
+    The mode 1 (single exponential) or mode 2 (double exponential, with
+    the second lifetime fixed) model for the time points and IRF in a_tp,
+    aligned using the peak and shift of the seed parameters as returned
+    by procFitIt: [params..., smax, shift].
+
+    All pixels share the time points, IRF and alignment, so the
+    convolution matrix and the convolved background are calculated once
+    here and reused for every block.
+    """
+
+    def __init__(self, a_tp, mode, seed):
+        seed = npy.asarray(seed, npy.float)
+        self.mode = mode
+        self.n = len(a_tp)
+        self.tp, self.irf = padded_axes(a_tp)
+        self.smax = int(seed[-2])
+        self.shift = int(seed[-1])
+        if mode > 1:
+            self.nparams = 5
+            self.free = [0, 1, 2, 3]
+        else:
+            self.nparams = 3
+            self.free = [0, 1, 2]
+        self.seed = seed[:self.nparams]
+
+        # Same slices as err_1 and err_2 on the 2n long signal and the
+        # 4n-1 long full convolution.
+        length = len(self.tp)
+        sm, sh, lf = self.smax, self.shift, self.n
+        self.ywin = npy.arange(length)[sm:lf]
+        mwin = npy.arange(2*length-1)[sm+sh:sh+lf]
+        if len(self.ywin) != len(mwin):
+            raise ValueError("Signal and model windows differ: %s != %s" % \
+                (len(self.ywin), len(mwin)))
+
+        # full[j] = sum_i f[i] * irf[::-1][j-i], restricted to the window
+        k = self.irf[::-1]
+        lag = mwin[npy.newaxis,:] - npy.arange(length)[:,npy.newaxis]
+        valid = (lag >= 0) & (lag < length)
+        self.conv = npy.where(valid, k[npy.clip(lag, 0, length-1)], 0.0)
+        self.background = self.conv.sum(axis=0)
+        self.seed_model = self.evaluate(self.seed[npy.newaxis,:])[0][0]
+
+    def window(self, signals):
+        """
+        Returns the part of each m x n signal compared against the model.
+        """
+        signals = npy.asarray(signals, npy.float)
+        y = npy.zeros((len(signals), len(self.tp)))
+        y[:,:self.n] = signals[:,:self.n]
+        return y[:,self.ywin]
+
+    def evaluate(self, p, jacobian=False):
+        """
+        Returns the windowed model for the m x nparams parameters and, if
+        requested, its m x w x len(free) derivatives.
+        """
+        tau1 = p[:,1:2] + eps
+        e1 = npy.exp(-self.tp / tau1)
+        c1 = npy.dot(e1, self.conv)
+        model = p[:,0:1] * c1 + p[:,2:3] * self.background
+        if self.mode > 1:
+            c2 = npy.dot(npy.exp(-self.tp / (p[:,4:5] + eps)), self.conv)
+            model += p[:,3:4] * c2
+        if not jacobian:
+            return model, None
+        jac = npy.empty(model.shape + (len(self.free),))
+        jac[:,:,0] = c1
+        jac[:,:,1] = p[:,0:1] * npy.dot(e1 * self.tp / tau1**2, self.conv)
+        jac[:,:,2] = self.background
+        if self.mode > 1:
+            jac[:,:,3] = c2
+        return model, jac
+
+    def initial(self, y):
+        """
+        Seeds each pixel from the segmentation mean fit, scaling the
+        amplitudes (in which the model is linear) to the pixel's signal.
+        """
+        p = npy.repeat(self.seed[npy.newaxis,:], len(y), axis=0)
+        total = self.seed_model.sum()
+        if total > 0:
+            scale = y.sum(axis=1) / total
+            scale = npy.where(scale > 0, scale, 1.0)
+            for i in (0, 2, 3):
+                if i < self.nparams:
+                    p[:,i] *= scale
+        return p
+
+    def fit(self, signals, maxiter=200, ftol=1e-10):
+        """
+        Fits the m x n signals, returning the m x nparams parameters, the
+        chi-square of each fit and an mpfit-like status per pixel.
+        Parameters are bounded below by zero as in procFitIt.
+        """
+        y = self.window(signals)
+        m = len(y)
+        p = self.initial(y)
+        model, jac = self.evaluate(p)
+        chisq = ((y - model)**2).sum(axis=1)
+        status = npy.zeros(m, npy.int)
+        lam = npy.zeros(m) + 1e-3
+        free = self.free
+        d = npy.arange(len(free))
+        active = npy.arange(m)
+        for iteration in range(maxiter):
+            if not len(active):
+                break
+            pa = p[active]
+            ya = y[active]
+            ca = chisq[active]
+            la = lam[active]
+            model, jac = self.evaluate(pa, True)
+            r = ya - model
+            jtj = (jac[:,:,:,npy.newaxis] * jac[:,:,npy.newaxis,:]).sum(axis=1)
+            jtr = (jac * r[:,:,npy.newaxis]).sum(axis=1)
+            diag = jtj[:,d,d]
+            jtj[:,d,d] += la[:,npy.newaxis] * npy.maximum(diag, 1e-12)
+            step = _solve(jtj, jtr)
+
+            trial = pa.copy()
+            trial[:,free] = npy.maximum(pa[:,free] + step, 0.0)
+            tchisq = ((ya - self.evaluate(trial)[0])**2).sum(axis=1)
+            better = tchisq < ca
+            p[active[better]] = trial[better]
+            chisq[active[better]] = tchisq[better]
+            lam[active] = npy.where(better, la * 0.1, la * 10.0)
+
+            small = better & (ca - tchisq <= ftol * ca)
+            stuck = ~better & (la >= 1e16)
+            status[active[small]] = STATUS_FTOL
+            status[active[stuck]] = STATUS_XTOL
+            active = active[~(small | stuck)]
+        status[active] = STATUS_MAXITER
+        return p, chisq, status
+
+
+_worker_model = None
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+def _fit_block(signals):
+    return _worker_model.fit(signals)
+
+
+def fit_pixels(rawdata, pixels, model, i_res, processes=1,
+               block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Fits the decay curves of the given (row, column) pixels of rawdata
+    (t x i_res*i_res) in blocks of block_size, using a pool of processes
+    if processes is greater than one. Returns the parameters, chi-square
+    and status of each pixel in the order given.
+    """
+    log = logging.getLogger("omero.util.flim_fit")
+    signals = neighbourhood_signals(rawdata, i_res, pixels)
+    m = len(signals)
+    params = npy.zeros((m, model.nparams))
+    fnorm = npy.zeros(m)
+    status = npy.zeros(m, npy.int)
+    if not m:
+        return params, fnorm, status
+    starts = range(0, m, block_size)
+    blocks = [signals[s:s+block_size] for s in starts]
+    if processes > 1 and len(blocks) > 1:
+        pool = multiprocessing.Pool(processes, _init_worker, (model,))
+        try:
+            results = pool.map(_fit_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [model.fit(block) for block in blocks]
+    for s, (p, c, st) in zip(starts, results):
+        params[s:s+len(p)] = p
+        fnorm[s:s+len(p)] = c
+        status[s:s+len(p)] = st
+    log.debug("Fitted %s pixels in %s blocks", m, len(blocks))
+    return params, fnorm, status
@@ -599,7 +599,7 @@ class mpfit:
 				 damp=0., maxiter=200, factor=100., nprint=1,
 				 iterfunct='default', iterkw=None, nocovar=0,
 				 fastnorm=0, rescale=0, autoderivative=1, quiet=0,
-				 diag=None, epsfcn=None, debug=0):
+				 diag=None, epsfcn=None, debug=0, solver='minpack'):
 		"""
   Inputs:
 	fcn:
@@ -745,6 +745,15 @@ class mpfit:
 
 		Note: DAMP doesn't work with autoderivative=0
 
+	 solver:
+		Selects the implementation of the QR factorization of the jacobian
+		and of the damped least-squares solutions in the LM parameter search.
+		'minpack' uses the Python ports of the MINPACK routines QRFAC and
+		QRSOLV, with column pivoting.  'numpy' uses numpy.linalg.qr for both,
+		without pivoting, which is considerably faster when there are many
+		data points or parameters.
+		   Default: 'minpack'
+
 	 xtol:
 		A nonnegative input variable. Termination occurs when the relative error
 		between two consecutive iterates is at most xtol (and status is
@@ -861,16 +870,21 @@ class mpfit:
 		self.fastnorm = fastnorm
 		self.nfev = 0
 		self.damp = damp
+		self.solver = solver
 		self.machar = machar(double=1)
 		machep = self.machar.machep
 		self.dof=0
 
-		if (fcn==None):
+		if (fcn is None):
 			self.errmsg = "Usage: parms = mpfit('myfunt', ... )"
 			return
 
 		if (iterfunct == 'default'): iterfunct = self.defiter
 
+		if (solver not in ('minpack', 'numpy')):
+			self.errmsg = 'ERROR: SOLVER must be one of "minpack" or "numpy"'
+			return
+
 		## Parameter damping doesn't work when user is providing their own
 		## gradients.
 		if (self.damp != 0) and (autoderivative == 0):
@@ -878,12 +892,12 @@ class mpfit:
 			return
 
 		## Parameters can either be stored in parinfo, or x. x takes precedence if it exists
-		if (xall == None) and (parinfo == None):
+		if (xall is None) and (parinfo is None):
 			self.errmsg = 'ERROR: must pass parameters in P or PARINFO'
 			return
 
 		## Be sure that PARINFO is of the right type
-		if (parinfo != None):
+		if (parinfo is not None):
 			if (type(parinfo) != types.ListType):
 				self.errmsg = 'ERROR: PARINFO must be a list of dictionaries.'
 				return
@@ -891,15 +905,15 @@ class mpfit:
 				if (type(parinfo[0]) != types.DictionaryType):
 					self.errmsg = 'ERROR: PARINFO must be a list of dictionaries.'
 					return
-			if ((xall != None) and (len(xall) != len(parinfo))):
+			if ((xall is not None) and (len(xall) != len(parinfo))):
 				self.errmsg = 'ERROR: number of elements in PARINFO and P must agree'
 				return
 
 		## If the parameters were not specified at the command line, then
 		## extract them from PARINFO
-		if (xall == None):
+		if (xall is None):
 			xall = self.parinfo(parinfo, 'value')
-			if (xall == None):
+			if (xall is None):
 				self.errmsg = 'ERROR: either P or PARINFO(*)["value"] must be supplied.'
 				return
 
@@ -955,7 +969,7 @@ class mpfit:
 		## LIMITED parameters ?
 		limited = self.parinfo(parinfo, 'limited', default=[0,0], n=npar)
 		limits = self.parinfo(parinfo, 'limits', default=[0.,0.], n=npar)
-		if (limited != None) and (limits != None):
+		if (limited is not None) and (limits is not None):
 			## Error checking on limits in parinfo
 			wh = (nonzero((limited[:,0] & (xall < limits[:,0])) |
 								 (limited[:,1] & (xall > limits[:,1]))))[0]
@@ -1030,7 +1044,7 @@ class mpfit:
 			put(self.params, ifree, x)
 			if (self.qanytied): self.params = self.tie(self.params, ptied)
 
-			if (nprint > 0) and (iterfunct != None):
+			if (nprint > 0) and (iterfunct is not None):
 				if (((self.niter-1) % nprint) == 0):
 					mperr = 0
 					xnew0 = self.params.copy()
@@ -1039,7 +1053,7 @@ class mpfit:
 					status = iterfunct(fcn, self.params, self.niter, self.fnorm**2,
 					   functkw=functkw, parinfo=parinfo, quiet=quiet,
 					   dof=dof, **iterkw)
-					if (status != None): self.status = status
+					if (status is not None): self.status = status
 
 					## Check for user termination
 					if (self.status < 0):
@@ -1059,7 +1073,7 @@ class mpfit:
 						  epsfcn=epsfcn,
 						  autoderivative=autoderivative, dstep=dstep,
 						  functkw=functkw, ifree=ifree, xall=self.params)
-			if (fjac == None):
+			if (fjac is None):
 				self.errmsg = 'WARNING: premature termination by FDJAC2'
 				return
 
@@ -1083,7 +1097,10 @@ class mpfit:
 						if (sum0 < 0): fjac[:,whupeg[i]] = 0
 
 			## Compute the QR factorization of the jacobian
-			[fjac, ipvt, wa1, wa2] = self.qrfac(fjac, pivot=1)
+			if (self.solver == 'numpy'):
+				[fjac, ipvt, wa1, wa2, qtf] = self.qrfac_numpy(fjac, fvec)
+			else:
+				[fjac, ipvt, wa1, wa2] = self.qrfac(fjac, pivot=1)
 			
 			## On the first iteration if "diag" is unspecified, scale
 			## according to the norms of the columns of the initial jacobian
@@ -1101,27 +1118,28 @@ class mpfit:
 				delta = factor*xnorm
 				if (delta == 0.): delta = factor
 
-			## Form (q transpose)*fvec and store the first n components in qtf
-			catch_msg = 'forming (q transpose)*fvec'
-			wa4 = fvec.copy()
-			for j in range(n):
-				lj = ipvt[j]
-				temp3 = fjac[j,lj]
-				if (temp3 != 0):
-					fj = fjac[j:,lj]
-					wj = wa4[j:]
-					## *** optimization wa4(j:*)
-					wa4[j:] = wj - fj * sum(fj*wj) / temp3
-				fjac[j,lj] = wa1[j]
-				qtf[j] = wa4[j]
-			## From this point on, only the square matrix, consisting of the
-			## triangle of R, is needed.
-			fjac = fjac[0:n, 0:n]
-			fjac.shape = [n, n]
-			temp = fjac.copy()
-			for i in range(n):
-				temp[:,i] = fjac[:, ipvt[i]]
-			fjac = temp.copy()
+			if (self.solver != 'numpy'):
+				## Form (q transpose)*fvec and store the first n components in qtf
+				catch_msg = 'forming (q transpose)*fvec'
+				wa4 = fvec.copy()
+				for j in range(n):
+					lj = ipvt[j]
+					temp3 = fjac[j,lj]
+					if (temp3 != 0):
+						fj = fjac[j:,lj]
+						wj = wa4[j:]
+						## *** optimization wa4(j:*)
+						wa4[j:] = wj - fj * sum(fj*wj) / temp3
+					fjac[j,lj] = wa1[j]
+					qtf[j] = wa4[j]
+				## From this point on, only the square matrix, consisting of the
+				## triangle of R, is needed.
+				fjac = fjac[0:n, 0:n]
+				fjac.shape = [n, n]
+				temp = fjac.copy()
+				for i in range(n):
+					temp[:,i] = fjac[:, ipvt[i]]
+				fjac = temp.copy()
 
 			## Check for overflow.  This should be a cheap test here since FJAC
 			## has been reduced to a (small) square matrix, and the test is
@@ -1328,15 +1346,15 @@ class mpfit:
 			catch_msg = 'in the termination phase'
 			self.fnorm = self.enorm(fvec)
 
-		if ((self.fnorm != None) and (fnorm1 != None)):
+		if ((self.fnorm is not None) and (fnorm1 is not None)):
 			self.fnorm = numpy.max([self.fnorm, fnorm1])
 			self.fnorm = self.fnorm**2.
 
 		self.covar = None
 		self.perror = None
 		## (very carefully) set the covariance matrix COVAR
-		if ((self.status > 0) and (nocovar==0) and (n != None)
-					   and (fjac != None) and (ipvt != None)):
+		if ((self.status > 0) and (nocovar==0) and (n is not None)
+					   and (fjac is not None) and (ipvt is not None)):
 			sz = shape(fjac)
 			if ((n > 0) and (sz[0] >= n) and (sz[1] >= n)
 				and (len(ipvt) >= n)):
@@ -1385,7 +1403,7 @@ class mpfit:
 
 		if (self.debug): print 'Entering defiter...'
 		if (quiet): return
-		if (fnorm == None):
+		if (fnorm is None):
 			[status, fvec] = self.call(fcn, x, functkw)
 			fnorm = self.enorm(fvec)**2
 
@@ -1393,11 +1411,11 @@ class mpfit:
 		nprint = len(x)
 		print "Iter ", ('%6i' % iter),"   CHI-SQUARE = ",('%.10g' % fnorm)," DOF = ", ('%i' % dof)
 		for i in range(nprint):
-			if (parinfo != None) and (parinfo[i].has_key('parname')):
+			if (parinfo is not None) and (parinfo[i].has_key('parname')):
 				p = '   ' + parinfo[i]['parname'] + ' = '
 			else:
 				p = '   P' + str(i) + ' = '
-			if (parinfo != None) and (parinfo[i].has_key('mpprint')):
+			if (parinfo is not None) and (parinfo[i].has_key('mpprint')):
 				iprint = parinfo[i]['mpprint']
 			else:
 				iprint = 1
@@ -1425,13 +1443,13 @@ class mpfit:
 	## Procedure to parse the parameter values in PARINFO, which is a list of dictionaries
 	def parinfo(self, parinfo=None, key='a', default=None, n=0):
 		if (self.debug): print 'Entering parinfo...'
-		if (n == 0) and (parinfo != None): n = len(parinfo)
+		if (n == 0) and (parinfo is not None): n = len(parinfo)
 		if (n == 0):
 			values = default
 			return(values)
 		values = []
 		for i in range(n):
-			if ((parinfo != None) and (parinfo[i].has_key(key))):
+			if ((parinfo is not None) and (parinfo[i].has_key(key))):
 				values.append(parinfo[i][key])
 			else:
 				values.append(default)
@@ -1451,8 +1469,11 @@ class mpfit:
 		if (self.debug): print 'Entering call...'
 		if (self.qanytied): x = self.tie(x, self.ptied)
 		self.nfev = self.nfev + 1
-		if (fjac == None):
-			[status, f] = fcn(x, fjac=fjac, **functkw)
+		if (fjac is None):
+			## Functions providing analytical derivatives may also return
+			## their (None) derivative array when none are requested
+			result = fcn(x, fjac=fjac, **functkw)
+			status, f = result[0], result[1]
 			if (self.damp > 0):
 				## Apply the damping if requested.  This replaces the residuals
 				## with their hyperbolic tangent.  Thus residuals larger than
@@ -1500,10 +1521,10 @@ class mpfit:
 
 		if (self.debug): print 'Entering fdjac2...'
 		machep = self.machar.machep
-		if epsfcn == None:  epsfcn = machep
-		if xall == None:	xall = x
-		if ifree == None:   ifree = arange(len(xall))
-		if step == None:	step = x * 0.
+		if epsfcn is None:  epsfcn = machep
+		if xall is None:	xall = x
+		if ifree is None:   ifree = arange(len(xall))
+		if step is None:	step = x * 0.
 		nall = len(xall)
 
 		eps = sqrt(numpy.max([epsfcn, machep]))
@@ -1514,23 +1535,32 @@ class mpfit:
 		if (autoderivative == 0):
 			mperr = 0
 			fjac = zeros(nall, dtype=float)
-			Put(fjac, ifree, 1.0)  ## Specify which parameters need derivatives
-			[status, fp] = self.call(fcn, xall, functkw, fjac=fjac)
+			put(fjac, ifree, 1.0)  ## Specify which parameters need derivatives
+			result = self.call(fcn, xall, functkw, fjac=fjac)
+			if (result[0] < 0):
+				self.status = result[0]
+				return(None)
+			if (len(result) < 3) or (result[2] is None):
+				print 'ERROR: Derivative matrix was not returned.'
+				self.status = 0
+				return(None)
+			[status, fp, pderiv] = result[0:3]
 
-			if len(fjac) != m*nall:
+			pderiv = asarray(pderiv, float)
+			if pderiv.size != m*nall:
 				print 'ERROR: Derivative matrix was not computed properly.'
+				self.status = 0
 				return(None)
 
 			## This definition is consistent with CURVEFIT
 			## Sign error found (thanks Jesus Fernandez <fernande@irm.chu-caen.fr>)
-			fjac.shape = [m,nall]
-			fjac = -fjac
+			fjac = -reshape(pderiv, [m,nall])
 
 			## Select only the free parameters
 			if len(ifree) < nall:
 				fjac = fjac[:,ifree]
 				fjac.shape = [m, n]
-				return(fjac)
+			return(fjac)
 
 		fjac = zeros([m, n], dtype=float)
 
@@ -1538,7 +1568,7 @@ class mpfit:
 
 		## if STEP is given, use that
 		## STEP includes the fixed parameters
-		if step != None:
+		if step is not None:
 			stepi = take(step, ifree)
 			wh = (nonzero(stepi > 0))[0]
 			if (len(wh) > 0): put(h, wh, take(stepi, wh))
@@ -1568,7 +1598,9 @@ class mpfit:
 			xp = xall.copy()
 			xp[ifree[j]] = xp[ifree[j]] + h[j]
 			[status, fp] = self.call(fcn, xp, functkw)
-			if (status < 0): return(None)
+			if (status < 0):
+				self.status = status
+				return(None)
 
 			if abs(dside[ifree[j]]) <= 1:
 				## COMPUTE THE ONE-SIDED DERIVATIVE
@@ -1581,7 +1613,9 @@ class mpfit:
 
 				mperr = 0
 				[status, fm] = self.call(fcn, xp, functkw)
-				if (status < 0): return(None)
+				if (status < 0):
+					self.status = status
+					return(None)
 
 				## Note optimization fjac(0:*,j)
 				fjac[0:,j] = (fp-fm)/(2*h[j])
@@ -1876,6 +1910,8 @@ class mpfit:
 	
 	def qrsolv(self, r, ipvt, diag, qtb, sdiag):
 		if (self.debug): print 'Entering qrsolv...'
+		if (self.solver == 'numpy'):
+			return(self.qrsolv_numpy(r, ipvt, diag, qtb, sdiag))
 		sz = shape(r)
 		m = sz[0]
 		n = sz[1]
@@ -1885,7 +1921,7 @@ class mpfit:
 
 		for j in range(n):
 			r[j:n,j] = r[j,j:n]
-		x = diagonal(r)
+		x = diagonal(r).copy()
 		wa = qtb.copy()
 
 		## Eliminate the diagonal matrix d using a givens rotation
@@ -2151,10 +2187,62 @@ class mpfit:
 		return[r, par, x, sdiag]
 
 	
+	## numpy.linalg equivalents of QRFAC (followed by the formation of
+	## (q transpose)*fvec) and QRSOLV.
+	##
+	## Rather than pivoting at each step as QRFAC does, the columns are
+	## ordered by decreasing norm before the factorization, which moves
+	## vanishing derivatives to the end.  qrfac_numpy returns R of the
+	## permuted jacobian in the full upper triangle, with its diagonal, as
+	## the outer loop expects after reducing the factored jacobian.
+	def qrfac_numpy(self, a, fvec):
+		if (self.debug): print 'Entering qrfac_numpy...'
+		n = shape(a)[1]
+		acnorm = sqrt(sum(a*a, axis=0))
+		ipvt = argsort(-acnorm, kind='mergesort')
+		q, r = numpy.linalg.qr(take(a, ipvt, axis=1))
+		qtf = dot(transpose(q), fvec)
+		r = array(r[0:n, 0:n], dtype=float)
+		rdiag = diagonal(r).copy()
+		return([r, ipvt, rdiag, acnorm, qtf])
+
+	## Solves the same system as qrsolv by factoring R stacked on top of
+	## the diagonal matrix D, leaving S in the same places as QRSOLV: its
+	## strict upper triangle transposed in the strict lower triangle of r,
+	## and its diagonal in sdiag.
+	def qrsolv_numpy(self, r, ipvt, diag, qtb, sdiag):
+		if (self.debug): print 'Entering qrsolv_numpy...'
+		n = shape(r)[1]
+		a = zeros([2*n, n], dtype=float)
+		a[0:n,:] = triu(r)
+		a[arange(n)+n, arange(n)] = take(diag, ipvt)
+		b = zeros(2*n, dtype=float)
+		b[0:n] = qtb[0:n]
+		q, s = numpy.linalg.qr(a)
+		wa = dot(transpose(q), b)
+		sdiag[:] = diagonal(s)
+
+		## Solve the triangular system for z.  If the system is singular
+		## then obtain a least squares solution
+		nsing = n
+		wh = (nonzero(sdiag == 0))[0]
+		if (len(wh) > 0):
+			nsing = wh[0]
+			wa[nsing:] = 0
+		for j in range(nsing-1,-1,-1):
+			sum0 = sum(s[j,j+1:nsing]*wa[j+1:nsing])
+			wa[j] = (wa[j]-sum0)/sdiag[j]
+
+		for j in range(n):
+			r[j+1:n,j] = s[j,j+1:n]
+		x = zeros(n, dtype=float)
+		put(x, ipvt, wa[0:n])
+		return(r, x, sdiag)
+
 	## Procedure to tie one parameter to another.
 	def tie(self, p, ptied=None):
 		if (self.debug): print 'Entering tie...'
-		if (ptied == None): return
+		if (ptied is None): return
 		for i in range(len(ptied)):
 			if ptied[i] == '': continue
 			cmd = 'p[' + str(i) + '] = ' + ptied[i]
@@ -2232,7 +2320,7 @@ class mpfit:
 	def calc_covar(self, rr, ipvt=None, tol=1.e-14):
 
 		if (self.debug): print 'Entering calc_covar...'
-		if rank(rr) != 2:
+		if len(shape(rr)) != 2:
 			print 'ERROR: r must be a two-dimensional matrix'
 			return(-1)
 		s = shape(rr)
@@ -2241,7 +2329,7 @@ class mpfit:
 			print 'ERROR: r must be a square matrix'
 			return(-1)
 
-		if (ipvt == None): ipvt = arange(n)
+		if (ipvt is None): ipvt = arange(n)
 		r = rr.copy()
 		r.shape = [n,n]
 
@@ -2287,6 +2375,245 @@ class mpfit:
 
 		return(r)
 
+class mpfit_batch(mpfit):
+	"""
+  Fits many small, independent problems of the same form in one call.
+
+  FCN is called with a k x n array of parameters, one row per problem, and
+  must return the deviations of all problems as a k x m array:
+
+	def myfunct(p, fjac=None, x=None, y=None, err=None):
+	   # p is k x n; x, y and err hold the data of all k problems
+	   model = F(x, p)
+	   status = 0
+	   return([status, (y-model)/err])
+
+  With AUTODERIVATIVE=0 it must also return the k x m x n derivatives of the
+  model when FJAC is not None, exactly as for mpfit.
+
+  Rather than performing k separate fits, every iteration evaluates FCN
+  once for all problems (plus once per free parameter for finite
+  difference derivatives) and solves the k damped normal equations
+  together with numpy.linalg.  Each problem keeps its own Levenberg-
+  Marquardt damping and stops independently.  The problems share PARINFO,
+  of which 'fixed', 'limited' and 'limits' are supported; tied parameters
+  and DAMP are not.
+
+  Outputs:
+	.params   k x n array of the fitted parameters
+	.fnorm	  the summed squared residuals of each problem
+	.status   the status of each problem, with the same meaning as for mpfit
+			  (1, 2, 3, 4 or 5), or 0 for all problems if the inputs were
+			  invalid (see .errmsg)
+	.niter	  the number of successful iterations of each problem
+	.nfev	  the number of calls to FCN
+	.errmsg   a string error message
+	"""
+	def __init__(self, fcn, xall, functkw=None, parinfo=None,
+				 ftol=1.e-10, xtol=1.e-10, gtol=1.e-10, maxiter=200,
+				 autoderivative=1, epsfcn=None, debug=0):
+
+		if functkw is None:
+			functkw = {}
+
+		self.debug = debug
+		self.errmsg = ''
+		self.nfev = 0
+		self.damp = 0.
+		self.qanytied = 0
+		self.machar = machar(double=1)
+		machep = self.machar.machep
+
+		xall = array(xall, dtype=float, ndmin=2)
+		k, npar = shape(xall)
+		self.params = xall.copy()
+		self.fnorm = None
+		self.status = zeros(k, dtype=int)
+		self.niter = zeros(k, dtype=int)
+
+		if (parinfo is not None) and (len(parinfo) != npar):
+			self.errmsg = 'ERROR: number of elements in PARINFO and P must agree'
+			return
+		ptied = self.parinfo(parinfo, 'tied', default='', n=npar)
+		for i in range(npar):
+			if (ptied[i].strip() != ''):
+				self.errmsg = 'ERROR: tied parameters are not supported'
+				return
+		pfixed = self.parinfo(parinfo, 'fixed', default=0, n=npar)
+		ifree = (nonzero(pfixed != 1))[0]
+		nfree = len(ifree)
+		if nfree == 0:
+			self.errmsg = 'ERROR: no free parameters'
+			return
+
+		limited = self.parinfo(parinfo, 'limited', default=[0,0], n=npar)
+		limits = self.parinfo(parinfo, 'limits', default=[0.,0.], n=npar)
+		qllim = take(limited[:,0], ifree) != 0
+		qulim = take(limited[:,1], ifree) != 0
+		llim = take(limits[:,0], ifree)
+		ulim = take(limits[:,1], ifree)
+		x = xall[:,ifree]
+		if numpy.any((qllim & (x < llim)) | (qulim & (x > ulim))):
+			self.errmsg = 'ERROR: parameters are not within PARINFO limits'
+			return
+
+		if ((ftol <= 0) or (xtol <= 0) or (gtol <= 0) or (maxiter < 0)):
+			self.errmsg = 'ERROR: input keywords are inconsistent'
+			return
+
+		def evaluate(p):
+			[status, f] = self.call(fcn, p, functkw)
+			return(status, reshape(asarray(f, float), [k, -1]))
+
+		status, fvec = evaluate(self.params)
+		if (status < 0):
+			self.errmsg = 'ERROR: first call to "'+str(fcn)+'" failed'
+			return
+		m = shape(fvec)[1]
+		if (m < nfree):
+			self.errmsg = 'ERROR: number of parameters must not exceed data'
+			return
+		chisq = sum(fvec*fvec, axis=1)
+
+		eps = sqrt(numpy.max([epsfcn or machep, machep]))
+		lam = zeros(k, dtype=float) + 1.e-3
+		alpha = zeros([k, nfree, nfree], dtype=float)
+		beta = zeros([k, nfree], dtype=float)
+		active = chisq > 0
+		put(self.status, (nonzero(~active))[0], 1)
+		need = active.copy()
+		d = arange(nfree)
+
+		for iteration in range(maxiter):
+			if not numpy.any(active):
+				break
+
+			## Update the normal equations of the problems which moved
+			if numpy.any(need):
+				if (autoderivative == 0):
+					fjac = self.analytic(fcn, functkw, ifree, npar, k, m)
+				else:
+					fjac = self.finite(evaluate, fvec, ifree, x, qulim, ulim, eps)
+				if fjac is None:
+					self.errmsg = 'WARNING: premature termination by FCN'
+					self.status[active] = -1
+					break
+				jn = fjac[need]
+				fn = fvec[need]
+				alpha[need] = sum(jn[:,:,:,newaxis]*jn[:,:,newaxis,:], axis=1)
+				beta[need] = sum(jn*fn[:,:,newaxis], axis=1)
+
+				## Parameters pegged at a limit which the gradient would push
+				## them beyond are held where they are
+				pegged = need[:,newaxis] & (
+					(qllim & (x == llim) & (beta > 0)) |
+					(qulim & (x == ulim) & (beta < 0)))
+				beta[pegged] = 0.
+				for j in range(nfree):
+					alpha[pegged[:,j],j,:] = 0.
+					alpha[pegged[:,j],:,j] = 0.
+
+				## Gradient convergence
+				scale = sqrt(alpha[:,d,d] * chisq[:,newaxis])
+				scale = where(scale > 0, scale, 1.)
+				gnorm = numpy.max(abs(beta)/scale, axis=1)
+				conv = active & need & (gnorm <= gtol)
+				put(self.status, (nonzero(conv))[0], 4)
+				active &= ~conv
+				if not numpy.any(active):
+					break
+
+			## Damped Gauss-Newton steps for all active problems
+			damped = alpha.copy()
+			damped[:,d,d] += lam[:,newaxis] * maximum(alpha[:,d,d], machep)
+			step = -solve_stack(damped, beta)
+			step[~active] = 0.
+			trial = x + step
+			trial = where(qllim & (trial < llim), llim, trial)
+			trial = where(qulim & (trial > ulim), ulim, trial)
+			step = trial - x
+
+			ptrial = self.params.copy()
+			ptrial[:,ifree] = trial
+			status, ftrial = evaluate(ptrial)
+			if (status < 0):
+				self.errmsg = 'WARNING: premature termination by FCN'
+				self.status[active] = status
+				break
+			ctrial = sum(ftrial*ftrial, axis=1)
+
+			better = active & (ctrial < chisq)
+			worse = active & ~better
+			actred = (chisq - ctrial) / where(chisq > 0, chisq, 1.)
+			snorm = sqrt(sum(step*step, axis=1))
+			xnorm = sqrt(sum(x*x, axis=1))
+
+			x[better] = trial[better]
+			self.params[:,ifree] = x
+			fvec[better] = ftrial[better]
+			chisq[better] = ctrial[better]
+			self.niter[better] += 1
+			lam[better] *= 0.1
+			lam[worse] *= 10.
+			need = better
+
+			qftol = better & (actred <= ftol)
+			qxtol = active & (snorm <= xtol*xnorm)
+			self.status[qftol] = 1
+			self.status[qxtol] = 2
+			self.status[qftol & qxtol] = 3
+			self.status[active & (chisq == 0)] = 1
+			active &= (self.status == 0)
+
+		self.status[active] = 5
+		self.fnorm = chisq
+		return
+
+	## Analytical derivatives of the deviations of all problems
+	def analytic(self, fcn, functkw, ifree, npar, k, m):
+		fjac = zeros(npar, dtype=float)
+		put(fjac, ifree, 1.0)
+		result = self.call(fcn, self.params, functkw, fjac=fjac)
+		if (len(result) < 3) or (result[2] is None) or (result[0] < 0):
+			return(None)
+		pderiv = asarray(result[2], float)
+		if pderiv.size != k*m*npar:
+			print 'ERROR: Derivative matrix was not computed properly.'
+			return(None)
+		return(-reshape(pderiv, [k, m, npar])[:,:,ifree])
+
+	## One-sided finite difference derivatives of the deviations of all
+	## problems, stepping away from upper limits
+	def finite(self, evaluate, fvec, ifree, x, qulim, ulim, eps):
+		k, m = shape(fvec)
+		fjac = zeros([k, m, len(ifree)], dtype=float)
+		for j in range(len(ifree)):
+			h = eps * abs(x[:,j])
+			h = where(h == 0, eps, h)
+			h = where(qulim[j] & (x[:,j] > ulim[j]-h), -h, h)
+			p = self.params.copy()
+			p[:,ifree[j]] = x[:,j] + h
+			status, fp = evaluate(p)
+			if (status < 0): return(None)
+			fjac[:,:,j] = (fp - fvec) / h[:,newaxis]
+		return(fjac)
+
+
+## Solves the stack of linear systems a[i] x[i] = b[i]
+def solve_stack(a, b):
+	try:
+		return(numpy.linalg.solve(a, b[:,:,newaxis])[:,:,0])
+	except (ValueError, numpy.linalg.LinAlgError):
+		## Older numpy versions only solve one system at a time, and
+		## singular systems are left where they are
+		x = zeros(shape(b), dtype=float)
+		for i in range(len(b)):
+			try:
+				x[i] = numpy.linalg.solve(a[i], b[i])
+			except numpy.linalg.LinAlgError:
+				pass
+		return(x)
+
 class machar:
 	def __init__(self, double=1):
 		if (double == 0):
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Glencoe Software, Inc.  All Rights Reserved.
+# Use is subject to license terms supplied in LICENSE.txt
+#
+"""
+Pipelined, chunked reading from services which provide random
+access via a read(offset, length) method such as omero.api.Exporter
+and omero.api.RawFileStore.
+
+Several read() calls are kept outstanding on background threads so
+that the server-side read and the transfer of the next chunks overlap
+with whatever the caller does with the current chunk (usually writing
+it to disk).
+
+    size = exporter.generateTiff()
+    reader = PipelinedReader(exporter.read, size)
+    for chunk in reader:
+        handle.write(chunk)
+    print reader.throughput()
+"""
+
+import sys
+import time
+import logging
+import threading
+
+from Queue import Queue
+from collections import deque
+
+# Default block read size when downloading data
+DEFAULT_READ_LENGTH = 1000*1000
+
+# Default number of read() calls kept outstanding
+DEFAULT_DEPTH = 4
+
+
+class _Chunk(object):
+    """
+    A single outstanding read() call.
+    """
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+        self.data = None
+        self.exc_info = None
+        self.done = threading.Event()
+
+
+class PipelinedReader(object):
+    """
+    Iterable which yields the bytes [0, size) of a remote file in order,
+    in chunks of at most chunk_size, while keeping up to depth reads in
+    flight. A depth of 1 reads strictly sequentially on the calling
+    thread.
+
+    read() may return fewer bytes than requested, in which case the
+    rest of the chunk is requested again. An empty result is taken to
+    be the end of the remote file.
+
+    An optional progress callable is passed (bytes_read, size, seconds)
+    after each chunk is yielded.
+    """
+
+    def __init__(self, read, size, chunk_size = DEFAULT_READ_LENGTH,
+                 depth = DEFAULT_DEPTH, progress = None):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive: %s" % chunk_size)
+        if depth < 1:
+            raise ValueError("depth must be positive: %s" % depth)
+        self.logger = logging.getLogger("omero.util.PipelinedReader")
+        self.read = read
+        self.size = size
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.progress = progress
+        self.bytes_read = 0
+        self.start = None
+        self.stop = None
+
+    def elapsed(self):
+        """
+        Seconds spent reading so far (or in total once finished).
+        """
+        if self.start is None:
+            return 0.0
+        stop = self.stop
+        if stop is None:
+            stop = time.time()
+        return stop - self.start
+
+    def throughput(self):
+        """
+        Bytes per second read so far.
+        """
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_read / elapsed
+
+    def __iter__(self):
+        self.start = time.time()
+        self.stop = None
+        self.bytes_read = 0
+        if self.depth == 1:
+            chunks = self._sequential()
+        else:
+            chunks = self._pipelined()
+        try:
+            for data in chunks:
+                if not data:
+                    # Premature end of the remote file.
+                    break
+                data = data[:self.size - self.bytes_read]
+                self.bytes_read += len(data)
+                yield data
+                if self.progress is not None:
+                    self.progress(self.bytes_read, self.size, self.elapsed())
+        finally:
+            chunks.close()
+            self.stop = time.time()
+
+    def _sequential(self):
+        offset = 0
+        while offset < self.size:
+            length = min(self.chunk_size, self.size - offset)
+            data = self.read(offset, length)
+            yield data
+            if not data:
+                return
+            offset += len(data)
+
+    def _pipelined(self):
+        tasks = Queue()
+        workers = []
+        for i in range(min(self.depth, self._chunk_count())):
+            t = threading.Thread(target=self._work, args=(tasks,),
+                                 name="PipelinedReader-%s" % i)
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+
+        pending = deque()
+        state = {"offset": 0}
+        def submit():
+            offset = state["offset"]
+            length = min(self.chunk_size, self.size - offset)
+            chunk = _Chunk(offset, length)
+            pending.append(chunk)
+            tasks.put(chunk)
+            state["offset"] = offset + length
+
+        try:
+            while state["offset"] < self.size and len(pending) < self.depth:
+                submit()
+            while pending:
+                chunk = pending.popleft()
+                chunk.done.wait()
+                if chunk.exc_info is not None:
+                    raise chunk.exc_info[0], chunk.exc_info[1], chunk.exc_info[2]
+                data = chunk.data
+                if data and len(data) < chunk.length:
+                    # Short read: the rest of the chunk goes ahead of
+                    # the chunks already in flight.
+                    rest = _Chunk(chunk.offset + len(data), chunk.length - len(data))
+                    pending.appendleft(rest)
+                    tasks.put(rest)
+                # Refill the pipeline before handing the data out so that
+                # the next read overlaps with the caller's processing.
+                if state["offset"] < self.size and len(pending) < self.depth:
+                    submit()
+                yield data
+        finally:
+            for t in workers:
+                tasks.put(None)
+
+    def _chunk_count(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def _work(self, tasks):
+        while True:
+            chunk = tasks.get()
+            if chunk is None:
+                return
+            try:
+                chunk.data = self.read(chunk.offset, chunk.length)
+            except:
+                self.logger.debug("Failed read at %s", chunk.offset,
+                                  exc_info=True)
+                chunk.exc_info = sys.exc_info()
+            chunk.done.set()
@@ -44,6 +44,8 @@ from omero.model import DatasetAnnotationLink, DatasetI, FileAnnotationI, \
 from omero.grid import ImageColumn, LongColumn, PlateColumn, StringColumn, \
                        WellColumn
 from omero.util.temp_files import create_path, remove_path
+from omero.util.columnar import DEFAULT_BATCH_SIZE, TableCheckpoint, \
+                                TableWriter, buffered
 from omero import client
 
 from populate_roi import ThreadPool
@@ -71,11 +73,14 @@ Options:
   -k    OMERO session key to use
   -i    Dump measurement information and exit (no population)
   -d    Print debug statements
+  -b    Number of rows to send to the table at a time [defaults to %d]
+  -c    Checkpoint file, used to resume an interrupted table write
 
 Examples:
   %s -s localhost -p 14064 -u bob Plate:6 metadata.csv
 
-Report bugs to ome-devel@lists.openmicroscopy.org.uk""" % (error, cmd, cmd)
+Report bugs to ome-devel@lists.openmicroscopy.org.uk""" % \
+        (error, cmd, DEFAULT_BATCH_SIZE, cmd)
     sys.exit(2)
 
 # Global thread pool for use by workers
@@ -183,6 +188,10 @@ class ValueResolver(object):
         self.client = client
         self.target_object = target_object
         self.target_class = self.target_object.__class__
+        # (plate id, row, column) -> well id, rows and columns 0 offsetted
+        self.wells = dict()
+        self.plates_by_name = dict()
+        self.plate_names_by_id = dict()
         if PlateI is self.target_class:
             return self.load_plate()
         if DatasetI is self.target_class:
@@ -190,124 +199,152 @@ class ValueResolver(object):
         if ScreenI is self.target_class:
             return self.load_screen()
         raise MetadataError('Unsupported target object class: %s' \
-                            % target_class)
+                            % self.target_class)
+
     def load_screen(self):
-        query_service = self.client.getSession().getQueryService()
-        parameters = omero.sys.ParametersI()
-        parameters.addId(self.target_object.id.val)
         log.debug('Loading Screen:%d' % self.target_object.id.val)
-        self.target_object = query_service.findByQuery(
-                'select s from Screen as s '
-                'join fetch s.plateLinks as p_link '
-                'join fetch p_link.child as p '
-                'where s.id = :id', parameters)
-        if self.target_object is None:
-            raise MetadataException('Could not find target object!')
-        self.wells_by_location = dict()
-        self.plates_by_name = dict()
-        self.plates_by_id = dict()
-        for plate in (l.child for l in self.target_object.copyPlateLinks()):
-            parameters = omero.sys.ParametersI()
-            parameters.addId(plate.id.val)
-            plate = query_service.findByQuery(
-                    'select p from Plate as p '
-                    'join fetch p.wells as w '
-                    'join fetch w.wellSamples as ws '
-                    'where p.id = :id', parameters)
-            self.plates_by_name[plate.name.val] = plate
-            self.plates_by_id[plate.id.val] = plate
-            wells_by_location = dict()
-            self.wells_by_location[plate.name.val] = wells_by_location
-            self.parse_plate(plate, wells_by_location)
+        self.load_wells(
+                'select p.id, p.name, w.id, w.row, w.column '
+                'from Screen as s '
+                'join s.plateLinks as p_link '
+                'join p_link.child as p '
+                'left outer join p.wells as w '
+                'where s.id = :id')
 
     def load_plate(self):
+        log.debug('Loading Plate:%d' % self.target_object.id.val)
+        self.load_wells(
+                'select p.id, p.name, w.id, w.row, w.column '
+                'from Plate as p '
+                'left outer join p.wells as w '
+                'where p.id = :id')
+
+    def load_wells(self, query):
+        """
+        Fills the well index for every plate of the target object with a
+        single projection query rather than loading the object graph of
+        each plate.
+        """
         query_service = self.client.getSession().getQueryService()
         parameters = omero.sys.ParametersI()
         parameters.addId(self.target_object.id.val)
-        log.debug('Loading Plate:%d' % self.target_object.id.val)
-        self.target_object = query_service.findByQuery(
-                'select p from Plate as p '
-                'join fetch p.wells as w '
-                'join fetch w.wellSamples as ws '
-                'where p.id = :id', parameters)
-        if self.target_object is None:
-            raise MetadataException('Could not find target object!')
-        self.wells_by_location = dict()
-        wells_by_location = dict()
-        self.wells_by_location[self.target_object.name.val] = wells_by_location
-        self.parse_plate(self.target_object, wells_by_location)
-
-    def parse_plate(self, plate, wells_by_location):
-        # TODO: This should use the PlateNamingConvention. We're assuming rows
-        # as alpha and columns as numeric.
-        for well in plate.copyWells():
-            row = well.row.val
-            # 0 offsetted is not what people use in reality
-            column = str(well.column.val + 1)
-            try:
-                columns = wells_by_location[self.AS_ALPHA[row]]
-            except KeyError:
-                wells_by_location[self.AS_ALPHA[row]] = columns = dict()
-            columns[column] = well
-        log.debug('Completed parsing plate: %s' % plate.name.val)
-        for row in wells_by_location:
-            log.debug('%s: %r' % (row, wells_by_location[row].keys()))
+        rows = query_service.projection(query, parameters)
+        if not rows:
+            raise MetadataError('Could not find target object!')
+        for plate_id, plate_name, well_id, row, column in rows:
+            plate_id = plate_id.val
+            plate_name = plate_name.val
+            self.plates_by_name[plate_name] = plate_id
+            self.plate_names_by_id[plate_id] = plate_name
+            if well_id is None:
+                log.debug('Plate:%d has no wells' % plate_id)
+                continue
+            self.wells[(plate_id, row.val, column.val)] = well_id.val
+        log.debug('Loaded %d wells from %d plates' % \
+                (len(self.wells), len(self.plate_names_by_id)))
 
     def load_dataset(self):
         raise Exception('To be implemented!')
 
-    def resolve(self, column, value, row):
+    def get_plate_id(self):
+        """
+        Returns the identifier of the only plate we have loaded or None if
+        the well's plate needs to be resolved per row.
+        """
+        if len(self.plate_names_by_id) == 1:
+            return self.plate_names_by_id.keys()[0]
+        return None
+
+    def parse_row(self, value):
+        """
+        Parses an alpha row ("A" or "AA") into a 0 offsetted index.
+        """
+        index = 0
+        for c in value.lower():
+            index = index * 26 + self.AS_ALPHA.index(c) + 1
+        return index - 1
+
+    def format_row(self, index):
+        """
+        Formats a 0 offsetted row index as alpha, the inverse of parse_row().
+        """
+        name = ''
+        index += 1
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            name = self.AS_ALPHA[remainder] + name
+        return name
+
+    def get_resolver(self, column):
+        """
+        Returns the function used to resolve the values of a given column.
+        Each function takes the original value and the plate identifier of
+        the row, which is None when there is only one plate.
+        """
         column_class = column.__class__
         column_as_lower = column.name.lower()
         if WellColumn is column_class:
-            m = self.WELL_REGEX.match(value)
-            if m is None or len(m.groups()) != 2:
-                raise MetadataError(
-                        'Cannot parse well identifier "%s" from row: %r' % \
-                                (value, [o[1] for o in row]))
-            plate_row = m.group(1).lower()
-            plate_column = m.group(2)
-            if len(self.wells_by_location) == 1:
-                wells_by_location = self.wells_by_location.values()[0]
-                log.debug('Parsed "%s" row: %s column: %s' % \
-                        (value, plate_row, plate_column))
-            else:
-                for column, plate in row:
-                    if column.__class__ is PlateColumn:
-                        wells_by_location = self.wells_by_location[plate]
-                        log.debug('Parsed "%s" row: %s column: %s plate: %s' % \
-                                (value, plate_row, plate_column, plate))
-                        break
-            try:
-                return wells_by_location[plate_row][plate_column].id.val
-            except KeyError:
-                log.debug('Row: %s Column: %s not found!' % \
-                        (plate_row, plate_column))
-                return -1L
+            return self.resolve_well
         if PlateColumn is column_class:
-            try:
-                return self.plates_by_name[value].id.val
-            except KeyError:
-                log.warn('Screen is missing plate: %s' % value)
-                return Skip()
+            return self.resolve_plate
         if column_as_lower in ('row', 'column') \
            and column_class is LongColumn:
-            try:
-                # The value is not 0 offsetted
-                return long(value) - 1
-            except ValueError:
-                return long(self.AS_ALPHA.index(value.lower()))
+            return self.resolve_row_or_column
         if StringColumn is column_class:
-            return value
+            def resolve_string(value, plate_id):
+                column.size = max(column.size, len(value))
+                return value
+            return resolve_string
         raise MetadataError('Unsupported column class: %s' % column_class)
 
+    def resolve(self, column, value, plate_id=None):
+        return self.get_resolver(column)(value, plate_id)
+
+    def resolve_well(self, value, plate_id):
+        m = self.WELL_REGEX.match(value)
+        if m is None or len(m.groups()) != 2:
+            raise MetadataError(
+                    'Cannot parse well identifier "%s"' % value)
+        plate_row = self.parse_row(m.group(1))
+        # 0 offsetted is not what people use in reality
+        plate_column = int(m.group(2)) - 1
+        if plate_id is None:
+            plate_id = self.get_plate_id()
+        try:
+            return self.wells[(plate_id, plate_row, plate_column)]
+        except KeyError:
+            log.debug('Plate: %s Row: %s Column: %s not found!' % \
+                    (plate_id, plate_row, plate_column))
+            return -1L
+
+    def resolve_plate(self, value, plate_id):
+        try:
+            return self.plates_by_name[value]
+        except KeyError:
+            log.warn('Screen is missing plate: %s' % value)
+            return Skip()
+
+    def resolve_row_or_column(self, value, plate_id):
+        try:
+            # The value is not 0 offsetted
+            return long(value) - 1
+        except ValueError:
+            return long(self.parse_row(value))
+
+
 class ParsingContext(object):
     """Generic parsing context for CSV files."""
 
-    def __init__(self, client, target_object, file):
+    # The number of rows to read from the CSV file before resolving them
+    CHUNK_SIZE = 10000
+
+    def __init__(self, client, target_object, file,
+                 batch_size=DEFAULT_BATCH_SIZE, checkpoint=None):
         self.client = client
         self.target_object = target_object
         self.file = file
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
         self.value_resolver = ValueResolver(self.client, self.target_object)
 
     def create_annotation_link(self):
@@ -330,58 +367,143 @@ class ParsingContext(object):
                 widths.append(None)
         return widths
 
-    def parse(self):
+    def parse(self, create_writer=None):
+        """
+        Parses the CSV file into self.columns. If create_writer is given, it
+        is called with the columns once their string widths are known and
+        returns a TableWriter, which is then flushed as rows are resolved so
+        that only the rows not yet written are held. Returns the writer.
+        """
         data = open(self.file, 'U')
         try:
-            rows = list(csv.reader(data, delimiter=','))
+            reader = csv.reader(data, delimiter=',')
+            header = reader.next()
+            log.debug('Header: %r' % header)
+            header_resolver = HeaderResolver(self.target_object, header)
+            self.columns = [buffered(column) for column in
+                            header_resolver.create_columns()]
+            log.debug('Columns: %r' % self.columns)
+            writer = None
+            if create_writer is not None:
+                self.measure()
+                writer = create_writer(self.columns)
+            self.populate(reader, writer)
         finally:
             data.close()
-        log.debug('Header: %r' % rows[0])
-        header_resolver = HeaderResolver(self.target_object, rows[0])
-        self.columns = header_resolver.create_columns()
-        log.debug('Columns: %r' % self.columns)
-        self.populate(rows[1:])
-        self.post_process()
         log.debug('Column widths: %r' % self.get_column_widths())
         log.debug('Columns: %r' % \
                 [(o.name, len(o.values)) for o in self.columns])
-        # Paranoid debugging
-        #for i in range(len(self.columns[0].values)):
-        #    values = list()
-        #    for column in self.columns:
-        #        values.append(column.values[i])
-        #    log.debug('Row: %r' % values)
-
-    def populate(self, rows):
-        value = None
+        return writer
+
+    def measure(self):
+        """
+        Sizes the string columns to their longest value, which has to be
+        known before the table is initialized, in a pass over the CSV file
+        which resolves no identifiers.
+        """
+        columns = self.get_source_columns()
+        names = [column.name for column in columns]
+        strings = [i for i, column in enumerate(columns)
+                   if column.__class__ is StringColumn]
+        well_name_column = None
+        for column in self.columns:
+            if column.name == WELL_NAME_COLUMN:
+                well_name_column = column
+            elif column.name == PLATE_NAME_COLUMN:
+                for name in self.value_resolver.plate_names_by_id.values():
+                    column.size = max(column.size, len(name))
+        if 'Row' not in names or 'Column' not in names:
+            # Reported by post_process()
+            well_name_column = None
+        if well_name_column is not None:
+            row_index = names.index('Row')
+            column_index = names.index('Column')
+        resolve = self.value_resolver.resolve_row_or_column
+        data = open(self.file, 'U')
+        try:
+            reader = csv.reader(data, delimiter=',')
+            reader.next()
+            for row in reader:
+                if len(row) < len(columns):
+                    # Reported by populate()
+                    continue
+                for i in strings:
+                    columns[i].size = max(columns[i].size, len(row[i]))
+                if well_name_column is not None:
+                    v = '%s%d' % (self.value_resolver.format_row(
+                            resolve(row[row_index], None)),
+                            resolve(row[column_index], None) + 1)
+                    well_name_column.size = max(well_name_column.size, len(v))
+        finally:
+            data.close()
+        log.debug('Measured column widths: %r' % self.get_column_widths())
+
+    def get_source_columns(self):
+        """
+        Returns the columns with values in the original rows, leaving out
+        those which are filled in during post processing.
+        """
+        return [column for column in self.columns
+                if column.name not in (PLATE_NAME_COLUMN, WELL_NAME_COLUMN)]
+
+    def chunks(self, rows):
+        """Yields lists of at most CHUNK_SIZE rows from an iterable."""
+        chunk = list()
         for row in rows:
-            values = list()
-            row = [(self.columns[i], value) for i, value in enumerate(row)]
-            for column, original_value in row:
-                value = self.value_resolver.resolve(column, original_value, row)
-                if value.__class__ is Skip:
-                    break
-                values.append(value)
-                try:
-                    if value.__class__ is not long:
-                        column.size = max(column.size, len(value))
-                except TypeError:
-                    log.error('Original value "%s" now "%s" of bad type!' % \
-                            (original_value, value))
-                    raise
-            if value.__class__ is not Skip:
-                values.reverse()
-                for column in self.columns:
-                    if column.name in (PLATE_NAME_COLUMN, WELL_NAME_COLUMN):
+            chunk.append(row)
+            if len(chunk) == self.CHUNK_SIZE:
+                yield chunk
+                chunk = list()
+        if chunk:
+            yield chunk
+
+    def populate(self, rows, writer=None):
+        columns = self.get_source_columns()
+        resolvers = [self.value_resolver.get_resolver(column)
+                     for column in columns]
+        plate_index = None
+        for i, column in enumerate(columns):
+            if column.__class__ is PlateColumn:
+                plate_index = i
+                break
+        n_rows = 0
+        for chunk in self.chunks(rows):
+            start = len(columns[0].values)
+            for row in chunk:
+                if len(row) < len(columns):
+                    raise MetadataError(
+                            'Row has %d values, expected %d: %r' % \
+                            (len(row), len(columns), row))
+                plate_id = None
+                if plate_index is not None:
+                    plate_id = resolvers[plate_index](row[plate_index], None)
+                    if plate_id.__class__ is Skip:
+                        continue
+                values = list()
+                for i, resolver in enumerate(resolvers):
+                    if i == plate_index:
+                        values.append(plate_id)
                         continue
                     try:
-                        column.values.append(values.pop())
-                    except IndexError:
-                        log.error('Column %s has no values to pop.' % \
-                                column.name)
+                        values.append(resolver(row[i], plate_id))
+                    except TypeError:
+                        log.error('Original value "%s" of bad type!' % \
+                                row[i])
                         raise
-
-    def post_process(self):
+                for i, column in enumerate(columns):
+                    column.values.append(values[i])
+            self.post_process(start)
+            n_rows += len(chunk)
+            log.debug('Resolved %d rows' % n_rows)
+            if writer is not None:
+                writer.flush()
+                writer.discard()
+
+    def post_process(self, start=0):
+        """
+        Fills in the well and plate name columns for the buffered rows from
+        start on.
+        """
         columns_by_name = dict()
         plate_column = None
         well_column = None
@@ -399,7 +521,7 @@ class ParsingContext(object):
                 plate_name_column = column
         if well_name_column is None and plate_name_column is None:
             log.info('Nothing to do during post processing.')
-        for i in range(0, len(self.columns[0].values)):
+        for i in range(start, len(self.get_source_columns()[0].values)):
             if well_name_column is not None:
                 try:
                     row = columns_by_name['Row'].values[i]
@@ -407,7 +529,7 @@ class ParsingContext(object):
                 except KeyError:
                     log.error('Missing row or column for well name population!')
                     raise
-                row = self.value_resolver.AS_ALPHA[row]
+                row = self.value_resolver.format_row(row)
                 v = '%s%d' % (row, col + 1)
                 well_name_column.size = max(well_name_column.size, len(v))
                 well_name_column.values.append(v)
@@ -415,37 +537,72 @@ class ParsingContext(object):
                 log.info('Missing well name column, skipping.')
             if plate_name_column is not None:
                 plate = columns_by_name['Plate'].values[i]
-                plate = self.value_resolver.plates_by_id[plate]
-                v = plate.name.val
+                v = self.value_resolver.plate_names_by_id[plate]
                 plate_name_column.size = max(plate_name_column.size, len(v))
                 plate_name_column.values.append(v)
             else:
                 log.info('Missing plate name column, skipping.')
 
     def write_to_omero(self):
-        sf = self.client.getSession()
-        sr = sf.sharedResources()
-        update_service = sf.getUpdateService()
+        """
+        Parses the CSV file into a new OMERO.tables instance, or resumes
+        the table recorded by the checkpoint, and links it to the target
+        object. Rows are written in batches while the file is parsed.
+        """
+        writer = self.parse(self.create_writer)
+        try:
+            writer.write()
+        except:
+            log.error('Table write failed after %d committed rows.' % \
+                    writer.committed)
+            raise
+        log.info('Added %d rows of column data.' % writer.committed)
         name = 'bulk_annotations'
-        table = sr.newTable(1, name)
-        original_file = table.getOriginalFile()
-        if table is None:
-            raise MetadataError(
-                "Unable to create table: %s" % name)
-        log.info('Created new table OriginalFile:%d' % original_file.id.val)
-        table.initialize(self.columns)
-        log.info('Table initialized with %d columns.' % (len(self.columns)))
-        table.addData(self.columns)
-        log.info('Added data column data.')
         file_annotation = FileAnnotationI()
         file_annotation.ns = \
                 rstring('openmicroscopy.org/omero/bulk_annotations')
         file_annotation.description = rstring(name)
-        file_annotation.file = OriginalFileI(original_file.id.val, False)
+        file_annotation.file = OriginalFileI(writer.file_id, False)
         link = self.create_annotation_link()
         link.parent = self.target_object
         link.child = file_annotation
-        update_service.saveObject(link)
+        self.client.getSession().getUpdateService().saveObject(link)
+        writer.finish()
+
+    def create_writer(self, columns):
+        """
+        Returns a TableWriter for the columns to a new table, or to the
+        table recorded by the checkpoint if there is one.
+        """
+        sr = self.client.getSession().sharedResources()
+        name = 'bulk_annotations'
+        checkpoint = None
+        resume_from = None
+        if self.checkpoint is not None:
+            checkpoint = TableCheckpoint(self.checkpoint)
+            resume_from = checkpoint.load()
+        if resume_from is not None:
+            table = sr.openTable(OriginalFileI(resume_from[0], False))
+            if table is None:
+                raise MetadataError(
+                    "Unable to open table: OriginalFile:%d" % resume_from[0])
+            writer = TableWriter(table, columns, self.batch_size,
+                                 checkpoint)
+            writer.resume()
+        else:
+            table = sr.newTable(1, name)
+            if table is None:
+                raise MetadataError(
+                    "Unable to create table: %s" % name)
+            original_file = table.getOriginalFile()
+            log.info('Created new table OriginalFile:%d' % \
+                    original_file.id.val)
+            writer = TableWriter(table, columns, self.batch_size,
+                                 checkpoint)
+            writer.initialize()
+            log.info('Table initialized with %d columns.' % \
+                    (len(columns)))
+        return writer
 
 def parse_target_object(target_object):
     type, id = target_object.split(':')
@@ -459,7 +616,7 @@ def parse_target_object(target_object):
 
 if __name__ == "__main__":
     try:
-        options, args = getopt(sys.argv[1:], "s:p:u:w:k:id")
+        options, args = getopt(sys.argv[1:], "s:p:u:w:k:t:b:c:id")
     except GetoptError, (msg, opt):
         usage(msg)
 
@@ -477,6 +634,8 @@ if __name__ == "__main__":
     session_key = None
     logging_level = logging.INFO
     thread_count = 1
+    batch_size = DEFAULT_BATCH_SIZE
+    checkpoint = None
     for option, argument in options:
         if option == "-u":
             username = argument
@@ -494,6 +653,10 @@ if __name__ == "__main__":
             logging_level = logging.DEBUG
         if option == "-t":
             thread_count = int(argument)
+        if option == "-b":
+            batch_size = int(argument)
+        if option == "-c":
+            checkpoint = argument
     if session_key is None and username is None:
         usage("Username must be specified!")
     if session_key is None and hostname is None:
@@ -513,9 +676,11 @@ if __name__ == "__main__":
 
         log.debug('Creating pool of %d threads' % thread_count)
         thread_pool = ThreadPool(thread_count)
-        ctx = ParsingContext(client, target_object, file)
-        ctx.parse()
-        if not info:
+        ctx = ParsingContext(client, target_object, file,
+                             batch_size=batch_size, checkpoint=checkpoint)
+        if info:
+            ctx.parse()
+        else:
             ctx.write_to_omero()
     finally:
         pass
@@ -42,6 +42,8 @@ from omero.model import OriginalFileI, PlateI, PlateAnnotationLinkI, ImageI, \
                         FileAnnotationI, RoiI, EllipseI, PointI
 from omero.grid import ImageColumn, WellColumn, RoiColumn, LongColumn, DoubleColumn
 from omero.util.temp_files import create_path, remove_path
+from omero.util.columnar import DEFAULT_BATCH_SIZE, TableCheckpoint, \
+                                TableWriter, buffered
 from omero import client
 
 # Handle Python 2.5 built-in ElementTree
@@ -68,6 +70,7 @@ Options:
   -i    Dump measurement information and exit (no population)
   -d    Print debug statements
   -t    Number of threads to use when populating [defaults to 1]
+  -c    Checkpoint file prefix; an interrupted run resumes where it stopped
 
 Examples:
   %s -s localhost -p 4063 -u bob 27
@@ -537,6 +540,9 @@ class AbstractMeasurementCtx(object):
     
     # The number of ROI to have parsed before streaming them to the server
     ROI_UPDATE_LIMIT = 1000
+
+    # The number of rows to send to the table per addData() call
+    TABLE_BATCH_SIZE = DEFAULT_BATCH_SIZE
     
     def __init__(self, analysis_ctx, service_factory, original_file_provider,
                  original_file, result_files):
@@ -548,6 +554,10 @@ class AbstractMeasurementCtx(object):
         self.update_service = self.service_factory.getUpdateService()
         self.original_file = original_file
         self.result_files = result_files
+        self.table_writer = None
+        # Path prefix of the table checkpoints, None not to record them
+        self.checkpoint = None
+        self.table_checkpoint = None
 
         # Establish the rest of our initial state
         self.wellimages = dict()
@@ -589,8 +599,19 @@ class AbstractMeasurementCtx(object):
                     (row, col))
             return (None, None)
 
-    def update_table(self, columns):
-        """Updates the OmeroTables instance backing our results."""
+    def create_table(self, columns):
+        """
+        Creates the OmeroTables instance backing our results, linked to the
+        plate, and the TableWriter used to fill it. If the table checkpoint
+        was left by an earlier run, its table and file annotation are used
+        instead and writing resumes after the committed rows.
+        """
+        resume_from = None
+        if self.table_checkpoint is not None:
+            resume_from = self.table_checkpoint.load()
+        if resume_from is not None:
+            self.resume_table(columns, resume_from[0])
+            return
         # Create a new OMERO table to store our measurement results
         sr = self.service_factory.sharedResources()
         name = self.get_name()
@@ -617,14 +638,72 @@ class AbstractMeasurementCtx(object):
         self.file_annotation = plate_annotation_link.child
         
         t0 = int(time.time() * 1000)
-        self.table.initialize(columns)
+        self.table_writer = TableWriter(self.table, columns,
+                                        self.TABLE_BATCH_SIZE,
+                                        self.table_checkpoint)
+        self.table_writer.initialize()
         log.debug("Table init took %sms" % (int(time.time() * 1000) - t0))
+
+    def resume_table(self, columns, file_id):
+        """
+        Opens the OmeroTables instance of an earlier run, and the file
+        annotation linking it to the plate, to resume writing to it.
+        """
+        sr = self.service_factory.sharedResources()
+        self.table = sr.openTable(OriginalFileI(file_id, False))
+        if self.table is None:
+            raise MeasurementError(
+                "Unable to open table: OriginalFile:%d" % file_id)
+        params = omero.sys.ParametersI()
+        params.addLong('fid', file_id)
+        self.file_annotation = self.query_service.findByQuery(
+            'select fa from FileAnnotation as fa where fa.file.id = :fid',
+            params)
+        if self.file_annotation is None:
+            raise MeasurementError(
+                "No file annotation for table: OriginalFile:%d" % file_id)
+        self.table_writer = TableWriter(self.table, columns,
+                                        self.TABLE_BATCH_SIZE,
+                                        self.table_checkpoint)
+        self.table_writer.resume()
+
+    def get_table_checkpoint(self, set_of_columns):
+        """
+        Returns the TableCheckpoint of a set of columns, or None if no
+        checkpoints are recorded.
+        """
+        if self.checkpoint is None:
+            return None
+        return TableCheckpoint('%s.%d.%d' % \
+                (self.checkpoint, self.original_file.id.val, set_of_columns))
+
+    def update_table(self, columns):
+        """
+        Updates the OmeroTables instance backing our results, creating it
+        unless rows were already written while ROI were being saved.
+        """
+        if self.table_writer is None:
+            self.create_table(columns)
+        self.write_table()
+
+    def write_table(self):
+        """
+        Writes the buffered columns to the OmeroTables instance in batches.
+        Should a batch fail, calling this method again resumes from the last
+        committed row.
+        """
         t0 = int(time.time() * 1000)
         column_report = dict()
-        for column in columns:
+        for column in self.table_writer.columns:
             column_report[column.name] = len(column.values)
         log.debug("Column report: %r" % column_report)
-        self.table.addData(columns)
+        try:
+            self.table_writer.write()
+        except:
+            log.error("Table update failed after %d committed rows" % \
+                    self.table_writer.committed)
+            raise
+        self.table_writer.discard()
         log.info("Table update took %sms" % (int(time.time() * 1000) - t0))
     
     def create_file_annotation(self, set_of_columns):
@@ -650,6 +729,42 @@ class AbstractMeasurementCtx(object):
             (batch_no, int(time.time() * 1000) - t0))
         batches[batch_no] = roi_ids
 
+    def save_rois(self, rois, roi_column):
+        """
+        Saves the ROI yielded by rois(start), those of the rows from start
+        on, in batches of ROI_UPDATE_LIMIT using the thread pool. Rows which
+        an earlier run committed have their ROI already and are skipped.
+        As batches complete their IDs are appended, in order, to the ROI
+        column and each full batch of rows which is then complete is
+        written to the OmeroTables instance and dropped from the columns,
+        so rois() has to build the ROI from its own copy of the values.
+        """
+        start = self.table_writer.committed
+        # Placeholders for the committed rows, which are not written again
+        roi_column.values.extend([-1] * start)
+        self.table_writer.discard()
+        batches = dict()
+        batch = list()
+        batch_no = 1
+        next_batch_no = 1
+        for roi in rois(start):
+            batch.append(roi)
+            if len(batch) == self.ROI_UPDATE_LIMIT:
+                thread_pool.add_task(self.update_rois, batch, batches, batch_no)
+                batch = list()
+                batch_no += 1
+                while next_batch_no in batches:
+                    roi_column.values.extend(batches.pop(next_batch_no))
+                    next_batch_no += 1
+                self.table_writer.flush()
+                self.table_writer.discard()
+        thread_pool.add_task(self.update_rois, batch, batches, batch_no)
+        thread_pool.wait_completion()
+        batch_keys = batches.keys()
+        batch_keys.sort()
+        for k in batch_keys:
+            roi_column.values.extend(batches[k])
+
     def image_from_original_file(self, original_file):
         """Returns the image from which an original file has originated."""
         m = self.analysis_ctx.original_file_image_map
@@ -663,10 +778,18 @@ class AbstractMeasurementCtx(object):
         result = self.parse()
         if result is None:
             return
+        writers = list()
         for i, columns in enumerate(result.sets_of_columns):
+            self.table_writer = None
+            self.table_checkpoint = self.get_table_checkpoint(i)
             self.create_file_annotation(i)
             self.parse_and_populate_roi(columns)
             self.populate(columns)
+            writers.append(self.table_writer)
+        # Only now that every set is complete are the checkpoints removed,
+        # so that a resumed run does not write a complete set again.
+        for writer in writers:
+            writer.finish()
 
     ###
     ### Abstract methods
@@ -786,82 +909,62 @@ class MIASMeasurementCtx(AbstractMeasurementCtx):
     def _parse_neo_roi(self, columns):
         """Parses out ROI from OmeroTables columns for 'NEO' datasets."""
         log.debug("Parsing %s NEO ROIs..." % (len(columns[0].values)))
-        image_ids = columns[self.IMAGE_COL].values
-        rois = list()
-        # Save our file annotation to the database so we can use an unloaded
-        # annotation for the saveAndReturnIds that will be triggered below.
-        self.file_annotation = \
-            self.update_service.saveAndReturnObject(self.file_annotation)
+        # Copies, since rows are dropped from the columns once written
+        image_ids = columns[self.IMAGE_COL].values[:]
+        diameters = columns[6].values[:]
+        cxs = columns[4].values[:]
+        cys = columns[3].values[:]
+        # Save our file annotation to the database, linked to the table, so
+        # we can use an unloaded annotation for the saveAndReturnIds that
+        # will be triggered below.
+        self.create_table(columns)
         unloaded_file_annotation = \
             FileAnnotationI(self.file_annotation.id.val, False)
-        batch_no = 1
-        batches = dict()
-        for i, image_id in enumerate(image_ids):
-            unloaded_image = ImageI(image_id, False)
-            roi = RoiI()
-            shape = EllipseI()
-            values = columns[6].values
-            diameter = rdouble(float(values[i]))
-            shape.theZ = rint(0)
-            shape.theT = rint(0)
-            values = columns[4].values
-            shape.cx = rdouble(float(values[i]))
-            values = columns[3].values
-            shape.cy = rdouble(float(values[i]))
-            shape.rx = diameter
-            shape.ry = diameter
-            roi.addShape(shape)
-            roi.image = unloaded_image
-            roi.linkAnnotation(unloaded_file_annotation)
-            rois.append(roi)
-            if len(rois) == self.ROI_UPDATE_LIMIT:
-                thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-                rois = list()
-                batch_no += 1
-        thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-        thread_pool.wait_completion()
-        batch_keys = batches.keys()
-        batch_keys.sort()
-        for k in batch_keys:
-            columns[self.ROI_COL].values += batches[k]
+        def rois(start):
+            for i in xrange(start, len(image_ids)):
+                unloaded_image = ImageI(image_ids[i], False)
+                roi = RoiI()
+                shape = EllipseI()
+                diameter = rdouble(float(diameters[i]))
+                shape.theZ = rint(0)
+                shape.theT = rint(0)
+                shape.cx = rdouble(float(cxs[i]))
+                shape.cy = rdouble(float(cys[i]))
+                shape.rx = diameter
+                shape.ry = diameter
+                roi.addShape(shape)
+                roi.image = unloaded_image
+                roi.linkAnnotation(unloaded_file_annotation)
+                yield roi
+        self.save_rois(rois, columns[self.ROI_COL])
         
     def _parse_mnu_roi(self, columns):
         """Parses out ROI from OmeroTables columns for 'MNU' datasets."""
         log.debug("Parsing %s MNU ROIs..." % (len(columns[0].values)))
-        image_ids = columns[self.IMAGE_COL].values
-        rois = list()
-        # Save our file annotation to the database so we can use an unloaded
-        # annotation for the saveAndReturnIds that will be triggered below.
-        self.file_annotation = \
-            self.update_service.saveAndReturnObject(self.file_annotation)
+        # Copies, since rows are dropped from the columns once written
+        image_ids = columns[self.IMAGE_COL].values[:]
+        cxs = columns[3].values[:]
+        cys = columns[2].values[:]
+        # Save our file annotation to the database, linked to the table, so
+        # we can use an unloaded annotation for the saveAndReturnIds that
+        # will be triggered below.
+        self.create_table(columns)
         unloaded_file_annotation = \
             FileAnnotationI(self.file_annotation.id.val, False)
-        batch_no = 1
-        batches = dict()
-        for i, image_id in enumerate(image_ids):
-            unloaded_image = ImageI(image_id, False)
-            roi = RoiI()
-            shape = PointI()
-            shape.theZ = rint(0)
-            shape.theT = rint(0)
-            values = columns[3].values
-            shape.cx = rdouble(float(values[i]))
-            values = columns[2].values
-            shape.cy = rdouble(float(values[i]))
-            roi.addShape(shape)
-            roi.image = unloaded_image
-            roi.linkAnnotation(unloaded_file_annotation)
-            rois.append(roi)
-            if len(rois) == self.ROI_UPDATE_LIMIT:
-                thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-                rois = list()
-                batch_no += 1
-        thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-        thread_pool.wait_completion()
-        batch_keys = batches.keys()
-        batch_keys.sort()
-        for k in batch_keys:
-            columns[self.ROI_COL].values += batches[k]
+        def rois(start):
+            for i in xrange(start, len(image_ids)):
+                unloaded_image = ImageI(image_ids[i], False)
+                roi = RoiI()
+                shape = PointI()
+                shape.theZ = rint(0)
+                shape.theT = rint(0)
+                shape.cx = rdouble(float(cxs[i]))
+                shape.cy = rdouble(float(cys[i]))
+                roi.addShape(shape)
+                roi.image = unloaded_image
+                roi.linkAnnotation(unloaded_file_annotation)
+                yield roi
+        self.save_rois(rois, columns[self.ROI_COL])
     
     def parse_and_populate_roi(self, columns):
         names = [column.name for column in columns]
@@ -1022,13 +1125,23 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
                 if current_length > length:
                     log.debug("%s length %d > %d modding previous column" % \
                         (column.name, current_length, length))
-                    columns[i - 1].values.append(-1.0)
+                    self.pad_sparse_data(columns[i - 1])
                 if current_length < length:
                     log.debug("%s length %d < %d modding current column" % \
                         (column.name, current_length, length))
-                    column.values.append(-1.0)
+                    self.pad_sparse_data(column)
             length = len(column.values)
 
+    def pad_sparse_data(self, column):
+        """
+        Appends a -1 to a column, as an integer if the column is backed by
+        an integer buffer.
+        """
+        if getattr(column.values, 'typecode', 'd') == 'd':
+            column.values.append(-1.0)
+        else:
+            column.values.append(-1)
+
     ###
     ### Abstract method implementations
     ### 
@@ -1052,17 +1165,20 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
             well_data = None
             n_roi = 0
             n_measurements = 0
-            cells_columns = {'Image': ImageColumn('Image', '', list()),
-                             'Cell': LongColumn('Cell', '', list()),
-                             'ROI': RoiColumn('ROI', '', list())
-                            }
-            organelles_columns = {'Image': ImageColumn('Image', '', list()),
-                                  'Cell': LongColumn('Cell', '', list()),
-                                 }
-            nuclei_columns = {'Image': ImageColumn('Image', '', list()),
-                             'Cell': LongColumn('Cell', '', list()),
-                             'ROI': RoiColumn('ROI', '', list())
-                             }
+            cells_columns = {
+                    'Image': buffered(ImageColumn('Image', '', list())),
+                    'Cell': buffered(LongColumn('Cell', '', list())),
+                    'ROI': buffered(RoiColumn('ROI', '', list()))
+            }
+            organelles_columns = {
+                    'Image': buffered(ImageColumn('Image', '', list())),
+                    'Cell': buffered(LongColumn('Cell', '', list())),
+            }
+            nuclei_columns = {
+                    'Image': buffered(ImageColumn('Image', '', list())),
+                    'Cell': buffered(LongColumn('Cell', '', list())),
+                    'ROI': buffered(RoiColumn('ROI', '', list()))
+            }
             for event, element in iterparse(data, events=events):
                 if event == 'start' and element.tag == 'WellData' \
                    and element.get('cell') != 'Summary':
@@ -1104,7 +1220,8 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
                                         organelles_columns]
                     for columns in columns_list: 
                         if key not in columns:
-                            columns[key] = DoubleColumn(key, '', list())
+                            columns[key] = \
+                                    buffered(DoubleColumn(key, '', list()))
                         columns[key].values.append(value)
                     n_measurements += 1
                 elif event == 'end' and element.tag == 'WellData':
@@ -1143,62 +1260,46 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
         columns = dict()
         for column in columns_as_list:
             columns[column.name] = column
-        image_ids = columns['Image'].values
-        rois = list()
-        # Save our file annotation to the database so we can use an unloaded
-        # annotation for the saveAndReturnIds that will be triggered below.
-        self.file_annotation = \
-            self.update_service.saveAndReturnObject(self.file_annotation)
+        # Copies, since rows are dropped from the columns once written
+        image_ids = columns['Image'].values[:]
+        if False in nuclei_expected:
+            # Cell centre of gravity
+            cxs = columns['Cell: cgX'].values[:]
+            cys = columns['Cell: cgY'].values[:]
+        elif False in cells_expected:
+            # Nucleus centre of gravity
+            cxs = columns['Nucleus: cgX'].values[:]
+            cys = columns['Nucleus: cgY'].values[:]
+        else:
+            raise MeasurementError('Not a nucleus or cell ROI')
+        # Save our file annotation to the database, linked to the table, so
+        # we can use an unloaded annotation for the saveAndReturnIds that
+        # will be triggered below.
+        self.create_table(columns_as_list)
         unloaded_file_annotation = \
             FileAnnotationI(self.file_annotation.id.val, False)
         # Parse and append ROI
-        batch_no = 1
-        batches = dict()
-        for i, image_id in enumerate(image_ids):
-            unloaded_image = ImageI(image_id, False)
-            if False in nuclei_expected:
-                # Cell centre of gravity
+        def rois(start):
+            for i in xrange(start, len(image_ids)):
+                unloaded_image = ImageI(image_ids[i], False)
                 roi = RoiI()
                 shape = PointI()
                 shape.theZ = rint(0)
                 shape.theT = rint(0)
-                shape.cx = rdouble(float(columns['Cell: cgX'].values[i]))
-                shape.cy = rdouble(float(columns['Cell: cgY'].values[i]))
+                shape.cx = rdouble(float(cxs[i]))
+                shape.cy = rdouble(float(cys[i]))
                 roi.addShape(shape)
                 roi.image = unloaded_image
                 roi.linkAnnotation(unloaded_file_annotation)
-                rois.append(roi)
-            elif False in cells_expected:
-                # Nucleus centre of gravity
-                roi = RoiI()
-                shape = PointI()
-                shape.theZ = rint(0)
-                shape.theT = rint(0)
-                shape.cx = rdouble(float(columns['Nucleus: cgX'].values[i]))
-                shape.cy = rdouble(float(columns['Nucleus: cgY'].values[i]))
-                roi.addShape(shape)
-                roi.image = unloaded_image
-                roi.linkAnnotation(unloaded_file_annotation)
-                rois.append(roi)
-            else:
-                raise MeasurementError('Not a nucleus or cell ROI')
-            if len(rois) == self.ROI_UPDATE_LIMIT:
-                thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-                rois = list()
-                batch_no += 1
-        thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-        thread_pool.wait_completion()
-        batch_keys = batches.keys()
-        batch_keys.sort()
-        for k in batch_keys:
-            columns['ROI'].values += batches[k]
+                yield roi
+        self.save_rois(rois, columns['ROI'])
 
     def populate(self, columns):
         self.update_table(columns)
 
 if __name__ == "__main__":
     try:
-        options, args = getopt(sys.argv[1:], "s:p:u:m:k:t:id")
+        options, args = getopt(sys.argv[1:], "s:p:u:m:k:t:c:id")
     except GetoptError, (msg, opt):
         usage(msg)
 
@@ -1216,6 +1317,7 @@ if __name__ == "__main__":
     session_key = None
     logging_level = logging.INFO
     thread_count = 1
+    checkpoint = None
     for option, argument in options:
         if option == "-u":
             username = argument
@@ -1233,6 +1335,8 @@ if __name__ == "__main__":
             logging_level = logging.DEBUG
         if option == "-t":
             thread_count = int(argument)
+        if option == "-c":
+            checkpoint = argument
     if session_key is None and username is None:
         usage("Username must be specified!")
     if session_key is None and hostname is None:
@@ -1265,10 +1369,12 @@ if __name__ == "__main__":
             sys.exit(0)
         if measurement is not None:
             measurement_ctx = analysis_ctx.get_measurement_ctx(measurement)
+            measurement_ctx.checkpoint = checkpoint
             measurement_ctx.parse_and_populate()
         else:
             for i in range(n_measurements):
                 measurement_ctx = analysis_ctx.get_measurement_ctx(i)
+                measurement_ctx.checkpoint = checkpoint
                 measurement_ctx.parse_and_populate()
     finally:
         c.closeSession()
@@ -0,0 +1,541 @@
+#!/usr/bin/env python
+#
+# OMERO Warm Interpreter Pool
+#
+# Copyright 2011 Glencoe Software, Inc.  All Rights Reserved.
+# Use is subject to license terms supplied in LICENSE.txt
+#
+
+"""
+Pool of pre-started Python interpreters which have already imported
+omero (and Ice), used by omero.processor to launch scripts without
+paying for those imports on every job.
+
+Each worker is a "zygote": a python process which imports the modules
+once and then waits for jobs on its stdin. For each job it forks a
+child which moves into its own process group, changes to the job's
+directory, takes on the job's environment and output files, and runs
+the script as __main__. The zygote reaps its children and reports their
+return codes on its stdout, where a reader thread in the calling process
+picks them up.
+
+    pool = WarmPool(size=2, max_jobs=50)
+    popen = pool.Popen([sys.executable, "./script"], cwd=dir, env=env,
+                       stdout=out, stderr=err)
+    rc = popen.wait()
+
+WarmPool.Popen() returns an object with the parts of the killableprocess
+Popen API used by omero.processor.ProcessI (pid, poll, wait, kill) and
+falls back to starting a fresh interpreter whenever no worker is ready.
+Workers are retired after max_jobs jobs so that anything a script leaves
+behind in the zygote's state (there should be nothing, since scripts only
+run in the forked children) cannot accumulate. The pool follows the
+omero.util.Resources API, so check() replaces workers which have died.
+"""
+
+import os
+import sys
+import errno
+import fcntl
+import Queue
+import select
+import signal
+import logging
+import threading
+import traceback
+import subprocess
+import cPickle as pickle
+
+from omero.util.decorators import locked
+
+# Modules imported by each worker before it accepts any job
+DEFAULT_MODULES = ["Ice", "omero", "omero.clients", "omero.rtypes",
+                   "omero.scripts"]
+
+# Seconds to wait for a worker to report that it forked a job
+START_TIMEOUT = 30
+
+# Seconds kill() waits for the worker to report the exit of a job
+KILL_TIMEOUT = 1
+
+
+class WorkerError(Exception):
+    """
+    Raised when a job cannot be handed to a worker.
+    """
+    pass
+
+
+class WarmPopen(object):
+    """
+    Handle on a job forked by a worker. The return code is filled in by
+    the worker's reader thread.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self._done = threading.Event()
+
+    def _exited(self, rc):
+        if self.returncode is None:
+            self.returncode = rc
+        self._done.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        while not self._done.isSet():
+            self._done.wait(1.0) # Short waits keep the thread interruptible
+        return self.returncode
+
+    def kill(self, group = True):
+        """
+        Kills the job (and with group=True, all processes it started)
+        with SIGKILL.
+        """
+        try:
+            if group:
+                os.killpg(self.pid, signal.SIGKILL)
+            else:
+                os.kill(self.pid, signal.SIGKILL)
+        except OSError, ose:
+            if ose.errno != errno.ESRCH:
+                raise
+        self._done.wait(KILL_TIMEOUT)
+        self._exited(-signal.SIGKILL)
+
+
+class Worker(object):
+    """
+    One zygote process and the thread which reads its replies.
+    """
+
+    def __init__(self, python, modules, env = None):
+        self.logger = logging.getLogger("omero.util.WarmPool")
+        self._lock = threading.RLock()
+        self.jobs = 0
+        self.retired = False
+        self.ready = threading.Event()
+        self.replies = Queue.Queue()
+        self.children = {}
+        args = [python, "-c", "import omero.util.warm_pool as w; w.main()"]
+        args.extend(modules)
+        self.proc = subprocess.Popen(args, env = env, close_fds = True,
+            stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+        self.pid = self.proc.pid
+        # Keep other children of this process from holding the pipes open
+        for f in (self.proc.stdin, self.proc.stdout):
+            fd = f.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self.thread = threading.Thread(target = self._read,
+                                       name = "WarmPool-%s" % self.pid)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def alive(self):
+        return self.thread.isAlive()
+
+    def _read(self):
+        try:
+            for line in iter(self.proc.stdout.readline, ""):
+                parts = line.split(None, 1)
+                if not parts:
+                    continue
+                try:
+                    self._reply(parts[0], parts[1:] and parts[1] or "")
+                except:
+                    self.logger.error("Bad reply from worker %s: %r", self.pid, line, exc_info = True)
+        finally:
+            self._lost()
+
+    def _reply(self, kind, rest):
+        if kind == "ready":
+            self.logger.debug("Worker %s ready", self.pid)
+            self.ready.set()
+        elif kind == "started":
+            popen = WarmPopen(int(rest))
+            self.children[popen.pid] = popen
+            self.replies.put(popen)
+        elif kind == "exit":
+            pid, rc = [int(x) for x in rest.split()]
+            popen = self.children.pop(pid, None)
+            if popen is not None:
+                popen._exited(rc)
+        elif kind == "error":
+            self.replies.put(WorkerError(rest.strip()))
+
+    def _lost(self):
+        """
+        Called once the worker's stdout closes. A retired worker only exits
+        once all its jobs are finished, so any job still listed here has lost
+        its parent and is killed.
+        """
+        self.ready.clear()
+        try:
+            self.proc.wait()
+        except OSError:
+            pass
+        for pid, popen in self.children.items():
+            self.logger.warn("Worker %s exited before job %s", self.pid, pid)
+            popen.kill()
+        self.children.clear()
+        self.replies.put(WorkerError("worker %s exited" % self.pid))
+        self.logger.debug("Worker %s exited with %s", self.pid, self.proc.returncode)
+
+    @locked
+    def run(self, args, cwd, env, stdout, stderr):
+        """
+        Sends a job to the worker and returns its WarmPopen once forked.
+        """
+        if self.retired or not self.ready.isSet():
+            raise WorkerError("worker %s not accepting jobs" % self.pid)
+        job = {"args": list(args), "cwd": cwd, "env": env,
+               "stdout": stdout, "stderr": stderr}
+        try:
+            self.proc.stdin.write(pickle.dumps(job, 2).encode("hex") + "\n")
+            self.proc.stdin.flush()
+            rv = self.replies.get(timeout = START_TIMEOUT)
+        except (IOError, OSError), e:
+            raise WorkerError("worker %s: %s" % (self.pid, e))
+        except Queue.Empty:
+            raise WorkerError("worker %s did not start job" % self.pid)
+        if isinstance(rv, Exception):
+            raise rv
+        self.jobs += 1
+        return rv
+
+    @locked
+    def retire(self):
+        """
+        Closes the worker's stdin. It exits once its running jobs end.
+        """
+        if not self.retired:
+            self.retired = True
+            self.ready.clear()
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+
+
+class WarmPool(object):
+    """
+    Hands scripts to up to size warm workers, replacing each one after
+    max_jobs jobs. Popen calls which cannot be served by a worker (no
+    fork(), no ready worker, a different interpreter or unsupported
+    arguments) are passed on to fallback, which defaults to
+    killableprocess.Popen.
+    """
+
+    def __init__(self, size = 2, max_jobs = 50, python = sys.executable,
+                 modules = None, env = None, fallback = None):
+        self.logger = logging.getLogger("omero.util.WarmPool")
+        self._lock = threading.RLock()
+        if modules is None:
+            modules = DEFAULT_MODULES
+        if fallback is None:
+            import killableprocess
+            fallback = killableprocess.Popen
+        self.size = size
+        self.max_jobs = max(1, max_jobs)
+        self.python = python
+        self.modules = list(modules)
+        self.env = env
+        self.fallback = fallback
+        self.workers = []
+        self.closed = False
+        if self.size > 0 and not hasattr(os, "fork"):
+            self.logger.info("No os.fork(): warm pool disabled")
+            self.size = 0
+        self.fill()
+
+    @locked
+    def fill(self):
+        """
+        Drops dead workers and starts new ones up to size.
+        """
+        self.workers = [w for w in self.workers if w.alive() and not w.retired]
+        while not self.closed and len(self.workers) < self.size:
+            try:
+                self.workers.append(Worker(self.python, self.modules, self.env))
+            except OSError:
+                self.logger.error("Failed to start worker", exc_info = True)
+                break
+
+    @locked
+    def _checkout(self):
+        ready = [w for w in self.workers if w.ready.isSet() and not w.retired]
+        if not ready:
+            self.fill()
+            return None
+        worker = min(ready, key = lambda w: w.jobs)
+        if worker.jobs + 1 >= self.max_jobs:
+            # Last job for this worker: start its replacement now
+            self.workers.remove(worker)
+            self.fill()
+        return worker
+
+    def Popen(self, args, cwd = None, env = None, stdout = None, stderr = None, **kwargs):
+        """
+        subprocess.Popen-like entry point passed to ProcessI.
+        """
+        worker = None
+        args = list(args)
+        if not self.closed and not kwargs and len(args) == 2 and \
+                args[0] == self.python and not args[1].startswith("-"):
+            names = [_filename(stdout), _filename(stderr)]
+            if False not in names:
+                worker = self._checkout()
+        if worker is None:
+            return self.fallback(args, cwd = cwd, env = env, stdout = stdout, stderr = stderr, **kwargs)
+
+        if env is None:
+            env = dict(os.environ)
+        try:
+            try:
+                popen = worker.run(args, cwd and str(cwd), dict(env), names[0], names[1])
+                self.logger.debug("Started %s in worker %s", popen.pid, worker.pid)
+                return popen
+            except WorkerError, we:
+                self.logger.warn("Falling back to new process: %s", we)
+                worker.retire()
+                return self.fallback(args, cwd = cwd, env = env, stdout = stdout, stderr = stderr)
+        finally:
+            if worker.jobs >= self.max_jobs:
+                worker.retire()
+
+    #
+    # Resources API
+    #
+
+    def check(self):
+        self.fill()
+        return True
+
+    def cleanup(self):
+        """
+        Retires all workers, giving idle ones a moment to exit.
+        """
+        self._lock.acquire()
+        try:
+            self.closed = True
+            workers = self.workers
+            self.workers = []
+        finally:
+            self._lock.release()
+        for worker in workers:
+            worker.retire()
+        for worker in workers:
+            worker.thread.join(KILL_TIMEOUT)
+
+
+def _filename(f):
+    """
+    Returns the path of an output argument, None for no redirect, or False
+    if it cannot be passed to a worker.
+    """
+    if f is None:
+        return None
+    elif isinstance(f, basestring):
+        return f
+    elif isinstance(getattr(f, "name", None), basestring) and not f.name.startswith("<"):
+        return f.name
+    return False
+
+
+#
+# Worker side
+#
+
+def _write(fd, msg):
+    msg = msg + "\n"
+    while msg:
+        try:
+            msg = msg[os.write(fd, msg):]
+        except OSError, ose:
+            if ose.errno != errno.EINTR:
+                raise
+
+
+def _run(job):
+    """
+    Runs the job in the forked child, returning its exit code.
+    """
+    os.chdir(job["cwd"] or ".")
+    os.environ.clear()
+    os.environ.update(job["env"])
+
+    extra = [job["cwd"] or os.getcwd()]
+    extra.extend(os.environ.get("PYTHONPATH", "").split(os.pathsep))
+    sys.path[0:0] = [p for p in extra if p and p not in sys.path]
+
+    import random
+    random.seed()
+
+    import imp
+    script = job["args"][1]
+    sys.argv = list(job["args"][1:])
+    main = imp.new_module("__main__")
+    main.__file__ = script
+    main.__builtins__ = __builtins__
+    sys.modules["__main__"] = main
+    try:
+        execfile(script, main.__dict__)
+        rc = 0
+    except SystemExit, se:
+        if se.code is None:
+            rc = 0
+        elif isinstance(se.code, (int, long)):
+            rc = se.code
+        else:
+            print >>sys.stderr, se.code
+            rc = 1
+    except:
+        traceback.print_exc()
+        rc = 1
+    try:
+        import atexit
+        atexit._run_exitfuncs()
+    except:
+        traceback.print_exc()
+    return rc
+
+
+def _spawn(job, private):
+    """
+    Forks a child for job. private are the worker's descriptors which
+    the child must not keep open.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+
+    rc = 1
+    try:
+        try:
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            for fd in private:
+                os.close(fd)
+            null = os.open(os.devnull, os.O_RDWR)
+            os.dup2(null, 0)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+            for fd, name in ((1, job["stdout"]), (2, job["stderr"])):
+                if name is None:
+                    os.dup2(null, fd)
+                else:
+                    out = os.open(name, flags, 0644)
+                    os.dup2(out, fd)
+                    os.close(out)
+            os.close(null)
+            rc = _run(job)
+        except:
+            traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(rc)
+
+
+def _reap(children, reply):
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError, ose:
+            if ose.errno == errno.EINTR:
+                continue
+            if ose.errno != errno.ECHILD:
+                raise
+            pid, status = 0, 0
+        if not pid:
+            return
+        if os.WIFSIGNALED(status):
+            rc = -os.WTERMSIG(status)
+        else:
+            rc = os.WEXITSTATUS(status)
+        children.discard(pid)
+        _write(reply, "exit %s %s" % (pid, rc))
+
+
+def main(modules = None):
+    """
+    Entry point of a worker: imports the modules (by default those given
+    on the command line) and then forks a child for each job read from
+    stdin until stdin closes, exiting once the last child has finished.
+    """
+    if sys.path and sys.path[0] == "":
+        del sys.path[0]
+    if modules is None:
+        modules = sys.argv[1:]
+
+    # Replies go over the original stdout. Anything else printed by the
+    # worker goes to its stderr.
+    commands = 0
+    reply = os.dup(1)
+    os.dup2(2, 1)
+
+    for name in modules:
+        try:
+            __import__(name)
+        except:
+            print >>sys.stderr, "Failed to import %s" % name
+            traceback.print_exc()
+
+    # SIGCHLD wakes up the select() below via a pipe
+    wake_r, wake_w = os.pipe()
+    for fd in (wake_r, wake_w):
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    def wake(signum, frame):
+        try:
+            os.write(wake_w, "x")
+        except OSError:
+            pass
+    signal.signal(signal.SIGCHLD, wake)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    private = [commands, reply, wake_r, wake_w]
+
+    _write(reply, "ready")
+    children = set()
+    buf = ""
+    reading = True
+    while reading or children:
+        watch = [wake_r]
+        if reading:
+            watch.append(commands)
+        try:
+            readable = select.select(watch, [], [], 5.0)[0]
+        except select.error, se:
+            if se.args[0] != errno.EINTR:
+                raise
+            readable = []
+
+        if wake_r in readable:
+            try:
+                os.read(wake_r, 4096)
+            except OSError:
+                pass
+
+        if commands in readable:
+            data = os.read(commands, 65536)
+            if not data:
+                reading = False
+            buf += data
+            while "\n" in buf:
+                line, buf = buf.split("\n", 1)
+                try:
+                    job = pickle.loads(line.decode("hex"))
+                    pid = _spawn(job, private)
+                except:
+                    _write(reply, "error %s" % str(sys.exc_info()[1]).replace("\n", " "))
+                    continue
+                children.add(pid)
+                _write(reply, "started %s" % pid)
+
+        _reap(children, reply)
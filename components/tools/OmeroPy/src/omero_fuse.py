@@ -2,9 +2,9 @@
 
 #
 # omero_fuse.py - FUSE based OMERO client
-# 
+#
 # Copyright (c) 2009 Glencoe Software, Inc. All rights reserved.
-# 
+#
 # This software is distributed under the terms described by the LICENCE file
 # you can find at the root of the distribution bundle, which states you are
 # free to use it only for non commercial purposes.
@@ -20,9 +20,19 @@ from sys import argv, exit, stdout
 from time import time
 from types import StringTypes
 from array import array
+import threading
 import os
+import re
 
-from fuse import FUSE, Operations, LoggingMixIn
+try:
+    from fuse import FUSE, Operations, LoggingMixIn
+except ImportError:
+    # Allows the storage to be driven directly, e.g. by benchmarks
+    FUSE = None
+    class Operations(object):
+        pass
+    class LoggingMixIn(object):
+        pass
 
 import logging
 logging.basicConfig(level=logging.DEBUG,
@@ -31,15 +41,255 @@ logging.basicConfig(level=logging.DEBUG,
                     )
 
 import omero
+from omero.rtypes import rlong, unwrap
+
+# Directory names are $ObjectType$ID
+PATH_REGEX = re.compile(r'^([A-Za-z]+)(\d+)$')
+
+# Seconds for which resolved paths and directory listings are trusted
+DEFAULT_TTL = 60
+
+# Bytes of rendered image data kept in memory
+DEFAULT_CACHE_BYTES = 64*1024*1024
+
+# Seconds between polls of the server's event log for changes
+DEFAULT_POLL_INTERVAL = 10
+
+# Files available in each image directory and the planes to choose from
+IMAGE_FILES = ['image.jpg', 'thumb.jpg', 'packedint']
+IMAGE_CONTEXTS = ['Z', 'T']
+
+# Size of the thumbnails returned by getThumbnail()
+THUMBNAIL_SIZE = 64
+
+class TTLCache(object):
+    """
+    Dictionary keyed by path whose entries expire after ttl seconds.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """Returns the entry for key or raises KeyError if missing or stale."""
+        self.lock.acquire()
+        try:
+            expires, value = self.data[key]
+            if expires < time():
+                del self.data[key]
+                raise KeyError(key)
+            return value
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        self.lock.acquire()
+        try:
+            self.data[key] = (time() + self.ttl, value)
+        finally:
+            self.lock.release()
+
+    def discard(self, key):
+        """Drops key only, leaving the entries below it."""
+        self.lock.acquire()
+        try:
+            self.data.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def keys(self):
+        self.lock.acquire()
+        try:
+            return self.data.keys()
+        finally:
+            self.lock.release()
+
+    def invalidate(self, path=None):
+        """Drops path and everything below it, or everything if None."""
+        self.lock.acquire()
+        try:
+            if path is None:
+                self.data.clear()
+                return
+            prefix = path.rstrip('/') + '/'
+            for key in self.data.keys():
+                if key == path or key.startswith(prefix):
+                    del self.data[key]
+        finally:
+            self.lock.release()
+
+class LRUCache(object):
+    """
+    Keeps the most recently used strings up to a total of budget bytes.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.tick = 0
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.data[key]
+            self.tick += 1
+            entry[0] = self.tick
+            return entry[1]
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        self.lock.acquire()
+        try:
+            self.discard(key)
+            if len(value) > self.budget:
+                return
+            self.tick += 1
+            self.data[key] = [self.tick, value]
+            self.size += len(value)
+            while self.size > self.budget:
+                oldest = min(self.data.items(), key=lambda x: x[1][0])[0]
+                self.discard(oldest)
+        finally:
+            self.lock.release()
+
+    def discard(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.data.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+        finally:
+            self.lock.release()
+
+    def discard_if(self, predicate):
+        self.lock.acquire()
+        try:
+            for key in self.data.keys():
+                if predicate(key):
+                    self.discard(key)
+        finally:
+            self.lock.release()
+
+class ImageNode(object):
+    """
+    A directory inside an image directory. The path below the image
+    chooses the plane to render, e.g. Image1/Z/3/T/2/image.jpg.
+    """
+
+    def __init__(self, image, z=0, t=0, available=None, context=None):
+        self.image = image
+        self.z = z
+        self.t = t
+        if available is None:
+            available = list(IMAGE_CONTEXTS)
+        self.available = available
+        self.context = context
+
+    def child(self, name):
+        if self.context:
+            try:
+                value = int(name)
+            except ValueError:
+                return None
+            if self.context == 'Z':
+                return ImageNode(self.image, value, self.t, self.available)
+            return ImageNode(self.image, self.z, value, self.available)
+        if name in self.available:
+            available = [x for x in self.available if x != name]
+            return ImageNode(self.image, self.z, self.t, available, name)
+        if name in IMAGE_FILES:
+            return ImageFile(self.image, name, self.z, self.t)
+        return None
+
+    def listdir(self):
+        if self.context == 'Z':
+            return ['%i' % x for x in range(self.image.getSizeZ())]
+        if self.context == 'T':
+            return ['%i' % x for x in range(self.image.getSizeT())]
+        return IMAGE_FILES + self.available
+
+class ImageFile(object):
+    """
+    A rendered representation of an image plane.
+    """
+
+    def __init__(self, image, kind, z, t):
+        self.image = image
+        self.kind = kind
+        self.z = z
+        self.t = t
+        # Thumbnails do not depend on the plane
+        if kind == 'thumb.jpg':
+            self.key = (image.id, kind)
+        else:
+            self.key = (image.id, kind, z, t)
+
+    def render(self):
+        image = self.image
+        if self.kind == 'image.jpg':
+            return image.renderJpeg(self.z, self.t)
+        if self.kind == 'thumb.jpg':
+            return image.getThumbnail()
+        rv = array('i')
+        image._prepareRenderingEngine()
+        rv.fromlist(image._re.renderAsPackedInt(image._pd))
+        return rv.tostring()
+
+    def estimate(self):
+        """
+        Returns the size reported before the file has been rendered. This
+        is exact for packedint and an upper bound for the JPEG files,
+        which readers will see end early.
+        """
+        if self.kind == 'thumb.jpg':
+            return THUMBNAIL_SIZE * THUMBNAIL_SIZE * 3 + 1024
+        pixels = self.image.getSizeX() * self.image.getSizeY()
+        if self.kind == 'packedint':
+            return pixels * array('i').itemsize
+        return pixels * 3 + 1024
+
+class EventLogPoller(threading.Thread):
+    """
+    Polls the event log of the server every interval seconds, handing the
+    changes to BlitzStorage.poll_events() so that they show up before the
+    cached entries expire.
+    """
+
+    def __init__(self, storage, interval=DEFAULT_POLL_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.storage = storage
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.isSet():
+            try:
+                self.storage.poll_events()
+            except Exception:
+                logging.exception('Failed to poll the event log')
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
 
 class BlitzStorage(LoggingMixIn, Operations):
     """
     This is a demo implementation of a FUSE client for OMERO.
     Done using MacFUSE, and only tested in OSX 10.5.
     It's really just a proof of concept at this stage, so use it at your own risk.
-    - The performance is really bad, compared to what it can be if simple caching is implemented, because for every path
-      operation the object tree needs to be traversed, and every time a jpeg representation of an image is accessed
-      (for reading or simply for checking the size) the image is rendered.
+    - Resolved paths and directory listings are cached for ttl seconds, so the object tree
+      is only traversed when something is not cached. Unless poll is 0, an EventLogPoller
+      invalidates what changes on the server every poll seconds, so changes show up earlier.
+    - Rendered files are kept in an LRU cache of cache_bytes and their sizes are remembered,
+      so neither getattr() nor repeated reads render an image again. An open file keeps its
+      data until it is released, however large. Until a file has been rendered, getattr()
+      reports an upper bound of its size, then its real size.
     - Only simple access is implemented. You get the Project list at the mount root, dataset and image from there.
     - Images can be rendered as full size image or thumbnail, both as jpeg.
     - the 'packedint' file has an RGB representation of the image.
@@ -50,75 +300,181 @@ class BlitzStorage(LoggingMixIn, Operations):
     I tried to quickly implement TIFF access to the images, but couldn't do multiple planes on a single tiff using the
     available python libs. Maybe shoot for OME-TIFF directly wouldn't be a bad idea ;)
     """
-    def __init__(self, username, password):
-        self.client = omero.client_wrapper(username, password)
-        self.client.connect()
+    def __init__(self, username=None, password=None, client=None,
+                 ttl=DEFAULT_TTL, cache_bytes=DEFAULT_CACHE_BYTES, poll=0):
+        if client is None:
+            client = omero.client_wrapper(username, password)
+            client.connect()
+        self.client = client
         self.files = {}
         self.fd = []
+        self.objects = TTLCache(ttl)
+        self.listings = TTLCache(ttl)
+        self.sizes = {}
+        self.content = LRUCache(cache_bytes)
         now = time()
         self.files['/'] = dict(st_mode=(S_IFDIR | 0755), st_ctime=now,
             st_mtime=now, st_atime=now)
+        self.last_event = None
+        self.poller = None
+        if poll:
+            self.poller = EventLogPoller(self, poll)
+            self.poller.start()
 
-    def _resolvePath (self, path, fd=None):
-        if isinstance(path, StringTypes):
-            path = path.split('/')
-        print path
-        if path[0] == '':
-            if len(path) == 1:
-                return None
-            fd = self.client
-            path.pop(0)
-        gp = PATH_REGEX.match(path[0]).groups()
-        if hasattr(fd, 'CHILD_WRAPPER_CLASS'):
-            if fd.OMERO_CLASS == 'Image':
-                children = None
-                if fd._fs_meta['context']:
-                    fd._fs_meta[fd._fs_meta['context']] = long(path[0])
-                    fd._fs_meta['context'] = None
-                elif path[0] in fd._fs_meta['available_context']:
-                    fd._fs_meta['available_context'].pop(fd._fs_meta['available_context'].index(path[0]))
-                    fd._fs_meta['context'] = path[0]
-            else:
-                children = fd.listChildren()
+    def invalidate(self, path=None):
+        """
+        Event hook: forgets everything cached for path and below it, or
+        for the whole tree if path is None. Rendered data of an image is
+        dropped when the image itself or one of its parents is given.
+        """
+        if path is None:
+            self.objects.invalidate()
+            self.listings.invalidate()
+            self.sizes.clear()
+            self.content.discard_if(lambda key: True)
+            return
+        images = set()
+        prefix = path.rstrip('/') + '/'
+        self.objects.lock.acquire()
+        try:
+            for key, (expires, node) in self.objects.data.items():
+                if key == path or key.startswith(prefix):
+                    if isinstance(node, ImageNode):
+                        images.add(node.image.id)
+            self.objects.invalidate(path)
+        finally:
+            self.objects.lock.release()
+        self.listings.invalidate(path)
+        for key in self.sizes.keys():
+            if key[0] in images:
+                self.sizes.pop(key, None)
+        self.content.discard_if(lambda key: key[0] in images)
+
+    def invalidate_object(self, kind, id):
+        """
+        Event hook: forgets what is cached for the object of class kind,
+        e.g. "Dataset", and id. The parent of a link is not known, so a
+        changed link drops every listing, and a changed rendering setting
+        or thumbnail drops every rendered file.
+        """
+        if kind in ('Project', 'Dataset', 'Image'):
+            name = '%s%i' % (kind, id)
+            paths = [key for key in self.objects.keys()
+                     if key.rsplit('/', 1)[-1] == name]
+            if kind == 'Project':
+                self.listings.discard('/')
+            for path in paths:
+                self.invalidate(path)
+                self.listings.discard(path.rsplit('/', 1)[0] or '/')
+        elif kind in ('ProjectDatasetLink', 'DatasetImageLink'):
+            self.objects.invalidate()
+            self.listings.invalidate()
+        elif kind in ('Pixels', 'RenderingDef', 'Thumbnail'):
+            self.sizes.clear()
+            self.content.discard_if(lambda key: True)
+
+    def poll_events(self):
+        """
+        Hands the objects changed since the last call, as logged in the
+        event log of the server, to invalidate_object(). The first call
+        only records where the event log ends.
+        """
+        query_service = self.client.getQueryService()
+        if self.last_event is None:
+            rv = query_service.projection(
+                'select max(el.id) from EventLog el', None)
+            self.last_event = unwrap(rv[0][0]) or 0
+            return
+        params = omero.sys.Parameters()
+        params.map = {'id': rlong(self.last_event)}
+        rv = query_service.projection(
+            'select el.id, el.entityType, el.entityId from EventLog el '
+            'where el.id > :id order by el.id', params)
+        for row in rv:
+            event_id, entity_type, entity_id = unwrap(row)
+            self.last_event = event_id
+            self.invalidate_object(entity_type.rsplit('.', 1)[-1], entity_id)
+
+    def _children (self, path):
+        """
+        Returns the wrappers below a Project or Dataset path (or the
+        Projects for '/') keyed by their directory name.
+        """
+        try:
+            return self.listings.get(path)
+        except KeyError:
+            pass
+        if path == '/':
+            children = self.client.listProjects()
         else:
-            children = fd.listProjects()
-        if children:
-            for e in  children:
-                if e.OMERO_CLASS==gp[0] and e.id == long(gp[1]):
-                    fd = e
-                    if fd.OMERO_CLASS == 'Image':
-                        fd._fs_meta = {'Z':0, 'T':0, 'context':None, 'available_context':['Z', 'T']}
-                    break
-                else:
-                    fd = None
-        if len(path) == 1:
-            if path[0] == 'image.jpg':
-                def t ():
-                    return fd.renderJpeg(fd._fs_meta['Z'],fd._fs_meta['T'])
-                return t
-            elif path[0] == 'thumb.jpg':
-                return fd.getThumbnail
-            elif path[0] == 'packedint':
-                def t ():
-                    rv = array('i')
-                    fd._prepareRenderingEngine()
-                    rv.fromlist(fd._re.renderAsPackedInt(fd._pd))
-                    return rv.tostring()
-                return t
-            return fd
+            node = self._resolvePath(path)
+            if node is None or isinstance(node, (ImageNode, ImageFile)):
+                return None
+            children = node.listChildren()
+        rv = {}
+        for child in children:
+            rv['%s%i' % (child.OMERO_CLASS, child.id)] = child
+        self.listings.put(path, rv)
+        return rv
+
+    def _resolvePath (self, path):
+        """
+        Returns the wrapper, ImageNode or ImageFile for path or None.
+        """
+        path = '/' + path.strip('/')
+        if path == '/':
+            return None
+        try:
+            return self.objects.get(path)
+        except KeyError:
+            pass
+        parent, name = path.rsplit('/', 1)
+        if not parent:
+            parent = '/'
+        node = None
+        if parent == '/':
+            parent_node = None
         else:
-            return self._resolvePath(path[1:], fd)
+            parent_node = self._resolvePath(parent)
+        if isinstance(parent_node, ImageNode):
+            node = parent_node.child(name)
+        elif parent == '/' or parent_node is not None:
+            if PATH_REGEX.match(name) and not isinstance(parent_node, ImageFile):
+                children = self._children(parent)
+                if children:
+                    node = children.get(name)
+                if node is not None and node.OMERO_CLASS == 'Image':
+                    node = ImageNode(node)
+        if node is not None:
+            self.objects.put(path, node)
+        return node
 
-    def _stat (self, bobj):
-        if not bobj:
+    def _render (self, node):
+        """
+        Returns the content of a file, rendering it only if not cached.
+        """
+        try:
+            return self.content.get(node.key)
+        except KeyError:
+            pass
+        data = node.render()
+        self.sizes[node.key] = len(data)
+        self.content.put(node.key, data)
+        return data
+
+    def _stat (self, node):
+        if not node:
             return None
-        if callable(bobj):
+        if isinstance(node, ImageFile):
             mode = S_IFREG
-            st_size = len(bobj())
+            st_size = self.sizes.get(node.key)
+            if st_size is None:
+                st_size = node.estimate()
         else:
             mode = S_IFDIR
             st_size = 1
-        return dict(st_mode=(mode | 0755), st_ctime=time(), st_mtime=time(), st_atime=time(),
+        now = time()
+        return dict(st_mode=(mode | 0755), st_ctime=now, st_mtime=now, st_atime=now,
                     st_size=st_size)
 
 #    def chmod(self, path, mode):
@@ -126,7 +482,7 @@ class BlitzStorage(LoggingMixIn, Operations):
 #
 #    def chown(self, path, uid, gid):
 #        return 0
-#    
+#
 #    def create(self, path, mode):
 #        return self.fd
 
@@ -135,10 +491,15 @@ class BlitzStorage(LoggingMixIn, Operations):
         if path == '/':
             # Add 2 for `.` and `..` , subtruct 1 for `/`
             st = self.files[path]
-            st = self.files[path]
             st['st_nlink'] = len(self.files) + 1
         else:
-            st = self._stat(self._resolvePath(path))
+            node = self._resolvePath(path)
+            st = self._stat(node)
+            # An open file knows its real size even if the cache forgot it
+            if st and fh is not None and fh < len(self.fd) \
+                    and self.fd[fh] is not None \
+                    and self.fd[fh][0].key == getattr(node, 'key', None):
+                st['st_size'] = len(self.fd[fh][1])
         if not st:
             raise OSError(ENOENT)
         return st
@@ -148,36 +509,37 @@ class BlitzStorage(LoggingMixIn, Operations):
 
     def open(self, path, flags):
         # TODO: I'm always assuming read, but not verifying
+        node = self._resolvePath(path)
+        if not isinstance(node, ImageFile):
+            raise OSError(ENOENT)
+        # Render now so that errors are reported by open(), and keep the
+        # data until release() since the cache may not hold on to it
+        data = self._render(node)
         if None in self.fd:
             idx = self.fd.index(None)
-            self.fd[idx] = self._resolvePath(path)()
+            self.fd[idx] = (node, data)
             rv = idx
         else:
-            self.fd.append(self._resolvePath(path)())
+            self.fd.append((node, data))
             rv = len(self.fd)-1
         return rv
 
     def read(self, path, size, offset, fh):
-        return self.fd[fh][offset:offset+size]
+        return self.fd[fh][1][offset:offset+size]
 
     def readdir(self, path, fh):
         if path == '/':
-            files = ['Project%i' % x.id for x in self.client.listProjects()]
+            files = sorted(self._children('/').keys())
         else:
-            p = self._resolvePath(path)
-            if p:
-                if p.OMERO_CLASS == 'Image':
-                    meta = getattr(p, '_fs_meta', {})
-                    print meta
-                    if meta.get('context', None) == 'Z':
-                        files = ['%i' % x for x in range(p.getSizeZ())]
-                    elif meta.get('context', None) == 'T':
-                        files = ['%i' % x for x in range(p.getSizeT())]
-                    else:
-                        files = ['image.jpg', 'thumb.jpg', 'packedint']
-                        files.extend(meta.get('available_context', []))
-                else:
-                    files = ['%s%i' % (x.OMERO_CLASS, x.id) for x in p.listChildren()]
+            node = self._resolvePath(path)
+            if isinstance(node, ImageNode):
+                try:
+                    files = self.listings.get(path)
+                except KeyError:
+                    files = node.listdir()
+                    self.listings.put(path, files)
+            elif node is not None and not isinstance(node, ImageFile):
+                files = sorted(self._children(path).keys())
             else:
                 files = []
         return ['.','..'] + files
@@ -192,25 +554,25 @@ class BlitzStorage(LoggingMixIn, Operations):
 
 #    def rename(self, old, new):
 #        return 0
-#    
+#
 #    def rmdir(self, path):
 #        return 0
 
     def statfs(self, path):
         return dict(f_bsize=512, f_blocks=4096, f_bavail=2048)
-    
+
 #    def symlink(self, target, source):
 #        return 0
-#    
+#
 #    def truncate(self, path, length, fh=None):
 #        return 0
 #
 #    def unlink(self, path):
 #        return 0
-#    
+#
 #    def utimens(self, path, times=None):
 #        return 0
-#    
+#
 #    def write(self, path, data, offset, fh):
 #        return self.fd[fh].write(data, offset)
 
@@ -218,4 +580,5 @@ if __name__ == "__main__":
     if len(argv) != 4:
         print 'usage: %s user password <mountpoint>' % argv[0]
         exit(1)
-    fuse = FUSE(BlitzStorage(argv[1],argv[2]), argv[3], foreground=True)
+    fuse = FUSE(BlitzStorage(argv[1],argv[2],poll=DEFAULT_POLL_INTERVAL),
+                argv[3], foreground=True)
@@ -63,6 +63,9 @@ class TestExport(unittest.TestCase):
     def testSimpleExport(self):
         self.invoke("x -f %s Image:3" % self.p)
 
+    def testSequentialExport(self):
+        self.invoke("x -f %s --read-ahead=1 --progress Image:3" % self.p)
+
     def testStdOutExport(self):
         """
         "-f -" should export to stdout. See ticket:7106
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+   Test of the hql plugin's streaming output
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import unittest
+from omero.cli import CLI, NonZeroReturnCode
+from omero.plugins.hql import HqlControl
+from omero.rtypes import rlong, rstring
+
+
+class MockCLI(CLI):
+
+    def __init__(self, *args, **kwargs):
+        self.output = []
+        self.client = MockClient()
+        CLI.__init__(self, *args, **kwargs)
+
+    def conn(self, args):
+        return self.client
+
+    def out(self, text, newline = True):
+        self.output.append(text)
+
+
+class MockClient(object):
+
+    def __init__(self):
+        self.sf = MockServiceFactory()
+
+
+class MockServiceFactory(object):
+
+    def __init__(self):
+        self.query = MockQueryService(2500)
+
+    def getQueryService(self):
+        return self.query
+
+
+class MockQueryService(object):
+
+    def __init__(self, count):
+        self.count = count
+        self.pages = []
+
+    def projection(self, query, params, ice_map):
+        offset = params.theFilter.offset.val
+        limit = params.theFilter.limit.val
+        self.pages.append((offset, limit))
+        stop = min(offset + limit, self.count)
+        return [[rlong(i), rstring("name,%s" % i)] for i in range(offset, stop)]
+
+
+class TestHql(unittest.TestCase):
+
+    def setUp(self):
+        self.cli = MockCLI()
+        self.cli.register("hql", HqlControl, "TEST")
+
+    def invoke(self, string):
+        self.cli.invoke(string, strict=True)
+
+    def lines(self):
+        return "".join(self.cli.output).splitlines()
+
+    def testAllCsv(self):
+        self.invoke(["hql", "--all", "--format=csv", "--page-size=1000", "q"])
+        lines = self.lines()
+        self.assertEquals("Col1,Col2", lines[0])
+        self.assertEquals('0,"name,0"', lines[1])
+        self.assertEquals(2501, len(lines))
+        # One write per page
+        self.assertEquals(3, len(self.cli.output))
+        self.assertEquals([(0, 1000), (1000, 1000), (2000, 1000)],
+                          self.cli.client.sf.query.pages)
+
+    def testAllTsvWithOffset(self):
+        self.invoke(["hql", "--all", "--format=tsv", "--offset=2400", "q"])
+        lines = self.lines()
+        self.assertEquals("2400\tname,2400", lines[1])
+        self.assertEquals(101, len(lines))
+
+    def testAllJsonl(self):
+        self.invoke(["hql", "--all", "--format=jsonl", "--page-size=2000", "q"])
+        lines = self.lines()
+        self.assertEquals(2500, len(lines))
+        self.assertEquals('[2499, "name,2499"]', lines[-1])
+
+    def testAllRequiresDelimitedFormat(self):
+        self.assertRaises(NonZeroReturnCode, self.invoke, ["hql", "--all", "q"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,6 +24,7 @@ def _additional_tests():
     suite.addTest(load("clitest.cli"))
     suite.addTest(load("clitest.db"))
     suite.addTest(load("clitest.export"))
+    suite.addTest(load("clitest.hql"))
     suite.addTest(load("clitest.java"))
     suite.addTest(load("clitest.import"))
     suite.addTest(load("clitest.node"))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+   gateway tests - Ancestry of many objects via BlitzGateway.getAncestries,
+   counting the queries made against a mock query service.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import re
+import unittest
+import omero
+import omero.gateway
+
+from omero.model import DatasetI, ExperimenterI, ImageI, PlateI, ProjectI
+from omero.model import ScreenI, WellI, WellSampleI
+from omero.rtypes import rstring, unwrap
+
+
+class MockQueryService(object):
+    """
+    Answers the parent queries of the gateway wrappers and of getAncestries
+    from an in-memory graph, counting every call.
+    """
+
+    def __init__(self, images, wellsamples, experimenters):
+        self.images = images
+        self.wellsamples = wellsamples
+        self.experimenters = experimenters
+        self.calls = []
+
+    def ids(self, query, params):
+        m = re.search(r"id\s*=\s*(\d+)", query)
+        if m:
+            return [long(m.group(1))]
+        return unwrap(params.map["ids"])
+
+    def findAllByQuery(self, query, params, ctx=None):
+        self.calls.append(query)
+        ids = self.ids(query, params)
+        if "DatasetImageLink" in query:
+            return [l for i in ids if i in self.images for l in self.images[i].copyDatasetLinks()]
+        if "ProjectDatasetLink" in query:
+            datasets = dict([(l.parent.id.val, l.parent) for i in self.images.values() for l in i.copyDatasetLinks()])
+            return [l for i in ids if i in datasets for l in datasets[i].copyProjectLinks()]
+        if "ScreenPlateLink" in query:
+            plates = dict([(ws.well.plate.id.val, ws.well.plate) for ws in self.wellsamples])
+            return [l for i in ids if i in plates for l in plates[i].copyScreenLinks()]
+        if "WellSample" in query and "image.id" in query:
+            return [ws for ws in self.wellsamples if ws.image.id.val in ids]
+        if "WellSample" in query:
+            return [ws for ws in self.wellsamples if ws.id.val in ids]
+        raise AssertionError("unexpected query: %s" % query)
+
+    def findByQuery(self, query, params, ctx=None):
+        self.calls.append(query)
+        if "Experimenter" in query:
+            return self.experimenters[self.ids(query, params)[0]]
+        raise AssertionError("unexpected query: %s" % query)
+
+
+class MockGateway(omero.gateway.BlitzGateway):
+
+    def __init__(self, query):
+        self.query = query
+        self.SERVICE_OPTS = None
+
+    def getQueryService(self):
+        return self.query
+
+
+class AncestryTest (unittest.TestCase):
+
+    def setUp (self):
+        """
+        Images 1-6 in datasets 10 and 11 of project 20, images 7-9 in
+        dataset 12 which has no project and images 31-33 in wells of
+        plate 50 in screen 60. Image 40 has no parents.
+        """
+        owner = ExperimenterI(2, True)
+        owner.firstName = rstring("Jane")
+        owner.lastName = rstring("Doe")
+        project = ProjectI(20, True)
+        datasets = [DatasetI(i, True) for i in (10, 11, 12)]
+        datasets[0].linkProject(project)
+        datasets[1].linkProject(project)
+        images = {}
+        for i in range(1, 10) + [31, 32, 33, 40]:
+            images[i] = ImageI(i, True)
+            images[i].details.owner = ExperimenterI(2, False)
+        for i in range(1, 10):
+            images[i].linkDataset(datasets[(i - 1) / 3])
+        screen = ScreenI(60, True)
+        plate = PlateI(50, True)
+        plate.linkScreen(screen)
+        wellsamples = []
+        for i in (31, 32, 33):
+            well = WellI(i + 100, True)
+            well.plate = plate
+            ws = WellSampleI(i + 200, True)
+            ws.well = well
+            ws.image = ImageI(i, False)
+            wellsamples.append(ws)
+        self.query = MockQueryService(images, wellsamples, {2: owner})
+        self.gateway = MockGateway(self.query)
+        self.images = images
+
+    def wrappers (self, ids):
+        return [omero.gateway.ImageWrapper(self.gateway, self.images[i]) for i in ids]
+
+    def describe (self, ancestry):
+        return [(p.OMERO_CLASS, p.getId()) for p in ancestry]
+
+    def testImageAncestries (self):
+        rv = self.gateway.getAncestries("Image", [1, 5, 8, 31, 40])
+        self.assertEquals(2, len(self.query.calls))
+        self.assertEquals([("Dataset", 10), ("Project", 20)], self.describe(rv[1]))
+        self.assertEquals([("Dataset", 11), ("Project", 20)], self.describe(rv[5]))
+        self.assertEquals([("Dataset", 12)], self.describe(rv[8]))
+        self.assertEquals([("WellSample", 231), ("Well", 131), ("Plate", 50), ("Screen", 60)],
+                          self.describe(rv[31]))
+        self.assertEquals([], rv[40])
+        # Walking the returned ancestors makes no further queries
+        self.assertEquals(None, rv[1][-1].getParent())
+        self.assertEquals(2, len(self.query.calls))
+
+    def testSameAsGetAncestry (self):
+        ids = range(1, 10)
+        expected = dict([(w.getId(), self.describe(w.getAncestry())) for w in self.wrappers(ids)])
+        per_object = len(self.query.calls)
+        self.assertEquals(3 * len(ids), per_object)
+        self.query.calls = []
+        rv = self.gateway.getAncestries("Image", ids)
+        self.assertEquals(2, len(self.query.calls))
+        self.assertEquals(expected, dict([(k, self.describe(v)) for k, v in rv.items()]))
+
+    def testWrappersRemember (self):
+        images = self.wrappers([1, 2, 8, 40])
+        self.gateway.getAncestries("Image", images)
+        self.assertEquals(2, len(self.query.calls))
+        self.assertEquals(10, images[0].getParent().getId())
+        self.assertEquals(10, images[0].getDataset().getId())
+        self.assertEquals(20, images[1].getProject().getId())
+        self.assertEquals([("Dataset", 12)], self.describe(images[2].getAncestry()))
+        self.assertEquals(None, images[2].getProject())
+        self.assertEquals(None, images[3].getParent())
+        self.assertEquals(None, images[3].getDataset())
+        self.assertEquals(2, len(self.query.calls))
+        self.assertEquals("Jane Doe", images[0].getAuthor())
+        self.assertEquals("Jane Doe", images[0].getAuthor())
+        self.assertEquals(3, len(self.query.calls))
+
+    def testParentMemo (self):
+        image = self.wrappers([4])[0]
+        image.getParent()
+        image.getParent()
+        image.getAncestry()
+        self.assertEquals(3, len(self.query.calls))
+
+    def testOtherTypes (self):
+        rv = self.gateway.getAncestries("Dataset", [10, 12])
+        self.assertEquals([("Project", 20)], self.describe(rv[10]))
+        self.assertEquals([], rv[12])
+        rv = self.gateway.getAncestries("Plate", [50])
+        self.assertEquals([("Screen", 60)], self.describe(rv[50]))
+        self.assertEquals(2, len(self.query.calls))
+        self.assertEquals({}, self.gateway.getAncestries("Image", []))
+        self.assertEquals(2, len(self.query.calls))
+        self.assertRaises(AttributeError, self.gateway.getAncestries, "Experimenter", [2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+   gateway tests - Batched countChildren and listChildren of sibling
+   wrappers, counting the calls made against mock services.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import gc
+import unittest
+import omero
+import omero.gateway
+
+from omero.model import DatasetI, ImageI, ProjectI
+from omero.rtypes import rstring, unwrap
+
+
+class MockServices(object):
+    """
+    Query and container service over projects with datasets with images,
+    counting every call.
+    """
+
+    def __init__(self, projects):
+        self.projects = dict([(p.id.val, p) for p in projects])
+        self.datasets = dict([(l.child.id.val, l.child) for p in projects for l in p.copyDatasetLinks()])
+        self.calls = []
+
+    def links(self, query, ids):
+        if query.startswith("select c from ProjectDatasetLink"):
+            parents = self.projects
+            links = lambda p: p.copyDatasetLinks()
+        else:
+            parents = self.datasets
+            links = lambda d: d.copyImageLinks()
+        rv = [l for i in ids if i in parents for l in links(parents[i])]
+        rv.sort(key = lambda l: l.child.name.val)
+        return rv
+
+    def findAllByQuery(self, query, params, ctx=None):
+        self.calls.append(query)
+        if query.startswith("select obj from Project"):
+            return [self.projects[i] for i in unwrap(params.map["ids"])]
+        if "dsid" in params.map:
+            return self.links(query, [unwrap(params.map["dsid"])])
+        return self.links(query, unwrap(params.map["ids"]))
+
+    def getCollectionCount(self, type, property, ids, options, ctx=None):
+        self.calls.append((type, property, tuple(ids)))
+        parents = type == "Project" and self.projects or self.datasets
+        return dict([(i, len(getattr(parents[i], "copy%s" % property[0].upper() + property[1:])())) for i in ids])
+
+
+class MockGateway(omero.gateway.BlitzGateway):
+
+    def __init__(self, services):
+        self.services = services
+        self.SERVICE_OPTS = None
+
+    def getQueryService(self):
+        return self.services
+
+    def getContainerService(self):
+        return self.services
+
+
+class BatchingTest (unittest.TestCase):
+
+    def setUp (self):
+        """ 3 projects with 4 datasets each, dataset n has n % 5 images """
+        projects = []
+        for p in range(3):
+            project = ProjectI(p + 1, True)
+            project.name = rstring("P%s" % p)
+            for d in range(4):
+                dataset = DatasetI(10 * (p + 1) + d, True)
+                dataset.name = rstring("D%s" % (3 - d))
+                project.linkDataset(dataset)
+                for i in range(dataset.id.val % 5):
+                    image = ImageI(100 * dataset.id.val + i, True)
+                    image.name = rstring("I%s" % i)
+                    dataset.linkImage(image)
+            projects.append(project)
+        self.services = MockServices(projects)
+        self.gateway = MockGateway(self.services)
+
+    def tree (self):
+        rv = []
+        for p in self.gateway.getObjects("Project", [1, 2, 3]):
+            datasets = []
+            for d in p.listChildren():
+                datasets.append((d.getId(), d.countChildren(), [i.getId() for i in d.listChildren()]))
+            rv.append((p.getId(), p.countChildren(), datasets))
+        return rv
+
+    def testBatchedTree (self):
+        expected = self.tree()
+        # getObjects, then per project: count, list, and per dataset: count, list
+        self.assertEquals(1 + 3 * (2 + 4 * 2), len(self.services.calls))
+        self.services.calls = []
+        self.gateway.setBatching()
+        self.assertTrue(self.gateway.isBatching())
+        self.assertEquals(expected, self.tree())
+        # getObjects, one count and one list of projects, then of the datasets of each project
+        self.assertEquals(1 + 2 + 3 * 2, len(self.services.calls))
+        self.assertTrue(("Project", "datasetLinks", (1, 2, 3)) in self.services.calls)
+
+    def testChildrenOrdered (self):
+        self.gateway.setBatching()
+        p = list(self.gateway.getObjects("Project", [1]))[0]
+        self.assertEquals(["D0", "D1", "D2", "D3"], [d.getName() for d in p.listChildren()])
+
+    def testCountCached (self):
+        self.gateway.setBatching()
+        projects = list(self.gateway.getObjects("Project", [1, 2, 3]))
+        self.assertEquals([4, 4, 4], [p.countChildren_cached() for p in projects])
+        self.assertEquals([4, 4, 4], [p.countChildren_cached() for p in projects])
+        self.assertEquals(2, len(self.services.calls))
+
+    def testFilteredNotBatched (self):
+        self.gateway.setBatching()
+        projects = list(self.gateway.getObjects("Project", [1, 2]))
+        self.services.calls = []
+        list(projects[0].listChildren(params=omero.sys.Parameters()))
+        list(projects[1].listChildren(params=omero.sys.Parameters()))
+        self.assertEquals(2, len(self.services.calls))
+        self.gateway.setBatching(False)
+        self.assertFalse(self.gateway.isBatching())
+
+    def testNoGarbage (self):
+        """ Dropped batched wrappers are collected, ImageWrapper.__del__ and all """
+        self.gateway.setBatching()
+        gc.collect()
+        garbage = len(gc.garbage)
+        images = []
+        for p in self.gateway.getObjects("Project", [1]):
+            for d in p.listChildren():
+                d.countChildren()
+                images.extend(d.listChildren())
+        self.assertTrue(images)
+        self.assertTrue(isinstance(images[0], omero.gateway._ImageWrapper))
+        del p, d, images
+        gc.collect()
+        self.assertEquals(garbage, len(gc.garbage))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+   gateway tests - Plate grids loaded with PlateWrapper.getWellGridData,
+   against a fake query service holding synthetic plates.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import unittest
+import omero
+import omero.gateway
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from omero.model import EventI, ExperimenterI, ImageI, PixelsI, PlateI
+from omero.model import WellI, WellSampleI
+from omero.rtypes import rint, rstring, rtime, unwrap
+
+
+def synthetic_plate(pid, rows, columns, fields=2):
+    """
+    A plate of rows x columns wells with fields images each, leaving out
+    every 7th well and the last field of every 5th well.
+    """
+    plate = PlateI(pid, True)
+    plate.name = rstring("plate%s" % pid)
+    wells = []
+    for r in range(rows):
+        for c in range(columns):
+            n = r * columns + c
+            if n % 7 == 3:
+                continue
+            well = WellI(pid * 100000 + n, True)
+            well.row = rint(r)
+            well.column = rint(c)
+            well.plate = plate
+            for f in range(fields - (n % 5 == 0 and 1 or 0)):
+                image = ImageI(pid * 1000000 + n * 10 + f, True)
+                image.name = rstring("%s%s f%s" % (chr(ord('A') + r % 26), c + 1, f))
+                image.acquisitionDate = rtime(n % 3 and 1300000000000L + n * 1000 or 0)
+                image.details.owner = ExperimenterI(1 + n % 2, False)
+                image.details.creationEvent = EventI(1, False)
+                image.details.creationEvent._time = rtime(1290000000000L)
+                pixels = PixelsI(image.id.val, True)
+                pixels.sizeX = rint(512)
+                pixels.sizeY = rint(512)
+                pixels.sizeZ = rint(1)
+                pixels.sizeC = rint(3)
+                pixels.sizeT = rint(1)
+                image.addPixels(pixels)
+                ws = WellSampleI(image.id.val, True)
+                ws.image = image
+                well.addWellSample(ws)
+            wells.append(well)
+    return plate, wells
+
+
+class FakeQueryService(object):
+    """
+    Answers the well queries of PlateWrapper and the projections of
+    getWellGridData from synthetic plates, counting every call.
+    """
+
+    def __init__(self, plates):
+        self.plates = plates
+        self.experimenters = {}
+        for eid, first, last in ((1, "Jane", "Doe"), (2, "John", "Roe")):
+            e = ExperimenterI(eid, True)
+            e.firstName = rstring(first)
+            e.lastName = rstring(last)
+            self.experimenters[eid] = e
+        self.calls = []
+
+    def findAllByQuery(self, query, params, ctx=None):
+        self.calls.append(query)
+        return self.plates[unwrap(params.map["oid"])][1]
+
+    def findByQuery(self, query, params, ctx=None):
+        self.calls.append(query)
+        return self.experimenters[int(query.split("=")[-1])]
+
+    def projection(self, query, params, ctx=None):
+        self.calls.append(query)
+        wells = self.plates[unwrap(params.map["pid"])][1]
+        if query.startswith("select max("):
+            if not wells:
+                return [[None, None]]
+            return [[rint(max([w.row.val for w in wells])),
+                     rint(max([w.column.val for w in wells]))]]
+        index = unwrap(params.map["index"])
+        rv = []
+        for well in wells:
+            samples = well.copyWellSamples()
+            if len(samples) <= index:
+                continue
+            image = samples[index].image
+            owner = self.experimenters[image.details.owner.id.val]
+            pixels = image.copyPixels()[0]
+            rv.append([well.id, well.row, well.column, image.id, image.name, image.description,
+                       image.acquisitionDate, image.details.creationEvent._time,
+                       owner.firstName, owner.lastName, pixels.sizeX, pixels.sizeY,
+                       pixels.sizeZ, pixels.sizeC, pixels.sizeT])
+        return rv
+
+
+class FakeGateway(omero.gateway.BlitzGateway):
+
+    def __init__(self, query):
+        self.query = query
+        self.SERVICE_OPTS = None
+
+    def getQueryService(self):
+        return self.query
+
+
+def wrapper_grid(plate, field, xtra):
+    """ The plate grid as webgateway built it from getWellGrid() """
+    grid = []
+    for row in plate.getWellGrid(field):
+        tr = []
+        for e in row:
+            i = e and e.getImage() or None
+            if i:
+                t = i.simpleMarshal(xtra=xtra)
+                t['wellId'] = e.getId()
+                t['field'] = field
+                tr.append(t)
+            else:
+                tr.append(None)
+        grid.append(tr)
+    return grid
+
+
+class PlateGridTest (unittest.TestCase):
+
+    def setUp (self):
+        self.plates = {1: synthetic_plate(1, 8, 12), 2: synthetic_plate(2, 16, 24)}
+        self.query = FakeQueryService(self.plates)
+        self.gateway = FakeGateway(self.query)
+        self.xtra = {'thumbUrlPrefix': '/thumb/'}
+
+    def plate (self, pid):
+        return omero.gateway.PlateWrapper(self.gateway, self.plates[pid][0])
+
+    def testSameAsWellGrid (self):
+        for pid in (1, 2):
+            for field in (0, 1):
+                expected = wrapper_grid(self.plate(pid), field, self.xtra)
+                self.query.calls = []
+                grid = self.plate(pid).getWellGridData(field)
+                # The wells, then the grid size
+                self.assertEquals(2, len(self.query.calls))
+                self.assertEquals(expected, grid.toList(self.xtra))
+
+    def testGrid (self):
+        grid = self.plate(1).getWellGridData()
+        self.assertEquals((8, 12), (grid.rows, grid.columns))
+        self.assertEquals(None, grid.getWellId(0, 3))
+        self.assertEquals(None, grid.marshal(0, 3))
+        self.assertEquals(100001, grid.getWellId(0, 1))
+        self.assertEquals((512, 512, 1, 3, 1), grid.getPixelsSize(0, 1))
+        self.assertEquals(["Jane Doe", "John Roe"], sorted(grid.authors))
+        # Wells without a second field are left empty
+        grid = self.plate(1).getWellGridData(1)
+        self.assertEquals(None, grid.getWellId(0, 0))
+        self.assertEquals(1000011, grid.marshal(0, 1)['id'])
+
+    def testResize (self):
+        plate = self.plate(1)
+        grid = plate.getWellGridData()
+        expected = grid.toList()
+        plate.setGridSizeConstraints(16, 24)
+        grid.resize(plate.getGridSize()['rows'], plate.getGridSize()['columns'])
+        self.assertEquals((16, 24), (grid.rows, grid.columns))
+        self.assertEquals(expected, [row[:12] for row in grid.toList()[:8]])
+        self.assertEquals([None] * 24, grid.toList()[8])
+        self.assertEquals(2, len(self.query.calls))
+
+    def testGridSizeFromAllWells (self):
+        plate, wells = synthetic_plate(3, 4, 6)
+        # No images in the last row and column
+        for well in wells:
+            if well.row.val == 3 or well.column.val == 5:
+                well.clearWellSamples()
+        self.plates[3] = (plate, wells)
+        grid = self.plate(3).getWellGridData()
+        self.assertEquals((4, 6), (grid.rows, grid.columns))
+        self.assertEquals(None, grid.getWellId(3, 0))
+
+    def testKnownGridSize (self):
+        plate = self.plate(1)
+        plate.getGridSize()
+        self.query.calls = []
+        plate.getWellGridData()
+        self.assertEquals(1, len(self.query.calls))
+
+    def testJson (self):
+        plate = self.plate(2)
+        grid = plate.getWellGridData()
+        rv = json.loads(grid.toJson(self.xtra, collabels=plate.getColumnLabels(),
+                                    rowlabels=plate.getRowLabels()))
+        self.assertEquals(json.loads(json.dumps(grid.toList(self.xtra))), rv['grid'])
+        self.assertEquals(range(1, 25), rv['collabels'])
+        self.assertEquals(16, len(rv['rowlabels']))
+        self.assertEquals(2, len(self.query.calls))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+   gateway tests - Split channel views rendered per panel and from packed
+   ints, against a fake rendering engine.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import unittest
+import numpy
+import omero
+import omero.gateway
+
+from cStringIO import StringIO
+from omero.model import ChannelI, ImageI, PixelsI, RenderingModelI
+from omero.rtypes import rint, rstring
+
+try:
+    import Image, ImageChops
+except ImportError:
+    from PIL import Image, ImageChops
+
+
+class FakeRenderingEngine(object):
+    """
+    Renders the Z plane of the plane def of synthetic channels additively in
+    their colours, or the first active channel in grey, counting every
+    render. The default Z is the last plane. Compressed renders are
+    png unless a jpeg quality is given, so that they can be compared pixel
+    for pixel.
+    """
+
+    def __init__(self, pixels, planes, colors, jpeg=None):
+        self.pixels = pixels
+        self.planes = planes
+        self.colors = colors
+        self.active = [True] * len(planes)
+        self.jpeg = jpeg
+        self.model = "rgb"
+        self.renders = 0
+        self.defaultZ = len(planes[0]) - 1
+
+    def getPixels(self, ctx=None):
+        return self.pixels
+
+    def isActive(self, idx, ctx=None):
+        return self.active[idx]
+
+    def setActive(self, idx, active, ctx=None):
+        self.active[idx] = active
+
+    def getRGBA(self, idx, ctx=None):
+        return self.colors[idx]
+
+    def getModel(self, ctx=None):
+        m = RenderingModelI(1, True)
+        m.value = rstring(self.model)
+        return m
+
+    def getDefaultZ(self, ctx=None):
+        return self.defaultZ
+
+    def getDefaultT(self, ctx=None):
+        return 0
+
+    def setCompressionLevel(self, level, ctx=None):
+        pass
+
+    def untaint(self):
+        pass
+
+    def render(self, pd):
+        self.renders += 1
+        rgb = numpy.zeros(self.planes[0][pd.z].shape + (3,), dtype=numpy.int32)
+        for planes, color, active in zip(self.planes, self.colors, self.active):
+            if not active:
+                continue
+            plane = planes[pd.z]
+            if self.model == "greyscale":
+                return numpy.dstack([plane] * 3)
+            for i in range(3):
+                rgb[..., i] += plane * color[i] * color[3] / (255 * 255)
+        return numpy.minimum(rgb, 255)
+
+    def renderAsPackedInt(self, pd, ctx=None):
+        rgb = self.render(pd).astype(numpy.uint32)
+        packed = (0xff << 24) | (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+        return packed.view(numpy.int32).ravel().tolist()
+
+    def renderCompressed(self, pd, ctx=None):
+        out = StringIO()
+        img = Image.fromarray(self.render(pd).astype(numpy.uint8), 'RGB')
+        if self.jpeg is None:
+            img.save(out, 'png')
+        else:
+            img.save(out, 'jpeg', quality=self.jpeg)
+        return out.getvalue()
+
+
+class FakeGateway(omero.gateway.BlitzGateway):
+
+    def __init__(self):
+        self.SERVICE_OPTS = None
+
+
+def fake_image(sizeX, sizeY, sizeC, jpeg=None, sizeZ=1):
+    """ An ImageWrapper of sizeC random channels of sizeZ planes over a fake rendering engine """
+    rnd = numpy.random.RandomState(sizeC)
+    image = ImageI(1, True)
+    pixels = PixelsI(1, True)
+    pixels.sizeX = rint(sizeX)
+    pixels.sizeY = rint(sizeY)
+    pixels.sizeZ = rint(sizeZ)
+    pixels.sizeC = rint(sizeC)
+    pixels.sizeT = rint(1)
+    for c in range(sizeC):
+        pixels.addChannel(ChannelI(c + 1, True))
+    image.addPixels(pixels)
+    planes = [rnd.randint(0, 256, (sizeZ, sizeY, sizeX)) for c in range(sizeC)]
+    colors = [tuple(rnd.randint(0, 256, 3)) + (c % 2 and 255 or 200,) for c in range(sizeC)]
+    wrapper = omero.gateway.ImageWrapper(FakeGateway(), image)
+    wrapper._re = FakeRenderingEngine(pixels, planes, colors, jpeg)
+    wrapper._pd = omero.romio.PlaneDef(omero.romio.XY)
+    return wrapper
+
+
+class SplitChannelTest (unittest.TestCase):
+
+    def assertSameImage (self, a, b):
+        self.assertEquals(a.size, b.size)
+        self.assertEquals(None, ImageChops.difference(a.convert('RGB'), b.convert('RGB')).getbbox())
+
+    def testPackedSameAsPerPanel (self):
+        for c in (1, 2, 3, 5):
+            image = fake_image(64, 48, c)
+            expected = image.renderSplitChannelImage(0, 0)
+            self.assertEquals(c + 1, image._re.renders)
+            image._re.renders = 0
+            self.assertSameImage(expected, image.renderSplitChannelImage(0, 0, packed=True))
+            self.assertEquals(c, image._re.renders)
+
+    def testInactiveChannels (self):
+        image = fake_image(64, 48, 4)
+        image._re.active = [True, False, True, False]
+        expected = image.renderSplitChannelImage(0, 0)
+        image._re.renders = 0
+        self.assertSameImage(expected, image.renderSplitChannelImage(0, 0, packed=True))
+        self.assertEquals(2, image._re.renders)
+        self.assertEquals([True, False, True, False], image._re.active)
+
+    def testGreyscale (self):
+        image = fake_image(64, 48, 3)
+        image._re.model = "greyscale"
+        image.setActiveChannels((1, 2, 3))
+        expected = image.renderSplitChannelImage(0, 0)
+        image.setActiveChannels((1, 2, 3))
+        image._re.renders = 0
+        self.assertSameImage(expected, image.renderSplitChannelImage(0, 0, packed=True))
+        self.assertEquals(3, image._re.renders)
+
+    def testRenderPackedInt (self):
+        image = fake_image(64, 48, 2)
+        rgb = image.renderPackedInt(0, 0)
+        self.assertEquals((48, 64, 3), rgb.shape)
+        self.assertEquals(numpy.uint8, rgb.dtype)
+        self.assertSameImage(image.renderImage(0, 0), Image.fromarray(rgb, 'RGB'))
+
+    def testFirstPlane (self):
+        """ z=0 renders the first plane, not the default one """
+        image = fake_image(64, 48, 2, sizeZ=3)
+        self.assertEquals(2, image._re.getDefaultZ())
+        expected = image.renderSplitChannelImage(0, 0)
+        self.assertSameImage(expected, image.renderSplitChannelImage(0, 0, packed=True))
+        rgb = image.renderPackedInt(0, 0)
+        self.assertSameImage(image.renderImage(0, 0), Image.fromarray(rgb, 'RGB'))
+        default = Image.fromarray(image.renderPackedInt(), 'RGB')
+        self.assertNotEquals(None, ImageChops.difference(default, image.renderImage(0, 0).convert('RGB')).getbbox())
+
+if __name__ == '__main__':
+    unittest.main()
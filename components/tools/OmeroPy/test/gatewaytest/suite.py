@@ -26,6 +26,10 @@ def _additional_tests():
     suite.addTest(load("gatewaytest.connection"))
     suite.addTest(load("gatewaytest.wrapper"))
     suite.addTest(load("gatewaytest.get_objects"))
+    suite.addTest(load("gatewaytest.ancestry"))
+    suite.addTest(load("gatewaytest.batching"))
+    suite.addTest(load("gatewaytest.plategrid"))
+    suite.addTest(load("gatewaytest.splitchannel"))
     suite.addTest(load("gatewaytest.pixels"))
     suite.addTest(load("gatewaytest.z_db_cleanup"))
     return suite
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+   Compares the block fitting engine of omero.util.flim_fit with the
+   per-pixel mpfit path of flim-omero.py on synthetic decay curves,
+   reporting pixels per second for each and checking that the fitted
+   lifetimes agree.
+
+   The image size can be set via the BENCHMARK_SIZE environment variable
+   (default 24, i.e. a 24x24 image) and the number of processes used by the
+   block engine via BENCHMARK_PROCESSES (default 2).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+import numpy as npy
+
+from omero.util import mpfit as mpf
+from omero.util.flim_fit import *
+
+SIZE = int(os.environ.get("BENCHMARK_SIZE", 24))
+PROCESSES = int(os.environ.get("BENCHMARK_PROCESSES", 2))
+SLICES = 256
+# Position of the decay's peak in the synthetic signal
+PEAK = 20
+
+
+def synthetic_tp(n=SLICES):
+    """Time points in ns and a Gaussian instrument response function."""
+    a_tp = npy.zeros((n, 2))
+    a_tp[:,0] = npy.arange(n) * 0.05
+    a_tp[:,1] = npy.exp(-0.5 * ((npy.arange(n) - n/2.0) / 3.0)**2)
+    return a_tp
+
+def synthetic_image(a_tp, size=SIZE, seed=0):
+    """
+    Returns t x size*size raw data of single exponential decays with
+    lifetimes between 1.5 and 3.5ns, plus Poisson noise. The 2x2
+    neighbourhood averages fitted are smooth as each pixel's lifetime
+    varies slowly over the image.
+    """
+    rnd = npy.random.RandomState(seed)
+    tp, irf = padded_axes(a_tp)
+    n = len(a_tp)
+    raw = npy.zeros((n, size, size))
+    for r in range(size):
+        for c in range(size):
+            tau = 1.5 + 2.0 * (r + c) / (2.0 * size)
+            p = [40.0 + 10 * rnd.rand(), tau, 0.5]
+            raw[:,r,c] = cexp_1(p, tp, irf)[n-PEAK:2*n-PEAK]
+    raw = rnd.poisson(npy.maximum(raw, 0)).astype(npy.float)
+    return raw.reshape((n, size*size))
+
+def per_pixel_fit(s, a_tp, mode, par):
+    """The per-pixel fit of procFitIt in flim-omero.py."""
+    i_slice = len(a_tp)
+    sig = npy.zeros(i_slice*2)
+    sig[0:i_slice] = s[0:i_slice]
+    tp, irf = padded_axes(a_tp)
+    if par is None:
+        par = npy.array([1.0, 2.0, 0.0], 'd')
+        smax = int(npy.argmax(sig))
+        shift = int(npy.argmax(cexp_1(par, tp, irf))) - smax
+    else:
+        smax = int(par[-2])
+        shift = int(par[-1])
+    params = [{'value':par[i], 'fixed':0, 'limited':[1,0], 'limits':[0.,0.]}
+              for i in range(3)]
+    fa = {'x':tp, 'y':sig, 'i':irf, 'sh':shift, 'sm':smax, 'lf':i_slice}
+    fit = mpf.mpfit(err_1, parinfo=params, functkw=fa, quiet=True)
+    return fit, npy.array(list(fit.params) + [smax, shift])
+
+
+class TestFlimFit(unittest.TestCase):
+
+    def setUp(self):
+        self.a_tp = synthetic_tp()
+        self.raw = synthetic_image(self.a_tp)
+        rc = npy.indices((SIZE, SIZE)).reshape((2, -1)).T
+        self.pixels = rc[(rc[:,0] > 0) & (rc[:,1] > 0)]
+        # Segmentation mean, as procSEG
+        mean = neighbourhood_signals(self.raw, SIZE, self.pixels).mean(axis=0)
+        self.initfit, self.seed = per_pixel_fit(mean, self.a_tp, 1, None)
+
+    def testConvolutionMatrix(self):
+        model = DecayModel(self.a_tp, 1, self.seed)
+        p = npy.array([[3.0, 2.2, 0.4], [1.0, 0.7, 0.0]])
+        for row in p:
+            expected = err_1(row, x=model.tp, y=npy.zeros(len(model.tp)),
+                             i=model.irf, sh=model.shift, sm=model.smax,
+                             lf=model.n)[1]
+            got = model.evaluate(row[npy.newaxis,:])[0][0]
+            self.assertTrue(npy.allclose(-expected, got))
+
+    def testJacobian(self):
+        model = DecayModel(self.a_tp, 1, self.seed)
+        p = npy.array([[3.0, 2.2, 0.4]])
+        m0, jac = model.evaluate(p, True)
+        for i in range(3):
+            h = 1e-6 * max(1.0, p[0,i])
+            q = p.copy()
+            q[0,i] += h
+            numeric = (model.evaluate(q)[0] - m0) / h
+            self.assertTrue(npy.allclose(numeric, jac[:,:,i],
+                                         rtol=1e-3, atol=1e-4))
+
+    def testAgainstPerPixel(self):
+        signals = neighbourhood_signals(self.raw, SIZE, self.pixels)
+
+        t0 = time.time()
+        reference = npy.array([per_pixel_fit(s, self.a_tp, 1, self.seed)[0].params
+                               for s in signals])
+        t1 = time.time()
+        model = DecayModel(self.a_tp, 1, self.seed)
+        params, fnorm, status = fit_pixels(self.raw, self.pixels, model,
+                                           SIZE, processes=PROCESSES)
+        t2 = time.time()
+
+        m = len(self.pixels)
+        print "\n%d pixels: per-pixel %.0f pixels/s, block %.0f pixels/s " \
+              "(%d processes)" % (m, m / (t1 - t0), m / (t2 - t1), PROCESSES)
+        self.assertTrue((status > 0).all())
+        diff = npy.abs(params[:,1] - reference[:,1]) / reference[:,1]
+        print "lifetime relative difference: median %.2e, max %.2e" % \
+              (npy.median(diff), diff.max())
+        self.assertTrue(npy.median(diff) < 1e-4)
+        self.assertTrue((diff < 1e-2).mean() > 0.99)
+
+if __name__ == '__main__':
+    unittest.main()
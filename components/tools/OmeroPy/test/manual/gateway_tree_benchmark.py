@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+   Times loading a Project/Dataset tree with child counts through the
+   gateway wrappers, one query per container and with batching enabled
+   on the connection, against mock query and container services which
+   add a fixed delay to every call to stand in for the round trip.
+
+   The number of projects, datasets per project and images per dataset
+   can be set via the BENCHMARK_PROJECTS (default 50), BENCHMARK_DATASETS
+   (default 40) and BENCHMARK_IMAGES (default 5) environment variables
+   and the delay per call in milliseconds via BENCHMARK_LATENCY (default 1).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+from omero.model import DatasetI, ImageI, ProjectI
+from omero.rtypes import rstring
+from gatewaytest.batching import MockGateway, MockServices
+
+PROJECTS = int(os.environ.get("BENCHMARK_PROJECTS", 50))
+DATASETS = int(os.environ.get("BENCHMARK_DATASETS", 40))
+IMAGES = int(os.environ.get("BENCHMARK_IMAGES", 5))
+LATENCY = float(os.environ.get("BENCHMARK_LATENCY", 1)) / 1000.0
+
+
+class SlowServices(MockServices):
+
+    def findAllByQuery(self, *args):
+        time.sleep(LATENCY)
+        return super(SlowServices, self).findAllByQuery(*args)
+
+    def getCollectionCount(self, *args):
+        time.sleep(LATENCY)
+        return super(SlowServices, self).getCollectionCount(*args)
+
+
+class TestGatewayTreeBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        projects = []
+        for p in range(1, PROJECTS + 1):
+            project = ProjectI(p, True)
+            project.name = rstring("P%s" % p)
+            for d in range(DATASETS):
+                dataset = DatasetI(p * DATASETS + d, True)
+                dataset.name = rstring("D%s" % d)
+                project.linkDataset(dataset)
+                for i in range(IMAGES):
+                    image = ImageI((p * DATASETS + d) * IMAGES + i, True)
+                    image.name = rstring("I%s" % i)
+                    dataset.linkImage(image)
+            projects.append(project)
+        self.services = SlowServices(projects)
+        self.gateway = MockGateway(self.services)
+
+    def tree(self, label):
+        self.services.calls = []
+        t0 = time.time()
+        count = 0
+        for p in self.gateway.getObjects("Project", range(1, PROJECTS + 1)):
+            p.countChildren_cached()
+            for d in p.listChildren():
+                d.countChildren_cached()
+                count += 1
+        elapsed = time.time() - t0
+        print "%-12s %8d calls %8.3fs" % (label, len(self.services.calls), elapsed)
+        return count
+
+    def testTree(self):
+        print "\n%s projects of %s datasets of %s images, %sms per call" % (
+            PROJECTS, DATASETS, IMAGES, LATENCY * 1000)
+        unbatched = self.tree("per object")
+        self.gateway.setBatching()
+        self.assertEquals(unbatched, self.tree("batched"))
+
+if __name__ == '__main__':
+    unittest.main()
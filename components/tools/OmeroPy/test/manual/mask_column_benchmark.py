@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+   Measures the append and read time, file size and memory use of
+   omero.columns.MaskColumnI with the packed heap layout and with the
+   VLArray layout of older tables, for 10k to 1M masks.
+
+   The mask counts can be set via the BENCHMARK_MASKS environment
+   variable (default "10000,100000,1000000"), the masks per append via
+   BENCHMARK_BATCH (default 10000) and the mean size of a mask in bytes
+   via BENCHMARK_MASK_SIZE (default 64).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import logging
+import resource
+import unittest
+
+import Ice
+import numpy
+import tables
+import omero.columns
+import omero.tables
+
+from path import path
+from omero.util.temp_files import create_path
+
+MASKS = [int(x) for x in os.environ.get("BENCHMARK_MASKS", "10000,100000,1000000").split(",")]
+BATCH = int(os.environ.get("BENCHMARK_BATCH", 10000))
+SIZE = int(os.environ.get("BENCHMARK_MASK_SIZE", 64))
+
+
+class MockAdapter(object):
+    def __init__(self, ic):
+        self.ic = ic
+    def getCommunicator(self):
+        return self.ic
+
+
+def maxrss():
+    """Peak resident memory of this process in MB (Linux: KB units)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class TestMaskColumnBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level = logging.CRITICAL)
+        self.ic = Ice.initialize()
+        self.current = Ice.Current()
+        self.current.adapter = MockAdapter(self.ic)
+        for of in omero.columns.ObjectFactories.values():
+            of.register(self.ic)
+        self.dir = path(create_path(folder = True))
+        self.rnd = numpy.random.RandomState(0)
+
+    def tearDown(self):
+        self.ic.destroy()
+
+    def masks(self, count):
+        mask = omero.columns.MaskColumnI("mask", "", None)
+        mask.imageId = [1] * count
+        mask.theZ = [0] * count
+        mask.theT = [0] * count
+        mask.x = [0.0] * count
+        mask.y = [0.0] * count
+        mask.w = [8.0] * count
+        mask.h = [8.0] * count
+        sizes = self.rnd.randint(1, 2 * SIZE, count)
+        data = self.rnd.randint(0, 256, sizes.sum()).astype(numpy.uint8).tostring()
+        ends = numpy.cumsum(sizes)
+        mask.bytes = [data[e - s:e] for s, e in zip(sizes, ends)]
+        return mask
+
+    def run_layout(self, label, count, vlarray):
+        p = self.dir / ("%s-%s.h5" % (label, count))
+        hdf = omero.tables.HdfStorage(p)
+        try:
+            hdf.initialize([self.masks(0)], None)
+            if vlarray:
+                mea = hdf._HdfStorage__mea
+                mea._v_file.createVLArray(mea._v_parent, "Measurements_masks", tables.UInt8Atom())
+            append = 0.0
+            for start in range(0, count, BATCH):
+                mask = self.masks(min(BATCH, count - start))
+                t0 = time.time()
+                hdf.append([mask])
+                append += time.time() - t0
+
+            rss = maxrss()
+            t0 = time.time()
+            data = hdf.readCoordinates(time.time(), None, self.current)
+            read = time.time() - t0
+            self.assertEquals(count, len(data.columns[0].bytes))
+            del data
+
+            mea = hdf._HdfStorage__mea
+            t0 = time.time()
+            slices = omero.columns.MaskColumnI("mask").slices(mea, range(count))
+            sliced = time.time() - t0
+            self.assertEquals(count, len(slices))
+            del slices
+        finally:
+            hdf.cleanup()
+
+        print "%-8s %8d %10.0f %10.0f %10.0f %8.1f %8.1f" % (label, count,
+            count / append, count / read, count / sliced,
+            p.size / 1024.0 / 1024.0, maxrss() - rss)
+
+    def testLayouts(self):
+        print "\nMasks of %s bytes on average, appended %s at a time" % (SIZE, BATCH)
+        print "%-8s %8s %10s %10s %10s %8s %8s" % ("layout", "masks",
+            "append/s", "read/s", "slices/s", "MB", "+RSS MB")
+        for count in MASKS:
+            self.run_layout("packed", count, False)
+            self.run_layout("vlarray", count, True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+   Times omero.util.mpfit with finite difference and analytical
+   derivatives, the MINPACK and numpy.linalg solvers, and mpfit_batch,
+   on many small Gaussian fits and on one fit with many data points.
+
+   The number of small fits can be set via the BENCHMARK_FITS environment
+   variable (default 200) and the number of points of the large fit via
+   BENCHMARK_POINTS (default 20000).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+import numpy
+
+from omero.util.mpfit import mpfit, mpfit_batch
+
+FITS = int(os.environ.get("BENCHMARK_FITS", 200))
+POINTS = int(os.environ.get("BENCHMARK_POINTS", 20000))
+
+
+def gaussians(p, x):
+    """Sum of len(p)/3 Gaussians (amplitude, centre, width) on x."""
+    model = numpy.zeros(numpy.shape(x))
+    derivs = []
+    for i in range(0, len(p), 3):
+        a, c, w = p[i:i+3]
+        g = numpy.exp(-0.5*((x-c)/w)**2)
+        model += a*g
+        derivs.extend([g, a*g*(x-c)/w**2, a*g*(x-c)**2/w**3])
+    return model, derivs
+
+def deviates(p, fjac=None, x=None, y=None):
+    model, derivs = gaussians(p, x)
+    if fjac is None:
+        return [0, y-model, None]
+    return [0, y-model, numpy.array(derivs).T]
+
+def batch_deviates(p, fjac=None, x=None, y=None):
+    g = numpy.exp(-0.5*((x-p[:,1:2])/p[:,2:3])**2)
+    f = y - p[:,0:1]*g
+    if fjac is None:
+        return [0, f]
+    d = numpy.empty(f.shape + (3,))
+    d[:,:,0] = g
+    d[:,:,1] = p[:,0:1]*g*(x-p[:,1:2])/p[:,2:3]**2
+    d[:,:,2] = p[:,0:1]*g*(x-p[:,1:2])**2/p[:,2:3]**3
+    return [0, f, d]
+
+
+class TestMpfitBenchmark(unittest.TestCase):
+
+    def time(self, label, count, fn):
+        t0 = time.time()
+        result = fn()
+        elapsed = time.time() - t0
+        print "%-32s %8.3fs %10.1f fits/s" % (label, elapsed, count/elapsed)
+        return result
+
+    def testSmallFits(self):
+        rnd = numpy.random.RandomState(0)
+        x = numpy.linspace(-5, 5, 64)
+        truth = numpy.array([2 + rnd.rand(FITS), rnd.rand(FITS) - 0.5,
+                             0.8 + 0.4*rnd.rand(FITS)]).T
+        y = numpy.array([gaussians(p, x)[0] for p in truth])
+        y += 0.01 * rnd.randn(*y.shape)
+        start = [1., 0., 1.]
+
+        print "\n%d fits of 3 parameters to %d points" % (FITS, len(x))
+        results = {}
+        for label, kwargs in (
+                ("minpack, finite differences", {}),
+                ("minpack, analytic", {'autoderivative': 0}),
+                ("numpy, finite differences", {'solver': 'numpy'}),
+                ("numpy, analytic", {'solver': 'numpy', 'autoderivative': 0})):
+            def run():
+                return numpy.array([mpfit(deviates, start, quiet=1,
+                    functkw={'x': x, 'y': y[i]}, **kwargs).params
+                    for i in range(FITS)])
+            results[label] = self.time(label, FITS, run)
+
+        xs = x[numpy.newaxis,:]
+        p0 = numpy.array([start] * FITS)
+        for label, kwargs in (("batch, finite differences", {}),
+                              ("batch, analytic", {'autoderivative': 0})):
+            def run():
+                return mpfit_batch(batch_deviates, p0.copy(),
+                    functkw={'x': xs, 'y': y}, **kwargs).params
+            results[label] = self.time(label, FITS, run)
+
+        reference = results["minpack, finite differences"]
+        for label, params in results.items():
+            self.assertTrue(numpy.allclose(reference, params,
+                                           rtol=1e-4, atol=1e-6), label)
+
+    def testManyPoints(self):
+        rnd = numpy.random.RandomState(1)
+        x = numpy.linspace(-10, 10, POINTS)
+        truth = [3., -4., 1., 2., 0., 2., 1., 5., 0.5]
+        y = gaussians(truth, x)[0] + 0.01 * rnd.randn(POINTS)
+        start = [2.5, -3.8, 1.2, 1.5, 0.3, 1.5, 1.2, 4.8, 0.6]
+
+        print "\n1 fit of %d parameters to %d points" % (len(start), POINTS)
+        results = {}
+        for label, kwargs in (
+                ("minpack, finite differences", {}),
+                ("minpack, analytic", {'autoderivative': 0}),
+                ("numpy, analytic", {'solver': 'numpy', 'autoderivative': 0})):
+            def run():
+                return mpfit(deviates, list(start), quiet=1,
+                    functkw={'x': x, 'y': y}, **kwargs)
+            fit = self.time(label, 1, run)
+            self.assertTrue(fit.status > 0, label)
+            results[label] = fit.params
+
+        reference = results["minpack, finite differences"]
+        for label, params in results.items():
+            self.assertTrue(numpy.allclose(reference, params,
+                                           rtol=1e-4, atol=1e-6), label)
+
+if __name__ == '__main__':
+    unittest.main()
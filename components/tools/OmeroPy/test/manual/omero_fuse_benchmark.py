@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+"""
+   Counts the backend calls made by the omero_fuse BlitzStorage for a
+   scripted "ls -lR" and "cat" workload against an in-process fake
+   gateway, with and without caching.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import unittest
+import time
+
+from omero_fuse import BlitzStorage
+from omero.rtypes import rlong, rstring, unwrap
+
+PROJECTS = 3
+DATASETS = 4
+IMAGES = 5
+SIZE_X = 256
+SIZE_Y = 256
+SIZE_Z = 3
+SIZE_T = 2
+
+class Counter(object):
+
+    def __init__(self):
+        self.calls = {}
+
+    def __call__(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+class FakeWrapper(object):
+
+    def __init__(self, counter, klass, id, children=()):
+        self.counter = counter
+        self.OMERO_CLASS = klass
+        self.id = id
+        self.children = list(children)
+
+    def listChildren(self):
+        self.counter("listChildren")
+        return iter(self.children)
+
+class FakeImage(FakeWrapper):
+
+    def __init__(self, counter, id):
+        FakeWrapper.__init__(self, counter, "Image", id)
+
+    def getSizeX(self):
+        return SIZE_X
+
+    def getSizeY(self):
+        return SIZE_Y
+
+    def getSizeZ(self):
+        self.counter("getSizeZ")
+        return SIZE_Z
+
+    def getSizeT(self):
+        self.counter("getSizeT")
+        return SIZE_T
+
+    def renderJpeg(self, z, t):
+        self.counter("renderJpeg")
+        return ("%s:%s:%s" % (self.id, z, t)) * 1000
+
+    def getThumbnail(self):
+        self.counter("getThumbnail")
+        return ("%s" % self.id) * 500
+
+class FakeQueryService(object):
+    """Event log holding (id, entityType, entityId) rows."""
+
+    def __init__(self):
+        self.events = []
+
+    def projection(self, query, params):
+        if query.startswith('select max'):
+            return [[rlong(max([0] + [e[0] for e in self.events]))]]
+        last = unwrap(params.map['id'])
+        return [[rlong(e[0]), rstring(e[1]), rlong(e[2])]
+                for e in self.events if e[0] > last]
+
+class FakeGateway(object):
+
+    def __init__(self):
+        self.counter = Counter()
+        self.query_service = FakeQueryService()
+        self.projects = []
+        ids = {"Project": 0, "Dataset": 0, "Image": 0}
+        def next(klass):
+            ids[klass] += 1
+            return ids[klass]
+        for p in range(PROJECTS):
+            datasets = []
+            for d in range(DATASETS):
+                images = [FakeImage(self.counter, next("Image"))
+                          for i in range(IMAGES)]
+                datasets.append(FakeWrapper(self.counter, "Dataset",
+                                            next("Dataset"), images))
+            self.projects.append(FakeWrapper(self.counter, "Project",
+                                             next("Project"), datasets))
+
+    def listProjects(self):
+        self.counter("listProjects")
+        return iter(self.projects)
+
+    def getQueryService(self):
+        return self.query_service
+
+def ls_lR(fs, path="/", depth=0):
+    """Mimics "ls -lR": a readdir and a getattr per entry, recursively."""
+    files = []
+    for name in fs.readdir(path, None):
+        if name in (".", ".."):
+            continue
+        child = path.rstrip("/") + "/" + name
+        st = fs.getattr(child)
+        if st["st_mode"] & 0040000:
+            # Don't descend into T below Z and vice versa
+            if depth < 6:
+                files.extend(ls_lR(fs, child, depth + 1))
+        else:
+            files.append(child)
+    return files
+
+def cat(fs, path, blocksize=4096):
+    fs.getattr(path)
+    fh = fs.open(path, 0)
+    try:
+        data = []
+        offset = 0
+        while True:
+            block = fs.read(path, blocksize, offset, fh)
+            if not block:
+                break
+            data.append(block)
+            offset += len(block)
+        return "".join(data)
+    finally:
+        fs.release(path, fh)
+
+class TestFuseBackendCalls(unittest.TestCase):
+
+    def run_workload(self, **kwargs):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway, **kwargs)
+        t0 = time.time()
+        files = ls_lR(fs, "/Project1")
+        listed = gateway.counter.total()
+        jpegs = [f for f in files if f.endswith("image.jpg")][:10]
+        for i in range(3):
+            for f in jpegs:
+                cat(fs, f)
+        elapsed = time.time() - t0
+        return gateway, files, listed, elapsed
+
+    def report(self, label, gateway, files, listed, elapsed):
+        print "%s: %d files, %d backend calls for ls -lR, %d in total " \
+              "(%s) in %.3fs" % (label, len(files), listed,
+                gateway.counter.total(), gateway.counter.calls, elapsed)
+
+    def testCachedVersusUncached(self):
+        uncached = self.run_workload(ttl=0, cache_bytes=0)
+        cached = self.run_workload()
+        self.report("uncached", *uncached)
+        self.report("cached", *cached)
+        self.assertEquals(len(uncached[1]), len(cached[1]))
+        self.assertTrue(cached[0].counter.total() < uncached[0].counter.total())
+        # getattr never renders
+        self.assertEquals(0, cached[0].counter.calls.get("getThumbnail", 0))
+        # Each plane is rendered once and then read from memory; several of
+        # the files read are paths to the same plane.
+        fs = BlitzStorage(client=FakeGateway())
+        jpegs = [f for f in cached[1] if f.endswith("image.jpg")][:10]
+        planes = set([fs._resolvePath(f).key for f in jpegs])
+        self.assertEquals(len(planes), cached[0].counter.calls["renderJpeg"])
+
+    def testContent(self):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway)
+        data = cat(fs, "/Project1/Dataset1/Image1/Z/2/T/1/image.jpg")
+        self.assertEquals("1:2:1" * 1000, data)
+        self.assertEquals(len(data),
+            fs.getattr("/Project1/Dataset1/Image1/Z/2/T/1/image.jpg")["st_size"])
+
+    def testInvalidate(self):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway)
+        fs.readdir("/Project1", None)
+        count = gateway.counter.total()
+        fs.readdir("/Project1", None)
+        self.assertEquals(count, gateway.counter.total())
+        fs.invalidate("/Project1")
+        fs.readdir("/Project1", None)
+        self.assertTrue(count < gateway.counter.total())
+
+    def testEviction(self):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway, cache_bytes=6000)
+        cat(fs, "/Project1/Dataset1/Image1/image.jpg")
+        cat(fs, "/Project1/Dataset1/Image2/image.jpg")
+        cat(fs, "/Project1/Dataset1/Image1/image.jpg")
+        self.assertEquals(3, gateway.counter.calls["renderJpeg"])
+
+    def testLargeFileRenderedOnce(self):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway, cache_bytes=0)
+        path = "/Project1/Dataset1/Image1/image.jpg"
+        data = cat(fs, path, blocksize=1024)
+        self.assertEquals("1:0:0" * 1000, data)
+        # Kept by the open file although too large for the cache
+        self.assertEquals(1, gateway.counter.calls["renderJpeg"])
+
+    def testOpenFileSize(self):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway, cache_bytes=0)
+        path = "/Project1/Dataset1/Image1/thumb.jpg"
+        self.assertTrue(fs.getattr(path)["st_size"] > 500)
+        fh = fs.open(path, 0)
+        self.assertEquals(500, fs.getattr(path, fh)["st_size"])
+        self.assertEquals(500, fs.getattr(path)["st_size"])
+        fs.release(path, fh)
+
+    def testEventLog(self):
+        gateway = FakeGateway()
+        fs = BlitzStorage(client=gateway)
+        events = gateway.query_service.events
+        events.append((1, "ome.model.containers.Dataset", 2))
+        fs.poll_events()
+        self.assertEquals(1, fs.last_event)
+        fs.readdir("/Project1/Dataset1", None)
+        fs.readdir("/Project1/Dataset2", None)
+        cat(fs, "/Project1/Dataset1/Image1/image.jpg")
+        count = gateway.counter.total()
+        # Dataset2 is listed again, Dataset1 and the rendered image are kept
+        events.append((2, "ome.model.containers.Dataset", 2))
+        fs.poll_events()
+        self.assertEquals(2, fs.last_event)
+        fs.readdir("/Project1/Dataset1", None)
+        cat(fs, "/Project1/Dataset1/Image1/image.jpg")
+        self.assertEquals(count, gateway.counter.total())
+        fs.readdir("/Project1/Dataset2", None)
+        self.assertEquals(count + 2, gateway.counter.total())
+        # Changed links may have moved anything
+        events.append((3, "ome.model.containers.DatasetImageLink", 7))
+        fs.poll_events()
+        fs.readdir("/Project1/Dataset1", None)
+        self.assertTrue(count + 2 < gateway.counter.total())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+   Times building the webgateway plate grid of synthetic 96, 384 and
+   1536 well plates from PlateWrapper.getWellGrid() wrappers and from
+   PlateWrapper.getWellGridData(), as a list and as json, against a fake
+   query service which adds a fixed delay to every call to stand in for
+   the round trip.
+
+   The plate sizes can be set via the BENCHMARK_PLATES environment
+   variable as rows x columns (default "8x12,16x24,32x48") and the delay
+   per call in milliseconds via BENCHMARK_LATENCY (default 1).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+import omero.gateway
+
+from gatewaytest.plategrid import FakeGateway, FakeQueryService
+from gatewaytest.plategrid import synthetic_plate, wrapper_grid
+
+PLATES = [tuple(map(int, x.split("x"))) for x in os.environ.get("BENCHMARK_PLATES", "8x12,16x24,32x48").split(",")]
+LATENCY = float(os.environ.get("BENCHMARK_LATENCY", 1)) / 1000.0
+
+
+class SlowQueryService(FakeQueryService):
+
+    def findAllByQuery(self, *args):
+        time.sleep(LATENCY)
+        return super(SlowQueryService, self).findAllByQuery(*args)
+
+    def findByQuery(self, *args):
+        time.sleep(LATENCY)
+        return super(SlowQueryService, self).findByQuery(*args)
+
+    def projection(self, *args):
+        time.sleep(LATENCY)
+        return super(SlowQueryService, self).projection(*args)
+
+
+class TestPlateGridBenchmark(unittest.TestCase):
+
+    def time(self, label, wells, fn, *args):
+        self.query.calls = []
+        t0 = time.time()
+        rv = fn(*args)
+        print "%-6d %-24s %8d calls %8.3fs" % (wells, label, len(self.query.calls), time.time() - t0)
+        return rv
+
+    def testPlates(self):
+        print "\n%sms per call" % (LATENCY * 1000)
+        xtra = {'thumbUrlPrefix': '/thumb/'}
+        plates = dict([(rows * columns, synthetic_plate(rows * columns, rows, columns))
+                       for rows, columns in PLATES])
+        self.query = SlowQueryService(plates)
+        gateway = FakeGateway(self.query)
+        for wells in sorted(plates.keys()):
+            plate = lambda: omero.gateway.PlateWrapper(gateway, plates[wells][0])
+            expected = self.time("getWellGrid", wells, wrapper_grid, plate(), 0, xtra)
+            grid = self.time("getWellGridData", wells, plate().getWellGridData, 0)
+            self.assertEquals(expected, self.time("  toList", wells, grid.toList, xtra))
+            self.time("  toJson", wells, grid.toJson, xtra)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Correctness checks and a benchmark of bulk annotation CSV parsing by
+omero.util.populate_metadata against an in-process query service.
+
+The number of benchmark rows can be set via the BENCHMARK_ROWS environment
+variable and defaults to 1,000,000.
+"""
+
+#
+#  Copyright (C) 2011 University of Dundee. All rights reserved.
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import unittest
+import time
+import os
+
+from omero.util.populate_metadata import *
+from omero.util.temp_files import create_path
+
+from omero.rtypes import rint, rlong, rstring
+from omero.model import OriginalFileI, PlateI, ScreenI
+
+ROWS = 32
+COLUMNS = 48
+
+class TestingQueryService(object):
+    """
+    Query service returning the well projection of a synthetic screen of
+    1536 well plates, counting the calls made.
+    """
+    def __init__(self, n_plates):
+        self.n_plates = n_plates
+        self.calls = 0
+
+    def projection(self, query, parameters):
+        self.calls += 1
+        rows = list()
+        well_id = 1
+        for plate_id in range(1, self.n_plates + 1):
+            for row in range(ROWS):
+                for column in range(COLUMNS):
+                    rows.append([rlong(plate_id),
+                                 rstring('Plate %d' % plate_id),
+                                 rlong(well_id), rint(row), rint(column)])
+                    well_id += 1
+        return rows
+
+    def findByQuery(self, query, parameters):
+        self.calls += 1
+        raise Exception('Unexpected object graph query: %s' % query)
+
+class TestingTable(object):
+    """
+    Table keeping the rows added to it, and the number of rows parsed by
+    the time each batch was added.
+    """
+    def __init__(self, ctx=None):
+        self.ctx = ctx
+        self.columns = None
+        self.parsed = list()
+    def initialize(self, columns):
+        self.columns = columns
+    def getOriginalFile(self):
+        return OriginalFileI(1L, False)
+    def getNumberOfRows(self):
+        return len(self.columns[0].values)
+    def addData(self, columns):
+        self.parsed.append(self.ctx.parsed)
+        for column, batch in zip(self.columns, columns):
+            column.values.extend(batch.values)
+
+class TestingSharedResources(object):
+    def __init__(self, table):
+        self.table = table
+    def newTable(self, repository, name):
+        return self.table
+
+class TestingUpdateService(object):
+    def __init__(self):
+        self.saved = list()
+    def saveObject(self, obj):
+        self.saved.append(obj)
+
+class TestingServiceFactory(object):
+    def __init__(self, query_service):
+        self.query_service = query_service
+        self.table = TestingTable()
+        self.update_service = TestingUpdateService()
+    def getQueryService(self):
+        return self.query_service
+    def sharedResources(self):
+        return TestingSharedResources(self.table)
+    def getUpdateService(self):
+        return self.update_service
+
+class TestingClient(object):
+    def __init__(self, n_plates):
+        self.sf = TestingServiceFactory(TestingQueryService(n_plates))
+    def getSession(self):
+        return self.sf
+
+def row_name(row):
+    name = ''
+    row += 1
+    while row > 0:
+        row, remainder = divmod(row - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+def well_name(row, column):
+    return '%s%d' % (row_name(row), column + 1)
+
+def write_csv(path, n_rows, n_plates):
+    f = open(path, 'w')
+    try:
+        f.write('Plate,Well,Row,Column,Gene\n')
+        for i in xrange(n_rows):
+            plate = i % n_plates + 1
+            row = (i / n_plates) % ROWS
+            column = (i / (n_plates * ROWS)) % COLUMNS
+            f.write('Plate %d,%s,%d,%d,gene%d\n' % \
+                    (plate, well_name(row, column), row + 1, column + 1, i))
+    finally:
+        f.close()
+
+class PopulateMetadataTest(unittest.TestCase):
+
+    def parse(self, target_object, n_rows, n_plates):
+        path = create_path()
+        write_csv(path, n_rows, n_plates)
+        client = TestingClient(n_plates)
+        ctx = ParsingContext(client, target_object, str(path))
+        ctx.parse()
+        return client, ctx
+
+    def testScreenWellResolution(self):
+        client, ctx = self.parse(ScreenI(1L, False), 100, 3)
+        self.assertEquals(1, client.sf.query_service.calls)
+        columns = dict([(c.name, c) for c in ctx.columns])
+        self.assertEquals(100, len(columns['Well'].values))
+        # Row 4 is plate 2, well B1
+        self.assertEquals(2, columns['Plate'].values[4])
+        self.assertEquals(ROWS * COLUMNS + COLUMNS + 1,
+                          columns['Well'].values[4])
+        self.assertEquals('Plate 2', columns[PLATE_NAME_COLUMN].values[4])
+        self.assertEquals('b1', columns[WELL_NAME_COLUMN].values[4])
+
+    def testPlateWellResolution(self):
+        client, ctx = self.parse(PlateI(1L, False), 10, 1)
+        columns = dict([(c.name, c) for c in ctx.columns])
+        # Row 1 is well B1
+        self.assertEquals(COLUMNS + 1, columns['Well'].values[1])
+        self.assertEquals('Plate 1', columns['Plate'].values[1])
+
+    def testMissingWell(self):
+        resolver = ValueResolver(TestingClient(1), PlateI(1L, False))
+        self.assertEquals(-1L, resolver.resolve_well('ZZ99', None))
+        self.assertEquals(COLUMNS + 1, resolver.resolve_well('B1', None))
+        self.assertEquals(26 * COLUMNS + 1, resolver.resolve_well('AA1', None))
+        self.assertRaises(MetadataError, resolver.resolve_well, '1A', None)
+
+    def testAlphaRowOrColumn(self):
+        resolver = ValueResolver(TestingClient(1), PlateI(1L, False))
+        self.assertEquals(0L, resolver.resolve_row_or_column('A', None))
+        self.assertEquals(25L, resolver.resolve_row_or_column('z', None))
+        self.assertEquals(31L, resolver.resolve_row_or_column('AF', None))
+        self.assertEquals(31L, resolver.resolve_row_or_column('32', None))
+
+    def testWriteWhileParsing(self):
+        path = create_path()
+        write_csv(path, 100, 3)
+        client = TestingClient(3)
+        ctx = ParsingContext(client, ScreenI(1L, False), str(path),
+                             batch_size=20)
+        ctx.CHUNK_SIZE = 30
+        ctx.parsed = 0
+        populate = ctx.populate
+        def counting(rows, writer=None):
+            def count():
+                for row in rows:
+                    ctx.parsed += 1
+                    yield row
+            populate(count(), writer)
+        ctx.populate = counting
+        client.sf.table.ctx = ctx
+        ctx.write_to_omero()
+        table = client.sf.table
+        # Full batches as each chunk is resolved, the remainder at the end
+        self.assertEquals([30, 60, 60, 90, 100], table.parsed)
+        columns = dict([(c.name, c) for c in table.columns])
+        self.assertEquals(100, len(columns['Well'].values))
+        self.assertEquals(ROWS * COLUMNS + COLUMNS + 1,
+                          columns['Well'].values[4])
+        self.assertEquals('Plate 2', columns[PLATE_NAME_COLUMN].values[4])
+        self.assertEquals('b1', columns[WELL_NAME_COLUMN].values[4])
+        self.assertEquals('gene99', columns['Gene'].values[99])
+        # Widths are known before the table is initialized
+        self.assertEquals(len('Plate 1'), columns[PLATE_NAME_COLUMN].size)
+        self.assertEquals(len('gene99'), columns['Gene'].size)
+        # Only the rows not yet written were held
+        self.assertEquals(0, len(ctx.columns[0].values))
+        self.assertEquals(1, len(client.sf.update_service.saved))
+
+    def testBenchmark(self):
+        n_rows = int(os.environ.get('BENCHMARK_ROWS', 1000000))
+        path = create_path()
+        write_csv(path, n_rows, 10)
+        client = TestingClient(10)
+        t0 = time.time()
+        ctx = ParsingContext(client, ScreenI(1L, False), str(path))
+        t1 = time.time()
+        ctx.parse()
+        t2 = time.time()
+        print 'Well index load: %.3fs, %d queries' % \
+                (t1 - t0, client.sf.query_service.calls)
+        print 'Parsed %d rows in %.3fs (%.0f rows/s)' % \
+                (n_rows, t2 - t1, n_rows / (t2 - t1))
+        self.assertEquals(n_rows, len(ctx.columns[0].values))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,7 +29,8 @@ import os
 from omero.util.populate_roi import *
 
 import omero.clients
-from omero.rtypes import rdouble, rstring, rint
+from omero.rtypes import rdouble, rlong, rstring, rint
+from omero.util.temp_files import create_path
 from omero.model import OriginalFileI, PlateI, WellI, WellSampleI, PlateAnnotationLinkI, ImageI, FileAnnotationI, RoiI, EllipseI
 
 class TestingServiceFactory(object):
@@ -222,5 +223,107 @@ class InCellParseRoiTest(unittest.TestCase):
         for column in columns:
             self.assertEqual(114149, len(column.values))
 
+class TableFailure(Exception):
+    pass
+
+class ResumingTable(object):
+    """
+    Table keeping the rows added to it, failing addData() once fail_at rows
+    have been added.
+    """
+    def __init__(self):
+        self.rows = list()
+        self.fail_at = None
+    def getOriginalFile(self):
+        return OriginalFileI(5L, False)
+    def initialize(self, columns):
+        pass
+    def getNumberOfRows(self):
+        return len(self.rows)
+    def addData(self, columns):
+        if self.fail_at is not None and len(self.rows) >= self.fail_at:
+            raise TableFailure('Table write failed')
+        self.rows.extend(zip(*[column.values for column in columns]))
+
+class ResumingServiceFactory(object):
+    """
+    Service factory over a single table, saving ROI as the IDs of their
+    images.
+    """
+    def __init__(self):
+        self.table = ResumingTable()
+        self.saved = list()
+    def getUpdateService(self):
+        return self
+    def getQueryService(self):
+        return self
+    def sharedResources(self):
+        return self
+    def newTable(self, repository, name):
+        return self.table
+    def openTable(self, original_file):
+        return self.table
+    def saveAndReturnObject(self, link):
+        link.child.id = rlong(9L)
+        return link
+    def saveAndReturnIds(self, rois):
+        self.saved.extend(rois)
+        return [roi.image.id.val for roi in rois]
+    def findByQuery(self, query, parameters):
+        return FileAnnotationI(9L, False)
+
+class ResumeRoiTest(unittest.TestCase):
+
+    N_ROWS = 237
+
+    def setUp(self):
+        import omero.util.populate_roi
+        omero.util.populate_roi.thread_pool = ThreadPool(1)
+        self.sf = ResumingServiceFactory()
+        self.checkpoint = create_path()
+        self.checkpoint.remove()
+
+    def populate(self):
+        analysis_ctx = type('AnalysisCtx', (), {'images': [], 'plate_id': 1L})
+        original_file = OriginalFileI(3L, True)
+        original_file.name = rstring('MNU.txt')
+        ctx = MIASMeasurementCtx(analysis_ctx, self.sf, None, original_file,
+                                 [])
+        ctx.ROI_UPDATE_LIMIT = 10
+        ctx.TABLE_BATCH_SIZE = 25
+        ctx.checkpoint = str(self.checkpoint)
+        columns = ctx.get_empty_columns(3)
+        for i, name in enumerate(('row', 'col', 'type')):
+            columns[i + 2].name = name
+        for i in range(self.N_ROWS):
+            columns[0].values.append(1000L + i)
+            columns[2].values.append(float(i))
+            columns[3].values.append(float(i))
+            columns[4].values.append(1.0)
+        result = MeasurementParsingResult([columns])
+        ctx.parse = lambda: result
+        ctx.parse_and_populate()
+        return columns
+
+    def testResume(self):
+        self.sf.table.fail_at = 100
+        self.assertRaises(TableFailure, self.populate)
+        self.assertEqual(100, len(self.sf.table.rows))
+        import omero.util.populate_roi
+        omero.util.populate_roi.thread_pool.wait_completion()
+        self.sf.table.fail_at = None
+        saved = len(self.sf.saved)
+        columns = self.populate()
+        rows = self.sf.table.rows
+        self.assertEqual(self.N_ROWS, len(rows))
+        self.assertEqual([(1000L + i, 1000L + i) for i in range(self.N_ROWS)],
+                         [row[:2] for row in rows])
+        # The ROI of the committed rows are not saved again
+        self.assertEqual(self.N_ROWS - 100, len(self.sf.saved) - saved)
+        # Rows are dropped from the columns once written
+        self.assertEqual(0, len(columns[0].values))
+        self.assertEqual([], [p for p in self.checkpoint.parent.files()
+                              if p.startswith(self.checkpoint)])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""
+   Measures the time to start a script from omero.processor with a
+   fresh interpreter and with the warm interpreter pool, and the
+   throughput of ProcessorI.parseJob with and without the params cache,
+   against a local stand-in for the session and its services.
+
+   The number of jobs can be set via the BENCHMARK_JOBS environment
+   variable (default 20).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import sys
+import time
+import logging
+import hashlib
+import unittest
+
+import killableprocess
+
+import omero
+import omero.processor
+import omero.util
+import omero.util.concurrency
+import omero.util.warm_pool
+
+from omero.rtypes import rlong, rstring
+from omero.util.temp_files import create_path
+
+JOBS = int(os.environ.get("BENCHMARK_JOBS", 20))
+
+# Prints the time at which the script starts running
+SCRIPT = """
+import time
+started = time.time()
+import omero, omero.clients, omero.scripts
+print started
+"""
+
+# Finished processes have no server to report to
+omero.processor.ProcessI.tmp_client = lambda self: None
+
+
+def sha1(filename):
+    return hashlib.sha1(open(filename, "rb").read()).hexdigest()
+
+
+class Struct(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class StandInService(object):
+
+    def ice_getCommunicator(self):
+        ctx = Struct(getContext = lambda: {})
+        return Struct(getImplicitContext = lambda: ctx)
+
+
+class StandInHandle(StandInService):
+
+    def attach(self, id, ctx = None):
+        pass
+
+    def jobFinished(self, ctx = None):
+        return False
+
+    def setStatus(self, status, ctx = None):
+        return "Waiting"
+
+    def close(self, ctx = None):
+        pass
+
+
+class StandInScripts(StandInService):
+
+    def __init__(self, file, text):
+        self.file = file
+        self.text = text
+
+    def validateScript(self, job, accepts, ctx = None):
+        return self.file
+
+    def getScriptText(self, id, ctx = None):
+        return self.text
+
+
+class StandInSession(object):
+    """
+    The parts of a ServiceFactoryPrx used by ProcessorI.parseJob.
+    """
+
+    def __init__(self, scripts):
+        self.scripts = scripts
+
+    def keepAlive(self, prx):
+        pass
+
+    def createJobHandle(self):
+        return StandInHandle()
+
+    def getScriptService(self):
+        return self.scripts
+
+
+class StandInClient(object):
+    """
+    The parts of omero.client used by ProcessorI.parseJob. The params
+    a script would store are returned for every parse.
+    """
+
+    def __init__(self, params):
+        self.params = params
+
+    def joinSession(self, session):
+        return Struct(detachOnDestroy = lambda: None)
+
+    def getProperty(self, key):
+        return ""
+
+    def sha1(self, filename):
+        return sha1(filename)
+
+    def getOutput(self, key):
+        return Struct(val = self.params)
+
+    def closeSession(self):
+        pass
+
+
+class StandInAdapter(object):
+
+    def addWithUUID(self, servant):
+        return None
+
+
+class TestProcessorBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level = logging.CRITICAL)
+        self.ctx = omero.util.ServerContext(server_id = "benchmark",
+            communicator = None, stop_event = omero.util.concurrency.get_event())
+        self.env = omero.processor.script_env(os.getcwd())()
+        self.script = create_path("benchmark", ".py")
+        self.script.write_text(SCRIPT)
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.cleanup()
+        self.ctx.stop_event.set()
+
+    def warm_pool(self, size = 2):
+        if self.pool:
+            self.pool.cleanup()
+        self.pool = omero.util.warm_pool.WarmPool(size = size, max_jobs = JOBS,
+            env = self.env, fallback = killableprocess.Popen)
+        for worker in self.pool.workers:
+            worker.ready.wait(30)
+        return self.pool
+
+    def start_latency(self, label, Popen):
+        latency = []
+        for i in range(JOBS):
+            out = create_path("benchmark", ".out")
+            f = open(str(out), "w")
+            try:
+                t0 = time.time()
+                popen = Popen([sys.executable, str(self.script)],
+                              cwd = str(self.script.parent), env = self.env,
+                              stdout = f, stderr = None)
+                self.assertEquals(0, popen.wait())
+            finally:
+                f.close()
+            latency.append(float(out.text().strip()) - t0)
+        latency.sort()
+        print "%-24s median %6.1f ms, max %6.1f ms" % \
+              (label, 1000 * latency[len(latency)/2], 1000 * latency[-1])
+
+    def testStartLatency(self):
+        print "\nScript start latency over %s jobs" % JOBS
+        self.start_latency("new interpreter", killableprocess.Popen)
+        self.start_latency("warm pool", self.warm_pool().Popen)
+
+    def processor(self, warm_workers, cache_size):
+        file = omero.model.OriginalFileI(1, False)
+        file.sha1 = rstring(sha1(str(self.script)))
+        session = StandInSession(StandInScripts(file, self.script.text()))
+        params = omero.grid.JobParams()
+        params.name = "benchmark"
+
+        impl = omero.processor.ProcessorI(self.ctx, use_session = session)
+        impl.user_client = lambda agent: StandInClient(params)
+        impl.params_cache = omero.processor.ParamsCache(cache_size)
+        impl.warm_pool.cleanup()
+        impl.warm_pool = self.warm_pool(warm_workers)
+        return impl
+
+    def parse_throughput(self, label, impl):
+        job = Struct(id = rlong(1), details = Struct(group = Struct(id = rlong(1))))
+        t0 = time.time()
+        for i in range(JOBS):
+            self.assertEquals("benchmark", impl.parseJob("session", job, StandInAdapter()).name)
+        elapsed = time.time() - t0
+        print "%-24s %8.1f parses/s" % (label, JOBS / elapsed)
+        impl.cleanup()
+
+    def testParseThroughput(self):
+        print "\nparseJob throughput over %s parses" % JOBS
+        self.parse_throughput("new interpreter", self.processor(0, 0))
+        self.parse_throughput("warm pool", self.processor(2, 0))
+        self.parse_throughput("params cache", self.processor(0, 100))
+
+if __name__ == '__main__':
+    unittest.main()
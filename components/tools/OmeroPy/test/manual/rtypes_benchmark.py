@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+   Times omero.rtypes.wrap, unwrap and unwrap_view on large lists of
+   longs and doubles, a numpy array, a wide map as returned by scripts
+   and a nested mixed structure, against a per-item conversion as the
+   recursive implementation performed it.
+
+   The number of items can be set via the BENCHMARK_ITEMS environment
+   variable (default 1000000).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+import numpy
+import omero
+
+from omero.rtypes import rlist, rmap, rtype, unwrap, unwrap_view, wrap
+
+ITEMS = int(os.environ.get("BENCHMARK_ITEMS", 1000000))
+
+
+def per_item_wrap(val):
+    """Recursive conversion with type dispatch for every item"""
+    if isinstance(val, list):
+        return rlist([per_item_wrap(x) for x in val])
+    elif isinstance(val, dict):
+        return rmap(dict([(k, per_item_wrap(v)) for k, v in val.items()]))
+    return rtype(val)
+
+
+class TestRTypesBenchmark(unittest.TestCase):
+
+    def time(self, label, fn, *args):
+        t0 = time.time()
+        rv = fn(*args)
+        print "%-36s %8.3fs" % (label, time.time() - t0)
+        return rv
+
+    def testLists(self):
+        print "\n%s items" % ITEMS
+        longs = [long(x) for x in range(ITEMS)]
+        doubles = [x * 0.5 for x in range(ITEMS)]
+        for label, values in (("longs", longs), ("doubles", doubles)):
+            self.time("wrap %s, per item" % label, per_item_wrap, values)
+            rv = self.time("wrap %s" % label, wrap, values)
+            self.assertEquals(values, self.time("unwrap %s" % label, unwrap, rv))
+            view = self.time("unwrap_view %s" % label, unwrap_view, rv)
+            self.assertEquals(values[-1], self.time("  last item of view", view.__getitem__, -1))
+
+        array = numpy.arange(ITEMS, dtype=numpy.float64)
+        rv = self.time("wrap numpy float64", wrap, array)
+        self.assertEquals(ITEMS, len(rv.val))
+
+    def testWideMap(self):
+        width = ITEMS / 10
+        print "\nmap of %s keys" % width
+        outputs = dict([("key%s" % i, i * 0.25) for i in range(width)])
+        self.time("wrap, per item", per_item_wrap, outputs)
+        rv = self.time("wrap", wrap, outputs)
+        self.assertEquals(outputs, self.time("unwrap", unwrap, rv))
+        view = self.time("unwrap_view", unwrap_view, rv)
+        self.assertEquals(0.25, view["key1"])
+
+    def testNested(self):
+        rows = ITEMS / 100
+        print "\n%s rows of mixed values, a list and a map" % rows
+        nested = [[i, float(i), "row%s" % i, True, range(5), {"a": i, "b": [i, i]}]
+                  for i in range(rows)]
+        self.time("wrap, per item", per_item_wrap, nested)
+        rv = self.time("wrap", wrap, nested)
+        self.assertEquals(nested, self.time("unwrap", unwrap, rv))
+
+if __name__ == '__main__':
+    unittest.main()
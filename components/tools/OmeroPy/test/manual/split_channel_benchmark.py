@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""
+   Times ImageWrapper.renderSplitChannel for 1 to 8 channels, rendering a
+   jpeg per panel and rendering each channel once as packed ints, against
+   a fake rendering engine which compresses its renders as jpeg and adds
+   a fixed delay to every render to stand in for the round trip.
+
+   The image size can be set via the BENCHMARK_SIZE environment variable
+   (default 512), the channel counts via BENCHMARK_CHANNELS (default
+   "1,2,3,4,6,8") and the delay per render in milliseconds via
+   BENCHMARK_LATENCY (default 5).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import unittest
+
+from gatewaytest.splitchannel import FakeRenderingEngine, fake_image
+
+SIZE = int(os.environ.get("BENCHMARK_SIZE", 512))
+CHANNELS = [int(x) for x in os.environ.get("BENCHMARK_CHANNELS", "1,2,3,4,6,8").split(",")]
+LATENCY = float(os.environ.get("BENCHMARK_LATENCY", 5)) / 1000.0
+
+
+class SlowRenderingEngine(FakeRenderingEngine):
+
+    def render(self):
+        time.sleep(LATENCY)
+        return FakeRenderingEngine.render(self)
+
+
+class TestSplitChannelBenchmark(unittest.TestCase):
+
+    def time(self, image, packed):
+        image._re.renders = 0
+        t0 = time.time()
+        image.renderSplitChannel(0, 0, packed=packed)
+        return image._re.renders, time.time() - t0
+
+    def testChannels(self):
+        print "\n%sx%s, %sms per render" % (SIZE, SIZE, LATENCY * 1000)
+        print "%8s %8s %10s %8s %10s" % ("channels", "renders", "per panel", "renders", "packed")
+        for c in CHANNELS:
+            image = fake_image(SIZE, SIZE, c, jpeg=90)
+            fake = image._re
+            image._re = SlowRenderingEngine(fake.pixels, fake.planes, fake.colors, fake.jpeg)
+            print "%8d %8d %9.3fs %8d %9.3fs" % ((c,) + self.time(image, False) + self.time(image, True))
+
+if __name__ == '__main__':
+    unittest.main()
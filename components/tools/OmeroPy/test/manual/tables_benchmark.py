@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+   Measures the read throughput of omero.tables.HdfStorage with several
+   threads reading the same file and reading separate files, with all
+   files held open and with fewer handles than files so that they are
+   reopened as they are used.
+
+   The number of threads, files and reads per thread can be set via the
+   BENCHMARK_THREADS (default 8), BENCHMARK_FILES (default 64) and
+   BENCHMARK_READS (default 200) environment variables.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import logging
+import threading
+import unittest
+
+import Ice
+import omero.columns
+import omero.tables
+
+from path import path
+from omero.util.temp_files import create_path
+
+THREADS = int(os.environ.get("BENCHMARK_THREADS", 8))
+FILES = int(os.environ.get("BENCHMARK_FILES", 64))
+READS = int(os.environ.get("BENCHMARK_READS", 200))
+ROWS = 1000
+
+
+class MockAdapter(object):
+    def __init__(self, ic):
+        self.ic = ic
+    def getCommunicator(self):
+        return self.ic
+
+
+class TestTablesBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level = logging.CRITICAL)
+        self.ic = Ice.initialize()
+        self.current = Ice.Current()
+        self.current.adapter = MockAdapter(self.ic)
+        for of in omero.columns.ObjectFactories.values():
+            of.register(self.ic)
+        self.limit = omero.tables.HDFLIST.max_open
+        self.dir = path(create_path(folder = True))
+        self.hdfs = [self.create(self.dir / ("%s.h5" % i)) for i in range(FILES)]
+
+    def tearDown(self):
+        for hdf in self.hdfs:
+            hdf.cleanup()
+        omero.tables.HDFLIST.max_open = self.limit
+        self.ic.destroy()
+
+    def create(self, p):
+        hdf = omero.tables.HdfStorage(p)
+        cols = [omero.columns.LongColumnI("a"), omero.columns.DoubleColumnI("b")]
+        hdf.initialize(cols)
+        cols[0].values = range(ROWS)
+        cols[1].values = [0.5 * x for x in range(ROWS)]
+        hdf.append(cols)
+        return hdf
+
+    def throughput(self, label, choose):
+        def reader(n):
+            for i in range(READS):
+                hdf = choose(n, i)
+                data = hdf.read(time.time(), [0, 1], 0, ROWS, self.current)
+                self.assertEquals(ROWS, len(data.rowNumbers))
+        threads = [threading.Thread(target = reader, args = (n,)) for n in range(THREADS)]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+        print "%-32s %8.1f reads/s" % (label, THREADS * READS / elapsed)
+
+    def testReadThroughput(self):
+        print "\n%s threads reading %s rows, %s reads each" % (THREADS, ROWS, READS)
+        omero.tables.HDFLIST.max_open = FILES
+        self.throughput("same file", lambda n, i: self.hdfs[0])
+        self.throughput("file per thread", lambda n, i: self.hdfs[n % FILES])
+        self.throughput("all files, all open",
+            lambda n, i: self.hdfs[(n * READS + i) % FILES])
+        omero.tables.HDFLIST.max_open = max(1, FILES / 4)
+        self.throughput("all files, 1/4 open",
+            lambda n, i: self.hdfs[(n * READS + i) % FILES])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+   Measures the write throughput, read and where throughput, random
+   reads and file size of omero.tables.HdfStorage for each storage
+   profile in omero.tables.PROFILES on a synthetic measurement table.
+
+   The number of rows can be set via the BENCHMARK_ROWS environment
+   variable (default 1000000) and the rows per append via BENCHMARK_BATCH
+   (default 10000).
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import os
+import time
+import logging
+import unittest
+
+import Ice
+import numpy
+import omero.columns
+import omero.tables
+
+from path import path
+from omero.util.temp_files import create_path
+
+ROWS = int(os.environ.get("BENCHMARK_ROWS", 1000000))
+BATCH = int(os.environ.get("BENCHMARK_BATCH", 10000))
+RANDOM = 1000
+
+
+class MockAdapter(object):
+    def __init__(self, ic):
+        self.ic = ic
+    def getCommunicator(self):
+        return self.ic
+
+
+class TestTablesProfileBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level = logging.CRITICAL)
+        self.ic = Ice.initialize()
+        self.current = Ice.Current()
+        self.current.adapter = MockAdapter(self.ic)
+        for of in omero.columns.ObjectFactories.values():
+            of.register(self.ic)
+        self.dir = path(create_path(folder = True))
+
+    def tearDown(self):
+        self.ic.destroy()
+
+    def cols(self, n):
+        """
+        Synthetic rows: a well index, a plate-like repeating id and two
+        measurements, of which one is mostly constant.
+        """
+        cols = [omero.columns.LongColumnI("well"),
+                omero.columns.LongColumnI("image"),
+                omero.columns.DoubleColumnI("area"),
+                omero.columns.DoubleColumnI("flag")]
+        if n:
+            start = self.written
+            cols[0].values = (numpy.arange(start, start + n) % 384).tolist()
+            cols[1].values = range(start, start + n)
+            cols[2].values = self.rnd.gamma(2.0, 50.0, n).tolist()
+            cols[3].values = (self.rnd.rand(n) > 0.99).astype(float).tolist()
+            self.written += n
+        return cols
+
+    def run_profile(self, name):
+        p = self.dir / ("%s.h5" % name)
+        hdf = omero.tables.HdfStorage(p)
+        try:
+            self.rnd = numpy.random.RandomState(0)
+            self.written = 0
+            hdf.initialize(self.cols(0), None, name)
+            t0 = time.time()
+            while self.written < ROWS:
+                hdf.append(self.cols(min(BATCH, ROWS - self.written)))
+            write = time.time() - t0
+
+            t0 = time.time()
+            for start in range(0, ROWS, BATCH):
+                hdf.read(time.time(), [0, 1, 2, 3], start, start + BATCH, self.current)
+            read = time.time() - t0
+
+            t0 = time.time()
+            hits = hdf.getWhereList(time.time(), "(area > 300) & (well == 17)", None, None, None, None, None)
+            where = time.time() - t0
+
+            rows = self.rnd.randint(0, ROWS, RANDOM).tolist()
+            t0 = time.time()
+            for row in rows:
+                hdf.readCoordinates(time.time(), [row], self.current)
+            random = time.time() - t0
+        finally:
+            hdf.cleanup()
+
+        print "%-14s %10.0f %10.0f %10.0f %10.0f %8.1f" % (name,
+            ROWS / write, ROWS / read, ROWS / where, RANDOM / random,
+            p.size / 1024.0 / 1024.0)
+        return len(hits)
+
+    def testProfiles(self):
+        print "\n%s rows, appended %s at a time" % (ROWS, BATCH)
+        print "%-14s %10s %10s %10s %10s %8s" % ("profile",
+            "write/s", "read/s", "where/s", "random/s", "MB")
+        hits = [self.run_profile(name) for name in sorted(omero.tables.PROFILES.keys())]
+        self.assertEquals(1, len(set(hits)))
+
+if __name__ == '__main__':
+    unittest.main()
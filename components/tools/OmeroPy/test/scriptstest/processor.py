@@ -8,7 +8,7 @@
 
 """
 
-import unittest, os, sys, logging, subprocess
+import unittest, os, sys, logging, subprocess, threading
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -16,6 +16,8 @@ import Ice
 import omero.processor
 import omero.util
 import omero.util.concurrency
+import omero.util.warm_pool
+from omero.util.temp_files import create_path
 from omero_ext.functional import wraps
 
 def pass_through(arg):
@@ -188,5 +190,237 @@ client = s.client("name","description",s.Long("l"))
         self.process.cleanup()
     testKillProcess = with_process(testKillProcess, subprocess.Popen)
 
+    #
+    # Warm pool
+    #
+
+    def warm_pool(self, **kwargs):
+        env = omero.processor.script_env(os.getcwd())()
+        pool = omero.util.warm_pool.WarmPool(env = env, **kwargs)
+        for worker in pool.workers:
+            worker.ready.wait(30)
+        return pool
+
+    def testWarmPoolRunsScript(self):
+        pool = self.warm_pool(size = 1)
+        try:
+            process = omero.processor.ProcessI(self.ctx, sys.executable, self.props(), self.params(), Popen = pool.Popen, callback_cast = pass_through)
+            try:
+                process.script_path.write_text("import os, sys\n"
+                    "print os.environ['ICE_CONFIG']\n"
+                    "sys.exit(3)\n")
+                process.activate()
+                self.assertTrue(isinstance(process.popen, omero.util.warm_pool.WarmPopen))
+                self.assertEquals(3, process.popen.wait())
+                self.assertEquals(str(process.config_path), process.stdout_path.text().strip())
+            finally:
+                process.cleanup()
+        finally:
+            pool.cleanup()
+
+    def testWarmPoolRecyclesWorkers(self):
+        pool = self.warm_pool(size = 1, max_jobs = 2)
+        try:
+            first = pool.workers[0]
+            script = create_path("warm", ".py")
+            script.write_text("pass\n")
+            for i in range(2):
+                popen = pool.Popen([sys.executable, str(script)])
+                self.assertTrue(isinstance(popen, omero.util.warm_pool.WarmPopen))
+                self.assertEquals(0, popen.wait())
+            self.assertTrue(first.retired)
+            self.assertFalse(first in pool.workers)
+            self.assertEquals(1, len(pool.workers))
+        finally:
+            pool.cleanup()
+
+    def testWarmPoolKill(self):
+        pool = self.warm_pool(size = 1)
+        try:
+            process = omero.processor.ProcessI(self.ctx, sys.executable, self.props(), self.params(), Popen = pool.Popen, callback_cast = pass_through)
+            process.script_path.write_text("import time\ntime.sleep(100)\n")
+            process.activate()
+            self.assertFalse(process.poll())
+            popen = process.popen
+            try:
+                process.kill()
+                self.assertEquals(-9, popen.wait())
+            finally:
+                process.cleanup()
+        finally:
+            pool.cleanup()
+
+    def testWarmPoolFallback(self):
+        pool = omero.util.warm_pool.WarmPool(size = 0, fallback = MockPopen)
+        popen = pool.Popen([sys.executable, "./script"])
+        self.assertTrue(isinstance(popen, MockPopen))
+
+    #
+    # Params cache
+    #
+
+    def testParamsCache(self):
+        cache = omero.processor.ParamsCache(size = 2)
+        files = [omero.model.OriginalFileI(x, False) for x in range(3)]
+        for i, f in enumerate(files):
+            f.sha1 = omero.rtypes.rstring("sha1-%s" % i)
+        self.assertEquals(None, cache.get(files[0]))
+        cache.put(files[0], "a")
+        cache.put(files[1], "b")
+        self.assertEquals("a", cache.get(files[0]))
+        cache.put(files[2], "c")
+        # files[1] was least recently used
+        self.assertEquals(None, cache.get(files[1]))
+        self.assertEquals("a", cache.get(files[0]))
+        self.assertEquals("c", cache.get(files[2]))
+        changed = omero.model.OriginalFileI(0, False)
+        changed.sha1 = omero.rtypes.rstring("sha1-changed")
+        self.assertEquals(None, cache.get(changed))
+        self.assertEquals(None, cache.get(None))
+
+    def testParamsCacheKey(self):
+        cache = omero.processor.ParamsCache(interpreter = "/usr/bin/python")
+        file = omero.model.OriginalFileI(1, False)
+        file.sha1 = omero.rtypes.rstring("sha1")
+        cache.put(file, "a")
+        # Same text in another file
+        other = omero.model.OriginalFileI(2, False)
+        other.sha1 = omero.rtypes.rstring("sha1")
+        self.assertEquals(None, cache.get(other))
+        # Same file under another interpreter
+        cache.interpreter = "/opt/python/bin/python"
+        self.assertEquals(None, cache.get(file))
+        cache.interpreter = "/usr/bin/python"
+        self.assertEquals("a", cache.get(file))
+        # Unsaved files are not cached
+        unsaved = omero.model.OriginalFileI()
+        unsaved.sha1 = omero.rtypes.rstring("sha1")
+        cache.put(unsaved, "b")
+        self.assertEquals(None, cache.get(unsaved))
+
+class FakeScriptService(object):
+    """
+    Returns the current text of each script and counts the fetches.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = {}
+        self.fetches = 0
+
+    def getScriptText(self, id):
+        self.lock.acquire()
+        try:
+            self.fetches += 1
+        finally:
+            self.lock.release()
+        return self.texts[id]
+
+    def replace(self, id, text):
+        """
+        Sets the text of script id, returning its OriginalFile.
+        """
+        self.texts[id] = text
+        file = omero.model.OriginalFileI(id, False)
+        file.sha1 = omero.rtypes.rstring(omero.processor.sha_new(text).hexdigest())
+        return file
+
+class TestScriptCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = create_path("scripts", ".dir", folder = True)
+        self.svc = FakeScriptService()
+
+    def cache(self, max_bytes = 1024):
+        return omero.processor.ScriptCache(self.dir / "cache", max_bytes)
+
+    def write(self, cache, file):
+        """
+        Writes the script as ProcessorI.launch does, returning its text
+        """
+        target = create_path("script", ".py")
+        sha1 = cache.write(file, target, lambda: self.svc.getScriptText(file.id.val))
+        self.assertEquals(file.sha1.val, sha1)
+        return target.bytes()
+
+    def testFetchedOnce(self):
+        cache = self.cache()
+        file = self.svc.replace(1, "print 'one'\n")
+        for i in range(5):
+            self.assertEquals("print 'one'\n", self.write(cache, file))
+        self.assertEquals(1, self.svc.fetches)
+        self.assertEquals(4, cache.hits)
+
+    def testReplacedScript(self):
+        cache = self.cache()
+        old = self.svc.replace(1, "print 'old'\n")
+        self.write(cache, old)
+        new = self.svc.replace(1, "print 'new'\n")
+        self.assertEquals("print 'new'\n", self.write(cache, new))
+        self.assertEquals("print 'new'\n", self.write(cache, new))
+        self.assertEquals(2, self.svc.fetches)
+        # Only the current version is kept
+        self.assertEquals([new.sha1.val], [f.name for f in (self.dir / "cache" / "1").files()])
+
+    def testChangedUnderneath(self):
+        cache = self.cache()
+        file = self.svc.replace(1, "print 'a'\n")
+        self.svc.texts[1] = "print 'b'\n" # sha1 no longer matches file
+        target = create_path("script", ".py")
+        sha1 = cache.write(file, target, lambda: self.svc.getScriptText(1))
+        self.assertNotEquals(file.sha1.val, sha1)
+        cache.write(file, target, lambda: self.svc.getScriptText(1))
+        self.assertEquals(2, self.svc.fetches) # Nothing was cached
+
+    def testDamagedEntry(self):
+        cache = self.cache()
+        file = self.svc.replace(1, "print 'ok'\n")
+        self.write(cache, file)
+        (self.dir / "cache" / "1" / file.sha1.val).write_bytes("print 'bad'\n")
+        self.assertEquals("print 'ok'\n", self.write(cache, file))
+        self.assertEquals(2, self.svc.fetches)
+
+    def testSizeBound(self):
+        cache = self.cache(max_bytes = 100)
+        files = [self.svc.replace(i, "#%s\n" % ("x" * 40) + str(i)) for i in range(3)]
+        for file in files:
+            self.write(cache, file)
+        self.assertTrue(cache.total <= 100)
+        self.assertEquals(2, len(cache.entries))
+        # The first, least recently used script was removed
+        self.write(cache, files[0])
+        self.assertEquals(4, self.svc.fetches)
+
+    def testPersistent(self):
+        file = self.svc.replace(1, "print 'kept'\n")
+        self.write(self.cache(), file)
+        self.assertEquals("print 'kept'\n", self.write(self.cache(), file))
+        self.assertEquals(1, self.svc.fetches)
+
+    def testDisabled(self):
+        cache = self.cache(max_bytes = 0)
+        file = self.svc.replace(1, "print 'none'\n")
+        self.write(cache, file)
+        self.write(cache, file)
+        self.assertEquals(2, self.svc.fetches)
+
+    def testThreads(self):
+        cache = self.cache(max_bytes = 10000)
+        files = [self.svc.replace(i, "print %s\n" % i) for i in range(4)]
+        errors = []
+        def run(file):
+            try:
+                for i in range(20):
+                    self.assertEquals("print %s\n" % file.id.val, self.write(cache, file))
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target = run, args = (files[i % 4],)) for i in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals([], errors)
+        self.assertEquals(4, self.svc.fetches)
+
 if __name__ == '__main__':
     unittest.main()
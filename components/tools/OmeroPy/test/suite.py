@@ -19,14 +19,19 @@ def additional_tests():
     load = unittest.defaultTestLoader.loadTestsFromName
     suite = unittest.TestSuite()
     suite.addTest(load("PythonOnly"))
+    suite.addTest(load("t_batch_upload"))
     suite.addTest(load("t_bin"))
     suite.addTest(load("t_clients"))
+    suite.addTest(load("t_columnar"))
     suite.addTest(load("t_config"))
     suite.addTest(load("t_ext"))
     suite.addTest(load("t_rtypes"))
     suite.addTest(load("t_model"))
+    suite.addTest(load("t_mpfit"))
     suite.addTest(load("t_parameters"))
     suite.addTest(load("t_permissions"))
+    suite.addTest(load("t_pipelined_read"))
+    suite.addTest(load("t_resources"))
     suite.addTest(load("t_tempfiles"))
     suite.addTest(load("clitest.suite"))
     suite.addTest(load("cmdtest.suite"))
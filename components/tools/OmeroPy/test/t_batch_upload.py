@@ -0,0 +1,128 @@
+"""
+/*
+ *   $Id$
+ *
+ *   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+ *   Use is subject to license terms supplied in LICENSE.txt
+ */
+"""
+
+import threading
+import unittest
+import omero
+
+from omero.rtypes import rlong, rstring
+from omero.util.batch_upload import BatchUploader, sha_new
+from omero.util.temp_files import create_path
+
+
+class MockUpdateService(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.next_id = 1
+
+    def saveAndReturnArray(self, objs):
+        self.calls += 1
+        for obj in objs:
+            obj.id = rlong(self.next_id)
+            self.next_id += 1
+        return objs
+
+
+class MockRawFileStore(object):
+
+    def __init__(self, files, fail_on = None):
+        self.files = files
+        self.fail_on = fail_on
+        self.closed = False
+        self.id = None
+
+    def setFileId(self, id):
+        self.id = id
+        self.files.setdefault(id, "")
+
+    def truncate(self, size):
+        self.files[self.id] = self.files[self.id][:size]
+
+    def write(self, buf, offset, length):
+        if self.id == self.fail_on:
+            raise omero.ServerError(None, None, "failed")
+        data = self.files[self.id]
+        self.files[self.id] = data[:offset] + buf[:length] + data[offset+length:]
+
+    def save(self):
+        ofile = omero.model.OriginalFileI(self.id, True)
+        ofile.sha1 = rstring(sha_new(self.files[self.id]).hexdigest())
+        return ofile
+
+    def close(self):
+        self.closed = True
+
+
+class MockServiceFactory(object):
+
+    def __init__(self, fail_on = None):
+        self.update = MockUpdateService()
+        self.stores = []
+        self.files = {}
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+
+    def getUpdateService(self):
+        return self.update
+
+    def createRawFileStore(self):
+        self.lock.acquire()
+        try:
+            store = MockRawFileStore(self.files, self.fail_on)
+            self.stores.append(store)
+            return store
+        finally:
+            self.lock.release()
+
+
+class TestBatchUpload(unittest.TestCase):
+
+    def files(self, count):
+        files = []
+        for i in range(count):
+            p = create_path("batch", ".txt")
+            p.write_bytes("%s\n" % i * (i + 1))
+            files.append((str(p), "text/plain"))
+        return files
+
+    def testUpload(self):
+        sf = MockServiceFactory()
+        files = self.files(20)
+        uploader = BatchUploader(sf, threads = 3, block_size = 7)
+        results = uploader.upload(files)
+        self.assertEquals(1, sf.update.calls)
+        self.assertTrue(len(sf.stores) <= 3)
+        total = 0
+        for (filename, type), result in zip(files, results):
+            self.assertEquals(None, result.error)
+            data = open(filename, "rb").read()
+            total += len(data)
+            self.assertEquals(data, sf.files[result.ofile.id.val])
+            self.assertEquals(sha_new(data).hexdigest(), result.sha1)
+        self.assertEquals(total, uploader.bytes)
+        for store in sf.stores:
+            self.assertTrue(store.closed)
+
+    def testFailureDoesNotAbortBatch(self):
+        sf = MockServiceFactory(fail_on = 2)
+        results = BatchUploader(sf, threads = 2).upload(self.files(5))
+        failed = [r for r in results if r.error is not None]
+        self.assertEquals(1, len(failed))
+        self.assertEquals(2, failed[0].ofile.id.val)
+
+    def testMissingFile(self):
+        sf = MockServiceFactory()
+        uploader = BatchUploader(sf)
+        self.assertRaises(omero.ClientError, uploader.upload,
+                          [("/does/not/exist", None)])
+        self.assertEquals(0, sf.update.calls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+   Tests for the columnar buffers and batched table writer used by the
+   populate_roi and populate_metadata scripts.
+
+   Copyright 2011 University of Dundee. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import unittest
+import array
+import omero
+
+from omero.rtypes import rlong
+from omero.grid import DoubleColumn, LongColumn, StringColumn
+from omero.util.columnar import TableCheckpoint, TableWriter, buffered
+from omero.util.temp_files import create_path
+
+class MockTable(object):
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.initialized = None
+        self.batches = []
+        self.rows = 0
+
+    def getOriginalFile(self):
+        return omero.model.OriginalFileI(1L, False)
+
+    def getNumberOfRows(self):
+        return self.rows
+
+    def initialize(self, columns):
+        self.initialized = columns
+
+    def addData(self, columns):
+        if self.fail_at is not None and self.rows >= self.fail_at:
+            self.fail_at = None
+            raise omero.ServerError(None, None, "failed")
+        self.batches.append(columns)
+        self.rows += len(columns[0].values)
+
+def make_columns(n):
+    longs = buffered(LongColumn('Long', '', range(n)))
+    doubles = buffered(DoubleColumn('Double', '', [float(i) for i in range(n)]))
+    strings = buffered(StringColumn('String', '', 8, [str(i) for i in range(n)]))
+    return [longs, doubles, strings]
+
+class TestColumnar(unittest.TestCase):
+
+    def testBuffered(self):
+        longs, doubles, strings = make_columns(3)
+        self.assertTrue(isinstance(longs.values, array.array))
+        self.assertTrue(isinstance(doubles.values, array.array))
+        self.assertTrue(isinstance(strings.values, list))
+        longs.values.append(3L)
+        longs.values.extend([4, 5])
+        self.assertEquals(6, len(longs.values))
+        self.assertEquals(5, longs.values[-1])
+
+    def testBatches(self):
+        table = MockTable()
+        writer = TableWriter(table, make_columns(25), batch_size=10)
+        writer.initialize()
+        for column in table.initialized:
+            self.assertEquals([], column.values)
+        self.assertEquals(25, writer.write())
+        self.assertEquals([10, 10, 5],
+                [len(b[0].values) for b in table.batches])
+        self.assertEquals(range(20, 25), table.batches[2][0].values)
+        self.assertEquals(8, table.batches[2][2].size)
+        self.assertEquals(25, writer.committed)
+        self.assertEquals(0, writer.write())
+
+    def testResumeAfterFailure(self):
+        table = MockTable(fail_at=10)
+        writer = TableWriter(table, make_columns(25), batch_size=10)
+        writer.initialize()
+        self.assertRaises(omero.ServerError, writer.write)
+        self.assertEquals(10, writer.committed)
+        self.assertEquals(15, writer.write())
+        self.assertEquals(range(25),
+                sum([b[0].values for b in table.batches], []))
+
+    def testCheckpoint(self):
+        checkpoint = TableCheckpoint(create_path())
+        table = MockTable(fail_at=20)
+        writer = TableWriter(table, make_columns(25), batch_size=10,
+                             checkpoint=checkpoint)
+        writer.initialize()
+        self.assertRaises(omero.ServerError, writer.write)
+        self.assertEquals((1L, 20L), checkpoint.load())
+        # A new writer, as after a restart
+        writer = TableWriter(table, make_columns(25), batch_size=10,
+                             checkpoint=checkpoint)
+        writer.resume()
+        self.assertEquals(20, writer.committed)
+        self.assertEquals(5, writer.write())
+        self.assertEquals((1L, 25L), checkpoint.load())
+        writer.finish()
+        self.assertEquals(None, checkpoint.load())
+
+    def testFlush(self):
+        table = MockTable()
+        columns = make_columns(0)
+        writer = TableWriter(table, columns, batch_size=10)
+        writer.initialize()
+        for i in range(25):
+            columns[0].values.append(i)
+            columns[1].values.append(float(i))
+            self.assertEquals(0, writer.flush())
+            columns[2].values.append(str(i))
+            writer.flush()
+            writer.discard()
+            self.assertTrue(len(columns[0].values) < 10)
+        self.assertEquals([10, 10], [len(b[0].values) for b in table.batches])
+        self.assertEquals(20, writer.committed)
+        self.assertEquals(25, writer.get_row_count())
+        self.assertEquals(5, writer.write())
+        self.assertEquals(range(25),
+                sum([b[0].values for b in table.batches], []))
+        self.assertEquals([str(i) for i in range(25)],
+                sum([b[2].values for b in table.batches], []))
+
+    def testFlushAfterResume(self):
+        table = MockTable()
+        table.rows = 15
+        columns = make_columns(0)
+        writer = TableWriter(table, columns, batch_size=10)
+        writer.resume()
+        for i in range(40):
+            for column in columns:
+                column.values.append(column is columns[2] and str(i) or i)
+            writer.flush()
+            writer.discard()
+        self.assertEquals([10, 10], [len(b[0].values) for b in table.batches])
+        self.assertEquals(range(15, 35), table.batches[0][0].values + table.batches[1][0].values)
+        self.assertEquals(5, writer.write())
+        self.assertEquals(40, table.rows)
+
+if __name__ == '__main__':
+    unittest.main()
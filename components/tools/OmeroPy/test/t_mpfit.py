@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+   Regression tests for omero.util.mpfit: analytical derivatives, the
+   numpy.linalg solver and batched fitting are checked against the
+   default MINPACK solver with finite difference derivatives on
+   standard least-squares test problems (More, Garbow and Hillstrom,
+   ACM TOMS 7, 1981) and on curve fits with limits and fixed parameters.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import unittest
+
+import numpy
+
+from omero.util.mpfit import mpfit, mpfit_batch
+
+
+class Problem(object):
+    """
+    A least-squares problem given by its residuals and their jacobian.
+    """
+
+    def __init__(self, name, residuals, jacobian, start, solution=None,
+                 parinfo=None):
+        self.name = name
+        self.residuals = residuals
+        self.jacobian = jacobian
+        self.start = numpy.asarray(start, float)
+        self.solution = solution
+        self.parinfo = parinfo
+
+    def __call__(self, p, fjac=None):
+        f = self.residuals(p)
+        if fjac is None:
+            return [0, f, None]
+        # mpfit expects the derivatives of the model, i.e. of -f
+        return [0, f, -self.jacobian(p)]
+
+    def fit(self, **kwargs):
+        parinfo = None
+        xall = self.start.copy()
+        if self.parinfo is not None:
+            parinfo = [dict(info, value=v)
+                       for info, v in zip(self.parinfo, self.start)]
+            xall = None
+        return mpfit(self, xall, parinfo=parinfo, quiet=1, **kwargs)
+
+
+def rosenbrock():
+    def f(p):
+        return numpy.array([10*(p[1]-p[0]**2), 1-p[0]])
+    def j(p):
+        return numpy.array([[-20*p[0], 10.], [-1., 0.]])
+    return Problem("rosenbrock", f, j, [-1.2, 1.], [1., 1.])
+
+def beale():
+    y = numpy.array([1.5, 2.25, 2.625])
+    i = numpy.arange(1, 4)
+    def f(p):
+        return y - p[0]*(1-p[1]**i)
+    def j(p):
+        return numpy.array([-(1-p[1]**i), p[0]*i*p[1]**(i-1)]).T
+    return Problem("beale", f, j, [1., 1.], [3., 0.5])
+
+def box3d():
+    t = 0.1 * numpy.arange(1, 11)
+    def f(p):
+        return numpy.exp(-t*p[0]) - numpy.exp(-t*p[1]) - \
+               p[2]*(numpy.exp(-t) - numpy.exp(-10*t))
+    def j(p):
+        return numpy.array([-t*numpy.exp(-t*p[0]), t*numpy.exp(-t*p[1]),
+                            -(numpy.exp(-t) - numpy.exp(-10*t))]).T
+    return Problem("box3d", f, j, [0., 10., 20.], [1., 10., 1.])
+
+def helical_valley():
+    def theta(p):
+        return numpy.arctan2(p[1], p[0]) / (2*numpy.pi)
+    def f(p):
+        r = numpy.sqrt(p[0]**2 + p[1]**2)
+        return numpy.array([10*(p[2] - 10*theta(p)), 10*(r-1), p[2]])
+    def j(p):
+        r2 = p[0]**2 + p[1]**2
+        r = numpy.sqrt(r2)
+        c = 100 / (2*numpy.pi*r2)
+        return numpy.array([[c*p[1], -c*p[0], 10.],
+                            [10*p[0]/r, 10*p[1]/r, 0.],
+                            [0., 0., 1.]])
+    return Problem("helical valley", f, j, [-1., 0., 0.], [1., 0., 0.])
+
+def gaussian_curve():
+    x = numpy.linspace(-5, 5, 101)
+    rnd = numpy.random.RandomState(1)
+    y = 3*numpy.exp(-0.5*((x-0.7)/1.3)**2) + 0.2 + 0.01*rnd.randn(len(x))
+    def f(p):
+        return y - (p[0]*numpy.exp(-0.5*((x-p[1])/p[2])**2) + p[3])
+    def j(p):
+        g = numpy.exp(-0.5*((x-p[1])/p[2])**2)
+        return -numpy.array([g, p[0]*g*(x-p[1])/p[2]**2,
+                             p[0]*g*(x-p[1])**2/p[2]**3,
+                             numpy.ones(len(x))]).T
+    return Problem("gaussian", f, j, [1., 0., 1., 0.])
+
+def bounded_decay():
+    """A decay whose background is limited below by 1.0 and so ends up
+    pegged at the limit, with a fixed lifetime."""
+    t = numpy.linspace(0, 10, 60)
+    y = 5*numpy.exp(-t/2.0) + 0.5
+    info = [{'limited':[1,0], 'limits':[0.,0.]},
+            {'fixed':1},
+            {'limited':[1,1], 'limits':[1.,3.]}]
+    def f(p):
+        return y - (p[0]*numpy.exp(-t/p[1]) + p[2])
+    def j(p):
+        e = numpy.exp(-t/p[1])
+        return -numpy.array([e, p[0]*e*t/p[1]**2, numpy.ones(len(t))]).T
+    return Problem("bounded decay", f, j, [1., 2., 2.], parinfo=info)
+
+PROBLEMS = [rosenbrock, beale, box3d, helical_valley, gaussian_curve,
+            bounded_decay]
+
+
+class TestMpfit(unittest.TestCase):
+
+    def assertSameFit(self, expected, got, name, rtol=1e-5, atol=1e-7):
+        self.assertTrue(got.status > 0, "%s: %s %s" % \
+                        (name, got.status, got.errmsg))
+        self.assertTrue(numpy.allclose(expected.params, got.params,
+                        rtol=rtol, atol=atol), "%s: %s != %s" % \
+                        (name, expected.params, got.params))
+        self.assertTrue(abs(expected.fnorm - got.fnorm) <= \
+                        1e-6 * max(1., expected.fnorm), name)
+
+    def testReference(self):
+        for problem in PROBLEMS:
+            problem = problem()
+            fit = problem.fit()
+            self.assertTrue(fit.status > 0, problem.name)
+            if problem.solution is not None:
+                self.assertTrue(numpy.allclose(fit.params, problem.solution,
+                                atol=1e-6), problem.name)
+
+    def testAnalyticDerivatives(self):
+        for problem in PROBLEMS:
+            problem = problem()
+            self.assertSameFit(problem.fit(),
+                               problem.fit(autoderivative=0), problem.name)
+
+    def testAnalyticDerivativesAreUsed(self):
+        problem = gaussian_curve()
+        calls = []
+        def fcn(p, fjac=None):
+            calls.append(fjac is not None)
+            return problem(p, fjac)
+        fit = mpfit(fcn, problem.start.copy(), autoderivative=0, quiet=1)
+        self.assertTrue(fit.status > 0)
+        # One call with derivatives per iteration and no finite
+        # differences: the other calls are single function evaluations.
+        self.assertTrue(0 < sum(calls) <= fit.niter)
+        self.assertTrue(fit.nfev < problem.fit().nfev)
+
+    def testMissingDerivatives(self):
+        problem = rosenbrock()
+        fcn = lambda p, fjac=None: [0, problem.residuals(p)]
+        fit = mpfit(fcn, problem.start, autoderivative=0, quiet=1)
+        self.assertTrue(fit.status <= 0)
+        self.assertTrue(fit.errmsg)
+
+    def testNumpySolver(self):
+        for problem in PROBLEMS:
+            problem = problem()
+            reference = problem.fit()
+            self.assertSameFit(reference, problem.fit(solver='numpy'),
+                               problem.name)
+            self.assertSameFit(reference,
+                problem.fit(solver='numpy', autoderivative=0), problem.name)
+
+    def testNumpySolverCovariance(self):
+        problem = gaussian_curve()
+        reference = problem.fit()
+        fit = problem.fit(solver='numpy')
+        self.assertTrue(numpy.allclose(reference.perror, fit.perror,
+                                       rtol=1e-4))
+
+    def testBadSolver(self):
+        problem = rosenbrock()
+        fit = problem.fit(solver='lapack')
+        self.assertEquals(0, fit.status)
+        self.assertTrue(fit.errmsg)
+
+
+class TestMpfitBatch(unittest.TestCase):
+
+    def setUp(self):
+        rnd = numpy.random.RandomState(2)
+        self.t = numpy.linspace(0, 10, 50)
+        self.k = 40
+        self.truth = numpy.array([4 + rnd.rand(self.k),
+                                  1 + 2*rnd.rand(self.k),
+                                  0.3*rnd.rand(self.k)]).T
+        self.y = self.model(self.truth) + 0.01*rnd.randn(self.k, len(self.t))
+        self.start = numpy.array([[1., 1., 0.]] * self.k)
+
+    def model(self, p):
+        t = self.t[numpy.newaxis,:]
+        return p[:,0:1]*numpy.exp(-t/p[:,1:2]) + p[:,2:3]
+
+    def fcn(self, p, fjac=None, y=None):
+        f = y - self.model(p)
+        if fjac is None:
+            return [0, f]
+        t = self.t[numpy.newaxis,:]
+        e = numpy.exp(-t/p[:,1:2])
+        d = numpy.empty(f.shape + (3,))
+        d[:,:,0] = e
+        d[:,:,1] = p[:,0:1]*e*t/p[:,1:2]**2
+        d[:,:,2] = 1.
+        return [0, f, d]
+
+    def single(self, i, **kwargs):
+        def fcn(p, fjac=None):
+            return [0, self.fcn(p[numpy.newaxis,:], y=self.y[i:i+1])[1][0]]
+        return mpfit(fcn, self.start[i], quiet=1, **kwargs)
+
+    def testMatchesIndividualFits(self):
+        for kwargs in ({}, {'autoderivative': 0}):
+            batch = mpfit_batch(self.fcn, self.start, functkw={'y': self.y},
+                                **kwargs)
+            self.assertTrue((batch.status > 0).all(), batch.errmsg)
+            for i in range(self.k):
+                fit = self.single(i)
+                self.assertTrue(numpy.allclose(fit.params, batch.params[i],
+                                               rtol=1e-5), i)
+                self.assertTrue(abs(fit.fnorm - batch.fnorm[i]) <= \
+                                1e-8 + 1e-6 * fit.fnorm)
+
+    def testLimitsAndFixed(self):
+        parinfo = [{}, {'fixed': 1}, {'limited': [1,1], 'limits': [0.2, 0.25]}]
+        start = self.start.copy()
+        start[:,1] = self.truth[:,1]
+        start[:,2] = 0.22
+        batch = mpfit_batch(self.fcn, start, functkw={'y': self.y},
+                            parinfo=parinfo)
+        self.assertTrue((batch.status > 0).all(), batch.errmsg)
+        self.assertTrue((batch.params[:,1] == self.truth[:,1]).all())
+        self.assertTrue((batch.params[:,2] >= 0.2).all())
+        self.assertTrue((batch.params[:,2] <= 0.25).all())
+        for i in range(self.k):
+            info = [dict(d, value=v) for d, v in zip(parinfo, start[i])]
+            def fcn(p, fjac=None):
+                return [0, self.fcn(p[numpy.newaxis,:], y=self.y[i:i+1])[1][0]]
+            fit = mpfit(fcn, parinfo=info, quiet=1)
+            self.assertTrue(numpy.allclose(fit.params, batch.params[i],
+                                           rtol=1e-4, atol=1e-6), i)
+
+    def testCallsPerIteration(self):
+        batch = mpfit_batch(self.fcn, self.start, functkw={'y': self.y},
+                            autoderivative=0)
+        # One call for the derivatives and one for the trial step of
+        # every iteration of all problems together
+        self.assertTrue(batch.nfev <= 2 * batch.niter.max() + 40)
+
+    def testTiedUnsupported(self):
+        batch = mpfit_batch(self.fcn, self.start, functkw={'y': self.y},
+                            parinfo=[{}, {}, {'tied': 'p[0]'}])
+        self.assertTrue((batch.status == 0).all())
+        self.assertTrue(batch.errmsg)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+/*
+ *   $Id$
+ *
+ *   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+ *   Use is subject to license terms supplied in LICENSE.txt
+ */
+"""
+
+import time
+import random
+import threading
+import unittest
+
+from omero.util.pipelined_read import PipelinedReader
+
+
+class MockFile(object):
+    """
+    Random access read() over a string which records the maximum number
+    of concurrent calls.
+    """
+
+    def __init__(self, data, delay = 0.0, fail_at = None, max_length = None):
+        self.data = data
+        self.delay = delay
+        self.fail_at = fail_at
+        self.max_length = max_length
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    def read(self, offset, length):
+        self.lock.acquire()
+        try:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        finally:
+            self.lock.release()
+        try:
+            if self.delay:
+                time.sleep(self.delay * random.random())
+            if offset == self.fail_at:
+                raise IOError("failed at %s" % offset)
+            if self.max_length is not None:
+                length = min(length, self.max_length)
+            return self.data[offset:offset+length]
+        finally:
+            self.lock.acquire()
+            self.active -= 1
+            self.lock.release()
+
+
+class TestPipelinedRead(unittest.TestCase):
+
+    def data(self, size):
+        return "".join([chr(i % 256) for i in range(size)])
+
+    def testOrdered(self):
+        data = self.data(10007)
+        f = MockFile(data, delay = 0.005)
+        reader = PipelinedReader(f.read, len(data), chunk_size = 100, depth = 8)
+        self.assertEquals(data, "".join(reader))
+        self.assertEquals(101, f.calls)
+        self.assertEquals(len(data), reader.bytes_read)
+        self.assertTrue(f.max_active > 1)
+        self.assertTrue(f.max_active <= 8)
+
+    def testSequential(self):
+        data = self.data(1000)
+        f = MockFile(data)
+        reader = PipelinedReader(f.read, len(data), chunk_size = 64, depth = 1)
+        self.assertEquals(data, "".join(reader))
+        self.assertEquals(1, f.max_active)
+
+    def testEmpty(self):
+        f = MockFile("")
+        self.assertEquals([], list(PipelinedReader(f.read, 0)))
+        self.assertEquals(0, f.calls)
+
+    def testShortRemoteFile(self):
+        data = self.data(500)
+        f = MockFile(data)
+        reader = PipelinedReader(f.read, 1000, chunk_size = 100, depth = 4)
+        self.assertEquals(data, "".join(reader))
+
+    def testShortReads(self):
+        data = self.data(1000)
+        f = MockFile(data, max_length = 30)
+        reader = PipelinedReader(f.read, len(data), chunk_size = 100, depth = 1)
+        self.assertEquals(data, "".join(reader))
+        self.assertEquals(34, f.calls)
+
+    def testShortReadsPipelined(self):
+        data = self.data(1050)
+        f = MockFile(data, delay = 0.002, max_length = 30)
+        reader = PipelinedReader(f.read, len(data), chunk_size = 100, depth = 4)
+        self.assertEquals(data, "".join(reader))
+        self.assertEquals(len(data), reader.bytes_read)
+
+    def testShortReadAtEnd(self):
+        data = self.data(450)
+        f = MockFile(data, max_length = 70)
+        reader = PipelinedReader(f.read, 1000, chunk_size = 100, depth = 4)
+        self.assertEquals(data, "".join(reader))
+
+    def testErrorIsRaisedInOrder(self):
+        data = self.data(1000)
+        f = MockFile(data, fail_at = 300)
+        reader = PipelinedReader(f.read, len(data), chunk_size = 100, depth = 4)
+        seen = []
+        try:
+            for chunk in reader:
+                seen.append(chunk)
+            self.fail("No error")
+        except IOError:
+            pass
+        self.assertEquals(data[:300], "".join(seen))
+
+    def testProgress(self):
+        data = self.data(1000)
+        f = MockFile(data)
+        calls = []
+        def progress(done, total, elapsed):
+            calls.append((done, total))
+        reader = PipelinedReader(f.read, len(data), chunk_size = 400,
+                                 progress = progress)
+        list(reader)
+        self.assertEquals([(400, 1000), (800, 1000), (1000, 1000)], calls)
+
+if __name__ == '__main__':
+    unittest.main()
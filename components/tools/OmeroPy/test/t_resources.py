@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""
+   Tests of the check scheduling of omero.util.Resources, including
+   a stress test with thousands of resources, some slow or failing.
+
+   Copyright 2011 Glencoe Software, Inc. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import time
+import threading
+import unittest
+
+import omero.util
+
+from omero.util.concurrency import get_event
+
+
+class Resource(object):
+    """
+    Synthetic resource whose check sleeps for delay seconds and then
+    returns the next of results (the last one repeating).
+    """
+
+    def __init__(self, delay = 0.0, results = (True,)):
+        self.delay = delay
+        self.results = list(results)
+        self.checks = []
+        self.cleaned = 0
+        self.lock = threading.Lock()
+
+    def check(self):
+        self.lock.acquire()
+        try:
+            self.checks.append(time.time())
+            rv = self.results[min(len(self.checks), len(self.results)) - 1]
+        finally:
+            self.lock.release()
+        if self.delay:
+            time.sleep(self.delay)
+        if isinstance(rv, Exception):
+            raise rv
+        return rv
+
+    def cleanup(self):
+        self.cleaned += 1
+
+
+class TestResources(unittest.TestCase):
+
+    def setUp(self):
+        self.resources = None
+
+    def tearDown(self):
+        if self.resources is not None:
+            self.resources.cleanup()
+
+    def make(self, **kwargs):
+        self.resources = omero.util.Resources(stop_event = get_event("t_resources"), **kwargs)
+        return self.resources
+
+    def waitFor(self, condition, timeout = 10.0):
+        stop = time.time() + timeout
+        while not condition():
+            if time.time() > stop:
+                self.fail("Timed out")
+            time.sleep(0.02)
+
+    def testSleeptime(self):
+        self.assertRaises(Exception, omero.util.Resources, sleeptime = 1)
+
+    def testAddRemoveCleanup(self):
+        r = self.make()
+        a, b = Resource(), Resource()
+        r.add(a)
+        r.add(b)
+        self.assertTrue(r.remove(b))
+        self.assertFalse(r.remove(b))
+        r.cleanup()
+        self.resources = None
+        self.assertEquals(1, a.cleaned)
+        self.assertEquals(0, b.cleaned)
+
+    def testFailureIsRechecked(self):
+        r = self.make(retries = 1)
+        flaky = Resource(results = (False, True))
+        dead = Resource(results = (False,))
+        broken = Resource(results = (ValueError("broken"),))
+        for x in (flaky, dead, broken):
+            r.add(x, interval = 0.1)
+        self.waitFor(lambda: broken.cleaned and dead.cleaned and len(flaky.checks) > 2)
+        # The retry follows the failure straight away
+        self.assertTrue(flaky.checks[1] - flaky.checks[0] < 0.05)
+        self.assertEquals(0, flaky.cleaned)
+        self.assertEquals(2, len(dead.checks))
+        self.assertEquals(2, len(broken.checks))
+        self.assertEquals(2, r.stats()["removed"])
+
+    def testBackoff(self):
+        r = self.make(max_interval = 0.8)
+        steady = Resource()
+        fixed = Resource()
+        r.add(steady, interval = 0.1)
+        r.add(fixed, interval = 0.1, max_interval = 0.1)
+        time.sleep(2.0)
+        gaps = [y - x for x, y in zip(steady.checks, steady.checks[1:])]
+        self.assertTrue(gaps[-1] > 0.7, gaps)
+        self.assertTrue(len(fixed.checks) > 3 * len(steady.checks))
+
+    def testSlowCheckDoesNotBlock(self):
+        r = self.make(threads = 2, timeout = 0.2)
+        hung = [Resource(delay = 2.0) for i in range(3)]
+        fast = Resource()
+        for x in hung:
+            r.add(x, interval = 0.1)
+        r.add(fast, interval = 0.1)
+        self.waitFor(lambda: len(fast.checks) > 5, timeout = 1.5)
+        stats = r.stats()
+        self.assertEquals(3, stats["timeouts"])
+        self.assertEquals(3, stats["running"])
+        for x in hung:
+            self.assertEquals(1, len(x.checks))
+
+    def testStress(self):
+        count = 3000
+        r = self.make(threads = 8, timeout = 0.5, max_interval = 1.0)
+        fast = [Resource() for i in range(count)]
+        slow = [Resource(delay = 0.3) for i in range(20)]
+        hung = [Resource(delay = 3.0) for i in range(5)]
+        dead = [Resource(results = (False,)) for i in range(50)]
+        everything = fast + slow + hung + dead
+        start = time.time()
+        for x in everything:
+            r.add(x, interval = 0.2)
+        self.waitFor(lambda: min([len(x.checks) for x in fast]) >= 3)
+        elapsed = time.time() - start
+        stats = r.stats()
+        print "\n%s resources: %s checks in %.1fs, mean %.2fms, max %.0fms, %s timeouts, %s workers" % \
+            (len(everything), stats["checks"], elapsed, 1000 * stats["mean_time"],
+             1000 * stats["max_time"], stats["timeouts"], stats["workers"])
+        self.assertTrue(elapsed < 8.0, elapsed)
+        self.assertEquals(len(dead), len([x for x in dead if x.cleaned]))
+        self.assertEquals(len(everything) - len(dead), stats["entries"])
+        self.assertEquals(len(hung), stats["timeouts"])
+        self.assertTrue(stats["workers"] <= 8 + len(hung))
+        for x in slow:
+            self.assertTrue(len(x.checks) >= 2)
+
+if __name__ == '__main__':
+    unittest.main()
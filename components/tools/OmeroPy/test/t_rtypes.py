@@ -7,10 +7,16 @@
  */
 """
 
+import random
 import unittest, omero
 import omero_model_ImageI # For Image
 from omero.rtypes import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Data
 ids = [rlong(1)]
 
@@ -430,6 +436,117 @@ class TestModel(unittest.TestCase):
 
         self.assertRaises(ValueError, wrap, {1:2})
 
+    def testWrapHomogeneous(self):
+        for values, rclass in (([1, 0, 2], omero.RInt), ([1L, 0L], omero.RLong),
+                               ([0.5, 0.0], omero.RFloat), (["a", ""], omero.RString),
+                               ([True, False], omero.RBool)):
+            rv = wrap(values)
+            self.assertEquals(values, unwrap(rv))
+            for x in rv.val:
+                self.assertTrue(isinstance(x, rclass))
+        self.assertEquals(rint0, wrap([0]).val[0])
+        self.assertEquals(remptystr, wrap([""]).val[0])
+
+    def testWrapSet(self):
+        rv = wrap(set([1, 2]))
+        self.assertTrue(isinstance(rv, omero.RSet))
+        self.assertEquals([1, 2], sorted(unwrap(rv)))
+
+    def testWrapNumpy(self):
+        if numpy is None:
+            return
+        rv = wrap(numpy.arange(5, dtype=numpy.int64))
+        self.assertTrue(isinstance(rv, omero.RArray))
+        self.assertTrue(isinstance(rv.val[0], omero.RLong))
+        self.assertEquals([0, 1, 2, 3, 4], unwrap(rv))
+        rv = wrap(numpy.array([0.5, 1.5]))
+        self.assertTrue(isinstance(rv.val[0], omero.RDouble))
+        self.assertTrue(isinstance(wrap(numpy.array([1], dtype=numpy.int16)).val[0], omero.RInt))
+        self.assertTrue(isinstance(wrap(numpy.array([1], dtype=numpy.float32)).val[0], omero.RFloat))
+        rv = wrap(numpy.arange(6).reshape(2, 3))
+        self.assertEquals([[0, 1, 2], [3, 4, 5]], unwrap(rv))
+        self.assertTrue(isinstance(rv.val[1], omero.RArray))
+        self.assertEquals(3, unwrap(wrap(numpy.int32(3))))
+        self.assertEquals(["a", "bc"], unwrap(wrap(numpy.array(["a", "bc"]))))
+
+    def testMemoSharedSubstructures(self):
+        shared = [1, 2]
+        rv = wrap({"a": shared, "b": [shared, shared]})
+        self.assertTrue(rv.val["a"] is rv.val["b"].val[0])
+        self.assertTrue(rv.val["a"] is rv.val["b"].val[1])
+        back = unwrap(rv)
+        self.assertTrue(back["a"] is back["b"][0])
+        # Equal but distinct lists are not merged
+        rv = wrap([[1], [1]])
+        self.assertFalse(rv.val[0] is rv.val[1])
+        # A caller's cache maps the id of each collection to its result
+        cache = {}
+        l = [1]
+        first = wrap(l, cache)
+        self.assertEquals({id(l): first}, cache)
+        self.assertTrue(first is wrap(l, cache))
+        back = unwrap(first, cache)
+        self.assertTrue(back is cache[id(first)])
+        self.assertTrue(back is unwrap(first, cache))
+
+    def testUnwrapView(self):
+        rv = wrap({"a": [1, [2, 3]], "b": "x"})
+        view = unwrap_view(rv)
+        self.assertEquals(2, len(view))
+        self.assertTrue("a" in view)
+        self.assertEquals("x", view["b"])
+        self.assertEquals(None, view.get("c"))
+        self.assertEquals([1, [2, 3]], view["a"])
+        self.assertEquals(3, view["a"][1][1])
+        self.assertEquals([[2, 3]], view["a"][1:])
+        self.assertEquals(unwrap(rv), view)
+        self.assertEquals(5, unwrap_view(rint(5)))
+        self.assertEquals([], unwrap_view(rlist()))
+
+    def random_structure(self, rnd, depth = 0):
+        choice = rnd.randint(0, depth < 4 and 9 or 4)
+        if choice == 0:
+            return rnd.randint(-5, 5)
+        elif choice == 1:
+            return long(rnd.randint(-5, 5))
+        elif choice == 2:
+            return rnd.random()
+        elif choice == 3:
+            return rnd.choice(["", "a", "bc"])
+        elif choice == 4:
+            return rnd.choice([True, False])
+        elif choice == 5:
+            # Homogeneous, for the one-pass conversion
+            item = rnd.choice([rnd.random, lambda: rnd.randint(-5, 5), lambda: rnd.choice(["", "a"])])
+            return [item() for i in range(rnd.randint(0, 20))]
+        elif choice == 6:
+            return [self.random_structure(rnd, depth + 1) for i in range(rnd.randint(0, 5))]
+        else:
+            rv = {}
+            for i in range(rnd.randint(0, 5)):
+                rv["k%s" % i] = self.random_structure(rnd, depth + 1)
+            return rv
+
+    def assertSameTypes(self, expected, got):
+        self.assertEquals(type(expected), type(got))
+        if isinstance(expected, list):
+            for a, b in zip(expected, got):
+                self.assertSameTypes(a, b)
+        elif isinstance(expected, dict):
+            for k in expected:
+                self.assertSameTypes(expected[k], got[k])
+
+    def testRoundTrip(self):
+        rnd = random.Random(0)
+        for i in range(200):
+            value = self.random_structure(rnd)
+            rv = wrap(value)
+            self.assertEquals(value, unwrap(rv))
+            self.assertSameTypes(value, unwrap(rv))
+            if isinstance(value, (list, dict)):
+                self.assertEquals(value, unwrap_view(rv))
+            self.assertEquals(rv, wrap(unwrap(rv)))
+
     def testResuingClass(self):
         myLong = rlong(5)
         myLongFromString = rlong("5")
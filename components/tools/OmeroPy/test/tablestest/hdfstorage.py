@@ -208,7 +208,7 @@ class TestHdfStorage(TestCase):
         self.assertEquals(5, test.y[0])
         self.assertEquals(6, test.w[0])
         self.assertEquals(7, test.h[0])
-        self.assertEquals([0], test.bytes[0])
+        self.assertEquals([0], test.bytes[0].tolist())
 
         self.assertEquals(2, test.imageId[1])
         self.assertEquals(2, test.theZ[1])
@@ -217,9 +217,251 @@ class TestHdfStorage(TestCase):
         self.assertEquals(5, test.y[1])
         self.assertEquals(6, test.w[1])
         self.assertEquals(7, test.h[1])
-        self.assertEquals([0,1,2,3,4], test.bytes[1])
+        self.assertEquals([0,1,2,3,4], test.bytes[1].tolist())
         hdf.cleanup()
 
+    def masks(self, count, start = 0):
+        mask = omero.columns.MaskColumnI('mask', 'desc', None)
+        mask.imageId = range(start, start + count)
+        mask.theZ = [0] * count
+        mask.theT = [0] * count
+        mask.x = [0.0] * count
+        mask.y = [0.0] * count
+        mask.w = [0.0] * count
+        mask.h = [0.0] * count
+        mask.bytes = [[(i + j) % 256 for j in range(i % 7)] for i in range(start, start + count)]
+        return mask
+
+    def testMaskColumnRanges(self):
+        hdf = omero.tables.HdfStorage(self.hdfpath())
+        hdf.initialize([self.masks(0)], None)
+        hdf.append([self.masks(500)])
+        hdf.append([self.masks(500, 500)])
+        mea = hdf._HdfStorage__mea
+        self.assertEquals(1000, mea._v_parent.Measurements_mask_ends.nrows)
+        expected = self.masks(1000).bytes
+        for rows in ([0], [999], [6, 3, 3, 500], range(480, 520), [0, 999]):
+            data = hdf.readCoordinates(hdf._stamp, rows, self.current)
+            self.assertEquals([expected[r] for r in rows], [x.tolist() for x in data.columns[0].bytes])
+        col = self.masks(0)
+        slices = col.slices(mea, range(495, 505))
+        self.assertEquals(expected[495:505], [x.tolist() for x in slices])
+        # only turned into byte strings for Ice
+        data.columns[0].marshal()
+        self.assertEquals(["".join([chr(b) for b in expected[r]]) for r in [0, 999]], data.columns[0].bytes)
+        hdf.cleanup()
+
+    def testMaskColumnVLArray(self):
+        """
+        Tables written before the packed layout keep their VLArray
+        """
+        hdf = omero.tables.HdfStorage(self.hdfpath())
+        hdf.initialize([self.masks(0)], None)
+        mea = hdf._HdfStorage__mea
+        mea._v_file.createVLArray(mea._v_parent, "Measurements_masks", tables.UInt8Atom())
+        hdf.append([self.masks(20)])
+        hdf.append([self.masks(20, 20)])
+        self.assertEquals(40, mea._v_parent.Measurements_masks.nrows)
+        self.assertRaises(tables.NoSuchNodeError, getattr, mea._v_parent, "Measurements_mask_heap")
+        data = hdf.readCoordinates(hdf._stamp, range(40), self.current)
+        self.assertEquals(self.masks(40).bytes, [x.tolist() for x in data.columns[0].bytes])
+        hdf.cleanup()
+
+    #
+    # Storage profiles
+    #
+
+    def testProfiles(self):
+        for name in omero.tables.PROFILES.keys():
+            hdf = omero.tables.HdfStorage(path(self.tmpdir()) / "test.h5")
+            hdf.initialize(self.cols(), None, name)
+            self.append(hdf, {"a":1,"b":2,"c":3})
+            mea = hdf._HdfStorage__mea
+            profile = omero.tables.PROFILES[name]
+            self.assertEquals(profile.get("complevel", 0), mea.filters.complevel)
+            if "chunkshape" in profile:
+                self.assertEquals(profile["chunkshape"], mea.chunkshape)
+            self.assertEquals(1, hdf.rows())
+            hdf.cleanup()
+
+    def testUnknownProfile(self):
+        hdf = omero.tables.HdfStorage(self.hdfpath())
+        self.assertRaises(omero.ApiUsageException, hdf.initialize, self.cols(), None, "unknown")
+        self.init(hdf) # Still uninitialized
+        hdf.cleanup()
+
+    #
+    # Open handles
+    #
+
+    def testReadOnlyUntilWritten(self):
+        p = self.hdfpath()
+        hdf = omero.tables.HdfStorage(p)
+        self.init(hdf, False)
+        hdf.cleanup()
+        hdf = omero.tables.HdfStorage(p)
+        self.assertEquals("r", hdf._HdfStorage__mode)
+        self.assertEquals(0, hdf.rows())
+        self.append(hdf, {"a":1,"b":2,"c":3})
+        self.assertEquals("a", hdf._HdfStorage__mode)
+        self.assertEquals(1, hdf.rows())
+        hdf.cleanup()
+
+    def testClosedStorage(self):
+        hdf = omero.tables.HdfStorage(self.hdfpath())
+        self.init(hdf, False)
+        hdf.cleanup()
+        self.assertRaises(omero.ApiUsageException, hdf.rows)
+        hdf.cleanup() # No-op
+
+    def lockable(self, p, flags):
+        """
+        Returns True if the given lock can be taken on p via another file.
+        """
+        f = open(p, "a+")
+        try:
+            try:
+                portalocker.lock(f, portalocker.LOCK_NB|flags)
+                return True
+            except portalocker.LockException:
+                return False
+        finally:
+            f.close()
+
+    def testWriteLockKeptWhenEvicted(self):
+        limit = omero.tables.HDFLIST.max_open
+        omero.tables.HDFLIST.max_open = 1
+        tmpdir = path(self.tmpdir())
+        first = omero.tables.HdfStorage(tmpdir / "first.h5")
+        second = None
+        try:
+            self.init(first, False)
+            second = omero.tables.HdfStorage(tmpdir / "second.h5")
+            self.assertEquals(1, omero.tables.HDFLIST.size())
+            self.assertFalse(self.lockable(tmpdir / "first.h5", portalocker.LOCK_SH))
+            self.append(first, {"a":1,"b":2,"c":3})
+            self.assertEquals(1, first.rows())
+        finally:
+            first.cleanup()
+            if second:
+                second.cleanup()
+            omero.tables.HDFLIST.max_open = limit
+        self.assertTrue(self.lockable(tmpdir / "first.h5", portalocker.LOCK_EX))
+
+    def testReadLockReleasedWhenEvicted(self):
+        limit = omero.tables.HDFLIST.max_open
+        tmpdir = path(self.tmpdir())
+        first = omero.tables.HdfStorage(tmpdir / "first.h5")
+        self.init(first, False)
+        first.cleanup()
+        omero.tables.HDFLIST.max_open = 1
+        first = omero.tables.HdfStorage(tmpdir / "first.h5")
+        second = None
+        try:
+            self.assertTrue(self.lockable(tmpdir / "first.h5", portalocker.LOCK_SH))
+            self.assertFalse(self.lockable(tmpdir / "first.h5", portalocker.LOCK_EX))
+            second = omero.tables.HdfStorage(tmpdir / "second.h5")
+            self.assertTrue(self.lockable(tmpdir / "first.h5", portalocker.LOCK_EX))
+            self.assertEquals(0, first.rows())
+        finally:
+            first.cleanup()
+            if second:
+                second.cleanup()
+            omero.tables.HDFLIST.max_open = limit
+
+    def testUpgradeKeepsLock(self):
+        p = self.hdfpath()
+        hdf = omero.tables.HdfStorage(p)
+        self.init(hdf, False)
+        hdf.cleanup()
+        hdf = omero.tables.HdfStorage(p)
+        try:
+            self.append(hdf, {"a":1,"b":2,"c":3})
+            self.assertFalse(self.lockable(p, portalocker.LOCK_SH))
+        finally:
+            hdf.cleanup()
+
+    def testUpgradeFailsWhileShared(self):
+        p = self.hdfpath()
+        hdf = omero.tables.HdfStorage(p)
+        self.init(hdf, False)
+        hdf.cleanup()
+        hdf = omero.tables.HdfStorage(p)
+        other = open(p, "a+")
+        try:
+            portalocker.lock(other, portalocker.LOCK_NB|portalocker.LOCK_SH)
+            self.assertRaises(omero.LockTimeout, self.append, hdf, {"a":1,"b":2,"c":3})
+            self.assertEquals("r", hdf._HdfStorage__mode)
+            self.assertEquals(0, hdf.rows())
+            self.assertFalse(self.lockable(p, portalocker.LOCK_EX))
+            other.close()
+            self.append(hdf, {"a":1,"b":2,"c":3})
+            self.assertEquals(1, hdf.rows())
+        finally:
+            other.close()
+            hdf.cleanup()
+
+    def testManyOpenTables(self):
+        count = 2000
+        limit = omero.tables.HDFLIST.max_open
+        tmpdir = path(self.tmpdir())
+        for i in range(count):
+            hdf = omero.tables.HdfStorage(tmpdir / ("%s.h5" % i))
+            self.init(hdf, False)
+            self.append(hdf, {"a":i,"b":2*i,"c":3*i})
+            hdf.cleanup()
+        nofile = None
+        try:
+            import resource
+            nofile = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (256, nofile[1]))
+        except (ImportError, ValueError):
+            pass
+        omero.tables.HDFLIST.max_open = 16
+        hdfs = []
+        try:
+            for i in range(count):
+                hdf = omero.tables.HdfStorage(tmpdir / ("%s.h5" % i))
+                hdfs.append(hdf)
+                self.assertEquals(1, hdf.rows())
+                self.assertTrue(omero.tables.HDFLIST.size() <= 16)
+            for i in range(count - 1, -1, -1):
+                data = hdfs[i].readCoordinates(time.time(), [0], self.current)
+                self.assertEquals(2*i, data.columns[1].values[0])
+            self.assertTrue(omero.tables.HDFLIST.size() <= 16)
+        finally:
+            for hdf in hdfs:
+                hdf.cleanup()
+            omero.tables.HDFLIST.max_open = limit
+            if nofile:
+                resource.setrlimit(resource.RLIMIT_NOFILE, nofile)
+        self.assertEquals(0, omero.tables.HDFLIST.size())
+
+    def testManyWrittenTables(self):
+        count = 100
+        limit = omero.tables.HDFLIST.max_open
+        omero.tables.HDFLIST.max_open = 16
+        hdfs = []
+        try:
+            tmpdir = path(self.tmpdir())
+            for i in range(count):
+                hdf = omero.tables.HdfStorage(tmpdir / ("%s.h5" % i))
+                hdfs.append(hdf)
+                self.init(hdf, False)
+                self.assertTrue(omero.tables.HDFLIST.size() <= 16)
+            for i in range(count):
+                self.append(hdfs[i], {"a":i,"b":2*i,"c":3*i})
+                self.assertFalse(self.lockable(tmpdir / ("%s.h5" % i), portalocker.LOCK_SH))
+            for i in range(count - 1, -1, -1):
+                data = hdfs[i].readCoordinates(time.time(), [0], self.current)
+                self.assertEquals(2*i, data.columns[1].values[0])
+            self.assertTrue(omero.tables.HDFLIST.size() <= 16)
+        finally:
+            for hdf in hdfs:
+                hdf.cleanup()
+            omero.tables.HDFLIST.max_open = limit
+        self.assertEquals(0, omero.tables.HDFLIST.size())
+
 def test_suite():
     return 1
 
@@ -245,6 +245,11 @@ CUSTOM_SETTINGS_MAPPINGS = {
     "omero.web.open_astex_max_side": ["OPEN_ASTEX_MAX_SIDE", 400, int],
     "omero.web.open_astex_min_side": ["OPEN_ASTEX_MIN_SIDE", 20, int],
     "omero.web.open_astex_max_voxels": ["OPEN_ASTEX_MAX_VOXELS", 27000000, int],  # 300 x 300 x 300
+    # Number of annotation links saved per call when annotating many objects at once
+    "omero.web.link_chunk_size": ["LINK_CHUNK_SIZE", 1000, int],
+    "omero.web.container_summary_timeout": ["CONTAINER_SUMMARY_TIMEOUT", 60, int],
+    # Load the child counts and children of the containers of one listing together
+    "omero.web.batch_sibling_queries": ["BATCH_SIBLING_QUERIES", "true", parse_boolean],
     "omero.web.scripts_to_ignore": ["SCRIPTS_TO_IGNORE", '["/omero/figure_scripts/Movie_Figure.py", "/omero/figure_scripts/Split_View_Figure.py", "/omero/figure_scripts/Thumbnail_Figure.py", "/omero/figure_scripts/ROI_Split_Figure.py", "/omero/export_scripts/Make_Movie.py"]', parse_paths],
     
     # Add links to the top header: links are ['Link Text', 'link'], where the url is reverse("link") OR simply 'link' (for external urls)
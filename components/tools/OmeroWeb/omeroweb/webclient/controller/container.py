@@ -27,11 +27,88 @@ from omero.rtypes import *
 from django.core.urlresolvers import reverse
 from django.utils.encoding import smart_str
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 from webclient.controller import BaseController
 
+
+class ContainerSummaries(object):
+    """
+    Keeps the counts of L{OmeroWebGateway.countContainers} for the top of the tree,
+    keyed by (host, port, user id, group id, owner id), for up to timeout seconds
+    or until data in their group is changed through L{BaseContainer}.
+    """
+
+    def __init__(self, timeout=None, max_entries=10000):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._summaries = {}
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._summaries.get(key)
+            if entry is None or entry[0] < time.time():
+                return None
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, summary):
+        timeout = self.timeout
+        if timeout is None:
+            from django.conf import settings
+            timeout = settings.CONTAINER_SUMMARY_TIMEOUT
+        self._lock.acquire()
+        try:
+            now = time.time()
+            if len(self._summaries) >= self.max_entries:
+                for k, entry in self._summaries.items():
+                    if entry[0] < now:
+                        del self._summaries[k]
+                if len(self._summaries) >= self.max_entries:
+                    self._summaries.clear()
+            self._summaries[key] = (now + timeout, summary)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, group_id=None):
+        """
+        Drops the summaries of group_id, or all of them if group_id is None
+        """
+        self._lock.acquire()
+        try:
+            if group_id is None:
+                self._summaries.clear()
+            else:
+                for k in self._summaries.keys():
+                    if k[3] == group_id:
+                        del self._summaries[k]
+        finally:
+            self._lock.release()
+
+summaries = ContainerSummaries()
+
+
+def invalidates_summaries(f):
+    """
+    Drops the container summaries of the current group once the decorated
+    L{BaseContainer} method has changed data.
+    """
+    def wrapped(self, *args, **kwargs):
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            self.invalidateSummaries()
+    wrapped.__name__ = f.__name__
+    wrapped.__doc__ = f.__doc__
+    return wrapped
+
+
 class BaseContainer(BaseController):
     
     project = None
@@ -270,26 +347,52 @@ class BaseContainer(BaseController):
         if page is not None:
             self.paging = self.doPaging(page, len(im_list), self.c_size)
     
-    def listContainerHierarchy(self, eid=None):
+    def listContainerHierarchy(self, eid=None, page=None):
         if eid is not None:
             self.experimenter = self.conn.getObject("Experimenter", eid)
         else:
             eid = self.conn.getEventContext().userId
         
-        pr_list = list(self.conn.listProjects(eid))
-        ds_list = list(self.conn.listOrphans("Dataset", eid))
-        sc_list = list(self.conn.listScreens(eid))
-        pl_list = list(self.conn.listOrphans("Plate", eid))
-
-        pr_list.sort(key=lambda x: x.getName() and x.getName().lower())
-        ds_list.sort(key=lambda x: x.getName() and x.getName().lower())
-        sc_list.sort(key=lambda x: x.getName() and x.getName().lower())
-        pl_list.sort(key=lambda x: x.getName() and x.getName().lower())
+        pr_list = list(self.conn.listContainers("Project", eid, page))
+        ds_list = list(self.conn.listContainers("Dataset", eid, page, orphaned=True))
+        sc_list = list(self.conn.listContainers("Screen", eid, page))
+        pl_list = list(self.conn.listContainers("Plate", eid, page, orphaned=True))
 
-        self.orphans = self.conn.countOrphans("Image", eid)
+        summary = self.getContainerSummary(eid)
+        self.orphans = summary['orphans']
         
         self.containers={'projects': pr_list, 'datasets': ds_list, 'screens': sc_list, 'plates': pl_list}
-        self.c_size = len(pr_list)+len(ds_list)+len(sc_list)+len(pl_list)
+        if page is not None:
+            self.c_size = summary['projects']+summary['datasets']+summary['screens']+summary['plates']
+            page_size = max([len(l) for l in self.containers.values()])
+            total_size = max([summary[k] for k in self.containers.keys()])
+            self.paging = self.doPaging(page, page_size, total_size)
+        else:
+            self.c_size = len(pr_list)+len(ds_list)+len(sc_list)+len(pl_list)
+    
+    def _summaryKey(self, eid):
+        ctx = self.conn.getEventContext()
+        gid = self.conn.SERVICE_OPTS.getOmeroGroup()
+        if gid is None:
+            gid = ctx.groupId
+        return (self.conn.host, self.conn.port, ctx.userId, long(gid), eid)
+    
+    def getContainerSummary(self, eid=None):
+        """
+        Returns the counts of L{OmeroWebGateway.countContainers}, cached until data in
+        the current group is changed or settings.CONTAINER_SUMMARY_TIMEOUT has passed.
+        """
+        key = self._summaryKey(eid)
+        summary = summaries.get(key)
+        if summary is None:
+            summary = self.conn.countContainers(eid)
+            summaries.set(key, summary)
+        return summary
+    
+    def invalidateSummaries(self):
+        gid = self._summaryKey(None)[3]
+        # Data changed across all groups (-1) may be in any of them
+        summaries.invalidate(gid >= 0 and gid or None)
     
     def listOrphanedImages(self, eid=None, page=None):
         if eid is not None:
@@ -446,6 +549,7 @@ class BaseContainer(BaseController):
     ####################################################################
     # Creation
     
+    @invalidates_summaries
     def createDataset(self, name, description=None):
         ds = omero.model.DatasetI()
         ds.name = rstring(str(name))
@@ -458,6 +562,7 @@ class BaseContainer(BaseController):
             ds.addProjectDatasetLink(l_ds)
         return self.conn.saveAndReturnId(ds)
         
+    @invalidates_summaries
     def createProject(self, name, description=None):
         pr = omero.model.ProjectI()
         pr.name = rstring(str(name))
@@ -465,6 +570,7 @@ class BaseContainer(BaseController):
             pr.description = rstring(str(description))
         return self.conn.saveAndReturnId(pr)
     
+    @invalidates_summaries
     def createScreen(self, name, description=None):
         sc = omero.model.ScreenI()
         sc.name = rstring(str(name))
@@ -626,7 +732,6 @@ class BaseContainer(BaseController):
         if not atype.lower() in ("tag", "comment", "file"):
             raise AttributeError("Object type must be: tag, comment, file.")
         
-        new_links = list()
         annotations = list(self.conn.getObjects("Annotation", tids))
         parent_objs = []
         for k in oids:
@@ -635,45 +740,82 @@ class BaseContainer(BaseController):
                     parent_type = 'PlateAcquisition'
                 else:
                     parent_type = k.lower().title()
-                parent_ids = [o.id for o in oids[k]]
-                # check for existing links
-                links = self.conn.getAnnotationLinks (parent_type, parent_ids=parent_ids, ann_ids=tids)
-                pcLinks = [(l.parent.id.val, l.child.id.val) for l in links]
-                # Create link between each object and annotation
-                for ob in self.conn.getObjects(parent_type, parent_ids):
-                    parent_objs.append(ob)
-                    for a in annotations:
-                        if (ob.id, a.id) in pcLinks:
-                            continue    # link already exists
-                        if isinstance(ob._obj, omero.model.WellI):
-                            parent_type = 'Image'
-                            obj = ob.getWellSample(well_index).image()
-                        else:
-                            obj = ob
-                        l_ann = getattr(omero.model, parent_type+"AnnotationLinkI")()
-                        l_ann.setParent(obj._obj)
-                        l_ann.setChild(a._obj)
-                        new_links.append(l_ann)
-        failed = 0
-        saved_links = []
-        try:
-            # will fail if any of the links already exist
-            saved_links = self.conn.getUpdateService().saveAndReturnArray(new_links, self.conn.SERVICE_OPTS)
-        except omero.ValidationException, x:
-            for l in new_links:
-                try:
-                    saved_links.append(self.conn.getUpdateService().saveAndReturnObject(l, self.conn.SERVICE_OPTS))
-                except:
-                    failed+=1
+                parents = list()
+                for ob in oids[k]:
+                    if isinstance(ob._obj, omero.model.WellI):
+                        # Wells are annotated via the image of one field
+                        ob = ob.getWellSample(well_index).image()
+                    parents.append(ob._obj)
+                parent_objs.extend(parents)
+                self.linkAnnotations(parents, [a._obj for a in annotations])
 
         # if we only annotated a single object, return file-anns with link loaded
         if len(parent_objs) == 1:
             parent = parent_objs[0]
-            links = self.conn.getAnnotationLinks (parent.OMERO_CLASS, parent_ids=[parent.getId()], ann_ids=tids)
+            parent_type = parent.__class__.__name__[:-1]
+            links = self.conn.getAnnotationLinks (parent_type, parent_ids=[parent.id.val], ann_ids=tids)
             fas = [fa_link.getAnnotation() for fa_link in links]
             return fas
         # Each annotation will have several new links - Just return the annotations
         return annotations
+
+    def linkAnnotations(self, parents, annotations, chunk_size=None):
+        """
+        Links each annotation to each parent object of a single type, skipping
+        pairs that are already linked. Existing links are found with one
+        projection query and the new links are saved chunk_size at a time.
+        
+        @param parents:     omero.model objects of one type E.g. ImageI
+        @param annotations: omero.model annotations
+        @param chunk_size:  Links to save per call, default settings.LINK_CHUNK_SIZE
+        @return:            List of the IDs of the new links
+        """
+        if len(parents) == 0 or len(annotations) == 0:
+            return []
+        if chunk_size is None:
+            from django.conf import settings
+            chunk_size = settings.LINK_CHUNK_SIZE
+        parent_type = parents[0].__class__.__name__[:-1]
+        link_class = getattr(omero.model, parent_type+"AnnotationLinkI")
+        # Links are saved against unloaded copies so that the loaded objects
+        # are not sent back to the server with every link.
+        parents = dict([(p.id.val, p.__class__(p.id.val, False)) for p in parents])
+        annotations = dict([(a.id.val, a.__class__(a.id.val, False)) for a in annotations])
+        
+        params = omero.sys.Parameters()
+        params.map = {'pids': rlist([rlong(i) for i in parents]), 'aids': rlist([rlong(i) for i in annotations])}
+        query = "select l.parent.id, l.child.id from %sAnnotationLink as l " \
+                "where l.parent.id in (:pids) and l.child.id in (:aids)" % parent_type
+        existing = set([(r[0].val, r[1].val) for r in 
+                self.conn.getQueryService().projection(query, params, self.conn.SERVICE_OPTS)])
+        
+        new_links = list()
+        for pid, parent in parents.items():
+            for aid, ann in annotations.items():
+                if (pid, aid) in existing:
+                    continue    # link already exists
+                l_ann = link_class()
+                l_ann.setParent(parent)
+                l_ann.setChild(ann)
+                new_links.append(l_ann)
+        
+        update = self.conn.getUpdateService()
+        link_ids = list()
+        failed = 0
+        for i in range(0, len(new_links), chunk_size):
+            chunk = new_links[i:i+chunk_size]
+            try:
+                # will fail if any of the links already exist
+                link_ids.extend(update.saveAndReturnIds(chunk, self.conn.SERVICE_OPTS))
+            except omero.ValidationException, x:
+                for l in chunk:
+                    try:
+                        link_ids.append(update.saveAndReturnObject(l, self.conn.SERVICE_OPTS).id.val)
+                    except:
+                        failed+=1
+        if failed:
+            logger.warning("Failed to save %s of %s %sAnnotationLinks" % (failed, len(new_links), parent_type))
+        return link_ids
             
     ################################################################
     # Update
@@ -740,6 +882,7 @@ class BaseContainer(BaseController):
         self.conn.saveObject(container)
 
 
+    @invalidates_summaries
     def move(self, parent, destination):
         if self.project is not None:
             return 'Cannot move project.'
@@ -868,6 +1011,7 @@ class BaseContainer(BaseController):
             return 'No data was choosen.'
         return 
     
+    @invalidates_summaries
     def remove(self, parent):
         if self.tag:
             for al in self.tag.getParentLinks(str(parent[0]), [long(parent[1])]):
@@ -910,6 +1054,7 @@ class BaseContainer(BaseController):
         else:
             raise AttributeError("Attribute not specified. Cannot be removed.")
     
+    @invalidates_summaries
     def removemany(self, images):
         if self.dataset is not None:
             dil = self.dataset.getParentLinks('image', images)
@@ -921,6 +1066,7 @@ class BaseContainer(BaseController):
     ##########################################################
     # Copy
     
+    @invalidates_summaries
     def paste(self, destination):
         if self.project is not None:
             return 'Cannot paste project.'
@@ -992,6 +1138,7 @@ class BaseContainer(BaseController):
         else:
             return 'No data was choosen.'
     
+    @invalidates_summaries
     def copyImageToDataset(self, source, destination=None):
         if destination is None:
             dsls = self.conn.getDatasetImageLinks(source[1]) #gets every links for child
@@ -1005,6 +1152,7 @@ class BaseContainer(BaseController):
             new_dsl.setParent(ds._obj)
             self.conn.saveObject(new_dsl)
     
+    @invalidates_summaries
     def copyImagesToDataset(self, images, dataset):
         if dataset is not None and dataset[0] is not "dataset":
             ims = self.conn.getObjects("Image", images)
@@ -1018,6 +1166,7 @@ class BaseContainer(BaseController):
             self.conn.saveArray(link_array)
         raise AttributeError("Destination not supported")
     
+    @invalidates_summaries
     def copyDatasetToProject(self, source, destination=None):
         if destination is not None and destination[0] is not "project":
             ds = self.conn.getObject("Dataset", source[1])
@@ -1028,6 +1177,7 @@ class BaseContainer(BaseController):
             self.conn.saveObject(new_pdl)
         raise AttributeError("Destination not supported")
    
+    @invalidates_summaries
     def copyDatasetsToProject(self, datasets, project):
         if project is not None and project[0] is not "project":
             dss = self.conn.getObjects("Dataset", datasets)
@@ -1041,6 +1191,7 @@ class BaseContainer(BaseController):
             self.conn.saveArray(link_array)
         raise AttributeError("Destination not supported")
     
+    @invalidates_summaries
     def copyPlateToScreen(self, source, destination=None):
         if destination is not None and destination[0] is not "screen":
             pl = self.conn.getObject("Plate", source[1])
@@ -1051,6 +1202,7 @@ class BaseContainer(BaseController):
             self.conn.saveObject(new_spl)
         raise AttributeError("Destination not supported")
     
+    @invalidates_summaries
     def copyPlatesToScreen(self, plates, screen):
         if screen is not None and screen[0] is not "screen":
             pls = self.conn.getObjects("Plate", plates)
@@ -1068,6 +1220,7 @@ class BaseContainer(BaseController):
     ##########################################################
     # Delete
     
+    @invalidates_summaries
     def deleteItem(self, child=False, anns=False):
         handle = None
         if self.image:
@@ -1088,6 +1241,7 @@ class BaseContainer(BaseController):
             handle = self.conn.deleteObjects("Annotation", [self.file.id], deleteAnns=anns)
         return handle
     
+    @invalidates_summaries
     def deleteObjects(self, otype, ids, child=False, anns=False):
         return self.conn.deleteObjects(otype, ids, deleteChildren=child, deleteAnns=anns)
         
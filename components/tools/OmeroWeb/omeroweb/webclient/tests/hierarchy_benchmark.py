@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+#
+# Copyright (C) 2011 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   Times loading the top of the tree with BaseContainer.listContainerHierarchy
+   against a fake query service holding a large synthetic hierarchy, and
+   compares it with the old loading of every container, sorting in Python and
+   counting the children of each container separately.
+
+   The number of Projects, Datasets, Screens and Plates can be set via the
+   BENCHMARK_CONTAINERS (default 10000 of each) environment variable, half of
+   the Datasets and Plates being orphaned, and the seconds each call to the
+   fake services takes via BENCHMARK_LATENCY (default 0.001).
+
+"""
+
+import os
+import re
+import time
+import unittest
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure(PAGE=200, CONTAINER_SUMMARY_TIMEOUT=60)
+
+import omero
+from omero.gateway.utils import ServiceOptsDict
+from omero.model import ProjectI, DatasetI, ScreenI, PlateI, ImageI
+from omero.rtypes import rlong, robject, rstring
+
+from webclient.webclient_gateway import OmeroWebGateway
+from webclient.controller import container
+from webclient.controller.container import BaseContainer
+
+CONTAINERS = int(os.environ.get("BENCHMARK_CONTAINERS", 10000))
+LATENCY = float(os.environ.get("BENCHMARK_LATENCY", 0.001))
+
+
+class FakeServices(object):
+    """
+    Query and container service over objects held in memory, understanding
+    only the queries of the tree.
+    """
+
+    def __init__(self, objects, linked, counts):
+        self.objects = objects
+        self.linked = linked
+        self.counts = counts
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        time.sleep(LATENCY)
+
+    def _select(self, sql):
+        obj_type = re.search(r" from (\w+) (?:as )?obj", sql).group(1)
+        objs = self.objects.get(obj_type, [])
+        if "not exists" in sql:
+            objs = [o for o in objs if (obj_type, o.id.val) not in self.linked]
+        return obj_type, objs
+
+    def projection(self, sql, params, ctx=None):
+        self._call()
+        obj_type, objs = self._select(sql)
+        if sql.startswith("select count"):
+            return [[rlong(len(objs))]]
+        objs = sorted(objs, key=lambda o: (o.name.val.lower(), o.id.val))
+        f = params.theFilter
+        if f is not None and f.limit is not None:
+            objs = objs[f.offset.val:f.offset.val+f.limit.val]
+        if "count(cl)" in sql:
+            return [[robject(o), rlong(self.counts.get((obj_type, o.id.val), 0))] for o in objs]
+        return [[robject(o)] for o in objs]
+
+    def findAllByQuery(self, sql, params, ctx=None):
+        self._call()
+        return list(self._select(sql)[1])
+
+    def getCollectionCount(self, obj_type, prop, ids, options=None, ctx=None):
+        self._call()
+        return dict([(i, self.counts.get((obj_type, i), 0)) for i in ids])
+
+
+class EventContext(object):
+
+    userId = 1
+    groupId = 1
+
+
+class FakeGateway(OmeroWebGateway):
+
+    host = "localhost"
+    port = 4064
+
+    def __init__(self, services):
+        self.services = services
+        self.SERVICE_OPTS = ServiceOptsDict()
+
+    def getQueryService(self):
+        return self.services
+
+    def getContainerService(self):
+        return self.services
+
+    def getEventContext(self):
+        return EventContext()
+
+
+class TestHierarchyBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        objects = {}
+        linked = set()
+        counts = {}
+        for klass in (ProjectI, DatasetI, ScreenI, PlateI):
+            obj_type = klass.__name__[:-1]
+            objects[obj_type] = []
+            for i in range(1, CONTAINERS + 1):
+                o = klass(i, True)
+                # names out of id order, so that sorting matters
+                o.setName(rstring("%s %s" % (obj_type, (i * 7919) % CONTAINERS)))
+                objects[obj_type].append(o)
+                counts[(obj_type, i)] = i % 5
+                if obj_type in ("Dataset", "Plate") and i % 2:
+                    linked.add((obj_type, i))
+        objects["Image"] = [ImageI(i, True) for i in range(1, 101)]
+        self.services = FakeServices(objects, linked, counts)
+        self.conn = FakeGateway(self.services)
+        container.summaries.invalidate()
+
+    def report(self, label, t0, manager):
+        print "%-24s %8.3fs %8d containers %8d calls" % (label, time.time() - t0,
+                sum([len(l) for l in manager.containers.values()]), self.services.calls)
+        self.services.calls = 0
+
+    def testOld(self):
+        print "\n%s Projects, Datasets, Screens and Plates, %ss per call" % (CONTAINERS, LATENCY)
+        manager = BaseContainer(self.conn)
+        t0 = time.time()
+        eid = self.conn.getEventContext().userId
+        pr_list = list(self.conn.listProjects(eid))
+        ds_list = list(self.conn.listOrphans("Dataset", eid))
+        sc_list = list(self.conn.listScreens(eid))
+        pl_list = list(self.conn.listOrphans("Plate", eid))
+        for l in (pr_list, ds_list, sc_list, pl_list):
+            l.sort(key=lambda x: x.getName() and x.getName().lower())
+        manager.orphans = self.conn.countOrphans("Image", eid)
+        manager.containers = {'projects': pr_list, 'datasets': ds_list, 'screens': sc_list, 'plates': pl_list}
+        # as the tree template counts the children of each
+        for l in (pr_list, ds_list, sc_list):
+            for c in l:
+                c.countChildren_cached()
+        self.report("old", t0, manager)
+
+    def testAll(self):
+        manager = BaseContainer(self.conn)
+        t0 = time.time()
+        manager.listContainerHierarchy()
+        for l in (manager.containers['projects'], manager.containers['datasets'], manager.containers['screens']):
+            for c in l:
+                c.countChildren_cached()
+        self.report("listContainerHierarchy", t0, manager)
+        self.assertEquals(2 * CONTAINERS + 2 * (CONTAINERS / 2), manager.c_size)
+        self.assertEquals(100, manager.orphans)
+        names = [p.getName().lower() for p in manager.containers['projects']]
+        self.assertEquals(sorted(names), names)
+
+    def testPaged(self):
+        manager = BaseContainer(self.conn)
+        last = (CONTAINERS - 1) / settings.PAGE + 1
+        for page in (1, 2, last):
+            t0 = time.time()
+            manager.listContainerHierarchy(page=page)
+            self.report("page %s" % page, t0, manager)
+            expected = max(0, min(settings.PAGE, CONTAINERS - (page - 1) * settings.PAGE))
+            self.assertEquals(expected, len(manager.containers['projects']))
+            self.assertEquals(2 * CONTAINERS + 2 * (CONTAINERS / 2), manager.c_size)
+        # the summary was counted once and cached
+        manager.invalidateSummaries()
+        t0 = time.time()
+        manager.listContainerHierarchy(page=1)
+        self.report("page 1, invalidated", t0, manager)
+
+if __name__ == '__main__':
+    unittest.main()
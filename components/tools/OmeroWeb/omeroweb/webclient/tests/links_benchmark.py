@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+#
+# Copyright (C) 2011 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   Times tagging many images at once with BaseContainer.createAnnotationsLinks
+   against fake query and update services, some of the images being tagged
+   already, and compares the old check of each pair against a list of the
+   existing links.
+
+   The number of images and tags can be set via the BENCHMARK_IMAGES
+   (default 10000) and BENCHMARK_TAGS (default 50) environment variables,
+   the links saved per call via BENCHMARK_CHUNK (default 1000) and the
+   number of images checked the old way via BENCHMARK_OLD (default 20).
+
+"""
+
+import os
+import time
+import unittest
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure(PAGE=200, LINK_CHUNK_SIZE=1000)
+
+import omero
+from omero.model import ImageI, TagAnnotationI
+from omero.rtypes import rlong, unwrap
+
+from webclient.controller.container import BaseContainer
+
+IMAGES = int(os.environ.get("BENCHMARK_IMAGES", 10000))
+TAGS = int(os.environ.get("BENCHMARK_TAGS", 50))
+CHUNK = int(os.environ.get("BENCHMARK_CHUNK", 1000))
+OLD = int(os.environ.get("BENCHMARK_OLD", 20))
+
+
+class Wrapper(object):
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def getId(self):
+        return self._obj.id.val
+
+
+class FakeServices(object):
+    """ Query and update service holding the links as (parent, child) id pairs """
+
+    def __init__(self, links):
+        self.links = set(links)
+        self.queries = 0
+        self.saves = []
+
+    def projection(self, query, params, ctx=None):
+        self.queries += 1
+        pids = set(unwrap(params.map["pids"]))
+        aids = set(unwrap(params.map["aids"]))
+        return [[rlong(p), rlong(a)] for p, a in self.links if p in pids and a in aids]
+
+    def saveAndReturnIds(self, links, ctx=None):
+        self.saves.append(len(links))
+        rv = []
+        for l in links:
+            pair = (l.parent.id.val, l.child.id.val)
+            if pair in self.links:
+                raise omero.ValidationException()
+            rv.append(len(self.links))
+            self.links.add(pair)
+        return rv
+
+
+class FakeConnection(object):
+
+    SERVICE_OPTS = None
+
+    def __init__(self, services, tags):
+        self.services = services
+        self.tags = tags
+
+    def getObjects(self, obj_type, ids):
+        return [self.tags[long(i)] for i in ids]
+
+    def getQueryService(self):
+        return self.services
+
+    def getUpdateService(self):
+        return self.services
+
+
+class TestLinksBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = {}
+        for t in range(1, TAGS + 1):
+            self.tags[t] = Wrapper(TagAnnotationI(t, True))
+        self.images = [Wrapper(ImageI(i, True)) for i in range(1, IMAGES + 1)]
+        # Every tenth image already has every tag
+        self.existing = [(i, t) for i in range(1, IMAGES + 1, 10) for t in self.tags]
+        self.services = FakeServices(self.existing)
+        self.manager = BaseContainer(FakeConnection(self.services, self.tags))
+
+    def testTagImages(self):
+        print "\n%s images, %s tags, %s links saved per call" % (IMAGES, TAGS, CHUNK)
+        settings.LINK_CHUNK_SIZE = CHUNK
+        t0 = time.time()
+        self.manager.createAnnotationsLinks("tag", self.tags.keys(), {"image": self.images})
+        elapsed = time.time() - t0
+        created = IMAGES * TAGS - len(self.existing)
+        print "%-24s %8.3fs %8d links %4d queries %4d saves" % ("createAnnotationsLinks",
+                elapsed, created, self.services.queries, len(self.services.saves))
+        self.assertEquals(IMAGES * TAGS, len(self.services.links))
+        self.assertEquals(created, sum(self.services.saves))
+
+        # The old check, on a few images
+        pcLinks = list(self.existing)
+        t0 = time.time()
+        for ob in self.images[:OLD]:
+            for a in self.tags.values():
+                (ob.getId(), a.getId()) in pcLinks
+        elapsed = time.time() - t0
+        print "%-24s %8.3fs for %s images, ~%.0fs for %s" % ("list check", elapsed, OLD,
+                elapsed * IMAGES / OLD, IMAGES)
+
+if __name__ == '__main__':
+    unittest.main()
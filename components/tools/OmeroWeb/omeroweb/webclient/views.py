@@ -84,7 +84,7 @@ from forms import ShareForm, BasketShareForm, \
 from controller import BaseController
 from controller.index import BaseIndex
 from controller.basket import BaseBasket
-from controller.container import BaseContainer
+from controller.container import BaseContainer, summaries
 from controller.help import BaseHelp
 from controller.history import BaseCalendar
 from controller.impexp import BaseImpexp
@@ -482,7 +482,11 @@ def load_data(request, o1_type=None, o1_id=None, o2_type=None, o2_id=None, o3_ty
             context['form_well_index'] = form_well_index
             template = "webclient/data/plate.html"
     else:
-        manager.listContainerHierarchy(filter_user_id)
+        # the top of the tree is only paged when asked for
+        if request.REQUEST.get('page') is not None:
+            manager.listContainerHierarchy(filter_user_id, page)
+        else:
+            manager.listContainerHierarchy(filter_user_id)
         if view =='tree':
             template = "webclient/data/containers_tree.html"
         elif view =='icon':
@@ -2109,6 +2113,12 @@ def activities(request, conn=None, **kwargs):
                 else:
                     in_progress+=1
 
+    # deleted or moved data changes the counts at the top of the tree
+    for cbString in new_results:
+        if request.session['callback'][cbString]['job_type'] in ('delete', 'chgrp'):
+            summaries.invalidate()
+            break
+
     # having updated the request.session, we can now prepare the data for http response
     rv = {}
     for cbString in request.session.get('callback').keys():
@@ -126,6 +126,7 @@ class OmeroWebGateway (omero.gateway.BlitzGateway):
         
         super(OmeroWebGateway, self).__init__(*args, **kwargs)
         self._shareId = None
+        self.setBatching(settings.BATCH_SIBLING_QUERIES)
 
     
     def getShareId(self):
@@ -456,7 +457,99 @@ class OmeroWebGateway (omero.gateway.BlitzGateway):
                 "where ws.image=obj.id %s)" % eidWsFilter
         for e in q.findAllByQuery(sql, p, self.SERVICE_OPTS):
             yield links[obj_type][1](self, e)
-    
+
+    def listContainers (self, obj_type, eid=None, page=None, orphaned=False):
+        """
+        List Projects, Datasets, Screens or Plates ordered by name, sorted and paged
+        by the server. The number of children of each is loaded by the same query,
+        so that countChildren_cached() needs no further call.
+        Optionally filter by experimenter 'eid'
+
+        @param obj_type:    'Project', 'Dataset', 'Screen', 'Plate'
+        @param eid:         experimenter id
+        @type eid:          Long
+        @param page:        page number, all objects if None
+        @type page:         Long
+        @param orphaned:    only Datasets or Plates not linked to a Project or Screen
+        @type orphaned:     Boolean
+        @return:            Generator yielding wrappers of obj_type
+        @rtype:             L{BlitzObjectWrapper} generator
+        """
+
+        # child link, parent link and wrapper of each type
+        containers = {'Project':('ProjectDatasetLink', None, ProjectWrapper),
+                'Dataset':('DatasetImageLink', 'ProjectDatasetLink', DatasetWrapper),
+                'Screen':('ScreenPlateLink', None, ScreenWrapper),
+                'Plate':(None, 'ScreenPlateLink', PlateWrapper)}
+
+        if obj_type not in containers:
+            raise TypeError("'%s' is not valid object type. Must use one of %s" % (obj_type, containers.keys()) )
+        child_link, parent_link, wrapper = containers[obj_type]
+        if orphaned and parent_link is None:
+            raise TypeError("'%s' cannot be orphaned." % obj_type)
+
+        q = self.getQueryService()
+        p = omero.sys.Parameters()
+        p.map = {}
+
+        clauses = []
+        if eid is not None:
+            p.map["eid"] = rlong(long(eid))
+            clauses.append("obj.details.owner.id=:eid")
+        if orphaned:
+            clauses.append("not exists (select obl from %s as obl where obl.child=obj.id)" % parent_link)
+
+        if page is not None:
+            f = omero.sys.Filter()
+            f.limit = rint(PAGE)
+            f.offset = rint((int(page)-1)*PAGE)
+            p.theFilter = f
+
+        sql = "select obj"
+        if child_link is not None:
+            sql += ", (select count(cl) from %s as cl where cl.parent=obj.id)" % child_link
+        sql += " from %s as obj " \
+                "join fetch obj.details.creationEvent "\
+                "join fetch obj.details.owner join fetch obj.details.group " % obj_type
+        if clauses:
+            sql += "where %s " % " and ".join(clauses)
+        sql += "order by lower(obj.name), obj.id"
+
+        rows = q.projection(sql, p, self.SERVICE_OPTS)
+        for w, row in zip(self._wrapSiblings(wrapper, [r[0].val for r in rows]), rows):
+            if child_link is not None:
+                w._cached_countChildren = row[1].val
+            yield w
+
+    def countContainers (self, eid=None):
+        """
+        Counts the Projects and Screens, and the orphaned Datasets, Plates and Images
+        at the top of the tree. Optionally filter by experimenter 'eid'
+
+        @param eid:         experimenter id
+        @type eid:          Long
+        @return:            Counts keyed by 'projects', 'datasets', 'screens', 'plates'
+                            and 'orphans' (the orphaned Images)
+        @rtype:             Dict
+        """
+
+        q = self.getQueryService()
+        p = omero.sys.Parameters()
+        p.map = {}
+        sql = "select count(obj.id) from %s as obj"
+        if eid is not None:
+            p.map["eid"] = rlong(long(eid))
+            sql += " where obj.details.owner.id=:eid"
+
+        summary = {}
+        for key, obj_type in (('projects', 'Project'), ('screens', 'Screen')):
+            rslt = q.projection(sql % obj_type, p, self.SERVICE_OPTS)
+            summary[key] = rslt and rslt[0] and rslt[0][0].val or 0
+        summary['datasets'] = self.countOrphans("Dataset", eid)
+        summary['plates'] = self.countOrphans("Plate", eid)
+        summary['orphans'] = self.countOrphans("Image", eid)
+        return summary
+
     def listImagesInDataset (self, oid, eid=None, page=None):
         """
         List Images in the given Dataset.
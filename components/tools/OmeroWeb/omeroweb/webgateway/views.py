@@ -1333,7 +1333,6 @@ def plateGrid_json (request, pid, field=0, conn=None, **kwargs):
         field = 0
     if plate is None:
         return HttpResponseServerError('""', mimetype='application/javascript')
-    grid = []
     prefix = kwargs.get('thumbprefix', 'webgateway.views.render_thumbnail')
     thumbsize = int(request.REQUEST.get('size', 64))
     logger.debug(thumbsize)
@@ -1345,27 +1344,19 @@ def plateGrid_json (request, pid, field=0, conn=None, **kwargs):
 
     rv = webgateway_cache.getJson(request, server_id, plate, 'plategrid-%d-%d' % (field, thumbsize))
     if rv is None:
+        grid = plate.getWellGridData(field)
         plate.setGridSizeConstraints(8,12)
-        for row in plate.getWellGrid(field):
-            tr = []
-            for e in row:
-                if e:
-                    i = e.getImage()
-                    if i:
-                        t = i.simpleMarshal(xtra=xtra)
-                        t['wellId'] = e.getId()
-                        t['field'] = field
-                        tr.append(t)
-                        continue
-                tr.append(None)
-            grid.append(tr)
-        rv = {'grid': grid,
-              'collabels': plate.getColumnLabels(),
-              'rowlabels': plate.getRowLabels()}
-        webgateway_cache.setJson(request, server_id, plate, simplejson.dumps(rv), 'plategrid-%d-%d' % (field, thumbsize))
-    else:
-        rv = simplejson.loads(rv)
-    return rv
+        grid.resize(plate.getGridSize()['rows'], plate.getGridSize()['columns'])
+        rv = grid.toJson(xtra, collabels=plate.getColumnLabels(), rowlabels=plate.getRowLabels())
+        webgateway_cache.setJson(request, server_id, plate, rv, 'plategrid-%d-%d' % (field, thumbsize))
+    if kwargs.get('_raw', False):
+        return simplejson.loads(rv)
+    if kwargs.get('_internal', False):
+        return rv
+    c = request.REQUEST.get('callback', None)
+    if c is not None:
+        rv = '%s(%s)' % (c, rv)
+    return HttpResponse(rv, mimetype='application/javascript')
 
 @login_required()
 @jsonp